@@ -0,0 +1,10 @@
+def get_payment_usecase():
+    """
+    Get the shared PaymentUsecase, importing it on first use
+
+    The payment usecase pulls in xendit, boto3 and requests, so it is imported here instead
+    of at module level to keep those off the cold start of routes that never take payments.
+    """
+    from usecase.payment_usecase import get_payment_usecase as get_shared_payment_usecase
+
+    return get_shared_payment_usecase()
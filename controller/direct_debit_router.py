@@ -1,8 +1,10 @@
-from fastapi import APIRouter
+from typing import Optional
 
+from fastapi import APIRouter, Depends, Header
+
+from controller.dependencies import get_payment_usecase
 from model.common import Message
 from model.payment.payment import DirectDebitPaymentIn, PaymentRequestOut
-from usecase.payment_usecase import PaymentUsecase
 
 direct_debit_router = APIRouter()
 
@@ -12,7 +14,10 @@ direct_debit_router = APIRouter()
     response_model=PaymentRequestOut,
     responses={
         400: {'model': Message, 'description': 'Bad request'},
+        409: {'model': Message, 'description': 'A request with the same idempotency key is in progress'},
+        422: {'model': Message, 'description': 'Idempotency key reused with a different request'},
         500: {'model': Message, 'description': 'Internal server error'},
+        503: {'model': Message, 'description': 'Storage or Xendit is failing, retry after the Retry-After header'},
     },
     summary='Pay with Direct Debit Payment Method',
 )
@@ -23,8 +28,11 @@ direct_debit_router = APIRouter()
     response_model_exclude_unset=True,
     include_in_schema=False,
 )
-def direct_debit_payment_request(
+async def direct_debit_payment_request(
     direct_debit_payment_request_in: DirectDebitPaymentIn,
+    payment_usecase=Depends(get_payment_usecase),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    payment_usecase = PaymentUsecase()
-    return payment_usecase.direct_debit_payment_request(direct_debit_payment_request_in)
+    return await payment_usecase.direct_debit_payment_request(
+        direct_debit_payment_request_in, idempotency_key=idempotency_key
+    )
@@ -1,8 +1,10 @@
-from fastapi import APIRouter
+from typing import Optional
 
+from fastapi import APIRouter, Depends, Header
+
+from controller.dependencies import get_payment_usecase
 from model.common import Message
 from model.payment.payment import EWalletPaymentIn, PaymentRequestOut
-from usecase.payment_usecase import PaymentUsecase
 
 e_wallet_router = APIRouter()
 
@@ -12,7 +14,10 @@ e_wallet_router = APIRouter()
     response_model=PaymentRequestOut,
     responses={
         400: {'model': Message, 'description': 'Bad request'},
+        409: {'model': Message, 'description': 'A request with the same idempotency key is in progress'},
+        422: {'model': Message, 'description': 'Idempotency key reused with a different request'},
         500: {'model': Message, 'description': 'Internal server error'},
+        503: {'model': Message, 'description': 'Storage or Xendit is failing, retry after the Retry-After header'},
     },
     summary='Create EWallet Payment Request',
 )
@@ -23,8 +28,11 @@ e_wallet_router = APIRouter()
     response_model_exclude_unset=True,
     include_in_schema=False,
 )
-def create_ewallet_payment_request(
+async def create_ewallet_payment_request(
     create_ewallet_payment_request_in: EWalletPaymentIn,
+    payment_usecase=Depends(get_payment_usecase),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    payment_usecase = PaymentUsecase()
-    return payment_usecase.e_wallet_payment_request(create_ewallet_payment_request_in)
+    return await payment_usecase.e_wallet_payment_request(
+        create_ewallet_payment_request_in, idempotency_key=idempotency_key
+    )
@@ -1,19 +1,59 @@
-from fastapi import APIRouter
+import os
+from decimal import Decimal
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 
 from model.common import Message
+from model.payment.payment_constants import PaymentMethod
 from model.transaction.transaction import (
+    GetTransactionDetailsBatchIn,
+    GetTransactionDetailsBatchOut,
     GetTransactionDetailsIn,
     GetTransactionDetailsOut,
 )
 from usecase.transaction_usecase import TransactionUsecase
 
+FEE_QUOTE_CACHE_CONTROL = os.environ.get('FEE_QUOTE_CACHE_CONTROL', 'public, max-age=300')
+
 transaction_router = APIRouter()
 
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return any(candidate == '*' or candidate.replace('W/', '', 1) == etag for candidate in candidates)
+
+
+def _cacheable_transaction_details(
+    transaction_details_in: GetTransactionDetailsIn, response: Response, if_none_match: Optional[str]
+):
+    transaction_usecase = TransactionUsecase()
+    transaction_details_out = transaction_usecase.get_transaction_details(transaction_details_in)
+    if not isinstance(transaction_details_out, GetTransactionDetailsOut):
+        return transaction_details_out
+
+    etag = transaction_usecase.get_transaction_details_etag(transaction_details_in, transaction_details_out)
+    cache_headers = {'ETag': etag, 'Cache-Control': FEE_QUOTE_CACHE_CONTROL}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=cache_headers)
+
+    response.headers.update(cache_headers)
+    return transaction_details_out
+
+
 @transaction_router.post(
     '/fees',
     response_model=GetTransactionDetailsOut,
     responses={
+        304: {'description': 'Not modified'},
         400: {'model': Message, 'description': 'Bad request'},
         422: {'model': Message, 'description': 'Unprocessable Entity'},
         500: {'model': Message, 'description': 'Internal server error'},
@@ -31,6 +71,74 @@ transaction_router = APIRouter()
 )
 def get_transaction_details(
     transaction_details_in: GetTransactionDetailsIn,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    return _cacheable_transaction_details(transaction_details_in, response, if_none_match)
+
+
+@transaction_router.get(
+    '/fees',
+    response_model=GetTransactionDetailsOut,
+    responses={
+        304: {'description': 'Not modified'},
+        400: {'model': Message, 'description': 'Bad request'},
+        422: {'model': Message, 'description': 'Unprocessable Entity'},
+        500: {'model': Message, 'description': 'Internal server error'},
+    },
+    response_model_exclude_none=True,
+    response_model_exclude_unset=True,
+    summary='Get Transaction total for fees (cacheable)',
+)
+@transaction_router.get(
+    '/fees/',
+    response_model=GetTransactionDetailsOut,
+    response_model_exclude_none=True,
+    response_model_exclude_unset=True,
+    include_in_schema=False,
+)
+def get_transaction_details_query(
+    response: Response,
+    ticket_price: Decimal = Query(..., title='Ticket Price'),
+    payment_method: PaymentMethod = Query(..., title='Payment Method'),
+    payment_channel: str = Query(..., title='Payment Channel'),
+    platform_fee: Optional[Decimal] = Query(None, description='Percent platform fee'),
+    if_none_match: Optional[str] = Header(None),
+):
+    try:
+        transaction_details_in = GetTransactionDetailsIn(
+            ticket_price=ticket_price,
+            platform_fee=platform_fee,
+            payment_method=payment_method,
+            payment_channel=payment_channel,
+        )
+    except ValidationError as e:
+        raise RequestValidationError([ErrorWrapper(e, loc='query')])
+
+    return _cacheable_transaction_details(transaction_details_in, response, if_none_match)
+
+
+@transaction_router.post(
+    '/fees/batch',
+    response_model=GetTransactionDetailsBatchOut,
+    responses={
+        400: {'model': Message, 'description': 'Bad request'},
+        422: {'model': Message, 'description': 'Unprocessable Entity'},
+        500: {'model': Message, 'description': 'Internal server error'},
+    },
+    response_model_exclude_none=True,
+    response_model_exclude_unset=True,
+    summary='Get Transaction totals for many ticket prices and payment channels',
+)
+@transaction_router.post(
+    '/fees/batch/',
+    response_model=GetTransactionDetailsBatchOut,
+    response_model_exclude_none=True,
+    response_model_exclude_unset=True,
+    include_in_schema=False,
+)
+def get_transaction_details_batch(
+    transaction_details_batch_in: GetTransactionDetailsBatchIn,
 ):
     transaction_usecase = TransactionUsecase()
-    return transaction_usecase.get_transaction_details(transaction_details_in)
+    return transaction_usecase.get_transaction_details_batch(transaction_details_batch_in)
@@ -0,0 +1,81 @@
+import os
+from http import HTTPStatus
+from typing import Optional, Tuple, Union
+
+from model.payment.payment import PaymentTransactionIn, PaymentTransactionOut
+from external.payment_storage_gateway import parse_payment_transaction_response
+from utils.async_http_client import send_async_request
+from utils.logger import logger
+
+
+class AsyncPaymentStorageGateway:
+    """
+    Async counterpart of PaymentStorageGateway for the API request path
+
+    Requests go through the container's shared httpx.AsyncClient, so they do not hold
+    a worker thread while waiting on the storage service and reuse its connections. They
+    share the timeouts, retries and retry budget of the blocking gateway.
+    """
+
+    def __init__(self):
+        self.__callback_base_url = os.environ.get('CALLBACK_BASE_URL')
+        self.__create_payment_url = f'{self.__callback_base_url}/payments'
+        self.__update_payment_url = f'{self.__callback_base_url}/payments'
+
+    async def create_payment(
+        self, payment: PaymentTransactionIn, entry_id: Optional[str] = None
+    ) -> Tuple[HTTPStatus, PaymentTransactionOut, str]:
+        """
+        Create a payment transaction
+
+        Arguments:
+            payment -- Payment transaction data
+            entry_id -- Payment transaction ID generated by this service, or None to let the storage service assign it
+
+        Returns:
+            Tuple[HTTPStatus, PaymentTransactionOut, str] -- Status code, created payment transaction, error message
+        """
+        try:
+            payment_dict = payment.dict()
+            if entry_id is not None:
+                payment_dict['entryId'] = entry_id
+
+            response = await send_async_request('POST', self.__create_payment_url, json=payment_dict)
+            status, payment_transaction, error_message = parse_payment_transaction_response(response)
+            if status == HTTPStatus.OK:
+                logger.info('Payment Transaction Successfully Added')
+
+            return status, payment_transaction, error_message
+
+        except Exception as e:
+            logger.error(f'Error creating payment: {e}')
+            return HTTPStatus.INTERNAL_SERVER_ERROR, None, str(e)
+
+    async def update_payment_transaction(
+        self, payment_transaction_id: str, payment: PaymentTransactionIn
+    ) -> Tuple[HTTPStatus, Union[PaymentTransactionOut, None], str]:
+        """
+        Update a payment transaction by ID
+
+        Arguments:
+            payment_transaction_id -- The ID of the payment transaction to update
+            payment -- The updated payment transaction data
+
+        Returns:
+            Tuple[HTTPStatus, PaymentTransactionOut, str] -- Status code, updated payment transaction, error message
+        """
+        try:
+            payment_dict = payment.dict()
+            update_url = f'{self.__update_payment_url}/{payment_transaction_id}'
+            response = await send_async_request('PUT', update_url, json=payment_dict)
+            logger.info(f'Sent request to update payment transaction {payment_transaction_id}: {payment_dict}')
+
+            status, payment_transaction, error_message = parse_payment_transaction_response(response)
+            if status == HTTPStatus.OK:
+                logger.info(f'Payment Transaction {payment_transaction_id} Successfully Updated')
+
+            return status, payment_transaction, error_message
+
+        except Exception as e:
+            logger.error(f'Error updating payment transaction {payment_transaction_id}: {e}')
+            return HTTPStatus.INTERNAL_SERVER_ERROR, None, str(e)
@@ -0,0 +1,36 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from xendit.apis import PaymentRequestApi
+from xendit.payment_request.model import PaymentRequest
+
+from external.xendit_payment_request_client import with_response_headers
+
+# The Xendit SDK is blocking, so its calls get their own threads instead of
+# competing with FastAPI's threadpool for sync dependencies and endpoints
+XENDIT_MAX_WORKERS = int(os.environ.get('XENDIT_MAX_WORKERS', 16))
+
+_xendit_executor = ThreadPoolExecutor(max_workers=XENDIT_MAX_WORKERS, thread_name_prefix='xendit')
+
+
+class AsyncPaymentRequestApi:
+    """
+    Awaitable adapter over the Xendit PaymentRequestApi
+
+    Each call runs the SDK method on a dedicated thread pool, so the event loop keeps
+    serving other requests while Xendit responds. XenditSdkException is raised with the
+    headers of its response, read on the thread that made the call.
+    """
+
+    def __init__(self, payment_request_api: PaymentRequestApi):
+        self.__payment_request_api = payment_request_api
+
+    async def create_payment_request(self, **kwargs) -> PaymentRequest:
+        return await self.__run(self.__payment_request_api.create_payment_request, **kwargs)
+
+    @staticmethod
+    async def __run(method, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_xendit_executor, partial(with_response_headers(method), **kwargs))
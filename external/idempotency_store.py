@@ -0,0 +1,256 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, NamedTuple, Optional
+
+from external.store_tables import DynamoDbTable
+from model.payment.payment_constants import IdempotencyStoreMode
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+RELEASED = 'RELEASED'
+
+
+class IdempotencyRecord(NamedTuple):
+    key: str
+    fingerprint: str
+    status: str
+    response: Optional[str]
+    expires_at: float
+    payment_transaction_id: Optional[str] = None
+
+
+class IdempotencyStore(ABC):
+    """
+    Store of idempotency keys and the responses of the requests that used them
+
+    begin() claims a key atomically: only one caller gets None back and runs the request,
+    every other caller gets the record that is in progress, completed or released. A record
+    is ignored once it expires, so a claim left by a crashed request times out.
+
+    A request that failed after creating its payment transaction is released with that
+    payment transaction's ID, and a retry with the same request resumes it.
+    """
+
+    @abstractmethod
+    def begin(self, key: str, fingerprint: str, ttl_seconds: float) -> Optional[IdempotencyRecord]:
+        pass
+
+    @abstractmethod
+    def resume(self, key: str, fingerprint: str, ttl_seconds: float) -> bool:
+        pass
+
+    @abstractmethod
+    def complete(self, key: str, response: str, ttl_seconds: float) -> None:
+        pass
+
+    @abstractmethod
+    def release(self, key: str, payment_transaction_id: Optional[str] = None, ttl_seconds: float = 0) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        pass
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """Idempotency store in process memory, least recently used keys are evicted past max_entries"""
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.time):
+        self.__max_entries = max_entries
+        self.__clock = clock
+        self.__records: 'OrderedDict[str, IdempotencyRecord]' = OrderedDict()
+        self.__lock = Lock()
+
+    def begin(self, key: str, fingerprint: str, ttl_seconds: float) -> Optional[IdempotencyRecord]:
+        with self.__lock:
+            record = self.__get(key)
+            if record is not None:
+                return record
+
+            self.__records[key] = IdempotencyRecord(key, fingerprint, IN_PROGRESS, None, self.__clock() + ttl_seconds)
+            while len(self.__records) > self.__max_entries:
+                self.__records.popitem(last=False)
+
+            return None
+
+    def resume(self, key: str, fingerprint: str, ttl_seconds: float) -> bool:
+        with self.__lock:
+            record = self.__get(key)
+            if record is None or record.status != RELEASED or record.fingerprint != fingerprint:
+                return False
+
+            self.__records[key] = record._replace(status=IN_PROGRESS, expires_at=self.__clock() + ttl_seconds)
+            return True
+
+    def complete(self, key: str, response: str, ttl_seconds: float) -> None:
+        with self.__lock:
+            record = self.__records.get(key)
+            if record is not None:
+                self.__records[key] = record._replace(
+                    status=COMPLETED, response=response, expires_at=self.__clock() + ttl_seconds
+                )
+
+    def release(self, key: str, payment_transaction_id: Optional[str] = None, ttl_seconds: float = 0) -> None:
+        with self.__lock:
+            record = self.__records.get(key)
+            if record is None or payment_transaction_id is None:
+                self.__records.pop(key, None)
+                return
+
+            self.__records[key] = record._replace(
+                status=RELEASED,
+                payment_transaction_id=payment_transaction_id,
+                expires_at=self.__clock() + ttl_seconds,
+            )
+
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        with self.__lock:
+            return self.__get(key)
+
+    def __get(self, key: str) -> Optional[IdempotencyRecord]:
+        record = self.__records.get(key)
+        if record is None:
+            return None
+
+        if record.expires_at <= self.__clock():
+            del self.__records[key]
+            return None
+
+        self.__records.move_to_end(key)
+        return record
+
+
+class DynamoDbIdempotencyStore(IdempotencyStore):
+    """
+    Idempotency store in a DynamoDB table, shared by every container
+
+    The table is keyed by the string attribute idempotencyKey. Claims are conditional puts
+    that only succeed if the key is missing or its record expired, and a released record is
+    resumed with a conditional update; expiresAt can also be the table's TTL attribute so
+    DynamoDB deletes old records.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None, clock: Callable[[], float] = time.time):
+        self.__table = DynamoDbTable(table_name, dynamodb_client)
+        self.__clock = clock
+
+    def begin(self, key: str, fingerprint: str, ttl_seconds: float) -> Optional[IdempotencyRecord]:
+        dynamodb_client = self.__table.client
+        now = self.__clock()
+        try:
+            dynamodb_client.put_item(
+                TableName=self.__table.name,
+                Item={
+                    'idempotencyKey': {'S': key},
+                    'fingerprint': {'S': fingerprint},
+                    'status': {'S': IN_PROGRESS},
+                    'expiresAt': {'N': str(int(now + ttl_seconds))},
+                },
+                ConditionExpression='attribute_not_exists(idempotencyKey) OR expiresAt <= :now',
+                ExpressionAttributeValues={':now': {'N': str(int(now))}},
+            )
+            return None
+
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            record = self.get(key)
+            if record is None:
+                # released or expired between the put and the read, claim it again
+                return self.begin(key, fingerprint, ttl_seconds)
+
+            return record
+
+    def resume(self, key: str, fingerprint: str, ttl_seconds: float) -> bool:
+        dynamodb_client = self.__table.client
+        now = self.__clock()
+        try:
+            dynamodb_client.update_item(
+                TableName=self.__table.name,
+                Key={'idempotencyKey': {'S': key}},
+                UpdateExpression='SET #status = :status, expiresAt = :expires_at',
+                ConditionExpression='#status = :released AND fingerprint = :fingerprint AND expiresAt > :now',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':status': {'S': IN_PROGRESS},
+                    ':expires_at': {'N': str(int(now + ttl_seconds))},
+                    ':released': {'S': RELEASED},
+                    ':fingerprint': {'S': fingerprint},
+                    ':now': {'N': str(int(now))},
+                },
+            )
+            return True
+
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def complete(self, key: str, response: str, ttl_seconds: float) -> None:
+        self.__table.client.update_item(
+            TableName=self.__table.name,
+            Key={'idempotencyKey': {'S': key}},
+            UpdateExpression='SET #status = :status, #response = :response, expiresAt = :expires_at',
+            ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+            ExpressionAttributeValues={
+                ':status': {'S': COMPLETED},
+                ':response': {'S': response},
+                ':expires_at': {'N': str(int(self.__clock() + ttl_seconds))},
+            },
+        )
+
+    def release(self, key: str, payment_transaction_id: Optional[str] = None, ttl_seconds: float = 0) -> None:
+        if payment_transaction_id is None:
+            self.__table.client.delete_item(TableName=self.__table.name, Key={'idempotencyKey': {'S': key}})
+            return
+
+        self.__table.client.update_item(
+            TableName=self.__table.name,
+            Key={'idempotencyKey': {'S': key}},
+            UpdateExpression='SET #status = :status, paymentTransactionId = :payment_transaction_id, '
+            'expiresAt = :expires_at',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':status': {'S': RELEASED},
+                ':payment_transaction_id': {'S': payment_transaction_id},
+                ':expires_at': {'N': str(int(self.__clock() + ttl_seconds))},
+            },
+        )
+
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        response = self.__table.client.get_item(
+            TableName=self.__table.name, Key={'idempotencyKey': {'S': key}}, ConsistentRead=True
+        )
+        item = response.get('Item')
+        if item is None or float(item['expiresAt']['N']) <= self.__clock():
+            return None
+
+        return IdempotencyRecord(
+            key=key,
+            fingerprint=item['fingerprint']['S'],
+            status=item['status']['S'],
+            response=item.get('response', {}).get('S'),
+            expires_at=float(item['expiresAt']['N']),
+            payment_transaction_id=item.get('paymentTransactionId', {}).get('S'),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_idempotency_store() -> Optional[IdempotencyStore]:
+    """
+    Get the idempotency store of this container, configured from the environment
+
+    IDEMPOTENCY_STORE selects NONE, MEMORY (per container) or DYNAMODB (the table named by
+    IDEMPOTENCY_TABLE_NAME, at DYNAMODB_ENDPOINT_URL if it is set, e.g. DynamoDB Local).
+
+    Returns:
+        Optional[IdempotencyStore] -- Store, or None if payment requests are not deduplicated
+    """
+    mode = IdempotencyStoreMode(os.environ.get('IDEMPOTENCY_STORE', IdempotencyStoreMode.MEMORY.value).upper())
+    if mode == IdempotencyStoreMode.MEMORY:
+        return InMemoryIdempotencyStore(int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000)))
+
+    if mode == IdempotencyStoreMode.DYNAMODB:
+        return DynamoDbIdempotencyStore(os.environ['IDEMPOTENCY_TABLE_NAME'])
+
+    return None
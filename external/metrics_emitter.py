@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import sys
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Optional, TextIO
+
+from model.payment.payment_constants import MetricsEmitterMode
+
+DEFAULT_METRICS_NAMESPACE = 'SparcsPaymentService'
+
+# CloudWatch extracts at most 100 metrics from a record
+EMF_MAX_METRICS = 100
+
+UNIT_COUNT = 'Count'
+UNIT_SECONDS = 'Seconds'
+UNIT_MILLISECONDS = 'Milliseconds'
+
+
+class Metric(NamedTuple):
+    name: str
+    value: float
+    unit: str = UNIT_COUNT
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Get the nearest-rank percentile of some values
+
+    Arguments:
+        values -- Values, in any order
+        percent -- Percentile, from 0 to 100
+
+    Returns:
+        float -- Percentile, or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_emf_record(
+    namespace: str,
+    metrics: List[Metric],
+    dimensions: Optional[Dict[str, str]] = None,
+    properties: Optional[Dict[str, object]] = None,
+    timestamp_millis: Optional[int] = None,
+) -> dict:
+    """
+    Build a CloudWatch Embedded Metric Format record
+
+    The metrics and the dimensions are root members of the record, declared in its _aws
+    metadata so CloudWatch extracts them; the properties are root members left in the log
+    only, e.g. to look a run up with Logs Insights without adding to the metrics' dimensions.
+
+    Arguments:
+        namespace -- CloudWatch namespace of the metrics
+        metrics -- Metrics, at most EMF_MAX_METRICS
+        dimensions -- Dimensions of every metric
+        properties -- Other members logged with the metrics
+        timestamp_millis -- Time of the metrics, now if not given
+
+    Returns:
+        dict -- Record, to be logged as one line of JSON
+
+    Raises:
+        ValueError -- If there are too many metrics
+    """
+    if len(metrics) > EMF_MAX_METRICS:
+        raise ValueError(f'{len(metrics)} metrics in one record, at most {EMF_MAX_METRICS} are extracted')
+
+    dimensions = dimensions or {}
+    record = dict(properties or {})
+    record.update(dimensions)
+    record.update((metric.name, metric.value) for metric in metrics)
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000) if timestamp_millis is None else timestamp_millis,
+        'CloudWatchMetrics': [
+            {
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': metric.name, 'Unit': metric.unit} for metric in metrics],
+            }
+        ],
+    }
+    return record
+
+
+class MetricsEmitter(ABC):
+    """
+    Emits the metrics of a unit of work, e.g. a tracker run, as one Embedded Metric Format record
+
+    Subclasses decide where the record goes by implementing write().
+    """
+
+    def __init__(self, namespace: str = DEFAULT_METRICS_NAMESPACE, clock: Callable[[], float] = time.time):
+        self.namespace = namespace
+        self.__clock = clock
+
+    def emit(
+        self,
+        metrics: List[Metric],
+        dimensions: Optional[Dict[str, str]] = None,
+        properties: Optional[Dict[str, object]] = None,
+    ) -> dict:
+        """
+        Emit metrics as one record
+
+        Arguments:
+            metrics -- Metrics
+            dimensions -- Dimensions of every metric
+            properties -- Other members logged with the metrics
+
+        Returns:
+            dict -- Record emitted
+        """
+        record = build_emf_record(
+            self.namespace, metrics, dimensions, properties, timestamp_millis=int(self.__clock() * 1000)
+        )
+        self.write(record)
+        return record
+
+    @abstractmethod
+    def write(self, record: dict) -> None:
+        pass
+
+
+class EmfMetricsEmitter(MetricsEmitter):
+    """
+    Writes each record as a line of JSON to stdout
+
+    On Lambda, stdout goes to CloudWatch Logs, which extracts the metrics of every line in
+    Embedded Metric Format without a PutMetricData call. The line is written bypassing the
+    logger, whose prefix would keep it from being parsed.
+    """
+
+    def __init__(
+        self,
+        namespace: str = DEFAULT_METRICS_NAMESPACE,
+        stream: Optional[TextIO] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(namespace, clock)
+        self.__stream = stream
+        self.__lock = Lock()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        stream = self.__stream or sys.stdout
+        with self.__lock:
+            stream.write(line + '\n')
+            stream.flush()
+
+
+class InMemoryMetricsEmitter(MetricsEmitter):
+    """Keeps every record in memory, e.g. for tests and benchmarks"""
+
+    def __init__(self, namespace: str = DEFAULT_METRICS_NAMESPACE, clock: Callable[[], float] = time.time):
+        super().__init__(namespace, clock)
+        self.records: List[dict] = []
+        self.__lock = Lock()
+
+    def write(self, record: dict) -> None:
+        with self.__lock:
+            self.records.append(record)
+
+    def values(self, name: str) -> List[float]:
+        """
+        Get the values of a metric in every record kept
+
+        Arguments:
+            name -- Metric name
+
+        Returns:
+            List[float] -- Values, in the order they were emitted
+        """
+        with self.__lock:
+            return [record[name] for record in self.records if name in record]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.records.clear()
+
+
+@lru_cache(maxsize=None)
+def get_metrics_emitter() -> Optional[MetricsEmitter]:
+    """
+    Get the metrics emitter of this container, configured from the environment
+
+    METRICS_EMITTER selects EMF (records written to stdout for CloudWatch), MEMORY or NONE
+    (no metrics). The metrics are put in the METRICS_NAMESPACE namespace.
+
+    Returns:
+        Optional[MetricsEmitter] -- Emitter, or None if metrics are not emitted
+    """
+    mode = MetricsEmitterMode(os.environ.get('METRICS_EMITTER', MetricsEmitterMode.EMF.value).upper())
+    namespace = os.environ.get('METRICS_NAMESPACE', DEFAULT_METRICS_NAMESPACE)
+    if mode == MetricsEmitterMode.EMF:
+        return EmfMetricsEmitter(namespace)
+
+    if mode == MetricsEmitterMode.MEMORY:
+        return InMemoryMetricsEmitter(namespace)
+
+    return None
@@ -0,0 +1,180 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from external.store_tables import DynamoDbTable, connect_sqlite, sqlite_select_in, sqlite_transaction
+from model.payment.payment_constants import PaymentPollScheduleStoreMode
+from utils.logger import logger
+
+DEFAULT_POLL_SCHEDULE_PATH = '/tmp/payment_poll_schedule.sqlite3'
+
+
+class PollSchedule(NamedTuple):
+    entry_id: str
+    created_at: float
+    next_check_at: float
+    checks: int
+    expires_at: float
+
+
+class PaymentPollScheduleStore(ABC):
+    """
+    Store of when each pending payment is next checked on Xendit, kept between tracker runs
+
+    A schedule is ignored once it expires, so the schedules of payments that are no longer
+    pending do not pile up.
+    """
+
+    @abstractmethod
+    def get_many(self, entry_ids: List[str]) -> Dict[str, PollSchedule]:
+        pass
+
+    @abstractmethod
+    def put_many(self, schedules: List[PollSchedule]) -> None:
+        pass
+
+
+class InMemoryPaymentPollScheduleStore(PaymentPollScheduleStore):
+    """Poll schedule store in process memory, lasting as long as the container"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__schedules: Dict[str, PollSchedule] = {}
+        self.__lock = Lock()
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, PollSchedule]:
+        now = self.__clock()
+        with self.__lock:
+            schedules = (self.__schedules.get(entry_id) for entry_id in entry_ids)
+            return {schedule.entry_id: schedule for schedule in schedules if schedule and schedule.expires_at > now}
+
+    def put_many(self, schedules: List[PollSchedule]) -> None:
+        now = self.__clock()
+        with self.__lock:
+            self.__schedules.update((schedule.entry_id, schedule) for schedule in schedules)
+            expired = [entry_id for entry_id, schedule in self.__schedules.items() if schedule.expires_at <= now]
+            for entry_id in expired:
+                del self.__schedules[entry_id]
+
+
+class SqlitePaymentPollScheduleStore(PaymentPollScheduleStore):
+    """
+    Poll schedule store in a local SQLite file
+
+    The file only outlives the process on a persistent disk; on Lambda it lasts as long as
+    the container, and a cold container checks every pending payment once.
+    """
+
+    def __init__(self, path: str = DEFAULT_POLL_SCHEDULE_PATH, clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__lock = Lock()
+        self.__connection = connect_sqlite(path)
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS poll_schedule ('
+            'entry_id TEXT PRIMARY KEY, created_at REAL NOT NULL, next_check_at REAL NOT NULL, '
+            'checks INTEGER NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, PollSchedule]:
+        with self.__lock:
+            rows = sqlite_select_in(
+                self.__connection,
+                'SELECT entry_id, created_at, next_check_at, checks, expires_at FROM poll_schedule '
+                'WHERE expires_at > ? AND entry_id IN ({values})',
+                (self.__clock(),),
+                entry_ids,
+            )
+
+        return {row[0]: PollSchedule(*row) for row in rows}
+
+    def put_many(self, schedules: List[PollSchedule]) -> None:
+        with self.__lock, sqlite_transaction(self.__connection) as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO poll_schedule (entry_id, created_at, next_check_at, checks, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                schedules,
+            )
+            connection.execute('DELETE FROM poll_schedule WHERE expires_at <= ?', (self.__clock(),))
+
+
+class DynamoDbPaymentPollScheduleStore(PaymentPollScheduleStore):
+    """
+    Poll schedule store in a DynamoDB table, shared by every container
+
+    The table is keyed by the string attribute entryId; expiresAt can also be the table's
+    TTL attribute so DynamoDB deletes old schedules.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None, clock: Callable[[], float] = time.time):
+        self.__table = DynamoDbTable(table_name, dynamodb_client)
+        self.__clock = clock
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, PollSchedule]:
+        items, unread = self.__table.batch_get('entryId', entry_ids)
+        if unread:
+            # the schedules not read are treated as missing, so those payments are checked this run
+            logger.warning(f'Could not read {unread} poll schedules from DynamoDB')
+
+        now = self.__clock()
+        schedules = (
+            PollSchedule(
+                entry_id=item['entryId']['S'],
+                created_at=float(item['createdAt']['N']),
+                next_check_at=float(item['nextCheckAt']['N']),
+                checks=int(item['checks']['N']),
+                expires_at=float(item['expiresAt']['N']),
+            )
+            for item in items
+        )
+        return {schedule.entry_id: schedule for schedule in schedules if schedule.expires_at > now}
+
+    def put_many(self, schedules: List[PollSchedule]) -> None:
+        unwritten = self.__table.batch_put(
+            {
+                'entryId': {'S': schedule.entry_id},
+                'createdAt': {'N': repr(schedule.created_at)},
+                'nextCheckAt': {'N': repr(schedule.next_check_at)},
+                'checks': {'N': str(schedule.checks)},
+                'expiresAt': {'N': str(int(schedule.expires_at))},
+            }
+            for schedule in schedules
+        )
+        if unwritten:
+            logger.warning(f'Could not write {unwritten} poll schedules to DynamoDB')
+
+
+@lru_cache(maxsize=None)
+def get_payment_poll_schedule_store() -> Optional[PaymentPollScheduleStore]:
+    """
+    Get the poll schedule store of this container, configured from the environment
+
+    PAYMENT_POLL_SCHEDULE selects NONE (every pending payment is checked on every run),
+    MEMORY (per container), LOCAL (a SQLite file at PAYMENT_POLL_SCHEDULE_PATH) or DYNAMODB
+    (the table named by PAYMENT_POLL_SCHEDULE_TABLE_NAME, shared by every container). It
+    defaults to DYNAMODB when the table is named and to LOCAL otherwise, e.g. in a local run.
+
+    Returns:
+        Optional[PaymentPollScheduleStore] -- Store, or None if payments are not scheduled
+
+    Raises:
+        ValueError -- PAYMENT_POLL_SCHEDULE is DYNAMODB without PAYMENT_POLL_SCHEDULE_TABLE_NAME
+    """
+    table_name = os.environ.get('PAYMENT_POLL_SCHEDULE_TABLE_NAME')
+    default_mode = PaymentPollScheduleStoreMode.DYNAMODB if table_name else PaymentPollScheduleStoreMode.LOCAL
+    mode = PaymentPollScheduleStoreMode(os.environ.get('PAYMENT_POLL_SCHEDULE', default_mode.value).upper())
+    if mode == PaymentPollScheduleStoreMode.MEMORY:
+        return InMemoryPaymentPollScheduleStore()
+
+    if mode == PaymentPollScheduleStoreMode.LOCAL:
+        return SqlitePaymentPollScheduleStore(os.environ.get('PAYMENT_POLL_SCHEDULE_PATH', DEFAULT_POLL_SCHEDULE_PATH))
+
+    if mode == PaymentPollScheduleStoreMode.DYNAMODB:
+        if not table_name:
+            raise ValueError('PAYMENT_POLL_SCHEDULE=DYNAMODB needs PAYMENT_POLL_SCHEDULE_TABLE_NAME')
+
+        return DynamoDbPaymentPollScheduleStore(table_name)
+
+    return None
@@ -0,0 +1,177 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from external.store_tables import DynamoDbTable, connect_sqlite, sqlite_select_in, sqlite_transaction
+from model.payment.payment_constants import PaymentStatusLedgerMode
+from utils.logger import logger
+
+DEFAULT_STATUS_LEDGER_PATH = '/tmp/payment_status_ledger.sqlite3'
+DEFAULT_STATUS_LEDGER_RETENTION_SECONDS = 3600
+
+
+class SentStatus(NamedTuple):
+    entry_id: str
+    status: str
+    sent_at: float
+    expires_at: float
+
+
+class PaymentStatusLedger(ABC):
+    """
+    Ledger of the last status update sent to SQS for each payment, kept between tracker runs
+
+    The tracker does not send a payment's status again while the ledger holds it. An entry
+    is ignored once it expires, so a payment that is still pending in the storage service
+    then gets its status sent once more, in case the update was lost.
+    """
+
+    @abstractmethod
+    def get_many(self, entry_ids: List[str]) -> Dict[str, SentStatus]:
+        pass
+
+    @abstractmethod
+    def put_many(self, sent_statuses: List[SentStatus]) -> None:
+        pass
+
+
+class InMemoryPaymentStatusLedger(PaymentStatusLedger):
+    """Status ledger in process memory, lasting as long as the container"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__sent_statuses: Dict[str, SentStatus] = {}
+        self.__lock = Lock()
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, SentStatus]:
+        now = self.__clock()
+        with self.__lock:
+            sent_statuses = (self.__sent_statuses.get(entry_id) for entry_id in entry_ids)
+            return {sent.entry_id: sent for sent in sent_statuses if sent and sent.expires_at > now}
+
+    def put_many(self, sent_statuses: List[SentStatus]) -> None:
+        now = self.__clock()
+        with self.__lock:
+            self.__sent_statuses.update((sent.entry_id, sent) for sent in sent_statuses)
+            expired = [entry_id for entry_id, sent in self.__sent_statuses.items() if sent.expires_at <= now]
+            for entry_id in expired:
+                del self.__sent_statuses[entry_id]
+
+
+class SqlitePaymentStatusLedger(PaymentStatusLedger):
+    """
+    Status ledger in a local SQLite file
+
+    On Lambda the file lasts as long as the container, and a cold container sends the
+    status of every settled payment still pending in the storage service once.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATUS_LEDGER_PATH, clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__lock = Lock()
+        self.__connection = connect_sqlite(path)
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS status_ledger ('
+            'entry_id TEXT PRIMARY KEY, status TEXT NOT NULL, sent_at REAL NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, SentStatus]:
+        with self.__lock:
+            rows = sqlite_select_in(
+                self.__connection,
+                'SELECT entry_id, status, sent_at, expires_at FROM status_ledger '
+                'WHERE expires_at > ? AND entry_id IN ({values})',
+                (self.__clock(),),
+                entry_ids,
+            )
+
+        return {row[0]: SentStatus(*row) for row in rows}
+
+    def put_many(self, sent_statuses: List[SentStatus]) -> None:
+        with self.__lock, sqlite_transaction(self.__connection) as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO status_ledger (entry_id, status, sent_at, expires_at) VALUES (?, ?, ?, ?)',
+                sent_statuses,
+            )
+            connection.execute('DELETE FROM status_ledger WHERE expires_at <= ?', (self.__clock(),))
+
+
+class DynamoDbPaymentStatusLedger(PaymentStatusLedger):
+    """
+    Status ledger in a DynamoDB table, shared by every container
+
+    The table is keyed by the string attribute entryId; expiresAt can also be the table's
+    TTL attribute so DynamoDB deletes old entries.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None, clock: Callable[[], float] = time.time):
+        self.__table = DynamoDbTable(table_name, dynamodb_client)
+        self.__clock = clock
+
+    def get_many(self, entry_ids: List[str]) -> Dict[str, SentStatus]:
+        items, unread = self.__table.batch_get('entryId', entry_ids)
+        if unread:
+            # the statuses not read are treated as not sent, so those are sent again
+            logger.warning(f'Could not read {unread} sent statuses from DynamoDB')
+
+        now = self.__clock()
+        sent_statuses = (
+            SentStatus(
+                entry_id=item['entryId']['S'],
+                status=item['status']['S'],
+                sent_at=float(item['sentAt']['N']),
+                expires_at=float(item['expiresAt']['N']),
+            )
+            for item in items
+        )
+        return {sent.entry_id: sent for sent in sent_statuses if sent.expires_at > now}
+
+    def put_many(self, sent_statuses: List[SentStatus]) -> None:
+        unwritten = self.__table.batch_put(
+            {
+                'entryId': {'S': sent.entry_id},
+                'status': {'S': sent.status},
+                'sentAt': {'N': repr(sent.sent_at)},
+                'expiresAt': {'N': str(int(sent.expires_at))},
+            }
+            for sent in sent_statuses
+        )
+        if unwritten:
+            logger.warning(f'Could not write {unwritten} sent statuses to DynamoDB')
+
+
+@lru_cache(maxsize=None)
+def get_payment_status_ledger() -> Optional[PaymentStatusLedger]:
+    """
+    Get the status ledger of this container, configured from the environment
+
+    PAYMENT_STATUS_LEDGER selects NONE (every resolved payment's status is sent on every
+    run), MEMORY (per container), LOCAL (a SQLite file at PAYMENT_STATUS_LEDGER_PATH) or
+    DYNAMODB (the table named by PAYMENT_STATUS_LEDGER_TABLE_NAME, shared by every
+    container). It defaults to DYNAMODB when the table is named and to LOCAL otherwise.
+
+    Returns:
+        Optional[PaymentStatusLedger] -- Ledger, or None if statuses are not recorded
+
+    Raises:
+        ValueError -- PAYMENT_STATUS_LEDGER is DYNAMODB without PAYMENT_STATUS_LEDGER_TABLE_NAME
+    """
+    table_name = os.environ.get('PAYMENT_STATUS_LEDGER_TABLE_NAME')
+    default_mode = PaymentStatusLedgerMode.DYNAMODB if table_name else PaymentStatusLedgerMode.LOCAL
+    mode = PaymentStatusLedgerMode(os.environ.get('PAYMENT_STATUS_LEDGER', default_mode.value).upper())
+    if mode == PaymentStatusLedgerMode.MEMORY:
+        return InMemoryPaymentStatusLedger()
+
+    if mode == PaymentStatusLedgerMode.LOCAL:
+        return SqlitePaymentStatusLedger(os.environ.get('PAYMENT_STATUS_LEDGER_PATH', DEFAULT_STATUS_LEDGER_PATH))
+
+    if mode == PaymentStatusLedgerMode.DYNAMODB:
+        if not table_name:
+            raise ValueError('PAYMENT_STATUS_LEDGER=DYNAMODB needs PAYMENT_STATUS_LEDGER_TABLE_NAME')
+
+        return DynamoDbPaymentStatusLedger(table_name)
+
+    return None
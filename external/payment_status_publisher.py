@@ -0,0 +1,250 @@
+import hashlib
+import json
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from external.payment_status_ledger import DEFAULT_STATUS_LEDGER_RETENTION_SECONDS, PaymentStatusLedger, SentStatus
+from model.payment.payment import PaymentTransactionOut, TransactionStatus
+from utils.logger import logger
+
+SQS_MAX_BATCH_ENTRIES = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+
+
+class PaymentStatusMessage(NamedTuple):
+    entry_id: str
+    status: str
+    body: str
+    group_id: str
+    deduplication_id: str
+
+
+class PublishStats(NamedTuple):
+    published: int
+    failed: int
+    skipped: int
+    batch_calls: int
+    single_calls: int
+
+
+class PaymentStatusPublisher:
+    """
+    Publishes payment status updates to the SQS FIFO queue in batches
+
+    Updates are buffered and sent with send_message_batch, up to 10 per call. Each payment
+    has its own message group, and a buffer never holds two updates of the same payment, so
+    retrying a failed entry on its own cannot reorder a group. Entries that fail in a batch,
+    or whose batch call fails, are retried one by one with send_message. flush() must be
+    called before the invocation ends to send what is still buffered.
+
+    With a status ledger, an update is skipped if the ledger holds the same status for the
+    payment, and every update sent is recorded in it when its buffer is flushed. The
+    deduplication ID of an update is derived from the payment and its status, so SQS also
+    drops an update sent again within its deduplication window.
+    """
+
+    def __init__(
+        self,
+        queue_url: str,
+        sqs_client,
+        batch_size: int = SQS_MAX_BATCH_ENTRIES,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 0.1,
+        status_ledger: Optional[PaymentStatusLedger] = None,
+        status_ledger_retention_seconds: float = DEFAULT_STATUS_LEDGER_RETENTION_SECONDS,
+    ):
+        self.__queue_url = queue_url
+        self.__sqs_client = sqs_client
+        self.__batch_size = min(batch_size, SQS_MAX_BATCH_ENTRIES)
+        self.__max_attempts = max_attempts
+        self.__retry_delay_seconds = retry_delay_seconds
+        self.__status_ledger = status_ledger
+        self.__status_ledger_retention_seconds = status_ledger_retention_seconds
+
+        self.__buffer: List[PaymentStatusMessage] = []
+        self.__buffer_bytes = 0
+        self.__sent: List[SentStatus] = []
+        self.__published = 0
+        self.__failed = 0
+        self.__skipped = 0
+        self.__batch_calls = 0
+        self.__single_calls = 0
+        self.__call_seconds: List[float] = []
+
+    @staticmethod
+    def build_message(payment: PaymentTransactionOut, status: TransactionStatus) -> PaymentStatusMessage:
+        message_body = {
+            'registration_details': payment.dict(),
+            'status': status.value,
+        }
+        return PaymentStatusMessage(
+            entry_id=payment.entryId,
+            status=status.value,
+            body=json.dumps(message_body),
+            group_id=f'payment-{payment.entryId}',
+            # at most 128 characters whatever the length of the entryId
+            deduplication_id=hashlib.sha256(f'{payment.entryId}:{status.value}'.encode()).hexdigest(),
+        )
+
+    def publish(self, payment: PaymentTransactionOut, status: TransactionStatus) -> None:
+        """
+        Buffer a payment status update, sending the buffer when it is full
+
+        Arguments:
+            payment -- Payment transaction
+            status -- Resolved transaction status
+        """
+        self.publish_many([(payment, status)])
+
+    def publish_many(self, updates: List[Tuple[PaymentTransactionOut, TransactionStatus]]) -> None:
+        """
+        Buffer the status updates of several payments, skipping the ones already sent
+
+        The status ledger is read once for all of them.
+
+        Arguments:
+            updates -- Payment transactions and their resolved transaction status
+        """
+        sent_statuses = {}
+        if self.__status_ledger is not None and updates:
+            try:
+                sent_statuses = self.__status_ledger.get_many([payment.entryId for payment, _ in updates])
+            except Exception as e:
+                logger.error(f'Failed to read the status ledger, sending every status update: {str(e)}')
+
+        for payment, status in updates:
+            sent = sent_statuses.get(payment.entryId)
+            if sent is not None and sent.status == status.value:
+                logger.info(f'Status {status.value} of payment {payment.entryId} was already sent')
+                self.__skipped += 1
+                continue
+
+            self.__buffer_message(self.build_message(payment, status))
+
+    def __buffer_message(self, message: PaymentStatusMessage) -> None:
+        message_bytes = len(message.body.encode())
+        if (
+            len(self.__buffer) >= self.__batch_size
+            or self.__buffer_bytes + message_bytes > SQS_MAX_BATCH_BYTES
+            or any(buffered.group_id == message.group_id for buffered in self.__buffer)
+        ):
+            self.flush()
+
+        self.__buffer.append(message)
+        self.__buffer_bytes += message_bytes
+        if len(self.__buffer) >= self.__batch_size:
+            self.flush()
+
+    def flush(self) -> PublishStats:
+        """
+        Send every buffered update
+
+        Returns:
+            PublishStats -- Counts since this publisher was created
+        """
+        messages, self.__buffer, self.__buffer_bytes = self.__buffer, [], 0
+        if messages:
+            for message, error_message in self.__send_batch(messages):
+                self.__send_alone(message, error_message)
+
+        sent, self.__sent = self.__sent, []
+        if self.__status_ledger is not None and sent:
+            try:
+                self.__status_ledger.put_many(sent)
+            except Exception as e:
+                # the next runs send these statuses again, and SQS drops them within its deduplication window
+                logger.error(f'Failed to record {len(sent)} sent statuses in the status ledger: {str(e)}')
+
+        return self.stats()
+
+    def stats(self) -> PublishStats:
+        return PublishStats(
+            published=self.__published,
+            failed=self.__failed,
+            skipped=self.__skipped,
+            batch_calls=self.__batch_calls,
+            single_calls=self.__single_calls,
+        )
+
+    def call_seconds(self) -> List[float]:
+        """
+        Get the latency of every SQS call made
+
+        Returns:
+            List[float] -- Seconds per send_message_batch and send_message call, in the order they were made
+        """
+        return list(self.__call_seconds)
+
+    def __send_batch(self, messages: List[PaymentStatusMessage]) -> List[Tuple[PaymentStatusMessage, str]]:
+        """Send messages in one call, returning the ones that failed with their error"""
+        self.__batch_calls += 1
+        started_at = time.perf_counter()
+        try:
+            response = self.__sqs_client.send_message_batch(
+                QueueUrl=self.__queue_url,
+                Entries=[
+                    {
+                        'Id': str(index),
+                        'MessageBody': message.body,
+                        'MessageGroupId': message.group_id,
+                        'MessageDeduplicationId': message.deduplication_id,
+                    }
+                    for index, message in enumerate(messages)
+                ],
+            )
+        except Exception as e:
+            logger.error(f'Failed to send a batch of {len(messages)} payment status updates to SQS: {str(e)}')
+            return [(message, str(e)) for message in messages]
+
+        finally:
+            self.__call_seconds.append(time.perf_counter() - started_at)
+
+        failed = [
+            (messages[int(entry['Id'])], f'{entry.get("Code")}: {entry.get("Message")}')
+            for entry in response.get('Failed', [])
+        ]
+        self.__published += len(messages) - len(failed)
+        self.__record_sent(messages[int(entry['Id'])] for entry in response.get('Successful', []))
+        logger.info(f'Sent {len(messages) - len(failed)} payment status updates to SQS, {len(failed)} failed')
+        return failed
+
+    def __send_alone(self, message: PaymentStatusMessage, error_message: Optional[str]) -> None:
+        for attempt in range(1, self.__max_attempts):
+            logger.warning(f'Retrying payment status update of {message.group_id} (attempt {attempt}): {error_message}')
+            time.sleep(self.__retry_delay_seconds * 2 ** (attempt - 1))
+            self.__single_calls += 1
+            started_at = time.perf_counter()
+            try:
+                response = self.__sqs_client.send_message(
+                    QueueUrl=self.__queue_url,
+                    MessageBody=message.body,
+                    MessageGroupId=message.group_id,
+                    MessageDeduplicationId=message.deduplication_id,
+                )
+                self.__call_seconds.append(time.perf_counter() - started_at)
+                logger.info(f'Successfully sent message to SQS: {response["MessageId"]}')
+                self.__published += 1
+                self.__record_sent([message])
+                return
+
+            except Exception as e:
+                self.__call_seconds.append(time.perf_counter() - started_at)
+                error_message = str(e)
+
+        logger.error(f'Failed to send payment status update of {message.group_id} to SQS: {error_message}')
+        self.__failed += 1
+
+    def __record_sent(self, messages) -> None:
+        if self.__status_ledger is None:
+            return
+
+        now = time.time()
+        self.__sent.extend(
+            SentStatus(
+                entry_id=message.entry_id,
+                status=message.status,
+                sent_at=now,
+                expires_at=now + self.__status_ledger_retention_seconds,
+            )
+            for message in messages
+        )
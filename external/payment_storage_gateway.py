@@ -1,14 +1,64 @@
+import json
 import os
 from http import HTTPStatus
-from typing import List, Tuple, Union
+from itertools import chain
+from typing import Iterator, List, Optional, Tuple, Union
 
+import httpx
 import requests
 
 from model.payment.payment import PaymentTransactionIn, PaymentTransactionOut
+from utils.http_session import send_request
+from utils.json_stream import iter_json_array
 from utils.logger import logger
 
+PENDING_PAYMENTS_PAGE_SIZE = int(os.environ.get('PENDING_PAYMENTS_PAGE_SIZE', 100))
+PENDING_PAYMENTS_CHUNK_SIZE = 64 * 1024
+
+
+def get_error_message(response: Union[requests.Response, httpx.Response], result) -> str:
+    """Get the error message of a failed storage service response, given its parsed JSON body"""
+    if isinstance(result, dict):
+        return result.get('message', f'HTTP {response.status_code}: {response.text}')
+
+    return str(result)
+
+
+def parse_payment_transaction_response(
+    response: Union[requests.Response, httpx.Response],
+) -> Tuple[HTTPStatus, Union[PaymentTransactionOut, None], str]:
+    """
+    Parse the payment transaction a storage service create or update call answered with
+
+    Shared by PaymentStorageGateway and AsyncPaymentStorageGateway, as requests and httpx
+    responses are read the same way.
+
+    Arguments:
+        response -- Response of the create or update call
+
+    Returns:
+        Tuple[HTTPStatus, PaymentTransactionOut, str] -- Status code, payment transaction, error message
+    """
+    try:
+        result = response.json() if response.content else {}
+        if response.status_code != HTTPStatus.OK:
+            return response.status_code, None, get_error_message(response, result)
+
+        return HTTPStatus.OK, PaymentTransactionOut(**result), None
+
+    except ValueError as json_error:
+        logger.error(f'Invalid JSON response from payment API: {json_error}. Response: {response.text}')
+        return HTTPStatus.BAD_GATEWAY, None, f'Invalid response from payment service: {response.text}'
+
 
 class PaymentStorageGateway:
+    """
+    Client of the payment transactions storage service
+
+    Calls go through the container's pooled HTTP session with connect and read timeouts;
+    reads and updates are retried within the invocation's retry budget.
+    """
+
     def __init__(self):
         self.__callback_base_url = os.environ.get('CALLBACK_BASE_URL')
         self.__create_payment_url = f'{self.__callback_base_url}/payments'
@@ -18,22 +68,12 @@ class PaymentStorageGateway:
     def create_payment(self, payment: PaymentTransactionIn) -> Tuple[HTTPStatus, PaymentTransactionOut, str]:
         try:
             payment_dict = payment.dict()
-            response = requests.post(self.__create_payment_url, json=payment_dict)
-            result = response.json() if response.content else {}
-            if response.status_code != HTTPStatus.OK:
-                error_message = (
-                    result.get('message', f'HTTP {response.status_code}: {response.text}')
-                    if isinstance(result, dict)
-                    else str(result)
-                )
-                return response.status_code, None, error_message
+            response = send_request('POST', self.__create_payment_url, json=payment_dict)
+            status, payment_transaction, error_message = parse_payment_transaction_response(response)
+            if status == HTTPStatus.OK:
+                logger.info('Payment Transaction Successfully Added')
 
-            logger.info('Payment Transaction Successfully Added')
-            return HTTPStatus.OK, PaymentTransactionOut(**result), None
-
-        except ValueError as json_error:
-            logger.error(f'Invalid JSON response from payment API: {json_error}. Response: {response.text}')
-            return HTTPStatus.BAD_GATEWAY, None, f'Invalid response from payment service: {response.text}'
+            return status, payment_transaction, error_message
 
         except Exception as e:
             logger.error(f'Error creating payment: {e}')
@@ -46,21 +86,63 @@ class PaymentStorageGateway:
         Returns:
             Tuple[HTTPStatus, list[PaymentTransactionOut], str]: Status code, list of payments, error message
         """
+        status, pending_payments, error_message = self.iter_pending_payment_transactions()
+        if status != HTTPStatus.OK:
+            return status, None, error_message
+
+        return HTTPStatus.OK, list(pending_payments), None
+
+    def iter_pending_payment_transactions(
+        self, page_size: int = PENDING_PAYMENTS_PAGE_SIZE, after_entry_id: Optional[str] = None
+    ) -> Tuple[HTTPStatus, Union[Iterator[PaymentTransactionOut], None], str]:
+        """
+        Get pending payment transactions as they are downloaded
+
+        Pages of page_size payments are requested with the limit and cursor parameters; a
+        page is {"items": [...], "nextCursor": "..."} and the last page has no nextCursor.
+        If the storage service returns the whole backlog as one JSON array instead, the
+        array is parsed incrementally from the response stream. Either way, payments are
+        yielded before the rest of the backlog has been downloaded.
+
+        The first request is made before returning, so its errors are returned as usual.
+        A failure on a later page is logged and ends the iteration early; the payments not
+        yielded are picked up by the next run.
+
+        Pages are ordered by entryId, so a run can resume after the last payment it handled
+        by passing its entryId as the first cursor. A backlog returned as one array is read
+        from the payment after the one with that entryId instead, by position as the array
+        may not be sorted, or from the start again if that payment is no longer pending.
+
+        Arguments:
+            page_size -- Payments requested per page
+            after_entry_id -- Only get the payments after this entryId
+
+        Returns:
+            Tuple[HTTPStatus, Iterator[PaymentTransactionOut], str]: Status code, pending payments, error message
+        """
+        status, response, error_message = self.__request_pending_payments_page(page_size, after_entry_id)
+        if status != HTTPStatus.OK:
+            return status, None, error_message
+
+        return HTTPStatus.OK, self.__iter_pending_payments(response, page_size, after_entry_id), None
+
+    def __request_pending_payments_page(
+        self, page_size: int, cursor: Optional[str]
+    ) -> Tuple[HTTPStatus, Union[requests.Response, None], str]:
+        params = {'limit': page_size}
+        if cursor is not None:
+            params['cursor'] = cursor
+
         try:
-            response = requests.get(self.__get_pending_payments_url)
-            result = response.json() if response.content else []
+            response = send_request('GET', self.__get_pending_payments_url, params=params, stream=True)
             if response.status_code != HTTPStatus.OK:
-                error_message = (
-                    result.get('message', f'HTTP {response.status_code}: {response.text}')
-                    if isinstance(result, dict)
-                    else str(result)
-                )
-                return response.status_code, None, error_message
-
-            # Convert response to list of PaymentTransactionOut objects
-            pending_payments = [PaymentTransactionOut(**payment) for payment in result]
-            logger.info(f'Successfully retrieved {len(pending_payments)} pending payments')
-            return HTTPStatus.OK, pending_payments, None
+                with response:
+                    result = response.json() if response.content else {}
+                    return response.status_code, None, get_error_message(response, result)
+
+            # the storage service may not declare a charset, and iter_content only decodes with one
+            response.encoding = response.encoding or 'utf-8'
+            return HTTPStatus.OK, response, None
 
         except ValueError as json_error:
             logger.error(f'Invalid JSON response from payment API: {json_error}. Response: {response.text}')
@@ -70,6 +152,62 @@ class PaymentStorageGateway:
             logger.error(f'Error getting pending payments: {e}')
             return HTTPStatus.INTERNAL_SERVER_ERROR, None, str(e)
 
+    def __iter_pending_payments(
+        self, response: requests.Response, page_size: int, after_entry_id: Optional[str]
+    ) -> Iterator[PaymentTransactionOut]:
+        count = 0
+        try:
+            while True:
+                page = None
+                with response:
+                    chunks = response.iter_content(chunk_size=PENDING_PAYMENTS_CHUNK_SIZE, decode_unicode=True)
+                    first_chunk = next((chunk for chunk in chunks if chunk.strip()), '')
+                    if first_chunk.lstrip().startswith('['):
+                        # the storage service does not paginate, parse the backlog as it downloads
+                        # and skip the payments up to the one to resume after, whatever their order
+                        skipping = after_entry_id is not None
+                        for payment in iter_json_array(chain((first_chunk,), chunks)):
+                            if skipping:
+                                skipping = payment['entryId'] != after_entry_id
+                                continue
+
+                            count += 1
+                            yield PaymentTransactionOut(**payment)
+
+                        if not skipping:
+                            break
+
+                    else:
+                        # an empty body is an empty backlog, as the storage service has always answered it
+                        body = first_chunk + ''.join(chunks)
+                        page = json.loads(body) if body.strip() else {}
+
+                if page is None:
+                    # the payment to resume after is no longer pending, so where it was is unknown
+                    logger.warning(
+                        f'Payment {after_entry_id} to resume after is no longer pending, reading from the start'
+                    )
+                    after_entry_id = cursor = None
+                else:
+                    for payment in page.get('items') or []:
+                        count += 1
+                        yield PaymentTransactionOut(**payment)
+
+                    cursor = page.get('nextCursor')
+                    if not cursor:
+                        break
+
+                status, response, error_message = self.__request_pending_payments_page(page_size, cursor)
+                if status != HTTPStatus.OK:
+                    logger.error(f'Failed to get a pending payments page after {count} payments: {error_message}')
+                    return
+
+        except Exception as e:
+            logger.error(f'Failed to read pending payments after {count} payments: {e}')
+            return
+
+        logger.info(f'Successfully retrieved {count} pending payments')
+
     def update_payment_transaction(
         self, payment_transaction_id: str, payment: PaymentTransactionIn
     ) -> Tuple[HTTPStatus, Union[PaymentTransactionOut, None], str]:
@@ -86,26 +224,14 @@ class PaymentStorageGateway:
         try:
             payment_dict = payment.dict()
             update_url = f'{self.__update_payment_url}/{payment_transaction_id}'
-            response = requests.put(update_url, json=payment_dict)
-
-            result = response.json() if response.content else {}
-
+            response = send_request('PUT', update_url, json=payment_dict)
             logger.info(f'Sent request to update payment transaction {payment_transaction_id}: {payment_dict}')
 
-            if response.status_code != HTTPStatus.OK:
-                error_message = (
-                    result.get('message', f'HTTP {response.status_code}: {response.text}')
-                    if isinstance(result, dict)
-                    else str(result)
-                )
-                return response.status_code, None, error_message
-
-            logger.info(f'Payment Transaction {payment_transaction_id} Successfully Updated')
-            return HTTPStatus.OK, PaymentTransactionOut(**result), None
+            status, payment_transaction, error_message = parse_payment_transaction_response(response)
+            if status == HTTPStatus.OK:
+                logger.info(f'Payment Transaction {payment_transaction_id} Successfully Updated')
 
-        except ValueError as json_error:
-            logger.error(f'Invalid JSON response from payment API: {json_error}. Response: {response.text}')
-            return HTTPStatus.BAD_GATEWAY, None, f'Invalid response from payment service: {response.text}'
+            return status, payment_transaction, error_message
 
         except Exception as e:
             logger.error(f'Error updating payment transaction {payment_transaction_id}: {e}')
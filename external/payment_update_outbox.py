@@ -0,0 +1,314 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, List, NamedTuple, Optional
+
+from external.store_tables import connect_sqlite, sqlite_transaction
+from model.payment.payment import PaymentTransactionIn
+from model.payment.payment_constants import PaymentUpdateOutboxMode
+from utils.logger import logger
+
+DEFAULT_OUTBOX_PATH = '/tmp/payment_update_outbox.sqlite3'
+
+# Applied outbox IDs are kept this long to drop updates that are queued again
+APPLIED_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# SQS ReceiveMessage returns at most 10 messages per call
+SQS_RECEIVE_MAX_MESSAGES = 10
+
+
+class OutboxEntry(NamedTuple):
+    outbox_id: str
+    payment_transaction_id: str
+    payment: PaymentTransactionIn
+    enqueued_at: float
+    attempts: int
+    receipt: Optional[str] = None
+
+
+def build_outbox_id(payment_transaction_id: str, payment_request_id: str) -> str:
+    """
+    Build the deduplication ID of a payment update
+
+    The same payment request attached to the same payment transaction is the same update,
+    so queueing it twice is a no-op.
+    """
+    return f'{payment_transaction_id}:{payment_request_id}'
+
+
+class PaymentUpdateOutbox(ABC):
+    """
+    Durable queue of payment transaction updates waiting to be written to the storage service
+
+    An entry carries the PENDING record with its payment request ID, written with the same
+    PUT as a synchronous update. The tracker only settles a payment once its payment request
+    ID is stored, so the first write of an entry always comes before the payment settles.
+    Entries taken by a drainer are leased: they stay in the outbox until they are
+    acknowledged, released for a retry, or dead lettered.
+    """
+
+    # True if entries can only be drained by the process that queued them
+    DRAINS_IN_PROCESS = False
+
+    @abstractmethod
+    def put(self, payment_transaction_id: str, payment: PaymentTransactionIn) -> bool:
+        pass
+
+    @abstractmethod
+    def take(self, max_entries: int) -> List[OutboxEntry]:
+        pass
+
+    @abstractmethod
+    def ack(self, entry: OutboxEntry) -> None:
+        pass
+
+    @abstractmethod
+    def release(self, entry: OutboxEntry, delay_seconds: float) -> None:
+        pass
+
+    @abstractmethod
+    def dead_letter(self, entry: OutboxEntry, error_message: str) -> None:
+        pass
+
+    @abstractmethod
+    def is_applied(self, outbox_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def depth(self) -> int:
+        pass
+
+    @abstractmethod
+    def oldest_enqueued_at(self) -> Optional[float]:
+        pass
+
+
+class SqlitePaymentUpdateOutbox(PaymentUpdateOutbox):
+    """
+    Outbox in a local SQLite file
+
+    Acknowledging an entry deletes it and records its outbox ID as applied in the same
+    transaction, so an update that was already applied is never queued or applied again.
+    The file only outlives the process on a persistent disk; on Lambda it lasts as long
+    as the container.
+    """
+
+    DRAINS_IN_PROCESS = True
+
+    def __init__(
+        self, path: str = DEFAULT_OUTBOX_PATH, lease_seconds: float = 60, clock: Callable[[], float] = time.time
+    ):
+        self.__lease_seconds = lease_seconds
+        self.__clock = clock
+        self.__lock = Lock()
+        self.__connection = connect_sqlite(path)
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'outbox_id TEXT PRIMARY KEY, payment_transaction_id TEXT NOT NULL, payment TEXT NOT NULL, '
+            'enqueued_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, '
+            'dead INTEGER NOT NULL DEFAULT 0, last_error TEXT)'
+        )
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS applied (outbox_id TEXT PRIMARY KEY, applied_at REAL)')
+
+    def put(self, payment_transaction_id: str, payment: PaymentTransactionIn) -> bool:
+        outbox_id = build_outbox_id(payment_transaction_id, payment.paymentRequestId)
+        now = self.__clock()
+        with self.__lock:
+            if self.__is_applied(outbox_id):
+                return False
+
+            cursor = self.__connection.execute(
+                'INSERT OR IGNORE INTO outbox (outbox_id, payment_transaction_id, payment, enqueued_at, available_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (outbox_id, payment_transaction_id, payment.json(), now, now),
+            )
+            return cursor.rowcount == 1
+
+    def take(self, max_entries: int) -> List[OutboxEntry]:
+        now = self.__clock()
+        with self.__lock, sqlite_transaction(self.__connection) as connection:
+            rows = connection.execute(
+                'SELECT outbox_id, payment_transaction_id, payment, enqueued_at, attempts FROM outbox '
+                'WHERE dead = 0 AND available_at <= ? ORDER BY enqueued_at LIMIT ?',
+                (now, max_entries),
+            ).fetchall()
+            connection.executemany(
+                'UPDATE outbox SET available_at = ? WHERE outbox_id = ?',
+                [(now + self.__lease_seconds, row[0]) for row in rows],
+            )
+
+        return [
+            OutboxEntry(
+                outbox_id=outbox_id,
+                payment_transaction_id=payment_transaction_id,
+                payment=PaymentTransactionIn.parse_raw(payment),
+                enqueued_at=enqueued_at,
+                attempts=attempts,
+            )
+            for outbox_id, payment_transaction_id, payment, enqueued_at, attempts in rows
+        ]
+
+    def ack(self, entry: OutboxEntry) -> None:
+        with self.__lock, sqlite_transaction(self.__connection) as connection:
+            connection.execute('DELETE FROM outbox WHERE outbox_id = ?', (entry.outbox_id,))
+            now = self.__clock()
+            connection.execute(
+                'INSERT OR IGNORE INTO applied (outbox_id, applied_at) VALUES (?, ?)', (entry.outbox_id, now)
+            )
+            connection.execute('DELETE FROM applied WHERE applied_at < ?', (now - APPLIED_RETENTION_SECONDS,))
+
+    def release(self, entry: OutboxEntry, delay_seconds: float) -> None:
+        with self.__lock:
+            self.__connection.execute(
+                'UPDATE outbox SET attempts = attempts + 1, available_at = ? WHERE outbox_id = ?',
+                (self.__clock() + delay_seconds, entry.outbox_id),
+            )
+
+    def dead_letter(self, entry: OutboxEntry, error_message: str) -> None:
+        with self.__lock:
+            self.__connection.execute(
+                'UPDATE outbox SET attempts = attempts + 1, dead = 1, last_error = ? WHERE outbox_id = ?',
+                (error_message, entry.outbox_id),
+            )
+
+    def is_applied(self, outbox_id: str) -> bool:
+        with self.__lock:
+            return self.__is_applied(outbox_id)
+
+    def depth(self) -> int:
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM outbox WHERE dead = 0').fetchone()[0]
+
+    def oldest_enqueued_at(self) -> Optional[float]:
+        with self.__lock:
+            return self.__connection.execute('SELECT MIN(enqueued_at) FROM outbox WHERE dead = 0').fetchone()[0]
+
+    def __is_applied(self, outbox_id: str) -> bool:
+        row = self.__connection.execute('SELECT 1 FROM applied WHERE outbox_id = ?', (outbox_id,)).fetchone()
+        return row is not None
+
+
+class SqsPaymentUpdateOutbox(PaymentUpdateOutbox):
+    """
+    Outbox on an SQS FIFO queue
+
+    Messages are grouped by payment transaction so its updates apply in order, and
+    deduplicated by outbox ID within the SQS deduplication window. SQS delivers at least
+    once, but the outbox processor reports failed messages one by one, so only an update
+    that was not acknowledged is delivered again. Messages that keep failing are moved by
+    the queue's redrive policy.
+    """
+
+    def __init__(self, queue_url: str, sqs_client=None, clock: Callable[[], float] = time.time):
+        self.__queue_url = queue_url
+        self.__sqs_client = sqs_client
+        self.__clock = clock
+
+    def put(self, payment_transaction_id: str, payment: PaymentTransactionIn) -> bool:
+        outbox_id = build_outbox_id(payment_transaction_id, payment.paymentRequestId)
+        message_body = {
+            'outbox_id': outbox_id,
+            'payment_transaction_id': payment_transaction_id,
+            'payment': json.loads(payment.json()),
+            'enqueued_at': self.__clock(),
+        }
+        self.__get_sqs_client().send_message(
+            QueueUrl=self.__queue_url,
+            MessageBody=json.dumps(message_body),
+            MessageGroupId=f'payment-{payment_transaction_id}',
+            MessageDeduplicationId=outbox_id,
+        )
+        return True
+
+    def take(self, max_entries: int) -> List[OutboxEntry]:
+        response = self.__get_sqs_client().receive_message(
+            QueueUrl=self.__queue_url,
+            MaxNumberOfMessages=min(max_entries, SQS_RECEIVE_MAX_MESSAGES),
+            AttributeNames=['ApproximateReceiveCount'],
+            WaitTimeSeconds=0,
+        )
+        return [
+            self.from_message(message['Body'], message['ReceiptHandle'], message.get('Attributes', {}))
+            for message in response.get('Messages', [])
+        ]
+
+    @staticmethod
+    def from_message(body: str, receipt: str, attributes: dict) -> OutboxEntry:
+        """
+        Build an outbox entry from an SQS message, as received or as delivered in a Lambda SQS event
+
+        Arguments:
+            body -- Message body
+            receipt -- Receipt handle of the message
+            attributes -- Message attributes, with ApproximateReceiveCount
+
+        Returns:
+            OutboxEntry -- Payment update
+        """
+        message_body = json.loads(body)
+        return OutboxEntry(
+            outbox_id=message_body['outbox_id'],
+            payment_transaction_id=message_body['payment_transaction_id'],
+            payment=PaymentTransactionIn(**message_body['payment']),
+            enqueued_at=message_body['enqueued_at'],
+            attempts=int(attributes.get('ApproximateReceiveCount', 1)) - 1,
+            receipt=receipt,
+        )
+
+    def ack(self, entry: OutboxEntry) -> None:
+        self.__get_sqs_client().delete_message(QueueUrl=self.__queue_url, ReceiptHandle=entry.receipt)
+
+    def release(self, entry: OutboxEntry, delay_seconds: float) -> None:
+        self.__get_sqs_client().change_message_visibility(
+            QueueUrl=self.__queue_url, ReceiptHandle=entry.receipt, VisibilityTimeout=int(delay_seconds)
+        )
+
+    def dead_letter(self, entry: OutboxEntry, error_message: str) -> None:
+        # left to the redrive policy of the queue, which moves it after its last receive
+        logger.error(f'Payment update {entry.outbox_id} exhausted its retries: {error_message}')
+
+    def is_applied(self, outbox_id: str) -> bool:
+        return False
+
+    def depth(self) -> int:
+        response = self.__get_sqs_client().get_queue_attributes(
+            QueueUrl=self.__queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'],
+        )
+        return sum(int(value) for value in response['Attributes'].values())
+
+    def oldest_enqueued_at(self) -> Optional[float]:
+        # SQS only exposes the age of the oldest message as the ApproximateAgeOfOldestMessage CloudWatch metric
+        return None
+
+    def __get_sqs_client(self):
+        if self.__sqs_client is None:
+            from boto3.session import Session
+
+            self.__sqs_client = Session().client(service_name='sqs', region_name=os.getenv('REGION'))
+
+        return self.__sqs_client
+
+
+@lru_cache(maxsize=None)
+def get_payment_update_outbox() -> Optional[PaymentUpdateOutbox]:
+    """
+    Get the payment update outbox of this container, configured from the environment
+
+    PAYMENT_UPDATE_OUTBOX selects NONE (updates are written synchronously), LOCAL (a SQLite
+    file at PAYMENT_UPDATE_OUTBOX_PATH) or SQS (the FIFO queue at PAYMENT_UPDATE_OUTBOX_QUEUE_URL).
+
+    Returns:
+        Optional[PaymentUpdateOutbox] -- Outbox, or None if updates are written synchronously
+    """
+    mode = PaymentUpdateOutboxMode(os.environ.get('PAYMENT_UPDATE_OUTBOX', PaymentUpdateOutboxMode.NONE.value).upper())
+    if mode == PaymentUpdateOutboxMode.LOCAL:
+        return SqlitePaymentUpdateOutbox(os.environ.get('PAYMENT_UPDATE_OUTBOX_PATH', DEFAULT_OUTBOX_PATH))
+
+    if mode == PaymentUpdateOutboxMode.SQS:
+        return SqsPaymentUpdateOutbox(os.environ['PAYMENT_UPDATE_OUTBOX_QUEUE_URL'])
+
+    return None
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+# DynamoDB BatchGetItem reads at most 100 keys per call, BatchWriteItem writes at most 25 items
+DYNAMODB_BATCH_GET_MAX_KEYS = 100
+DYNAMODB_BATCH_WRITE_MAX_ITEMS = 25
+DYNAMODB_BATCH_MAX_ATTEMPTS = 5
+
+# SQLite allows 999 parameters per statement in older builds
+SQLITE_MAX_PARAMETERS = 900
+
+
+def get_dynamodb_client():
+    """
+    Create a DynamoDB client, at DYNAMODB_ENDPOINT_URL if it is set, e.g. DynamoDB Local
+
+    Returns:
+        DynamoDB client
+    """
+    from boto3.session import Session
+
+    return Session().client(
+        service_name='dynamodb',
+        region_name=os.getenv('REGION'),
+        endpoint_url=os.getenv('DYNAMODB_ENDPOINT_URL') or None,
+    )
+
+
+class DynamoDbTable:
+    """
+    DynamoDB table of a store, read and written in batches
+
+    Batches are split to the limits of DynamoDB, and the keys or items it leaves
+    unprocessed, e.g. when throttled, are retried with backoff up to
+    DYNAMODB_BATCH_MAX_ATTEMPTS times. The client is created on first use.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None):
+        self.name = table_name
+        self.__dynamodb_client = dynamodb_client
+
+    @property
+    def client(self):
+        if self.__dynamodb_client is None:
+            self.__dynamodb_client = get_dynamodb_client()
+
+        return self.__dynamodb_client
+
+    def batch_get(self, key_name: str, key_values: List[str]) -> Tuple[List[dict], int]:
+        """
+        Read the items of many string keys with consistent reads
+
+        Arguments:
+            key_name -- Name of the key attribute
+            key_values -- Keys to read
+
+        Returns:
+            Tuple[List[dict], int] -- Items found, and the number of keys that could not be read
+        """
+        items = []
+        unread = 0
+        for start in range(0, len(key_values), DYNAMODB_BATCH_GET_MAX_KEYS):
+            keys = [{key_name: {'S': key}} for key in key_values[start : start + DYNAMODB_BATCH_GET_MAX_KEYS]]
+            request = {self.name: {'Keys': keys, 'ConsistentRead': True}}
+            for attempt in range(DYNAMODB_BATCH_MAX_ATTEMPTS):
+                response = self.client.batch_get_item(RequestItems=request)
+                items.extend(response.get('Responses', {}).get(self.name, []))
+                request = response.get('UnprocessedKeys') or {}
+                if not request:
+                    break
+
+                time.sleep(0.05 * 2**attempt)
+            else:
+                unread += len(request[self.name]['Keys'])
+
+        return items, unread
+
+    def batch_put(self, items: Iterable[dict]) -> int:
+        """
+        Put many items
+
+        Arguments:
+            items -- Items in the DynamoDB attribute value format
+
+        Returns:
+            int -- Number of items that could not be written
+        """
+        write_requests = [{'PutRequest': {'Item': item}} for item in items]
+        unwritten = 0
+        for start in range(0, len(write_requests), DYNAMODB_BATCH_WRITE_MAX_ITEMS):
+            request = {self.name: write_requests[start : start + DYNAMODB_BATCH_WRITE_MAX_ITEMS]}
+            for attempt in range(DYNAMODB_BATCH_MAX_ATTEMPTS):
+                response = self.client.batch_write_item(RequestItems=request)
+                request = response.get('UnprocessedItems') or {}
+                if not request:
+                    break
+
+                time.sleep(0.05 * 2**attempt)
+            else:
+                unwritten += len(request[self.name])
+
+        return unwritten
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite file shared by the threads of a store, in autocommit and WAL mode
+
+    Arguments:
+        path -- Path of the file, created if it does not exist
+
+    Returns:
+        sqlite3.Connection -- Connection, to be used under the store's lock
+    """
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+@contextmanager
+def sqlite_transaction(connection: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run statements in one write transaction, rolled back if any of them fails"""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def sqlite_select_in(
+    connection: sqlite3.Connection, query: str, parameters: Sequence, values: List[str]
+) -> List[tuple]:
+    """
+    Run a SELECT for many values, in chunks within the parameters SQLite allows
+
+    Arguments:
+        connection -- SQLite connection
+        query -- SELECT statement whose {values} placeholder is replaced by the parameters of a chunk of values
+        parameters -- Parameters of the statement before the values
+        values -- Values, e.g. keys in an IN list
+
+    Returns:
+        List[tuple] -- Rows of every chunk
+    """
+    rows = []
+    for start in range(0, len(values), SQLITE_MAX_PARAMETERS):
+        chunk = values[start : start + SQLITE_MAX_PARAMETERS]
+        rows.extend(connection.execute(query.format(values=','.join('?' * len(chunk))), (*parameters, *chunk)))
+
+    return rows
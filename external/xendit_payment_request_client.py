@@ -0,0 +1,123 @@
+import threading
+from functools import wraps
+from typing import Callable, List, Mapping, NamedTuple, Optional, TypeVar
+
+import xendit
+from xendit.apis import PaymentRequestApi
+from xendit.payment_request.model import PaymentRequest
+
+T = TypeVar('T')
+
+# Xendit caps the page size of its list endpoints
+XENDIT_LIST_MAX_LIMIT = 100
+
+_last_response = threading.local()
+
+
+class _ResponseHeadersRecorder:
+    """Pool manager of the Xendit SDK that keeps the headers and the retries of each thread's last response"""
+
+    def __init__(self, pool_manager):
+        self.__pool_manager = pool_manager
+
+    def request(self, *args, **kwargs):
+        response = self.__pool_manager.request(*args, **kwargs)
+        _last_response.headers = response.headers
+        # the retries urllib3 made before this response, e.g. after a connection error
+        retries = getattr(response, 'retries', None)
+        _last_response.retries = len(retries.history) if retries is not None else 0
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.__pool_manager, name)
+
+
+def record_response_headers(api_client: xendit.ApiClient) -> None:
+    """
+    Keep the headers of the responses of an SDK client, which XenditSdkException leaves out
+
+    Errors raised by calls wrapped with with_response_headers then carry the headers of
+    their response as response_headers, e.g. the Retry-After of a rate limited call.
+
+    Arguments:
+        api_client -- Xendit SDK client
+    """
+    rest_client = api_client.rest_client
+    if not isinstance(rest_client.pool_manager, _ResponseHeadersRecorder):
+        rest_client.pool_manager = _ResponseHeadersRecorder(rest_client.pool_manager)
+
+
+def with_response_headers(call: Callable[..., T]) -> Callable[..., T]:
+    """Wrap an SDK call to attach the headers of its response to the XenditSdkException it raises"""
+
+    @wraps(call)
+    def wrapper(*args, **kwargs):
+        _last_response.headers = None
+        _last_response.retries = 0
+        try:
+            return call(*args, **kwargs)
+        except xendit.XenditSdkException as e:
+            e.response_headers = _last_response.headers
+            raise
+
+    return wrapper
+
+
+def response_headers(error: BaseException) -> Optional[Mapping[str, str]]:
+    return getattr(error, 'response_headers', None)
+
+
+def last_response_retries() -> int:
+    """Get the retries made for the last response of this thread's SDK client, 0 if the call got no response"""
+    return getattr(_last_response, 'retries', 0)
+
+
+class PaymentRequestPage(NamedTuple):
+    payment_requests: List[PaymentRequest]
+    has_more: bool
+
+
+class XenditPaymentRequestClient:
+    """
+    Reads payment requests from Xendit, one by ID or many per call through the list endpoint
+
+    XenditSdkException is raised with the headers of its response, so callers decide what
+    counts as a failure of Xendit and how long a rate limit lasts.
+    """
+
+    def __init__(self, payment_request_api: PaymentRequestApi):
+        self.__payment_request_api = payment_request_api
+
+    def get_payment_request(self, payment_request_id: str) -> PaymentRequest:
+        """
+        Get a payment request by ID
+
+        Arguments:
+            payment_request_id -- Payment request ID
+
+        Returns:
+            PaymentRequest -- Payment request details
+        """
+        return with_response_headers(self.__payment_request_api.get_payment_request_by_id)(
+            payment_request_id=payment_request_id
+        )
+
+    def list_payment_requests(
+        self, payment_request_ids: List[str], after_id: Optional[str] = None
+    ) -> PaymentRequestPage:
+        """
+        List a page of the payment requests with the given IDs
+
+        Arguments:
+            payment_request_ids -- Payment request IDs, at most XENDIT_LIST_MAX_LIMIT
+            after_id -- ID of the last payment request of the previous page
+
+        Returns:
+            PaymentRequestPage -- Payment requests found, and whether more pages follow
+        """
+        kwargs = {'id': payment_request_ids, 'limit': min(len(payment_request_ids), XENDIT_LIST_MAX_LIMIT)}
+        if after_id:
+            kwargs['after_id'] = after_id
+
+        response = with_response_headers(self.__payment_request_api.get_all_payment_requests)(**kwargs)
+        return PaymentRequestPage(payment_requests=list(response.data), has_more=bool(response.has_more))
@@ -1,14 +1,131 @@
-from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+import json
+import os
+import time
+from typing import Callable, List, Optional
+
+from model.payment.payment import PaymentTransactionOut
+from model.payment.payment_constants import PaymentShardKey
+from usecase.payment_tracking_coordinator import get_payment_tracking_coordinator
+from usecase.payment_tracking_usecase import PaymentShard, PaymentTrackingUsecase
+from utils.circuit_breaker import get_circuit_breaker_metrics
+from utils.decorators import per_invocation_retry_budget
+from utils.http_session import get_http_session_stats
 from utils.logger import logger
+from utils.rate_limiter import get_rate_limiter_metrics
+
+_lambda_client = None
 
 
+@per_invocation_retry_budget
 def handler(event, context):
-    """Payment tracking handler"""
-    _ = context
+    """
+    Payment tracking handler
+
+    A scheduled run tracks every pending payment, or with PAYMENT_TRACKER_SHARDS above 1
+    coordinates workers that track a shard each. A worker is this function invoked with
+    the shard, shardCount and shardKey of its shard, and a part of the payments of the
+    shard to track, in its event; a worker that resumes gets the lastEntryId of its part
+    instead of the payments.
 
+    A run without a Lambda context, e.g. a local run, has no time limit and does not resume.
+    """
     logger.info(f'Payment tracking handler event: {event}')
 
+    shard = _get_shard(event)
+    function_name = context.function_name if context is not None else None
+    payment_tracking_coordinator = get_payment_tracking_coordinator(function_name)
+    if shard is None and payment_tracking_coordinator is not None:
+        sharded_tracking_summary = payment_tracking_coordinator.track_pending_payments(
+            context.get_remaining_time_in_millis if context is not None else None
+        )
+        return {
+            'statusCode': 200,
+            'body': 'Payment tracking coordinator completed',
+            'summary': sharded_tracking_summary.total._asdict(),
+        }
+
     payment_tracking_usecase = PaymentTrackingUsecase()
-    payment_tracking_usecase.track_pending_payments()
+    tracking_summary = payment_tracking_usecase.track_pending_payments(
+        remaining_time_millis=_get_remaining_time_millis(event, context),
+        resume_cursor=event.get('resumeCursor'),
+        shard=shard,
+        pending_payments=_get_pending_payments(event),
+        last_entry_id=event.get('lastEntryId'),
+    )
+    logger.info(f'HTTP session stats: {get_http_session_stats()._asdict()}')
+    logger.info(f'Circuit breakers: {[metrics._asdict() for metrics in get_circuit_breaker_metrics()]}')
+    logger.info(f'Rate limiters: {[metrics._asdict() for metrics in get_rate_limiter_metrics()]}')
+
+    if tracking_summary is not None and tracking_summary.stopped_early:
+        _resume(event, context, tracking_summary.resume_cursor)
+
+    return {
+        'statusCode': 200,
+        'body': 'Payment tracking handler completed',
+        'summary': tracking_summary._asdict() if tracking_summary is not None else None,
+    }
+
+
+def _get_shard(event: dict) -> Optional[PaymentShard]:
+    if event.get('shard') is None:
+        return None
+
+    return PaymentShard(
+        index=int(event['shard']),
+        count=int(event['shardCount']),
+        key=PaymentShardKey(event.get('shardKey', PaymentShardKey.ENTRY_ID.value)),
+    )
+
+
+def _get_pending_payments(event: dict) -> Optional[List[PaymentTransactionOut]]:
+    if event.get('payments') is None:
+        return None
+
+    return [PaymentTransactionOut(**payment) for payment in event['payments']]
+
+
+def _get_remaining_time_millis(event: dict, context) -> Optional[Callable[[], int]]:
+    """Time left of the invocation, or of the time budget a coordinator gave this worker if that is shorter"""
+    get_remaining_time_in_millis = context.get_remaining_time_in_millis if context is not None else None
+    if event.get('timeBudgetMillis') is None:
+        return get_remaining_time_in_millis
+
+    deadline = time.monotonic() + int(event['timeBudgetMillis']) / 1000
+    if get_remaining_time_in_millis is None:
+        return lambda: int((deadline - time.monotonic()) * 1000)
+
+    return lambda: min(get_remaining_time_in_millis(), int((deadline - time.monotonic()) * 1000))
+
+
+def _resume(event: dict, context, resume_cursor) -> None:
+    """Invoke this function again to continue a run that stopped early, up to PAYMENT_TRACKER_MAX_REINVOCATIONS times"""
+    if context is None:
+        logger.warning('Not resuming payment tracking without a Lambda context to invoke')
+        return
+
+    reinvocations = int(event.get('reinvocations', 0))
+    max_reinvocations = int(os.environ.get('PAYMENT_TRACKER_MAX_REINVOCATIONS', 0))
+    if reinvocations >= max_reinvocations:
+        logger.warning(f'Not resuming payment tracking, {reinvocations} of {max_reinvocations} reinvocations made')
+        return
+
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+
+        _lambda_client = boto3.client('lambda')
+
+    # a worker resumes its own shard from the storage service, after the cursor and up to the last
+    # payment of its part, so the payload stays small whatever the size of the part
+    payload = {key: event[key] for key in ('shard', 'shardCount', 'shardKey', 'lastEntryId') if key in event}
+    if event.get('payments'):
+        payload['lastEntryId'] = event['payments'][-1]['entryId']
+
+    payload.update(resumeCursor=resume_cursor, reinvocations=reinvocations + 1)
+    try:
+        _lambda_client.invoke(FunctionName=context.function_name, InvocationType='Event', Payload=json.dumps(payload))
+        logger.info(f'Resuming payment tracking in a new invocation from cursor {resume_cursor}')
 
-    return {'statusCode': 200, 'body': 'Payment tracking handler completed'}
+    except Exception as e:
+        # the next scheduled run picks the remaining payments up
+        logger.error(f'Failed to resume payment tracking: {str(e)}')
@@ -0,0 +1,27 @@
+from external.payment_update_outbox import SqsPaymentUpdateOutbox
+from usecase.payment_update_outbox_drainer import get_payment_update_outbox_drainer
+from utils.decorators import per_invocation_retry_budget
+from utils.logger import logger
+
+
+@per_invocation_retry_budget
+def handler(event, context):
+    """Payment update outbox handler, triggered by the SQS outbox queue"""
+    _ = context
+
+    records = event.get('Records', [])
+    logger.info(f'Payment update outbox handler received {len(records)} updates')
+
+    entries = [
+        SqsPaymentUpdateOutbox.from_message(record['body'], record['receiptHandle'], record.get('attributes', {}))
+        for record in records
+    ]
+    failed_entries = get_payment_update_outbox_drainer().apply_entries(entries)
+    receipts = {entry.receipt for entry in failed_entries}
+
+    # failed updates are reported so SQS redelivers only those messages
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': record['messageId']} for record in records if record['receiptHandle'] in receipts
+        ]
+    }
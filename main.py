@@ -1,12 +1,11 @@
 import os
 
-import lambdawarmer
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
-from lambda_decorators import cors_headers
 from mangum import Mangum
 
 from controller.app_controller import api_controller
+from utils.decorators import cors_headers, lazy_warmer, per_invocation_retry_budget
 
 STAGE = os.environ.get('STAGE')
 root_path = f'/{STAGE}' if STAGE else '/'
@@ -41,6 +40,7 @@ mangum_handler = Mangum(app, lifespan='off')
 
 
 @cors_headers
-@lambdawarmer.warmer
+@lazy_warmer
+@per_invocation_retry_budget
 def handler(event, context):
     return mangum_handler(event, context)
@@ -6,6 +6,63 @@ class PaymentMethod(str, Enum):
     E_WALLET = 'E_WALLET'
 
 
+class TransactionIdMode(str, Enum):
+    STORAGE = 'STORAGE'
+    SERVICE = 'SERVICE'
+
+
+class PaymentUpdateOutboxMode(str, Enum):
+    NONE = 'NONE'
+    LOCAL = 'LOCAL'
+    SQS = 'SQS'
+
+
+class IdempotencyStoreMode(str, Enum):
+    NONE = 'NONE'
+    MEMORY = 'MEMORY'
+    DYNAMODB = 'DYNAMODB'
+
+
+class PaymentPollScheduleStoreMode(str, Enum):
+    NONE = 'NONE'
+    MEMORY = 'MEMORY'
+    LOCAL = 'LOCAL'
+    DYNAMODB = 'DYNAMODB'
+
+
+class PaymentStatusLedgerMode(str, Enum):
+    NONE = 'NONE'
+    MEMORY = 'MEMORY'
+    LOCAL = 'LOCAL'
+    DYNAMODB = 'DYNAMODB'
+
+
+class MetricsEmitterMode(str, Enum):
+    NONE = 'NONE'
+    MEMORY = 'MEMORY'
+    EMF = 'EMF'
+
+
+class PaymentShardKey(str, Enum):
+    ENTRY_ID = 'ENTRY_ID'
+    EVENT_ID = 'EVENT_ID'
+
+
+class PaymentTrackingDispatchMode(str, Enum):
+    LOCAL = 'LOCAL'
+    LAMBDA = 'LAMBDA'
+
+
+class PaymentDependency(str, Enum):
+    STORAGE = 'storage'
+    XENDIT = 'xendit'
+
+
+class RateLimitBudget(str, Enum):
+    CHECKOUT = 'checkout'
+    TRACKING = 'tracking'
+
+
 class DirectDebitChannels(str, Enum):
     BPI = 'BPI'
     UBP = 'UBP'
@@ -0,0 +1,55 @@
+from decimal import Decimal
+from typing import Dict, Optional
+
+from pydantic import BaseModel, Extra, Field, root_validator, validator
+
+from model.payment.payment_constants import (
+    DirectDebitChannels,
+    EWalletChannels,
+    PaymentMethod,
+)
+
+PAYMENT_METHOD_CHANNELS = {
+    PaymentMethod.DIRECT_DEBIT: DirectDebitChannels,
+    PaymentMethod.E_WALLET: EWalletChannels,
+}
+
+
+class ChannelFeeRule(BaseModel):
+    class Config:
+        extra = Extra.forbid
+
+    fee_percentage: Decimal = Field(..., ge=0, lt=1, title='Fee Percentage')
+    default_fee: Optional[Decimal] = Field(None, ge=0, title='Default Fee')
+
+    # ticket price at or below which the default fee is charged instead of the percentage
+    min_ticket_price_for_default: Optional[Decimal] = Field(None, ge=0, title='Minimum Ticket Price for Default')
+
+    @root_validator(skip_on_failure=True)
+    def check_default_fee(cls, values):
+        if (values.get('default_fee') is None) != (values.get('min_ticket_price_for_default') is None):
+            raise ValueError('default_fee and min_ticket_price_for_default must be provided together.')
+
+        return values
+
+
+class FeeSchedule(BaseModel):
+    class Config:
+        extra = Extra.forbid
+
+    version: str = Field(..., title='Version')
+    vat: Decimal = Field(..., ge=0, title='VAT')
+    channels: Dict[PaymentMethod, Dict[str, ChannelFeeRule]] = Field(..., title='Channel Fee Rules')
+
+    # rule of any other channel of a payment method, e.g. a direct debit quote is priced like a bank whatever its channel
+    default_channels: Dict[PaymentMethod, ChannelFeeRule] = Field({}, title='Default Channel Fee Rules')
+
+    @validator('channels')
+    def check_channels(cls, v):
+        for payment_method, channel_rules in v.items():
+            channels = PAYMENT_METHOD_CHANNELS[payment_method]
+            unknown_channels = [channel for channel in channel_rules if channel not in channels.__members__]
+            if unknown_channels:
+                raise ValueError(f'Unknown {payment_method.value} channels: {", ".join(unknown_channels)}')
+
+        return v
@@ -1,7 +1,7 @@
 from decimal import Decimal
-from typing import Optional, TypeAlias, Union
+from typing import Any, Dict, List, Optional, TypeAlias, Union
 
-from pydantic import BaseModel, Extra, Field
+from pydantic import BaseModel, Extra, Field, root_validator
 from typing_extensions import Annotated
 
 from model.payment.payment_constants import (
@@ -12,6 +12,8 @@ from model.payment.payment_constants import (
 
 Price: TypeAlias = Annotated[Decimal, Field(decimal_places=2)]
 
+MAX_BATCH_QUOTES = 500
+
 
 class GetTransactionDetailsIn(BaseModel):
     class Config:
@@ -31,3 +33,48 @@ class GetTransactionDetailsOut(BaseModel):
     transaction_fee: Price
     platform_fee: Optional[Price] = None
     total_price: Price
+    fee_schedule_version: Optional[str] = Field(None, title='Fee Schedule Version')
+
+
+class GetTransactionDetailsBatchIn(BaseModel):
+    class Config:
+        extra = Extra.forbid
+
+    # an item that is not a valid GetTransactionDetailsIn is kept as sent and reported at its index
+    items: Optional[List[Union[GetTransactionDetailsIn, Dict[str, Any]]]] = Field(
+        None, title='Items', description='Transaction details requests, validated one by one'
+    )
+    ticket_prices: Optional[List[Price]] = Field(None, title='Ticket Prices')
+    platform_fee: Optional[Price] = Field(None, description='Percent platform fee applied to every ticket price')
+    payment_channels: Optional[List[Union[DirectDebitChannels, EWalletChannels]]] = Field(
+        None, title='Payment Channels'
+    )
+
+    @root_validator(skip_on_failure=True)
+    def check_items_or_cross_product(cls, values):
+        items = values.get('items')
+        ticket_prices = values.get('ticket_prices')
+        payment_channels = values.get('payment_channels')
+
+        has_cross_product = ticket_prices is not None or payment_channels is not None
+        if (items is None) == (not has_cross_product):
+            raise ValueError('Pass either items, or ticket_prices and payment_channels.')
+
+        if has_cross_product and (not ticket_prices or not payment_channels):
+            raise ValueError('Both ticket_prices and payment_channels must be provided.')
+
+        quote_count = len(items) if items is not None else len(ticket_prices) * len(payment_channels)
+        if quote_count > MAX_BATCH_QUOTES:
+            raise ValueError(f'A batch can have at most {MAX_BATCH_QUOTES} quotes.')
+
+        return values
+
+
+class GetTransactionDetailsBatchItemOut(BaseModel):
+    index: int = Field(..., title='Index')
+    result: Optional[GetTransactionDetailsOut] = Field(None, title='Result')
+    message: Optional[str] = Field(None, title='Error Message')
+
+
+class GetTransactionDetailsBatchOut(BaseModel):
+    results: List[GetTransactionDetailsBatchItemOut] = Field(..., title='Results')
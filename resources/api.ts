@@ -3,6 +3,8 @@ const functionConfig = {
     handler: "main.handler",
     environment: {
       STAGE: "${self:custom.stage}",
+      PAYMENT_UPDATE_OUTBOX: "SQS",
+      PAYMENT_UPDATE_OUTBOX_QUEUE_URL: { Ref: "PaymentUpdateOutboxQueue" },
     },
     layers: [{ Ref: "PythonRequirementsLambdaLayer" }],
     events: [
@@ -24,10 +26,45 @@ const functionConfig = {
     iamRoleStatements: [
       {
         Effect: "Allow",
-        Action: ["ssm:GetParameter"],
+        Action: ["ssm:GetParameter", "ssm:GetParameters"],
         Resource:
           "arn:aws:ssm:*:*:parameter/${self:custom.stage}-xendit-api-key",
       },
+      {
+        Effect: "Allow",
+        Action: ["sqs:SendMessage"],
+        Resource: { "Fn::GetAtt": ["PaymentUpdateOutboxQueue", "Arn"] },
+      },
+    ],
+  },
+  paymentUpdateOutboxProcessor: {
+    handler: "functions.payment_update_outbox_handler.handler",
+    environment: {
+      STAGE: "${self:custom.stage}",
+      PAYMENT_UPDATE_OUTBOX: "SQS",
+      PAYMENT_UPDATE_OUTBOX_QUEUE_URL: { Ref: "PaymentUpdateOutboxQueue" },
+    },
+    layers: [{ Ref: "PythonRequirementsLambdaLayer" }],
+    events: [
+      {
+        sqs: {
+          arn: { "Fn::GetAtt": ["PaymentUpdateOutboxQueue", "Arn"] },
+          batchSize: 10,
+          functionResponseType: "ReportBatchItemFailures",
+        },
+      },
+    ],
+    iamRoleStatements: [
+      {
+        Effect: "Allow",
+        Action: [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes",
+        ],
+        Resource: { "Fn::GetAtt": ["PaymentUpdateOutboxQueue", "Arn"] },
+      },
     ],
   },
   cronPaymentProcessor: {
@@ -35,6 +72,11 @@ const functionConfig = {
     environment: {
       STAGE: "${self:custom.stage}",
       SQS_QUEUE_URL: "${self:custom.sqsQueueUrl}",
+      PAYMENT_TRACKER_MAX_REINVOCATIONS: "3",
+      PAYMENT_POLL_SCHEDULE: "DYNAMODB",
+      PAYMENT_POLL_SCHEDULE_TABLE_NAME: { Ref: "PaymentPollScheduleTable" },
+      PAYMENT_STATUS_LEDGER: "DYNAMODB",
+      PAYMENT_STATUS_LEDGER_TABLE_NAME: { Ref: "PaymentStatusLedgerTable" },
     },
     layers: [{ Ref: "PythonRequirementsLambdaLayer" }],
     events: [
@@ -48,7 +90,7 @@ const functionConfig = {
     iamRoleStatements: [
       {
         Effect: "Allow",
-        Action: ["ssm:GetParameter"],
+        Action: ["ssm:GetParameter", "ssm:GetParameters"],
         Resource:
           "arn:aws:ssm:*:*:parameter/${self:custom.stage}-xendit-api-key",
       },
@@ -61,6 +103,20 @@ const functionConfig = {
         ],
         Resource: "${self:custom.sqsQueueArn}",
       },
+      {
+        Effect: "Allow",
+        Action: ["dynamodb:BatchGetItem", "dynamodb:BatchWriteItem"],
+        Resource: [
+          { "Fn::GetAtt": ["PaymentPollScheduleTable", "Arn"] },
+          { "Fn::GetAtt": ["PaymentStatusLedgerTable", "Arn"] },
+        ],
+      },
+      {
+        Effect: "Allow",
+        Action: ["lambda:InvokeFunction"],
+        Resource:
+          "arn:aws:lambda:${aws:region}:${aws:accountId}:function:${self:service}-${self:custom.stage}-cronPaymentProcessor",
+      },
     ],
   },
 };
@@ -0,0 +1,208 @@
+"""
+Benchmark the payment request path, blocking versus async, against local fake servers.
+
+Every payment request makes three dependent round trips: create the payment in the
+storage service, create the Xendit payment request, then update the payment with the
+payment request ID. Each fake server adds --latency-ms to every response.
+
+- sync: the three blocking calls (PaymentStorageGateway and the Xendit SDK) on a thread
+  pool sized like the one Starlette runs sync endpoints on
+- async: PaymentUsecase.e_wallet_payment_request, with the storage calls on the shared
+  httpx.AsyncClient and the Xendit call on its async adapter
+- async-service-id: the async path with TRANSACTION_ID_MODE=SERVICE, where the storage
+  create runs concurrently with the Xendit call
+
+For each concurrency level it reports the p50/p99 latency and the throughput.
+
+Usage:
+    python scripts/async_payment_benchmark.py --requests 200 --concurrency 1 16 64
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+from uuid import uuid4
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('XENDIT_RATE_LIMIT_PER_SECOND', '0')
+
+from external.payment_storage_gateway import PaymentStorageGateway  # noqa: E402
+from model.payment.payment import (  # noqa: E402
+    EWalletPaymentIn,
+    PaymentRequestOut,
+    PaymentTransactionIn,
+    TransactionStatus,
+)
+from scripts.fake_servers import (  # noqa: E402
+    SAMPLE_REGISTRATION,
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySsmClient,
+)
+from utils.async_http_client import close_async_http_client  # noqa: E402
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+
+# Starlette runs sync endpoints on the default executor of the event loop
+STARLETTE_THREADPOOL_SIZE = min(32, (os.cpu_count() or 1) + 4)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_payment_in() -> EWalletPaymentIn:
+    return EWalletPaymentIn(
+        successReturnUrl='https://example.com/success',
+        failureReturnUrl='https://example.com/failure',
+        referenceId=str(uuid4()),
+        amount=500,
+        channelCode='GCASH',
+        eventId='benchmark-event',
+        registrationData=SAMPLE_REGISTRATION,
+    )
+
+
+def sync_e_wallet_payment_request(payment_usecase, payment_storage_gateway: PaymentStorageGateway) -> None:
+    """The blocking request path: create, Xendit payment request, update"""
+    in_data = build_payment_in()
+    payment_transaction_in = PaymentTransactionIn(
+        price=in_data.amount,
+        transactionStatus=TransactionStatus.PENDING,
+        eventId=in_data.eventId,
+        registrationData=in_data.registrationData,
+    )
+    _, payment, _ = payment_storage_gateway.create_payment(payment_transaction_in)
+    api_response = payment_usecase.xendit_api_instance.create_payment_request(
+        idempotency_key=str(uuid4()),
+        payment_request_parameters={
+            'country': 'PH',
+            'amount': in_data.amount,
+            'currency': 'PHP',
+            'reference_id': in_data.referenceId,
+            'payment_method': {
+                'type': 'EWALLET',
+                'ewallet': {
+                    'channel_properties': {
+                        'success_return_url': in_data.successReturnUrl,
+                        'failure_return_url': in_data.failureReturnUrl,
+                    },
+                    'channel_code': in_data.channelCode,
+                },
+                'reusability': 'ONE_TIME_USE',
+            },
+        },
+    )
+    payment_transaction_in.paymentRequestId = api_response.id
+    status, _, message = payment_storage_gateway.update_payment_transaction(payment.entryId, payment_transaction_in)
+    if status != 200:
+        raise RuntimeError(message)
+
+
+def run_sync(payment_usecase, total_requests: int, concurrency: int) -> List[float]:
+    payment_storage_gateway = PaymentStorageGateway()
+    threadpool = ThreadPoolExecutor(max_workers=min(concurrency, STARLETTE_THREADPOOL_SIZE))
+
+    def timed_request(submitted_at: float) -> float:
+        sync_e_wallet_payment_request(payment_usecase, payment_storage_gateway)
+        return time.perf_counter() - submitted_at
+
+    latencies = []
+    with ThreadPoolExecutor(max_workers=concurrency) as clients, threadpool:
+        # each client waits for its request, which queues for a threadpool worker like a sync endpoint does
+        def client(_: int) -> float:
+            return threadpool.submit(timed_request, time.perf_counter()).result()
+
+        latencies = list(clients.map(client, range(total_requests)))
+
+    return latencies
+
+
+async def run_async(payment_usecase, total_requests: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_request() -> float:
+        async with semaphore:
+            started_at = time.perf_counter()
+            payment_request_out = await payment_usecase.e_wallet_payment_request(build_payment_in())
+            if not isinstance(payment_request_out, PaymentRequestOut):
+                raise RuntimeError(payment_request_out.body)
+
+            return time.perf_counter() - started_at
+
+    try:
+        return await asyncio.gather(*(timed_request() for _ in range(total_requests)))
+    finally:
+        await close_async_http_client()
+
+
+def measure(name: str, run: Callable[[], List[float]]) -> float:
+    started_at = time.perf_counter()
+    latencies = run()
+    wall_seconds = time.perf_counter() - started_at
+    throughput = len(latencies) / wall_seconds
+    print(
+        f'  {name:<16} p50 {percentile(latencies, 50) * 1000:8.1f} ms  '
+        f'p99 {percentile(latencies, 99) * 1000:8.1f} ms  '
+        f'mean {statistics.mean(latencies) * 1000:8.1f} ms  {throughput:8.1f} req/s'
+    )
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the blocking and async payment request paths')
+    parser.add_argument('--requests', type=int, default=200, help='Payment requests per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64], help='Concurrent clients')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Latency added by each fake server')
+    args = parser.parse_args()
+
+    storage_server = FakeStorageServer(latency_seconds=args.latency_ms / 1000).start()
+    xendit_server = FakeXenditServer(latency_seconds=args.latency_ms / 1000).start()
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+    from usecase.payment_usecase import PaymentUsecase
+
+    payment_usecases = {}
+    for transaction_id_mode in ('STORAGE', 'SERVICE'):
+        os.environ['TRANSACTION_ID_MODE'] = transaction_id_mode
+        payment_usecase = PaymentUsecase()
+        payment_usecase.xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+        payment_usecases[transaction_id_mode] = payment_usecase
+
+    print(
+        f'{args.requests} requests, {args.latency_ms:.0f} ms per round trip, '
+        f'sync threadpool {STARLETTE_THREADPOOL_SIZE} workers'
+    )
+    try:
+        for concurrency in args.concurrency:
+            print(f'\nconcurrency {concurrency}')
+            sync_throughput = measure('sync', lambda: run_sync(payment_usecases['STORAGE'], args.requests, concurrency))
+            for name, transaction_id_mode in (('async', 'STORAGE'), ('async-service-id', 'SERVICE')):
+                async_throughput = measure(
+                    name,
+                    lambda: asyncio.run(run_async(payment_usecases[transaction_id_mode], args.requests, concurrency)),
+                )
+                print(f'  {name} throughput gain x{async_throughput / sync_throughput:.2f}')
+
+    finally:
+        storage_server.stop()
+        xendit_server.stop()
+
+
+if __name__ == '__main__':
+    main()
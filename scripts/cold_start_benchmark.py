@@ -0,0 +1,217 @@
+"""
+Cold start benchmark for the Lambda handlers.
+
+Every run starts a fresh interpreter with -X importtime, imports the handler module,
+then invokes the handler once with a sample event. It reports the import time, the
+first invocation latency and the per-package import time breakdown, and exits with
+status 1 when a median exceeds the budget in scripts/cold_start_budget.json.
+
+The payment tracker runs offline: the storage service is a local HTTP stand-in that
+returns no pending payments and SSM is replaced with an in-memory client.
+
+Usage:
+    python scripts/cold_start_benchmark.py --runs 5 --top 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cold_start_budget.json')
+IMPORTED_MARKER = '-- cold start benchmark: handler imported --'
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+
+API_GATEWAY_GET_ROOT_EVENT = {
+    'resource': '/',
+    'path': '/',
+    'httpMethod': 'GET',
+    'headers': {'Host': 'localhost'},
+    'multiValueHeaders': {},
+    'queryStringParameters': None,
+    'multiValueQueryStringParameters': None,
+    'pathParameters': None,
+    'stageVariables': None,
+    'requestContext': {'resourcePath': '/', 'httpMethod': 'GET', 'path': '/'},
+    'body': None,
+    'isBase64Encoded': False,
+}
+SCHEDULED_EVENT = {'source': 'aws.events', 'detail-type': 'Scheduled Event', 'detail': {}}
+
+TARGETS = {
+    'main': {'event': API_GATEWAY_GET_ROOT_EVENT, 'setup': None},
+    'functions.payment_tracking_handler': {'event': SCHEDULED_EVENT, 'setup': 'setup_offline_tracker'},
+}
+
+CHILD_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module} as target
+import_ms = (time.perf_counter() - start) * 1000
+sys.stderr.write({marker!r} + '\\n')
+sys.stderr.flush()
+
+from scripts import cold_start_benchmark
+setup = {setup!r}
+if setup:
+    getattr(cold_start_benchmark, setup)()
+
+start = time.perf_counter()
+target.handler(json.loads({event!r}), cold_start_benchmark.FakeLambdaContext())
+first_invocation_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{'import_ms': import_ms, 'first_invocation_ms': first_invocation_ms}}))
+'''
+
+
+class FakeLambdaContext:
+    aws_request_id = 'cold-start-benchmark'
+    function_name = 'cold-start-benchmark'
+    function_version = '$LATEST'
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 30000
+
+
+def setup_offline_tracker():
+    """Point the payment tracker at a local storage stand-in and an in-memory SSM client"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+
+    from scripts.fake_servers import InMemorySsmClient
+    from utils.secret_provider import SecretProvider
+
+    class PendingPaymentsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'[]'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PendingPaymentsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ['CALLBACK_BASE_URL'] = f'http://127.0.0.1:{server.server_port}'
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Parse -X importtime output up to the handler imported marker
+
+    Returns:
+        List[Tuple[str, int, int]] -- Module name, self time and cumulative time in microseconds
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if line.strip() == IMPORTED_MARKER:
+            break
+
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:') :].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return modules
+
+
+def run_target(module: str, target: dict) -> Tuple[dict, List[Tuple[str, int, int]]]:
+    env = dict(
+        os.environ, LOG_LEVEL='WARNING', AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    )
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    # the DynamoDB stores are not reachable here
+    env.setdefault('PAYMENT_POLL_SCHEDULE', 'NONE')
+    env.setdefault('PAYMENT_STATUS_LEDGER', 'NONE')
+    script = CHILD_SCRIPT.format(
+        module=module, marker=IMPORTED_MARKER, setup=target['setup'], event=json.dumps(target['event'])
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=ROOT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'{module} benchmark run failed:\n{process.stderr[-4000:]}')
+
+    return json.loads(process.stdout.strip().splitlines()[-1]), parse_importtime(process.stderr)
+
+
+def summarize_packages(modules: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    package_us = defaultdict(int)
+    for name, self_us, _ in modules:
+        package_us[name.split('.')[0]] += self_us
+
+    return package_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure handler import time and first invocation latency')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreter runs per handler')
+    parser.add_argument('--top', type=int, default=15, help='Packages to show in the import breakdown')
+    parser.add_argument('--budget', default=DEFAULT_BUDGET_PATH, help='Budget JSON file')
+    parser.add_argument('--target', action='append', choices=sorted(TARGETS), help='Handler module to measure')
+    args = parser.parse_args()
+
+    with open(args.budget) as budget_file:
+        budgets = json.load(budget_file)
+
+    regressions = []
+    for module in args.target or list(TARGETS):
+        results = []
+        package_runs = defaultdict(list)
+        for _ in range(args.runs):
+            result, modules = run_target(module, TARGETS[module])
+            results.append(result)
+            for package, package_us in summarize_packages(modules).items():
+                package_runs[package].append(package_us)
+
+        print(f'\n{module} ({args.runs} runs)')
+        for metric in ('import_ms', 'first_invocation_ms'):
+            values = [result[metric] for result in results]
+            median = statistics.median(values)
+            budget = budgets.get(module, {}).get(metric)
+            status = ''
+            if budget is not None:
+                status = f'budget {budget:.0f} ms'
+                if median > budget:
+                    status += ' EXCEEDED'
+                    regressions.append(f'{module} {metric} median {median:.1f} ms > {budget} ms')
+
+            print(f'  {metric:<20} median {median:8.1f} ms  max {max(values):8.1f} ms  {status}')
+
+        print('  import time by package (median self time):')
+        package_medians = {package: statistics.median(values) for package, values in package_runs.items()}
+        for package, package_us in sorted(package_medians.items(), key=lambda item: -item[1])[: args.top]:
+            print(f'    {package:<30} {package_us / 1000:8.1f} ms')
+
+    if regressions:
+        print('\nCold start budget exceeded:')
+        for regression in regressions:
+            print(f'  {regression}')
+
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
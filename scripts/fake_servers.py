@@ -0,0 +1,518 @@
+"""
+Local stand-ins for the storage service, Xendit, SSM, SQS, DynamoDB and the Lambda context, used by the
+benchmark scripts.
+
+Both HTTP servers speak HTTP/1.1 with keep-alive so clients can reuse connections,
+and add a fixed latency to every response to stand in for the network round trip. A
+handshake latency can be added to every new connection to stand in for the TCP and TLS
+handshakes, and fail_next() makes the next requests fail to exercise retries.
+"""
+
+import json
+import operator
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+SAMPLE_REGISTRATION = {
+    'firstName': 'Juan',
+    'lastName': 'Dela Cruz',
+    'nickname': 'Juan',
+    'pronouns': 'they/them',
+    'email': 'juan@example.com',
+    'eventId': 'benchmark-event',
+    'contactNumber': '09171234567',
+    'organization': 'SPARCS',
+    'jobTitle': 'Engineer',
+    'facebookLink': 'https://facebook.com/juan',
+    'ticketType': 'coder',
+    'sprintDay': False,
+    'availTShirt': False,
+    'communityInvolvement': False,
+    'futureVolunteer': False,
+    'validIdObjectKey': 'ids/juan.png',
+}
+
+
+class InMemorySsmClient:
+    def __init__(self, values: Dict[str, str]):
+        self.__values = values
+
+    def get_parameters(self, Names, WithDecryption=False):
+        return {
+            'Parameters': [{'Name': name, 'Value': self.__values[name]} for name in Names if name in self.__values],
+            'InvalidParameters': [name for name in Names if name not in self.__values],
+        }
+
+
+class FakeLambdaContext:
+    """Lambda context whose remaining time counts down from timeout_seconds from when it is created"""
+
+    def __init__(self, timeout_seconds: float = 30, function_name: str = 'payment-tracker'):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid4())
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class InMemorySqsClient:
+    """
+    SQS client that keeps sent messages in a list, with an optional latency per call
+
+    fail_next_entries() makes the next entries of send_message_batch calls fail, as SQS
+    reports entries it could not send.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.lock = Lock()
+        self.messages = []
+        self.call_count = 0
+        self.entry_failures_left = 0
+
+    def fail_next_entries(self, count: int) -> None:
+        with self.lock:
+            self.entry_failures_left = count
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if len(Entries) > 10:
+            raise ValueError('AWS.SimpleQueueService.TooManyEntriesInBatchRequest')
+
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        successful, failed = [], []
+        with self.lock:
+            self.call_count += 1
+            for entry in Entries:
+                if self.entry_failures_left > 0:
+                    self.entry_failures_left -= 1
+                    failed.append(
+                        {'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError', 'Message': 'Injected'}
+                    )
+                    continue
+
+                message_id = str(uuid4())
+                self.messages.append(
+                    {
+                        'MessageId': message_id,
+                        'QueueUrl': QueueUrl,
+                        'MessageBody': entry['MessageBody'],
+                        'MessageGroupId': entry.get('MessageGroupId'),
+                        'MessageDeduplicationId': entry.get('MessageDeduplicationId'),
+                    }
+                )
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+
+        response = {'Successful': successful}
+        if failed:
+            response['Failed'] = failed
+
+        return response
+
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId=None, MessageDeduplicationId=None):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        message = {
+            'MessageId': str(uuid4()),
+            'QueueUrl': QueueUrl,
+            'MessageBody': MessageBody,
+            'MessageGroupId': MessageGroupId,
+            'MessageDeduplicationId': MessageDeduplicationId,
+        }
+        with self.lock:
+            self.call_count += 1
+            self.messages.append(message)
+
+        return {'MessageId': message['MessageId']}
+
+
+class InMemoryDynamoDbClient:
+    """
+    DynamoDB client stand-in for one table keyed by a string attribute
+
+    Supports the calls DynamoDbIdempotencyStore makes: get_item, put_item with an
+    attribute_not_exists(key) OR <attribute> <= :value condition, update_item with a
+    SET expression and an optional AND of <attribute> =, > or <= :value conditions, and
+    delete_item. A failed condition raises ConditionalCheckFailedException.
+    """
+
+    class exceptions:
+        class ConditionalCheckFailedException(Exception):
+            pass
+
+    def __init__(self, key_name: str = 'idempotencyKey'):
+        self.__key_name = key_name
+        self.__items: Dict[str, dict] = {}
+        self.__lock = Lock()
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        with self.__lock:
+            item = self.__items.get(Key[self.__key_name]['S'])
+            return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        key = Item[self.__key_name]['S']
+        with self.__lock:
+            existing = self.__items.get(key)
+            if existing is not None and ConditionExpression:
+                match = re.search(r'OR (\w+) <= (:\w+)', ConditionExpression)
+                attribute, value_name = match.groups()
+                if not float(existing[attribute]['N']) <= float(ExpressionAttributeValues[value_name]['N']):
+                    raise self.exceptions.ConditionalCheckFailedException('The conditional request failed')
+
+            self.__items[key] = dict(Item)
+            return {}
+
+    def update_item(
+        self,
+        TableName,
+        Key,
+        UpdateExpression,
+        ExpressionAttributeValues,
+        ExpressionAttributeNames=None,
+        ConditionExpression=None,
+    ):
+        names = ExpressionAttributeNames or {}
+        with self.__lock:
+            if ConditionExpression and not self.__matches(
+                self.__items.get(Key[self.__key_name]['S']), ConditionExpression, ExpressionAttributeValues, names
+            ):
+                raise self.exceptions.ConditionalCheckFailedException('The conditional request failed')
+
+            item = self.__items.setdefault(Key[self.__key_name]['S'], dict(Key))
+            for assignment in UpdateExpression.replace('SET ', '', 1).split(','):
+                attribute, value_name = (part.strip() for part in assignment.split('='))
+                item[names.get(attribute, attribute)] = ExpressionAttributeValues[value_name]
+
+            return {}
+
+    def delete_item(self, TableName, Key):
+        with self.__lock:
+            self.__items.pop(Key[self.__key_name]['S'], None)
+            return {}
+
+    @staticmethod
+    def __matches(item: Optional[dict], condition: str, values: dict, names: dict) -> bool:
+        if item is None:
+            return False
+
+        for comparison in condition.split(' AND '):
+            attribute, comparison_operator, value_name = comparison.split()
+            attribute_value, value = item.get(names.get(attribute, attribute)), values[value_name]
+            if attribute_value is None:
+                return False
+
+            if 'N' in value:
+                attribute_value, value = float(attribute_value['N']), float(value['N'])
+
+            compare = {'=': operator.eq, '>': operator.gt, '<=': operator.le}[comparison_operator]
+            if not compare(attribute_value, value):
+                return False
+
+        return True
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients that stop reading a response early, e.g. a tracker run out of time, reset the connection
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeServer:
+    """
+    Threaded HTTP server that routes requests to handler methods by method and path regex
+
+    Subclasses define ROUTES as (method, pattern, handler name) tuples. Handlers receive
+    the path match and the parsed JSON body and return a status code and a JSON payload.
+    Requests beyond rate_limit_per_second in a second are answered with a 429 and a
+    Retry-After of a second.
+    """
+
+    ROUTES: Tuple[Tuple[str, str, str], ...] = ()
+
+    def __init__(self, latency_seconds: float = 0.0, handshake_latency_seconds: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.handshake_latency_seconds = handshake_latency_seconds
+        self.lock = Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.failures_left = 0
+        self.failure_status = 503
+        self.rate_limit_per_second = 0
+        self.rate_limited_count = 0
+        self.__window = (0, 0)
+        self.__server: Optional[_QuietHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.__server.server_port}'
+
+    def fail_next(self, count: int, status: int = 503) -> None:
+        """Answer the next count requests with status instead of routing them"""
+        with self.lock:
+            self.failures_left = count
+            self.failure_status = status
+
+    def rate_limited(self) -> bool:
+        """Count a request in its one-second window, telling whether it goes over rate_limit_per_second"""
+        if not self.rate_limit_per_second:
+            return False
+
+        with self.lock:
+            second = int(time.monotonic())
+            window_second, window_requests = self.__window
+            window_requests = window_requests + 1 if window_second == second else 1
+            self.__window = (second, window_requests)
+            if window_requests <= self.rate_limit_per_second:
+                return False
+
+            self.rate_limited_count += 1
+            return True
+
+    def start(self) -> 'FakeServer':
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake_server.lock:
+                    fake_server.connection_count += 1
+
+                if fake_server.handshake_latency_seconds:
+                    time.sleep(fake_server.handshake_latency_seconds)
+
+            def do_GET(self):
+                self.__dispatch('GET')
+
+            def do_POST(self):
+                self.__dispatch('POST')
+
+            def do_PUT(self):
+                self.__dispatch('PUT')
+
+            def log_message(self, *args):
+                pass
+
+            def __dispatch(self, method: str):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with fake_server.lock:
+                    fake_server.request_count += 1
+                    failing = fake_server.failures_left > 0
+                    if failing:
+                        fake_server.failures_left -= 1
+
+                status, payload, headers = 404, {'message': 'Not found'}, {}
+                if failing:
+                    status, payload = fake_server.failure_status, {'message': 'Injected failure'}
+                elif fake_server.rate_limited():
+                    status, payload = 429, {'error_code': 'RATE_LIMIT_EXCEEDED', 'message': 'Too many requests'}
+                    headers['Retry-After'] = '1'
+                else:
+                    for route_method, pattern, handler_name in fake_server.ROUTES:
+                        match = re.fullmatch(pattern, self.path)
+                        if route_method == method and match:
+                            status, payload = getattr(fake_server, handler_name)(match, body)
+                            break
+
+                if fake_server.latency_seconds:
+                    time.sleep(fake_server.latency_seconds)
+
+                # a None payload is answered with an empty body
+                content = b'' if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                # headers and body go out in one write, so Nagle's algorithm does not hold back the body
+                self._headers_buffer.append(b'\r\n' + content)
+                self.flush_headers()
+
+        self.__server = _QuietHTTPServer(('127.0.0.1', 0), Handler)
+        self.__server.daemon_threads = True
+        Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+
+
+class FakeStorageServer(FakeServer):
+    """Payment transactions storage service, keyed by entryId"""
+
+    ROUTES = (
+        ('POST', r'/payments', 'create_payment'),
+        ('PUT', r'/payments/(?P<entry_id>[^/?]+)', 'update_payment'),
+        ('GET', r'/payments/pending(\?.*)?', 'get_pending_payments'),
+    )
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        handshake_latency_seconds: float = 0.0,
+        paginates: bool = True,
+    ):
+        super().__init__(latency_seconds, handshake_latency_seconds)
+        self.paginates = paginates
+        self.payments: Dict[str, dict] = {}
+
+    def create_payment(self, match, body):
+        payment = dict(body, entryId=body.get('entryId') or str(uuid4()))
+        with self.lock:
+            self.payments[payment['entryId']] = payment
+
+        return 200, payment
+
+    def update_payment(self, match, body):
+        entry_id = match.group('entry_id')
+        with self.lock:
+            if entry_id not in self.payments:
+                return 404, {'message': f'Payment {entry_id} not found'}
+
+            self.payments[entry_id] = dict(body, entryId=entry_id)
+            return 200, self.payments[entry_id]
+
+    def get_pending_payments(self, match, body):
+        query = parse_qs(urlparse(match.group(0)).query)
+        with self.lock:
+            pending_payments = [
+                payment for payment in self.payments.values() if payment['transactionStatus'] == 'PENDING'
+            ]
+
+        if not self.paginates or 'limit' not in query:
+            return 200, pending_payments
+
+        # keyset pagination: the cursor is the last entryId of the previous page, so payments
+        # that leave the pending set between pages do not shift the next page
+        cursor = query.get('cursor', [''])[0]
+        limit = int(query['limit'][0])
+        remaining = sorted(
+            (payment for payment in pending_payments if payment['entryId'] > cursor), key=lambda p: p['entryId']
+        )
+        page = remaining[:limit]
+        return 200, {'items': page, 'nextCursor': page[-1]['entryId'] if len(remaining) > limit else None}
+
+
+class FakeXenditServer(FakeServer):
+    """
+    Xendit payment requests API
+
+    Payment requests in unlisted_ids are left out of list results, as ones the list has
+    not caught up with yet, and with lists=False listing is rejected with a 403.
+    """
+
+    ROUTES = (
+        ('POST', r'/payment_requests', 'create_payment_request'),
+        ('GET', r'/payment_requests(\?.*)?', 'list_payment_requests'),
+        ('GET', r'/payment_requests/(?P<payment_request_id>[^/?]+)', 'get_payment_request'),
+    )
+
+    def __init__(self, latency_seconds: float = 0.0, handshake_latency_seconds: float = 0.0, lists: bool = True):
+        super().__init__(latency_seconds, handshake_latency_seconds)
+        self.lists = lists
+        self.unlisted_ids: Set[str] = set()
+        self.list_request_count = 0
+        self.payment_requests: Dict[str, dict] = {}
+
+    def create_payment_request(self, match, body):
+        payment_method = body['payment_method']
+        payment_request = self.add_payment_request(
+            f'pr-{uuid4()}',
+            reference_id=body['reference_id'],
+            amount=body['amount'],
+            currency=body['currency'],
+            payment_method_type=payment_method['type'],
+            reusability=payment_method['reusability'],
+        )
+        return 201, payment_request
+
+    def add_payment_request(
+        self,
+        payment_request_id: str,
+        status: str = 'REQUIRES_ACTION',
+        reference_id: str = 'benchmark-reference',
+        amount: float = 500,
+        currency: str = 'PHP',
+        payment_method_type: str = 'EWALLET',
+        reusability: str = 'ONE_TIME_USE',
+        created: Optional[datetime] = None,
+    ) -> dict:
+        """Store a payment request, as if it had been created earlier"""
+        created = (created or datetime.now(timezone.utc)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        payment_request = {
+            'id': payment_request_id,
+            'created': created,
+            'updated': created,
+            'reference_id': reference_id,
+            'business_id': 'benchmark-business',
+            'currency': currency,
+            'amount': amount,
+            'country': 'PH',
+            'payment_method': {
+                'id': f'pm-{uuid4()}',
+                'type': payment_method_type,
+                'reusability': reusability,
+                'status': 'ACTIVE',
+            },
+            'status': status,
+            'actions': [
+                {
+                    'action': 'AUTH',
+                    'url_type': 'WEB',
+                    'method': 'GET',
+                    'url': f'https://checkout.example.com/{payment_request_id}',
+                    'qr_code': None,
+                }
+            ],
+        }
+        with self.lock:
+            self.payment_requests[payment_request_id] = payment_request
+
+        return payment_request
+
+    def get_payment_request(self, match, body):
+        with self.lock:
+            payment_request = self.payment_requests.get(match.group('payment_request_id'))
+
+        if payment_request is None:
+            return 404, {'error_code': 'DATA_NOT_FOUND', 'message': 'Payment request not found'}
+
+        return 200, payment_request
+
+    def list_payment_requests(self, match, body):
+        if not self.lists:
+            return 403, {'error_code': 'REQUEST_FORBIDDEN_ERROR', 'message': 'Listing payment requests is not allowed'}
+
+        query = parse_qs(urlparse(match.group(0)).query)
+        limit = int(query.get('limit', ['10'])[0])
+        after_id = query.get('after_id', [''])[0]
+        with self.lock:
+            self.list_request_count += 1
+            ids = query.get('id') or list(self.payment_requests)
+            listed = sorted(
+                (
+                    self.payment_requests[payment_request_id]
+                    for payment_request_id in set(ids)
+                    if payment_request_id in self.payment_requests and payment_request_id not in self.unlisted_ids
+                ),
+                key=lambda payment_request: payment_request['id'],
+            )
+
+        listed = [payment_request for payment_request in listed if payment_request['id'] > after_id]
+        return 200, {'data': listed[:limit], 'has_more': len(listed) > limit, 'links': []}
@@ -0,0 +1,136 @@
+"""
+Check the closed-form fee engine against the original sympy solver.
+
+Runs both implementations over a grid of ticket prices, platform fees and
+payment channels and reports every field that differs to the centavo. Exact
+half-centavo ties are counted separately: sympy solves in binary floating point,
+so which way it rounds a tie depends on the representation error of the inputs.
+
+Usage:
+    python scripts/fee_engine_reference_check.py --step 0.37 --max-price 5000
+"""
+
+import argparse
+import os
+import sys
+from decimal import Decimal
+
+from sympy import Eq, solve, symbols
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from model.payment.payment_constants import (  # noqa: E402
+    DirectDebitChannels,
+    EWalletChannels,
+    PaymentMethod,
+)
+from model.transaction.transaction import GetTransactionDetailsIn  # noqa: E402
+from usecase.fee_engine import (  # noqa: E402
+    compute_transaction_details,
+    get_channel_total_price,
+)
+
+PLATFORM_FEES = (None, Decimal('0.03'), Decimal('0.05'), Decimal('0.1'))
+THRESHOLD_PRICES = (Decimal('1483.19'), Decimal('1483.2'), Decimal('1483.21'))
+
+
+def sympy_transaction_details(get_transaction_details_in: GetTransactionDetailsIn) -> dict:
+    """Original sympy implementation of TransactionUsecase.get_transaction_details"""
+    e_wallet_fee_map = {EWalletChannels.GCASH.value: 0.023, EWalletChannels.PAYMAYA.value: 0.018}
+    platform_percent = get_transaction_details_in.platform_fee or Decimal(0.00)
+
+    initial_ticket_price = get_transaction_details_in.ticket_price
+    platform_fee = platform_percent * initial_ticket_price
+    ticket_price = initial_ticket_price + platform_fee
+
+    vat = 0.12
+    P = symbols('P')
+
+    if get_transaction_details_in.payment_method == PaymentMethod.E_WALLET.value:
+        transaction_fee = P * e_wallet_fee_map.get(get_transaction_details_in.payment_channel)
+    else:
+        is_fee_greater_than_default = ticket_price > 1483.2
+        transaction_fee = (P * 0.01) if is_fee_greater_than_default else 15
+
+    equation = Eq(P - transaction_fee - (transaction_fee * vat), ticket_price)
+    total_price = solve(equation, P)[0]
+    transaction_fee = total_price - ticket_price
+
+    return {
+        'ticket_price': round(initial_ticket_price, 2),
+        'total_price': round(total_price, 2),
+        'platform_fee': None if platform_fee <= 0 else round(platform_fee, 2),
+        'transaction_fee': round(transaction_fee, 2),
+    }
+
+
+def to_centavo(value):
+    return None if value is None else Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def is_half_centavo_tie(get_transaction_details_in: GetTransactionDetailsIn, field: str) -> bool:
+    platform_percent = get_transaction_details_in.platform_fee or Decimal(0)
+    ticket_price = get_transaction_details_in.ticket_price * (1 + platform_percent)
+    total_price = get_channel_total_price(
+        ticket_price,
+        get_transaction_details_in.payment_method,
+        get_transaction_details_in.payment_channel,
+    )
+    amount = total_price if field == 'total_price' else total_price - ticket_price
+    return (amount * 1000) % 10 == 5
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the fee engine with the sympy reference')
+    parser.add_argument('--step', type=Decimal, default=Decimal('0.37'), help='Ticket price step')
+    parser.add_argument('--max-price', type=Decimal, default=Decimal('5000'), help='Highest ticket price')
+    args = parser.parse_args()
+
+    channels = [(PaymentMethod.E_WALLET, channel) for channel in EWalletChannels]
+    channels += [(PaymentMethod.DIRECT_DEBIT, channel) for channel in DirectDebitChannels]
+
+    prices = []
+    price = Decimal(0)
+    while price <= args.max_price:
+        prices.append(price)
+        price += args.step
+    prices.extend(THRESHOLD_PRICES)
+
+    checked = 0
+    ties = 0
+    mismatches = 0
+    for ticket_price in prices:
+        for platform_fee in PLATFORM_FEES:
+            for payment_method, payment_channel in channels:
+                get_transaction_details_in = GetTransactionDetailsIn(
+                    ticket_price=ticket_price,
+                    platform_fee=platform_fee,
+                    payment_method=payment_method,
+                    payment_channel=payment_channel,
+                )
+                expected = sympy_transaction_details(get_transaction_details_in)
+                actual = compute_transaction_details(get_transaction_details_in).dict()
+                checked += 1
+
+                for field, expected_value in expected.items():
+                    if to_centavo(expected_value) == to_centavo(actual[field]):
+                        continue
+
+                    if field in ('total_price', 'transaction_fee') and is_half_centavo_tie(
+                        get_transaction_details_in, field
+                    ):
+                        ties += 1
+                        continue
+
+                    mismatches += 1
+                    print(
+                        f'{payment_method.value}/{payment_channel.value} ticket_price={ticket_price} '
+                        f'platform_fee={platform_fee}: {field} expected {expected_value}, got {actual[field]}'
+                    )
+
+    print(f'Checked {checked} quotes, {ties} half-centavo ties rounded differently, {mismatches} mismatches')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
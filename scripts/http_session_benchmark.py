@@ -0,0 +1,121 @@
+"""
+Benchmark PaymentStorageGateway with a new connection per call versus the pooled session.
+
+The fake storage service adds --latency-ms to every response and --handshake-ms to every
+new connection, standing in for the TCP and TLS handshakes to the real service.
+
+- per-call: module-level requests.put, as the gateway used to call it, which opens a
+  connection for every call
+- pooled: PaymentStorageGateway on the shared keep-alive session
+
+It reports the p50/p99 latency and connections opened of each, then injects 503s to show
+the retries of an update and the invocation's retry budget running out.
+
+Usage:
+    python scripts/http_session_benchmark.py --calls 200 --latency-ms 5 --handshake-ms 30
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+import requests  # noqa: E402
+
+from external.payment_storage_gateway import PaymentStorageGateway  # noqa: E402
+from model.payment.payment import PaymentTransactionIn, TransactionStatus  # noqa: E402
+from scripts.fake_servers import SAMPLE_REGISTRATION, FakeStorageServer  # noqa: E402
+from utils.http_session import get_http_session_stats, send_request  # noqa: E402
+from utils.retry_budget import RetryBudget, get_retry_budget  # noqa: E402
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(name: str, storage_server: FakeStorageServer, calls: int, call: Callable[[], None]) -> float:
+    connections_before = storage_server.connection_count
+    latencies = []
+    for _ in range(calls):
+        started_at = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started_at)
+
+    connections = storage_server.connection_count - connections_before
+    print(
+        f'  {name:<10} p50 {percentile(latencies, 50) * 1000:8.1f} ms  '
+        f'p99 {percentile(latencies, 99) * 1000:8.1f} ms  '
+        f'mean {statistics.mean(latencies) * 1000:8.1f} ms  {connections:5d} connections'
+    )
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-call connections with the pooled HTTP session')
+    parser.add_argument('--calls', type=int, default=200, help='Payment updates per run')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Latency added to every response')
+    parser.add_argument('--handshake-ms', type=float, default=30, help='Latency added to every new connection')
+    args = parser.parse_args()
+
+    storage_server = FakeStorageServer(
+        latency_seconds=args.latency_ms / 1000, handshake_latency_seconds=args.handshake_ms / 1000
+    ).start()
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+
+    payment = PaymentTransactionIn(
+        price=500,
+        transactionStatus=TransactionStatus.PENDING,
+        eventId='benchmark-event',
+        registrationData=SAMPLE_REGISTRATION,
+    )
+    payment_storage_gateway = PaymentStorageGateway()
+    _, payment_transaction, _ = payment_storage_gateway.create_payment(payment)
+    update_url = f'{storage_server.base_url}/payments/{payment_transaction.entryId}'
+
+    def per_call_update() -> None:
+        response = requests.put(update_url, json=payment.dict())
+        response.raise_for_status()
+
+    def pooled_update() -> None:
+        status, _, message = payment_storage_gateway.update_payment_transaction(payment_transaction.entryId, payment)
+        if status != 200:
+            raise RuntimeError(message)
+
+    print(f'{args.calls} updates, {args.latency_ms:.0f} ms per response, {args.handshake_ms:.0f} ms per handshake')
+    try:
+        per_call_mean = measure('per-call', storage_server, args.calls, per_call_update)
+        pooled_mean = measure('pooled', storage_server, args.calls, pooled_update)
+        print(f'  pooled saves {(per_call_mean - pooled_mean) * 1000:.1f} ms per call')
+
+        print('\nretries')
+        get_retry_budget().reset()
+        storage_server.fail_next(2)
+        status, _, _ = payment_storage_gateway.update_payment_transaction(payment_transaction.entryId, payment)
+        print(f'  update after 2 injected 503s: HTTP {status}, retry budget spent {get_retry_budget().spent}')
+
+        storage_server.fail_next(10)
+        status, _, _ = payment_storage_gateway.update_payment_transaction(payment_transaction.entryId, payment)
+        print(f'  update after 10 injected 503s: HTTP {status}, retry budget spent {get_retry_budget().spent}')
+        storage_server.fail_next(0)
+
+        small_budget = RetryBudget(1)
+        storage_server.fail_next(3)
+        response = send_request('PUT', update_url, retry_budget=small_budget, json=payment.dict())
+        storage_server.fail_next(0)
+        print(f'  retry budget of 1 with 3 injected 503s: HTTP {response.status_code}, denied {small_budget.denied}')
+
+        print(f'\nsession stats: {get_http_session_stats()._asdict()}')
+
+    finally:
+        storage_server.stop()
+
+
+if __name__ == '__main__':
+    main()
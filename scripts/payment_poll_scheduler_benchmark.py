@@ -0,0 +1,135 @@
+"""
+Benchmark the payments checked per tracker run with and without the poll scheduler.
+
+The fake storage service starts with a backlog of --payments abandoned pending payments,
+created evenly over the last --backlog-hours, and --arrivals new pending payments are
+added before every run. A run is simulated every --interval-minutes for --runs runs on a
+simulated clock, once checking every pending payment on every run and once with the poll
+scheduler. None of the payments resolve, so both track the same backlog.
+
+For each it reports the payments checked and the Xendit requests per run, first run and
+the average of the others.
+
+Usage:
+    python scripts/payment_poll_scheduler_benchmark.py --payments 2000 --backlog-hours 48 --runs 36
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('XENDIT_RATE_LIMIT_PER_SECOND', '0')
+os.environ.setdefault('METRICS_EMITTER', 'NONE')
+os.environ.setdefault('PAYMENT_STATUS_LEDGER', 'NONE')
+
+from external.payment_poll_schedule_store import InMemoryPaymentPollScheduleStore  # noqa: E402
+from scripts.fake_servers import (  # noqa: E402
+    SAMPLE_REGISTRATION,
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySqsClient,
+    InMemorySsmClient,
+)
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+
+
+class SimulatedClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now.timestamp()
+
+
+def add_payment(storage_server: FakeStorageServer, xendit_server: FakeXenditServer, created: datetime) -> None:
+    index = len(storage_server.payments)
+    entry_id = f'payment-{index:06d}'
+    payment_request_id = f'pr-{index:06d}'
+    xendit_server.add_payment_request(payment_request_id, created=created)
+    storage_server.payments[entry_id] = {
+        'entryId': entry_id,
+        'price': 500.0,
+        'transactionStatus': 'PENDING',
+        'eventId': 'benchmark-event',
+        'paymentRequestId': payment_request_id,
+        'registrationData': SAMPLE_REGISTRATION,
+    }
+
+
+def simulate(args, scheduled: bool):
+    from usecase.payment_poll_scheduler import PaymentPollScheduler
+    from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+    from usecase.payment_usecase import get_payment_usecase
+
+    storage_server = FakeStorageServer().start()
+    xendit_server = FakeXenditServer().start()
+    clock = SimulatedClock(datetime.now(timezone.utc))
+    backlog = timedelta(hours=args.backlog_hours)
+    for index in range(args.payments):
+        add_payment(storage_server, xendit_server, clock.now - backlog * (index + 1) / args.payments)
+
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+    os.environ['PAYMENT_POLL_SCHEDULE'] = 'NONE'
+    get_payment_usecase().xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+    payment_poll_scheduler = PaymentPollScheduler(InMemoryPaymentPollScheduleStore(clock), clock=clock)
+
+    checked, xendit_requests = [], []
+    try:
+        for _ in range(args.runs):
+            for _ in range(args.arrivals):
+                add_payment(storage_server, xendit_server, clock.now - timedelta(minutes=1))
+
+            request_count = xendit_server.request_count
+            tracking_summary = PaymentTrackingUsecase(
+                sqs_client=InMemorySqsClient(),
+                payment_poll_scheduler=payment_poll_scheduler if scheduled else None,
+            ).track_pending_payments()
+            checked.append(tracking_summary.checked)
+            xendit_requests.append(xendit_server.request_count - request_count)
+            clock.now += timedelta(minutes=args.interval_minutes)
+
+    finally:
+        storage_server.stop()
+        xendit_server.stop()
+
+    return checked, xendit_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the payments checked per run with the poll scheduler')
+    parser.add_argument('--payments', type=int, default=2000, help='Abandoned pending payments at the start')
+    parser.add_argument('--backlog-hours', type=float, default=48, help='Age of the oldest pending payment')
+    parser.add_argument('--arrivals', type=int, default=20, help='New pending payments before every run')
+    parser.add_argument('--runs', type=int, default=36, help='Tracker runs to simulate')
+    parser.add_argument('--interval-minutes', type=float, default=10, help='Time between runs')
+    args = parser.parse_args()
+
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+    print(
+        f'{args.payments} pending payments over {args.backlog_hours:.0f} h, {args.arrivals} new per run, '
+        f'{args.runs} runs every {args.interval_minutes:.0f} min'
+    )
+    for name, scheduled in (('every run', False), ('scheduled', True)):
+        checked, xendit_requests = simulate(args, scheduled)
+        later_runs = max(1, len(checked) - 1)
+        print(
+            f'  {name:<10} first run {checked[0]:6d} checked {xendit_requests[0]:5d} Xendit requests  '
+            f'later runs {sum(checked[1:]) / later_runs:8.1f} checked {sum(xendit_requests[1:]) / later_runs:7.1f} '
+            f'Xendit requests  total {sum(checked)} checked'
+        )
+
+
+if __name__ == '__main__':
+    main()
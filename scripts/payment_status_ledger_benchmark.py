@@ -0,0 +1,113 @@
+"""
+Benchmark the status updates the tracker sends to SQS with and without the status ledger.
+
+The fake storage service holds --payments pending payments, of which --settled-percent
+have succeeded or failed on the fake Xendit server. The storage service never applies the
+status updates, as if it were slow to stop listing settled payments as pending, so every
+run finds the same settled payments. --runs tracker runs are made, once sending every
+settled payment's status on every run and once with an in-memory status ledger.
+
+For each it reports the status updates sent and skipped per run, first run and the
+average of the others, and the distinct deduplication IDs sent, which with content-derived
+IDs is at most one per settled payment.
+
+Usage:
+    python scripts/payment_status_ledger_benchmark.py --payments 1000 --settled-percent 50 --runs 10
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('PAYMENT_POLL_SCHEDULE', 'NONE')
+os.environ.setdefault('PAYMENT_STATUS_LEDGER', 'NONE')
+os.environ.setdefault('XENDIT_RATE_LIMIT_PER_SECOND', '0')
+os.environ.setdefault('METRICS_EMITTER', 'NONE')
+
+from external.payment_status_ledger import InMemoryPaymentStatusLedger  # noqa: E402
+from scripts.fake_servers import (  # noqa: E402
+    SAMPLE_REGISTRATION,
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySqsClient,
+    InMemorySsmClient,
+)
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+
+
+def simulate(args, storage_server: FakeStorageServer, with_ledger: bool):
+    from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+
+    payment_status_ledger = InMemoryPaymentStatusLedger() if with_ledger else None
+    sqs_client = InMemorySqsClient()
+    sent, skipped = [], []
+    for _ in range(args.runs):
+        tracking_summary = PaymentTrackingUsecase(
+            sqs_client=sqs_client, payment_status_ledger=payment_status_ledger
+        ).track_pending_payments()
+        sent.append(tracking_summary.status_updates_sent)
+        skipped.append(tracking_summary.status_updates_skipped)
+
+    deduplication_ids = {message['MessageDeduplicationId'] for message in sqs_client.messages}
+    return sent, skipped, len(deduplication_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the status updates sent per run with the status ledger')
+    parser.add_argument('--payments', type=int, default=1000, help='Pending payments in the storage service')
+    parser.add_argument('--settled-percent', type=float, default=50, help='Payments settled on Xendit')
+    parser.add_argument('--runs', type=int, default=10, help='Tracker runs to make')
+    args = parser.parse_args()
+
+    storage_server = FakeStorageServer().start()
+    xendit_server = FakeXenditServer().start()
+    for index in range(args.payments):
+        entry_id = f'payment-{index:06d}'
+        payment_request_id = f'pr-{index:06d}'
+        settled = index * args.settled_percent // 100 != (index + 1) * args.settled_percent // 100
+        status = ('SUCCEEDED', 'FAILED')[index % 2] if settled else 'PENDING'
+        xendit_server.add_payment_request(payment_request_id, status=status)
+        storage_server.payments[entry_id] = {
+            'entryId': entry_id,
+            'price': 500.0,
+            'transactionStatus': 'PENDING',
+            'eventId': 'benchmark-event',
+            'paymentRequestId': payment_request_id,
+            'registrationData': SAMPLE_REGISTRATION,
+        }
+
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+    from usecase.payment_usecase import get_payment_usecase
+
+    get_payment_usecase().xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+
+    print(f'{args.payments} pending payments, {args.settled_percent:.0f}% settled on Xendit, {args.runs} runs')
+    try:
+        for name, with_ledger in (('no ledger', False), ('ledger', True)):
+            sent, skipped, deduplication_ids = simulate(args, storage_server, with_ledger)
+            later_runs = max(1, len(sent) - 1)
+            print(
+                f'  {name:<10} first run {sent[0]:5d} sent  '
+                f'later runs {sum(sent[1:]) / later_runs:7.1f} sent {sum(skipped[1:]) / later_runs:7.1f} skipped  '
+                f'total {sum(sent)} sent with {deduplication_ids} deduplication IDs'
+            )
+
+    finally:
+        storage_server.stop()
+        xendit_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark PaymentTrackingUsecase.track_pending_payments at increasing concurrency and lookup batch size.
+
+The fake storage service holds --payments pending payments whose payment requests on the
+fake Xendit server are pending, succeeded or failed in turn. The Xendit server adds
+--latency-ms to every lookup, and status updates go to an in-memory SQS client, whose
+calls are counted.
+
+For each lookup batch size and concurrency level it reports the wall time, the lookups
+per second, the requests Xendit received and the p50/p99 latency of the Xendit calls from
+the run's metrics, and checks that the summary and the status
+updates sent are the same as in the first run. A batch size of 1 gets every payment
+request by ID; larger batches list them, getting by ID only the --unlisted-percent of
+payment requests left out of the list results. With more than one of --shards, a
+coordinator splits the run into shards tracked on parallel threads, the way Lambda
+workers would track them, and the summaries of the shards are added up.
+
+Usage:
+    python scripts/payment_tracker_benchmark.py --payments 1000 --latency-ms 50 --concurrency 1 4 16 64 \\
+        --batch-size 1 50 --unlisted-percent 2 --shards 1 4 --shard-key ENTRY_ID
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('PAYMENT_POLL_SCHEDULE', 'NONE')
+os.environ.setdefault('PAYMENT_STATUS_LEDGER', 'NONE')
+os.environ.setdefault('XENDIT_RATE_LIMIT_PER_SECOND', '0')
+os.environ.setdefault('METRICS_EMITTER', 'NONE')
+
+from external.metrics_emitter import InMemoryMetricsEmitter  # noqa: E402
+from scripts.fake_servers import (  # noqa: E402
+    SAMPLE_REGISTRATION,
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySqsClient,
+    InMemorySsmClient,
+)
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+PAYMENT_REQUEST_STATUSES = ('REQUIRES_ACTION', 'SUCCEEDED', 'FAILED', 'PENDING')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure payment tracking throughput by concurrency')
+    parser.add_argument('--payments', type=int, default=1000, help='Pending payments to track')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Latency of every Xendit lookup')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help='Concurrent lookups')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 50], help='Payment requests per lookup')
+    parser.add_argument('--unlisted-percent', type=float, default=2, help='Payment requests missing from lists')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1], help='Shards each run is split into')
+    parser.add_argument('--shard-key', default='ENTRY_ID', help='ENTRY_ID or EVENT_ID, hashed to pick the shard')
+    parser.add_argument('--events', type=int, default=20, help='Events the payments belong to')
+    args = parser.parse_args()
+
+    storage_server = FakeStorageServer().start()
+    xendit_server = FakeXenditServer(latency_seconds=args.latency_ms / 1000).start()
+    for index in range(args.payments):
+        entry_id = f'payment-{index:06d}'
+        payment_request_id = f'pr-{index:06d}'
+        xendit_server.add_payment_request(
+            payment_request_id, status=PAYMENT_REQUEST_STATUSES[index % len(PAYMENT_REQUEST_STATUSES)]
+        )
+        if index * args.unlisted_percent // 100 != (index + 1) * args.unlisted_percent // 100:
+            xendit_server.unlisted_ids.add(payment_request_id)
+        storage_server.payments[entry_id] = {
+            'entryId': entry_id,
+            'price': 500.0,
+            'transactionStatus': 'PENDING',
+            'eventId': f'benchmark-event-{index % args.events}',
+            'paymentRequestId': payment_request_id,
+            'registrationData': SAMPLE_REGISTRATION,
+        }
+
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+    from model.payment.payment_constants import PaymentShardKey
+    from usecase.payment_tracking_coordinator import LocalPaymentTrackingDispatcher, PaymentTrackingCoordinator
+    from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+    from usecase.payment_usecase import get_payment_usecase
+
+    get_payment_usecase().xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+
+    print(f'{args.payments} pending payments, {args.latency_ms:.0f} ms per Xendit lookup')
+    baseline = None
+    try:
+        for batch_size in args.batch_size:
+            for concurrency in args.concurrency:
+                for shard_count in args.shards:
+                    sqs_client = InMemorySqsClient()
+                    metrics_emitter = InMemoryMetricsEmitter()
+                    xendit_requests = xendit_server.request_count
+
+                    def usecase_factory():
+                        return PaymentTrackingUsecase(
+                            sqs_client=sqs_client,
+                            concurrency=concurrency,
+                            lookup_batch_size=batch_size,
+                            metrics_emitter=metrics_emitter,
+                        )
+
+                    if shard_count > 1:
+                        tracking_summary = (
+                            PaymentTrackingCoordinator(
+                                LocalPaymentTrackingDispatcher(usecase_factory),
+                                shard_count,
+                                PaymentShardKey(args.shard_key.upper()),
+                            )
+                            .track_pending_payments()
+                            .total
+                        )
+                    else:
+                        tracking_summary = usecase_factory().track_pending_payments()
+
+                    xendit_requests = xendit_server.request_count - xendit_requests
+                    updates = sorted(
+                        (message['MessageGroupId'], json.loads(message['MessageBody'])['status'])
+                        for message in sqs_client.messages
+                    )
+                    outcome = (tracking_summary._replace(xendit_calls=0, sqs_calls=0, wall_seconds=0), updates)
+                    baseline = baseline or outcome
+                    print(
+                        f'  batch {batch_size:3d}  concurrency {concurrency:3d}  shards {shard_count:2d}  '
+                        f'wall {tracking_summary.wall_seconds * 1000:9.1f} ms  '
+                        f'{tracking_summary.checked / tracking_summary.wall_seconds:8.1f} lookups/s  '
+                        f'{xendit_requests:5d} Xendit requests  '
+                        # the slowest shard's percentiles
+                        f'p50 {max(metrics_emitter.values("XenditLatencyP50"), default=0):6.1f} ms  '
+                        f'p99 {max(metrics_emitter.values("XenditLatencyP99"), default=0):6.1f} ms  '
+                        f'{len(updates)} updates in {sqs_client.call_count} SQS calls  '
+                        f'{"same outcome" if outcome == baseline else "DIFFERENT OUTCOME"}'
+                    )
+
+        print(f'\nsummary: {tracking_summary._asdict()}')
+
+    finally:
+        storage_server.stop()
+        xendit_server.stop()
+
+
+if __name__ == '__main__':
+    main()
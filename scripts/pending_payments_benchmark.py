@@ -0,0 +1,126 @@
+"""
+Benchmark downloading the pending payments backlog whole versus as a stream.
+
+The fake storage services run in a child process, so their memory is not counted, hold
+--payments pending payments and add --latency-ms to every response.
+
+- whole: one GET of the whole backlog parsed with response.json() into a list, as the
+  tracker used to download it
+- paged: PaymentStorageGateway.iter_pending_payment_transactions with limit/cursor pages
+- streamed: the same against a storage service that does not paginate, with the JSON
+  array parsed incrementally
+
+For each it reports the time to the first payment and the total time, then the peak
+memory allocated while the payments are consumed one at a time, measured in a second run
+since tracing allocations slows parsing down.
+
+Usage:
+    python scripts/pending_payments_benchmark.py --payments 20000 --page-size 100 --latency-ms 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterable
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from external.payment_storage_gateway import PaymentStorageGateway  # noqa: E402
+from model.payment.payment import PaymentTransactionOut  # noqa: E402
+from scripts.fake_servers import SAMPLE_REGISTRATION, FakeStorageServer  # noqa: E402
+from utils.http_session import send_request  # noqa: E402
+
+
+def consume(download: Callable[[], Iterable[PaymentTransactionOut]]):
+    started_at = time.perf_counter()
+    first_payment_seconds = None
+    count = 0
+    for _ in download():
+        if first_payment_seconds is None:
+            first_payment_seconds = time.perf_counter() - started_at
+
+        count += 1
+
+    return first_payment_seconds, time.perf_counter() - started_at, count
+
+
+def measure(name: str, download: Callable[[], Iterable[PaymentTransactionOut]]) -> None:
+    first_payment_seconds, total_seconds, count = consume(download)
+
+    tracemalloc.start()
+    consume(download)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f'  {name:<9} first payment {first_payment_seconds * 1000:8.1f} ms  '
+        f'total {total_seconds * 1000:8.1f} ms  peak memory {peak_bytes / 2**20:7.1f} MiB  {count} payments'
+    )
+
+
+def serve(payments: int, paginates: bool, latency_seconds: float, connection) -> None:
+    storage_server = FakeStorageServer(latency_seconds=latency_seconds, paginates=paginates).start()
+    for index in range(payments):
+        entry_id = f'payment-{index:08d}'
+        storage_server.payments[entry_id] = {
+            'entryId': entry_id,
+            'price': 500.0,
+            'transactionStatus': 'PENDING',
+            'eventId': 'benchmark-event',
+            'paymentRequestId': f'pr-{index:08d}',
+            'registrationData': SAMPLE_REGISTRATION,
+        }
+
+    connection.send(storage_server.base_url)
+    connection.recv()
+    storage_server.stop()
+
+
+def start_storage_server(payments: int, paginates: bool, latency_seconds: float):
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=serve, args=(payments, paginates, latency_seconds, child_connection), daemon=True
+    )
+    process.start()
+    return parent_connection.recv(), parent_connection, process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare whole and streamed downloads of the pending payments')
+    parser.add_argument('--payments', type=int, default=20000, help='Pending payments in the backlog')
+    parser.add_argument('--page-size', type=int, default=100, help='Payments per page')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Latency added to every response')
+    args = parser.parse_args()
+
+    servers = {
+        paginates: start_storage_server(args.payments, paginates, args.latency_ms / 1000) for paginates in (True, False)
+    }
+
+    def whole() -> Iterable[PaymentTransactionOut]:
+        response = send_request('GET', f'{os.environ["CALLBACK_BASE_URL"]}/payments/pending')
+        return [PaymentTransactionOut(**payment) for payment in response.json()]
+
+    def stream() -> Iterable[PaymentTransactionOut]:
+        _, pending_payments, _ = PaymentStorageGateway().iter_pending_payment_transactions(args.page_size)
+        return pending_payments
+
+    print(f'{args.payments} pending payments, {args.page_size} per page, {args.latency_ms:.0f} ms per response')
+    try:
+        os.environ['CALLBACK_BASE_URL'] = servers[False][0]
+        measure('whole', whole)
+        os.environ['CALLBACK_BASE_URL'] = servers[True][0]
+        measure('paged', stream)
+        os.environ['CALLBACK_BASE_URL'] = servers[False][0]
+        measure('streamed', stream)
+
+    finally:
+        for _, connection, process in servers.values():
+            connection.send('stop')
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
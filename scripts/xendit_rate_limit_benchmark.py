@@ -0,0 +1,196 @@
+"""
+Benchmark a tracker burst and checkout against a rate limited Xendit, with and without pacing.
+
+The fake Xendit server answers requests beyond --xendit-limit per second with a 429 and a
+Retry-After of a second. The tracker gets --payments payment requests one by one at
+--concurrency, while checkout creates --checkout-per-second e-wallet payment requests
+until the tracker is done.
+
+- unpaced: no rate limiter, the tracker bursts into the limit, urllib3 retries the 429s
+  after their Retry-After on the calling thread, and checkout calls still rate limited
+  after their retries fail
+- paced: the rate limiter at --rate calls per second, of which tracking gets its share,
+  so checkout keeps the rest, and a 429 holds every call off and slows the rate down
+
+For each it reports the tracker's lookup errors and throttle wait, and the checkout
+payment requests created, rejected and their p50/p99 latency.
+
+Usage:
+    python scripts/xendit_rate_limit_benchmark.py --payments 300 --concurrency 16 --xendit-limit 40 --rate 40
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List
+from uuid import uuid4
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+os.environ.setdefault('PAYMENT_POLL_SCHEDULE', 'NONE')
+os.environ.setdefault('PAYMENT_STATUS_LEDGER', 'NONE')
+os.environ.setdefault('METRICS_EMITTER', 'NONE')
+
+from model.payment.payment import EWalletPaymentIn, PaymentRequestOut  # noqa: E402
+from scripts.fake_servers import (  # noqa: E402
+    SAMPLE_REGISTRATION,
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySqsClient,
+    InMemorySsmClient,
+)
+from utils.async_http_client import close_async_http_client  # noqa: E402
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+BENCH_XENDIT_API_KEY_SECRET_NAME = 'bench-xendit-api-key'
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_payment_in() -> EWalletPaymentIn:
+    return EWalletPaymentIn(
+        successReturnUrl='https://example.com/success',
+        failureReturnUrl='https://example.com/failure',
+        referenceId=str(uuid4()),
+        amount=500,
+        channelCode='GCASH',
+        eventId='benchmark-event',
+        registrationData=SAMPLE_REGISTRATION,
+    )
+
+
+def run_checkout(payment_usecase, per_second: float, done: threading.Event, outcomes: Counter, latencies: list):
+    async def checkout():
+        tasks = []
+
+        async def timed_request():
+            started_at = time.perf_counter()
+            payment_request_out = await payment_usecase.e_wallet_payment_request(build_payment_in())
+            if isinstance(payment_request_out, PaymentRequestOut):
+                outcomes['created'] += 1
+                latencies.append(time.perf_counter() - started_at)
+            else:
+                outcomes[f'HTTP {payment_request_out.status_code}'] += 1
+
+        try:
+            while not done.is_set():
+                tasks.append(asyncio.ensure_future(timed_request()))
+                await asyncio.sleep(1 / per_second)
+
+            await asyncio.gather(*tasks)
+        finally:
+            await close_async_http_client()
+
+    asyncio.run(checkout())
+
+
+def simulate(args, storage_server: FakeStorageServer, xendit_server: FakeXenditServer, rate_per_second: float):
+    from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+    from usecase.payment_usecase import get_payment_usecase
+    from utils.circuit_breaker import get_circuit_breaker
+    from utils.rate_limiter import get_rate_limiter
+
+    os.environ['XENDIT_RATE_LIMIT_PER_SECOND'] = str(rate_per_second)
+    for cached in (get_payment_usecase, get_rate_limiter, get_circuit_breaker):
+        cached.cache_clear()
+
+    payment_usecase = get_payment_usecase()
+    payment_usecase.xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+    # a second for the limit window of the previous run to pass
+    time.sleep(1)
+    rate_limited_count = xendit_server.rate_limited_count
+
+    done, checkout_outcomes, checkout_latencies = threading.Event(), Counter(), []
+    checkout = threading.Thread(
+        target=run_checkout,
+        args=(payment_usecase, args.checkout_per_second, done, checkout_outcomes, checkout_latencies),
+    )
+    checkout.start()
+    try:
+        tracking_summary = PaymentTrackingUsecase(
+            sqs_client=InMemorySqsClient(), concurrency=args.concurrency, lookup_batch_size=1
+        ).track_pending_payments()
+    finally:
+        done.set()
+        checkout.join()
+
+    return (
+        tracking_summary,
+        checkout_outcomes,
+        checkout_latencies,
+        xendit_server.rate_limited_count - rate_limited_count,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure tracking and checkout against a rate limited Xendit')
+    parser.add_argument('--payments', type=int, default=300, help='Pending payments the tracker gets one by one')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent tracker lookups')
+    parser.add_argument('--xendit-limit', type=int, default=40, help='Requests per second Xendit answers')
+    parser.add_argument('--rate', type=float, default=40, help='Rate of the paced run, in calls per second')
+    parser.add_argument('--checkout-per-second', type=float, default=5, help='Checkout payment requests per second')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of every fake server response')
+    args = parser.parse_args()
+
+    storage_server = FakeStorageServer(latency_seconds=args.latency_ms / 1000).start()
+    xendit_server = FakeXenditServer(latency_seconds=args.latency_ms / 1000).start()
+    xendit_server.rate_limit_per_second = args.xendit_limit
+    for index in range(args.payments):
+        entry_id = f'payment-{index:06d}'
+        payment_request_id = f'pr-{index:06d}'
+        xendit_server.add_payment_request(payment_request_id, status='PENDING')
+        storage_server.payments[entry_id] = {
+            'entryId': entry_id,
+            'price': 500.0,
+            'transactionStatus': 'PENDING',
+            'eventId': 'benchmark-event',
+            'paymentRequestId': payment_request_id,
+            'registrationData': SAMPLE_REGISTRATION,
+        }
+
+    os.environ['CALLBACK_BASE_URL'] = storage_server.base_url
+    os.environ['XENDIT_API_KEY_SECRET_NAME'] = BENCH_XENDIT_API_KEY_SECRET_NAME
+    SecretProvider.set_default(
+        SecretProvider(
+            parameter_names=[BENCH_XENDIT_API_KEY_SECRET_NAME],
+            ssm_client=InMemorySsmClient({BENCH_XENDIT_API_KEY_SECRET_NAME: 'xnd_development_benchmark'}),
+        )
+    )
+
+    print(
+        f'{args.payments} lookups at concurrency {args.concurrency}, {args.checkout_per_second:.0f} checkouts/s, '
+        f'Xendit answering {args.xendit_limit} requests/s'
+    )
+    try:
+        for name, rate_per_second in (('unpaced', 0), ('paced', args.rate)):
+            tracking_summary, checkout_outcomes, checkout_latencies, rate_limited = simulate(
+                args, storage_server, xendit_server, rate_per_second
+            )
+            print(
+                f'  {name:<8} tracker {tracking_summary.wall_seconds:6.2f} s  '
+                f'{tracking_summary.lookup_errors:4d} lookup errors  '
+                f'throttled {tracking_summary.throttle_wait_seconds:7.2f} s  '
+                f'checkout {dict(checkout_outcomes)}  '
+                f'p50 {percentile(checkout_latencies, 50) * 1000:6.1f} ms  '
+                f'p99 {percentile(checkout_latencies, 99) * 1000:6.1f} ms  '
+                f'{rate_limited} 429s from Xendit'
+            )
+
+    finally:
+        storage_server.stop()
+        xendit_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -102,6 +102,62 @@ const serverlessConfiguration: AWS = {
           ],
         },
       },
+      PaymentUpdateOutboxQueue: {
+        Type: "AWS::SQS::Queue",
+        Properties: {
+          QueueName:
+            "${self:custom.stage}-${self:custom.serviceName}-payment-update-outbox.fifo",
+          FifoQueue: true,
+          VisibilityTimeout: 60,
+          RedrivePolicy: {
+            deadLetterTargetArn: {
+              "Fn::GetAtt": ["PaymentUpdateOutboxDeadLetterQueue", "Arn"],
+            },
+            maxReceiveCount: 8,
+          },
+        },
+      },
+      PaymentUpdateOutboxDeadLetterQueue: {
+        Type: "AWS::SQS::Queue",
+        Properties: {
+          QueueName:
+            "${self:custom.stage}-${self:custom.serviceName}-payment-update-outbox-dlq.fifo",
+          FifoQueue: true,
+          MessageRetentionPeriod: 1209600,
+        },
+      },
+      PaymentPollScheduleTable: {
+        Type: "AWS::DynamoDB::Table",
+        Properties: {
+          TableName:
+            "${self:custom.stage}-${self:custom.serviceName}-payment-poll-schedule",
+          BillingMode: "PAY_PER_REQUEST",
+          AttributeDefinitions: [
+            { AttributeName: "entryId", AttributeType: "S" },
+          ],
+          KeySchema: [{ AttributeName: "entryId", KeyType: "HASH" }],
+          TimeToLiveSpecification: {
+            AttributeName: "expiresAt",
+            Enabled: true,
+          },
+        },
+      },
+      PaymentStatusLedgerTable: {
+        Type: "AWS::DynamoDB::Table",
+        Properties: {
+          TableName:
+            "${self:custom.stage}-${self:custom.serviceName}-payment-status-ledger",
+          BillingMode: "PAY_PER_REQUEST",
+          AttributeDefinitions: [
+            { AttributeName: "entryId", AttributeType: "S" },
+          ],
+          KeySchema: [{ AttributeName: "entryId", KeyType: "HASH" }],
+          TimeToLiveSpecification: {
+            AttributeName: "expiresAt",
+            Enabled: true,
+          },
+        },
+      },
       PaymentServiceApiEndpointParameter: {
         Type: "AWS::SSM::Parameter",
         Properties: {
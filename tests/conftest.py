@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from scripts.fake_servers import (  # noqa: E402
+    FakeStorageServer,
+    FakeXenditServer,
+    InMemorySsmClient,
+)
+from utils.secret_provider import SecretProvider  # noqa: E402
+
+XENDIT_API_KEY_SECRET_NAME = 'test-xendit-api-key'
+
+
+@pytest.fixture
+def storage_server():
+    storage_server = FakeStorageServer().start()
+    yield storage_server
+    storage_server.stop()
+
+
+@pytest.fixture
+def xendit_server():
+    xendit_server = FakeXenditServer().start()
+    yield xendit_server
+    xendit_server.stop()
+
+
+@pytest.fixture
+def ssm_client(mocker):
+    return mocker.Mock(wraps=InMemorySsmClient({XENDIT_API_KEY_SECRET_NAME: 'xnd_development_test'}))
+
+
+@pytest.fixture
+def build_payment_usecase(monkeypatch, storage_server, xendit_server, ssm_client):
+    """Build the shared payment usecase against fake storage and Xendit servers and an in-memory SSM"""
+    from usecase.payment_request_idempotency import get_idempotency_guard
+    from usecase.payment_usecase import get_payment_usecase
+    from external.idempotency_store import get_idempotency_store
+    from external.payment_update_outbox import get_payment_update_outbox
+    from usecase.payment_update_outbox_drainer import get_payment_update_outbox_drainer
+
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    monkeypatch.setenv('XENDIT_API_KEY_SECRET_NAME', XENDIT_API_KEY_SECRET_NAME)
+    monkeypatch.setenv('XENDIT_RATE_LIMIT_PER_SECOND', '0')
+    monkeypatch.setenv('PAYMENT_UPDATE_OUTBOX', 'NONE')
+    monkeypatch.setenv('METRICS_EMITTER', 'NONE')
+
+    lru_caches = (
+        get_payment_usecase,
+        get_idempotency_guard,
+        get_idempotency_store,
+        get_payment_update_outbox,
+        get_payment_update_outbox_drainer,
+    )
+    for lru_cache in lru_caches:
+        lru_cache.cache_clear()
+
+    SecretProvider.set_default(SecretProvider(parameter_names=[XENDIT_API_KEY_SECRET_NAME], ssm_client=ssm_client))
+
+    def build(**environment):
+        for name, value in environment.items():
+            monkeypatch.setenv(name, value)
+
+        payment_usecase = get_payment_usecase()
+        payment_usecase.xendit_api_instance.api_client.configuration.host = xendit_server.base_url
+        return payment_usecase
+
+    yield build
+    SecretProvider.set_default(None)
+    for lru_cache in lru_caches:
+        lru_cache.cache_clear()
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from utils.async_http_client import close_async_http_client, send_async_request
+from utils.retry_budget import RetryBudget
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    mocker.patch('utils.async_http_client.retry_delay_seconds', return_value=0)
+
+
+def send(method: str, url: str, retry_budget: RetryBudget, **kwargs):
+    async def send_and_close():
+        try:
+            return await send_async_request(method, url, retry_budget, **kwargs)
+        finally:
+            await close_async_http_client()
+
+    return asyncio.run(send_and_close())
+
+
+def test_a_failed_put_is_retried_and_spends_the_budget(storage_server):
+    storage_server.create_payment(None, {'entryId': 'payment-a', 'price': 500, 'transactionStatus': 'PENDING'})
+    storage_server.fail_next(2)
+    retry_budget = RetryBudget(10)
+
+    response = send('PUT', f'{storage_server.base_url}/payments/payment-a', retry_budget, json={'price': 600})
+
+    assert response.status_code == 200
+    assert storage_server.request_count == 3
+    assert retry_budget.spent == 2
+
+
+def test_a_post_is_not_retried(storage_server):
+    storage_server.fail_next(1)
+
+    response = send('POST', f'{storage_server.base_url}/payments', RetryBudget(10), json={'price': 500})
+
+    assert response.status_code == 503
+    assert storage_server.request_count == 1
+
+
+def test_a_spent_budget_returns_the_failure(storage_server):
+    storage_server.fail_next(3)
+    retry_budget = RetryBudget(1)
+
+    response = send('GET', f'{storage_server.base_url}/payments/payment-a', retry_budget)
+
+    assert response.status_code == 503
+    assert storage_server.request_count == 2
+    assert retry_budget.denied == 1
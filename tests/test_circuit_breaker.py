@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def build_circuit_breaker(clock: FakeClock) -> CircuitBreaker:
+    return CircuitBreaker(
+        'storage', window_seconds=30, minimum_calls=4, failure_rate_threshold=0.5, open_seconds=10, clock=clock
+    )
+
+
+def fail(circuit_breaker: CircuitBreaker) -> None:
+    def raise_error():
+        raise ConnectionError('storage is down')
+
+    with pytest.raises(ConnectionError):
+        circuit_breaker.call(raise_error)
+
+
+def open_circuit(circuit_breaker: CircuitBreaker) -> None:
+    for _ in range(4):
+        fail(circuit_breaker)
+
+    assert circuit_breaker.metrics().state == OPEN
+
+
+def test_the_circuit_opens_once_enough_calls_fail(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    circuit_breaker.call(lambda: 'ok')
+    circuit_breaker.call(lambda: 'ok')
+    fail(circuit_breaker)
+    assert circuit_breaker.metrics().state == CLOSED
+
+    fail(circuit_breaker)
+
+    assert circuit_breaker.metrics().state == OPEN
+    with pytest.raises(CircuitOpenError) as e:
+        circuit_breaker.call(lambda: 'not called')
+    assert e.value.retry_after_seconds == 10
+    assert circuit_breaker.metrics().rejected_calls == 1
+
+
+def test_failures_outside_the_window_are_forgotten(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    for _ in range(3):
+        fail(circuit_breaker)
+
+    clock.now = 30
+    circuit_breaker.call(lambda: 'ok')
+    fail(circuit_breaker)
+
+    assert circuit_breaker.metrics().state == CLOSED
+    assert circuit_breaker.metrics().window_calls == 2
+
+
+def test_results_can_count_as_failures(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+
+    for _ in range(4):
+        circuit_breaker.call(lambda: 503, is_failure=lambda status: status >= 500)
+
+    assert circuit_breaker.metrics().state == OPEN
+
+
+def test_a_half_open_circuit_lets_one_probe_through_and_closes_if_it_succeeds(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    open_circuit(circuit_breaker)
+    clock.now = 10
+    assert circuit_breaker.metrics().state == HALF_OPEN
+
+    circuit_breaker.before_call()
+    # the probe is in flight, so other calls are still rejected
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.call(lambda: 'not called')
+
+    circuit_breaker.record_success()
+
+    assert circuit_breaker.metrics().state == CLOSED
+    assert circuit_breaker.call(lambda: 'ok') == 'ok'
+
+
+def test_a_failed_probe_opens_the_circuit_again(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    open_circuit(circuit_breaker)
+    clock.now = 10
+
+    fail(circuit_breaker)
+
+    metrics = circuit_breaker.metrics()
+    assert (metrics.state, metrics.times_opened, metrics.retry_after_seconds) == (OPEN, 2, 10)
+
+
+def test_raise_if_open_does_not_claim_the_probe(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    open_circuit(circuit_breaker)
+    clock.now = 10
+
+    circuit_breaker.raise_if_open()
+
+    assert circuit_breaker.call(lambda: 'probe') == 'probe'
+    assert circuit_breaker.metrics().state == CLOSED
+
+
+def test_awaited_calls_go_through_the_same_circuit(clock):
+    circuit_breaker = build_circuit_breaker(clock)
+    open_circuit(circuit_breaker)
+
+    async def call():
+        return 'probe'
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(circuit_breaker.call_async(call))
+
+    clock.now = 10
+    assert asyncio.run(circuit_breaker.call_async(call)) == 'probe'
+    assert circuit_breaker.metrics().state == CLOSED
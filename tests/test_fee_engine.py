@@ -0,0 +1,118 @@
+from decimal import Decimal
+from typing import List
+
+import pytest
+
+from model.payment.payment_constants import (
+    DirectDebitChannels,
+    EWalletChannels,
+    PaymentMethod,
+)
+from model.transaction.transaction import GetTransactionDetailsIn
+from usecase.fee_engine import (
+    FeeEngineError,
+    compute_transaction_details,
+    compute_transaction_details_batch,
+)
+
+BANK_FEE_THRESHOLD = Decimal('1483.2')
+CENTAVO = Decimal('0.01')
+
+CHANNELS = [(PaymentMethod.E_WALLET, channel) for channel in EWalletChannels] + [
+    (PaymentMethod.DIRECT_DEBIT, channel) for channel in DirectDebitChannels
+]
+
+
+def build_in(ticket_price, payment_method, payment_channel, platform_fee=None) -> GetTransactionDetailsIn:
+    return GetTransactionDetailsIn(
+        ticket_price=Decimal(ticket_price),
+        platform_fee=None if platform_fee is None else Decimal(platform_fee),
+        payment_method=payment_method,
+        payment_channel=payment_channel,
+    )
+
+
+@pytest.mark.parametrize(
+    'ticket_price, platform_fee, payment_method, payment_channel, total_price, transaction_fee',
+    [
+        ('100', None, PaymentMethod.E_WALLET, EWalletChannels.GCASH, '102.64', '2.64'),
+        ('100', None, PaymentMethod.E_WALLET, EWalletChannels.PAYMAYA, '102.06', '2.06'),
+        ('1000', '0.05', PaymentMethod.E_WALLET, EWalletChannels.GCASH, '1077.76', '27.76'),
+        ('500', None, PaymentMethod.DIRECT_DEBIT, DirectDebitChannels.BPI, '516.80', '16.80'),
+        ('1483.2', None, PaymentMethod.DIRECT_DEBIT, DirectDebitChannels.UBP, '1500.00', '16.80'),
+        ('2000', None, PaymentMethod.DIRECT_DEBIT, DirectDebitChannels.RCBC, '2022.65', '22.65'),
+    ],
+)
+def test_transaction_details_match_hand_computed_quotes(
+    ticket_price, platform_fee, payment_method, payment_channel, total_price, transaction_fee
+):
+    quote = compute_transaction_details(build_in(ticket_price, payment_method, payment_channel, platform_fee))
+
+    assert quote.total_price == Decimal(total_price)
+    assert quote.transaction_fee == Decimal(transaction_fee)
+    assert quote.ticket_price == Decimal(ticket_price).quantize(Decimal('0.01'))
+
+
+def test_platform_fee_is_omitted_when_zero():
+    quote = compute_transaction_details(build_in('100', PaymentMethod.E_WALLET, EWalletChannels.GCASH, '0'))
+
+    assert quote.platform_fee is None
+
+
+def sympy_parity_prices(platform_fee) -> List[Decimal]:
+    """Ticket prices over the whole range, and every centavo around where a bank's fee turns into a percent"""
+    prices = [Decimal(price) for price in ('0', '0.01', '1', '49.99', '250.5', '999.99', '3100.01', '9999.99')]
+    prices += [Decimal('0.37') + step * Decimal('421.13') for step in range(12)]
+    # the bank threshold applies to the ticket price with the platform fee
+    threshold_price = (BANK_FEE_THRESHOLD / (1 + (platform_fee or 0))).quantize(CENTAVO)
+    prices += [threshold_price + step * CENTAVO for step in range(-3, 4)]
+    # the flat and percent fees meet at the threshold, so a shifted threshold shows only further out
+    prices += [threshold_price + sign * Decimal(offset) for offset in ('0.25', '0.5', '1', '2') for sign in (-1, 1)]
+    return prices
+
+
+@pytest.mark.parametrize('platform_fee', [None, Decimal('0.03'), Decimal('0.05'), Decimal('0.1')])
+@pytest.mark.parametrize(
+    'payment_method, payment_channel',
+    # a direct debit quote with an e-wallet channel is priced like a bank
+    CHANNELS + [(PaymentMethod.DIRECT_DEBIT, channel) for channel in EWalletChannels],
+)
+def test_transaction_details_match_sympy_reference(platform_fee, payment_method, payment_channel):
+    pytest.importorskip('sympy')
+    from scripts.fee_engine_reference_check import (
+        is_half_centavo_tie,
+        sympy_transaction_details,
+        to_centavo,
+    )
+
+    for ticket_price in sympy_parity_prices(platform_fee):
+        get_transaction_details_in = GetTransactionDetailsIn(
+            ticket_price=ticket_price,
+            platform_fee=platform_fee,
+            payment_method=payment_method,
+            payment_channel=payment_channel,
+        )
+        expected = sympy_transaction_details(get_transaction_details_in)
+        actual = compute_transaction_details(get_transaction_details_in).dict()
+
+        for field, expected_value in expected.items():
+            if to_centavo(expected_value) == to_centavo(actual[field]):
+                continue
+
+            assert field in ('total_price', 'transaction_fee') and is_half_centavo_tie(
+                get_transaction_details_in, field
+            ), f'{ticket_price}: {field} expected {expected_value}, got {actual[field]}'
+
+
+def test_batch_matches_single_quotes_and_reports_invalid_channels():
+    get_transaction_details_in_list = [
+        build_in('100', PaymentMethod.E_WALLET, EWalletChannels.GCASH),
+        build_in('100', PaymentMethod.E_WALLET, DirectDebitChannels.BPI),
+        build_in('2000', PaymentMethod.DIRECT_DEBIT, DirectDebitChannels.BPI),
+    ]
+
+    quotes = compute_transaction_details_batch(get_transaction_details_in_list)
+
+    assert quotes[0] == compute_transaction_details(get_transaction_details_in_list[0])
+    assert isinstance(quotes[1], FeeEngineError)
+    assert quotes[2] == compute_transaction_details(get_transaction_details_in_list[2])
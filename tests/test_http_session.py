@@ -0,0 +1,62 @@
+import pytest
+import requests
+
+from utils import http_session
+from utils.http_session import retry_delay_seconds, send_request
+from utils.retry_budget import RetryBudget
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    return mocker.patch('utils.http_session.time.sleep')
+
+
+def test_a_failed_get_is_retried_on_the_same_connection(storage_server):
+    storage_server.fail_next(2)
+    retry_budget = RetryBudget(10)
+
+    # streamed responses only give their connection back once closed
+    response = send_request('GET', f'{storage_server.base_url}/payments/pending', retry_budget, stream=True)
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert storage_server.request_count == 3
+    assert storage_server.connection_count == 1
+    assert retry_budget.spent == 2
+
+
+def test_a_post_is_not_retried(storage_server):
+    storage_server.fail_next(1)
+
+    response = send_request('POST', f'{storage_server.base_url}/payments', RetryBudget(10), json={'price': 500})
+
+    assert response.status_code == 503
+    assert storage_server.request_count == 1
+
+
+def test_a_spent_budget_returns_the_failure(storage_server):
+    storage_server.fail_next(3)
+    retry_budget = RetryBudget(1)
+
+    response = send_request('GET', f'{storage_server.base_url}/payments/pending', retry_budget)
+
+    assert response.status_code == 503
+    assert storage_server.request_count == 2
+    assert retry_budget.denied == 1
+
+
+def test_connection_errors_are_raised_after_the_last_retry(mocker):
+    request = mocker.patch.object(http_session.get_http_session(), 'request', side_effect=requests.ConnectionError())
+
+    with pytest.raises(requests.ConnectionError):
+        send_request('GET', 'http://127.0.0.1:9/payments/pending', RetryBudget(10))
+
+    assert request.call_count == http_session.HTTP_MAX_RETRIES + 1
+
+
+def test_the_backoff_waits_for_retry_after_up_to_the_cap(mocker):
+    mocker.patch('utils.http_session.random.uniform', return_value=0.05)
+
+    assert retry_delay_seconds(0) == 0.05
+    assert retry_delay_seconds(0, mocker.Mock(headers={'Retry-After': '1'})) == 1
+    assert retry_delay_seconds(0, mocker.Mock(headers={'Retry-After': '30'})) == http_session.RETRY_MAX_DELAY_SECONDS
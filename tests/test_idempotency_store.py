@@ -0,0 +1,67 @@
+import pytest
+
+from external.idempotency_store import (
+    IN_PROGRESS,
+    RELEASED,
+    DynamoDbIdempotencyStore,
+    InMemoryIdempotencyStore,
+)
+from scripts.fake_servers import InMemoryDynamoDbClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(params=['MEMORY', 'DYNAMODB'])
+def build_store(request):
+    def build(clock: FakeClock):
+        if request.param == 'MEMORY':
+            return InMemoryIdempotencyStore(clock=clock)
+
+        return DynamoDbIdempotencyStore('idempotency', InMemoryDynamoDbClient(), clock=clock)
+
+    return build
+
+
+def test_released_key_keeps_its_payment_transaction_for_a_retry(build_store):
+    clock = FakeClock()
+    store = build_store(clock)
+    assert store.begin('E_WALLET:key-1', 'fingerprint', 60) is None
+
+    store.release('E_WALLET:key-1', 'payment-1', 900)
+
+    record = store.begin('E_WALLET:key-1', 'fingerprint', 60)
+    assert (record.status, record.payment_transaction_id) == (RELEASED, 'payment-1')
+    assert store.resume('E_WALLET:key-1', 'other-fingerprint', 60) is False
+    assert store.resume('E_WALLET:key-1', 'fingerprint', 60) is True
+    # a resumed key is claimed, so it cannot be resumed twice
+    assert store.resume('E_WALLET:key-1', 'fingerprint', 60) is False
+    record = store.get('E_WALLET:key-1')
+    assert (record.status, record.payment_transaction_id) == (IN_PROGRESS, 'payment-1')
+
+
+def test_released_key_without_a_payment_transaction_is_free_again(build_store):
+    clock = FakeClock()
+    store = build_store(clock)
+    store.begin('E_WALLET:key-1', 'fingerprint', 60)
+
+    store.release('E_WALLET:key-1')
+
+    assert store.begin('E_WALLET:key-1', 'other-fingerprint', 60) is None
+
+
+def test_released_key_expires(build_store):
+    clock = FakeClock()
+    store = build_store(clock)
+    store.begin('E_WALLET:key-1', 'fingerprint', 60)
+    store.release('E_WALLET:key-1', 'payment-1', 900)
+
+    clock.now += 900
+
+    assert store.resume('E_WALLET:key-1', 'fingerprint', 60) is False
+    assert store.begin('E_WALLET:key-1', 'other-fingerprint', 60) is None
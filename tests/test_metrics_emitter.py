@@ -0,0 +1,73 @@
+import io
+import json
+
+import pytest
+
+from external.metrics_emitter import (
+    EMF_MAX_METRICS,
+    UNIT_SECONDS,
+    EmfMetricsEmitter,
+    Metric,
+    MetricsEmitter,
+    build_emf_record,
+)
+
+
+def test_the_record_declares_its_metrics_and_dimensions():
+    record = build_emf_record(
+        'SparcsPaymentService',
+        [Metric('PaymentsChecked', 3), Metric('XenditThrottleWait', 0.5, UNIT_SECONDS)],
+        dimensions={'Service': 'PaymentTracker', 'Stage': 'dev'},
+        properties={'shard': 1},
+        timestamp_millis=1_700_000_000_000,
+    )
+
+    assert record == {
+        'shard': 1,
+        'Service': 'PaymentTracker',
+        'Stage': 'dev',
+        'PaymentsChecked': 3,
+        'XenditThrottleWait': 0.5,
+        '_aws': {
+            'Timestamp': 1_700_000_000_000,
+            'CloudWatchMetrics': [
+                {
+                    'Namespace': 'SparcsPaymentService',
+                    'Dimensions': [['Service', 'Stage']],
+                    'Metrics': [
+                        {'Name': 'PaymentsChecked', 'Unit': 'Count'},
+                        {'Name': 'XenditThrottleWait', 'Unit': 'Seconds'},
+                    ],
+                }
+            ],
+        },
+    }
+
+
+def test_a_record_takes_at_most_one_hundred_metrics():
+    build_emf_record('SparcsPaymentService', [Metric(f'Metric{index}', index) for index in range(EMF_MAX_METRICS)])
+
+    with pytest.raises(ValueError):
+        build_emf_record(
+            'SparcsPaymentService', [Metric(f'Metric{index}', index) for index in range(EMF_MAX_METRICS + 1)]
+        )
+
+
+def test_the_emf_emitter_writes_one_line_of_json_per_record():
+    stream = io.StringIO()
+    emitter = EmfMetricsEmitter('SparcsPaymentService', stream=stream, clock=lambda: 1_700_000_000.0)
+
+    record = emitter.emit([Metric('PaymentsChecked', 3)], dimensions={'Service': 'PaymentTracker'})
+    emitter.emit([Metric('PaymentsChecked', 4)], dimensions={'Service': 'PaymentTracker'})
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert ' ' not in lines[0]
+    assert json.loads(lines[0]) == record
+    assert record['_aws']['Timestamp'] == 1_700_000_000_000
+    assert json.loads(lines[1])['PaymentsChecked'] == 4
+
+
+def test_an_emitter_must_implement_write():
+    with pytest.raises(TypeError):
+        MetricsEmitter()
@@ -0,0 +1,122 @@
+from external.payment_poll_schedule_store import InMemoryPaymentPollScheduleStore
+from model.payment.payment import PaymentTransactionOut, TransactionStatus
+from usecase.payment_poll_scheduler import SCHEDULE_PAGE_SIZE, PaymentPollScheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def build_payment(entry_id: str) -> PaymentTransactionOut:
+    return PaymentTransactionOut(
+        entryId=entry_id, price=500, transactionStatus=TransactionStatus.PENDING, paymentRequestId=f'pr-{entry_id}'
+    )
+
+
+def build_scheduler(clock: FakeClock) -> PaymentPollScheduler:
+    return PaymentPollScheduler(InMemoryPaymentPollScheduleStore(clock), young_seconds=3600, clock=clock)
+
+
+def test_pending_payments_are_read_a_page_at_a_time():
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+    read = []
+
+    def pending_payments():
+        for index in range(3 * SCHEDULE_PAGE_SIZE):
+            read.append(index)
+            yield build_payment(f'payment-{index}')
+
+    payment_poll_run = scheduler.start_run(pending_payments())
+    assert read == []
+
+    next(payment_poll_run.due_payments)
+    assert len(read) == SCHEDULE_PAGE_SIZE
+
+    assert len(list(payment_poll_run.due_payments)) == 3 * SCHEDULE_PAGE_SIZE - 1
+    assert payment_poll_run.due == 3 * SCHEDULE_PAGE_SIZE
+
+
+def test_checked_payments_are_not_due_until_their_next_check():
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+    payments = [build_payment(f'payment-{index}') for index in range(3)]
+
+    payment_poll_run = scheduler.start_run(payments)
+    for payment in payment_poll_run.due_payments:
+        payment_poll_run.record_pending(payment, '2023-11-14T22:13:20.000Z')
+    payment_poll_run.save()
+
+    payment_poll_run = scheduler.start_run(payments)
+    assert list(payment_poll_run.due_payments) == []
+    assert payment_poll_run.not_due == 3
+
+    # young payments are due again on the next scheduled run
+    clock.now += 60
+    payment_poll_run = scheduler.start_run(payments)
+    assert [payment.entryId for payment in payment_poll_run.due_payments] == [payment.entryId for payment in payments]
+
+
+def test_payments_never_checked_come_before_payments_that_are_due():
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+
+    payment_poll_run = scheduler.start_run([build_payment('checked')])
+    for payment in payment_poll_run.due_payments:
+        payment_poll_run.record_pending(payment, None)
+    payment_poll_run.save()
+
+    clock.now += 60
+    payment_poll_run = scheduler.start_run([build_payment('checked'), build_payment('new')])
+    assert [payment.entryId for payment in payment_poll_run.due_payments] == ['new', 'checked']
+
+
+def test_schedules_are_saved_a_page_at_a_time(mocker):
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+    put_many = mocker.spy(scheduler.store, 'put_many')
+
+    payment_poll_run = scheduler.start_run(build_payment(f'payment-{index}') for index in range(SCHEDULE_PAGE_SIZE + 1))
+    for payment in payment_poll_run.due_payments:
+        payment_poll_run.record_resolved(payment)
+
+    assert [len(call.args[0]) for call in put_many.call_args_list] == [SCHEDULE_PAGE_SIZE]
+
+    payment_poll_run.save()
+    assert [len(call.args[0]) for call in put_many.call_args_list] == [SCHEDULE_PAGE_SIZE, 1]
+
+
+def test_every_payment_is_due_if_the_schedules_cannot_be_read(mocker):
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+    mocker.patch.object(scheduler.store, 'get_many', side_effect=RuntimeError('throttled'))
+
+    payment_poll_run = scheduler.start_run([build_payment('payment-0'), build_payment('payment-1')])
+    assert [payment.entryId for payment in payment_poll_run.due_payments] == ['payment-0', 'payment-1']
+    assert payment_poll_run.not_due == 0
+
+
+def test_the_resume_cursor_moves_past_a_page_once_its_due_payments_are_handled():
+    clock = FakeClock()
+    scheduler = build_scheduler(clock)
+    payments = [build_payment(f'payment-{index:03}') for index in range(SCHEDULE_PAGE_SIZE + 2)]
+
+    # the last payment of the first page is not due, so it is not yielded
+    payment_poll_run = scheduler.start_run(payments[SCHEDULE_PAGE_SIZE - 1 : SCHEDULE_PAGE_SIZE])
+    for payment in payment_poll_run.due_payments:
+        payment_poll_run.record_resolved(payment)
+    payment_poll_run.save()
+
+    payment_poll_run = scheduler.start_run(payments)
+    due_payments = list(payment_poll_run.due_payments)
+    assert len(due_payments) == SCHEDULE_PAGE_SIZE + 1
+
+    resume_cursor = payment_poll_run.resume_cursor_after(due_payments[: SCHEDULE_PAGE_SIZE - 2], None)
+    assert resume_cursor is None
+
+    resume_cursor = payment_poll_run.resume_cursor_after(due_payments[SCHEDULE_PAGE_SIZE - 2 : -1], resume_cursor)
+    assert resume_cursor == payments[SCHEDULE_PAGE_SIZE - 1].entryId
@@ -0,0 +1,70 @@
+import json
+
+from external.payment_status_ledger import InMemoryPaymentStatusLedger
+from external.payment_status_publisher import PaymentStatusPublisher
+from model.payment.payment import PaymentTransactionOut, TransactionStatus
+from scripts.fake_servers import InMemorySqsClient
+
+QUEUE_URL = 'https://sqs.example.com/payment-status.fifo'
+
+
+def build_payment(entry_id: str) -> PaymentTransactionOut:
+    return PaymentTransactionOut(entryId=entry_id, price=500, transactionStatus=TransactionStatus.PENDING)
+
+
+def test_updates_are_sent_in_batches_of_ten():
+    sqs_client = InMemorySqsClient()
+    publisher = PaymentStatusPublisher(QUEUE_URL, sqs_client)
+
+    publisher.publish_many([(build_payment(f'payment-{index}'), TransactionStatus.SUCCESS) for index in range(25)])
+    publish_stats = publisher.flush()
+
+    assert publish_stats.published == 25
+    assert publish_stats.batch_calls == 3
+    assert publish_stats.single_calls == 0
+    assert [
+        json.loads(message['MessageBody'])['registration_details']['entryId'] for message in sqs_client.messages
+    ] == [f'payment-{index}' for index in range(25)]
+
+
+def test_updates_of_one_payment_are_never_in_the_same_batch():
+    sqs_client = InMemorySqsClient()
+    publisher = PaymentStatusPublisher(QUEUE_URL, sqs_client)
+
+    publisher.publish(build_payment('payment-1'), TransactionStatus.FAILED)
+    publisher.publish(build_payment('payment-1'), TransactionStatus.SUCCESS)
+    publish_stats = publisher.flush()
+
+    assert publish_stats.batch_calls == 2
+    assert [json.loads(message['MessageBody'])['status'] for message in sqs_client.messages] == ['FAILED', 'SUCCESS']
+
+
+def test_failed_batch_entries_are_retried_one_by_one():
+    sqs_client = InMemorySqsClient()
+    sqs_client.fail_next_entries(2)
+    publisher = PaymentStatusPublisher(QUEUE_URL, sqs_client, retry_delay_seconds=0)
+
+    publisher.publish_many([(build_payment(f'payment-{index}'), TransactionStatus.SUCCESS) for index in range(5)])
+    publish_stats = publisher.flush()
+
+    assert publish_stats.published == 5
+    assert publish_stats.failed == 0
+    assert publish_stats.batch_calls == 1
+    assert publish_stats.single_calls == 2
+
+
+def test_statuses_in_the_ledger_are_not_sent_again():
+    sqs_client = InMemorySqsClient()
+    status_ledger = InMemoryPaymentStatusLedger()
+    payment = build_payment('payment-1')
+
+    first_publisher = PaymentStatusPublisher(QUEUE_URL, sqs_client, status_ledger=status_ledger)
+    first_publisher.publish(payment, TransactionStatus.SUCCESS)
+    first_publisher.flush()
+
+    second_publisher = PaymentStatusPublisher(QUEUE_URL, sqs_client, status_ledger=status_ledger)
+    second_publisher.publish(payment, TransactionStatus.SUCCESS)
+    publish_stats = second_publisher.flush()
+
+    assert publish_stats.skipped == 1
+    assert len(sqs_client.messages) == 1
@@ -0,0 +1,86 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+
+from external.async_payment_storage_gateway import AsyncPaymentStorageGateway
+from external.payment_storage_gateway import PaymentStorageGateway
+from model.payment.payment import PaymentTransactionIn
+from utils.async_http_client import close_async_http_client
+
+# not in entryId order, as a storage service that does not paginate may return them
+ENTRY_IDS = ['payment-c', 'payment-a', 'payment-e', 'payment-b', 'payment-d']
+
+
+@pytest.fixture
+def payment_storage_gateway(monkeypatch, storage_server):
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    for entry_id in ENTRY_IDS:
+        storage_server.create_payment(None, {'entryId': entry_id, 'price': 500, 'transactionStatus': 'PENDING'})
+
+    return PaymentStorageGateway()
+
+
+def get_pending_entry_ids(payment_storage_gateway: PaymentStorageGateway, **kwargs):
+    status, pending_payments, _ = payment_storage_gateway.iter_pending_payment_transactions(**kwargs)
+    assert status == HTTPStatus.OK
+    return [payment.entryId for payment in pending_payments]
+
+
+def test_pages_resume_after_the_cursor(payment_storage_gateway):
+    assert get_pending_entry_ids(payment_storage_gateway, page_size=2, after_entry_id='payment-b') == [
+        'payment-c',
+        'payment-d',
+        'payment-e',
+    ]
+
+
+def test_an_unsorted_backlog_resumes_after_the_position_of_the_cursor(storage_server, payment_storage_gateway):
+    storage_server.paginates = False
+
+    assert get_pending_entry_ids(payment_storage_gateway, after_entry_id='payment-a') == [
+        'payment-e',
+        'payment-b',
+        'payment-d',
+    ]
+
+
+def test_an_unsorted_backlog_is_read_from_the_start_if_the_cursor_is_no_longer_pending(
+    storage_server, payment_storage_gateway
+):
+    storage_server.paginates = False
+    storage_server.payments['payment-a']['transactionStatus'] = 'SUCCESS'
+
+    assert get_pending_entry_ids(payment_storage_gateway, after_entry_id='payment-a') == [
+        'payment-c',
+        'payment-e',
+        'payment-b',
+        'payment-d',
+    ]
+
+
+def test_an_empty_body_is_an_empty_backlog(mocker, monkeypatch, storage_server, payment_storage_gateway):
+    monkeypatch.setattr(storage_server, 'get_pending_payments', lambda match, body: (200, None))
+    logger_error = mocker.patch('external.payment_storage_gateway.logger.error')
+
+    assert get_pending_entry_ids(payment_storage_gateway) == []
+    logger_error.assert_not_called()
+
+
+def test_the_sync_and_async_gateways_parse_responses_alike(monkeypatch, storage_server):
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    payment = PaymentTransactionIn(price=500, transactionStatus='PENDING')
+
+    async def create_payment_async():
+        try:
+            return await AsyncPaymentStorageGateway().create_payment(payment, entry_id='payment-async')
+        finally:
+            await close_async_http_client()
+
+    storage_server.fail_next(1, status=400)
+    assert PaymentStorageGateway().create_payment(payment) == (400, None, 'Injected failure')
+    storage_server.fail_next(1, status=400)
+    assert asyncio.run(create_payment_async()) == (400, None, 'Injected failure')
+
+    status, payment_transaction, error_message = asyncio.run(create_payment_async())
+    assert (status, payment_transaction.entryId, error_message) == (HTTPStatus.OK, 'payment-async', None)
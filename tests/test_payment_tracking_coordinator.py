@@ -0,0 +1,202 @@
+import io
+import json
+
+import pytest
+
+from external.payment_poll_schedule_store import get_payment_poll_schedule_store
+from external.payment_status_ledger import get_payment_status_ledger
+from model.payment.payment import PaymentTransactionOut, TransactionStatus
+from model.payment.payment_constants import PaymentShardKey
+from usecase import payment_tracking_coordinator
+from usecase.payment_tracking_coordinator import (
+    LambdaPaymentTrackingDispatcher,
+    PaymentTrackingCoordinator,
+    PaymentTrackingDispatcher,
+    ShardPart,
+    get_payment_tracking_coordinator,
+    iter_shard_parts,
+)
+from usecase.payment_tracking_usecase import PaymentShard, TrackingSummary
+
+
+def build_payment(entry_id: str, event_id: str = 'event-0') -> PaymentTransactionOut:
+    return PaymentTransactionOut(
+        entryId=entry_id,
+        eventId=event_id,
+        price=500,
+        transactionStatus=TransactionStatus.PENDING,
+        paymentRequestId=f'pr-{entry_id}',
+    )
+
+
+def build_summary(checked: int) -> TrackingSummary:
+    counts = {field: 0 for field in TrackingSummary._fields}
+    return TrackingSummary(**dict(counts, checked=checked, stopped_early=False, resume_cursor=None))
+
+
+def build_shards(shard_count: int, shard_key: PaymentShardKey = PaymentShardKey.ENTRY_ID):
+    return [PaymentShard(index, shard_count, shard_key) for index in range(shard_count)]
+
+
+def partition_payments(payments, shards, max_payments=1000):
+    shard_payments = [[] for _ in shards]
+    for shard, payments_of_part in iter_shard_parts(payments, shards, max_payments):
+        shard_payments[shard.index].extend(payments_of_part)
+
+    return shard_payments
+
+
+class RecordingDispatcher(PaymentTrackingDispatcher):
+    def __init__(self):
+        self.shard_parts = None
+
+    def dispatch(self, shard_parts, remaining_time_millis):
+        self.shard_parts = list(shard_parts)
+        return [(shard, build_summary(len(payments))) for shard, payments in self.shard_parts]
+
+
+def test_every_payment_is_assigned_to_the_one_shard_that_contains_it():
+    payments = [build_payment(f'payment-{index}') for index in range(200)]
+    shards = build_shards(4)
+
+    shard_payments = partition_payments(payments, shards)
+
+    assert sorted(payment.entryId for payments in shard_payments for payment in payments) == sorted(
+        payment.entryId for payment in payments
+    )
+    for shard, payments_of_shard in zip(shards, shard_payments):
+        assert payments_of_shard
+        assert all(shard.contains(payment) for payment in payments_of_shard)
+
+
+def test_a_full_part_is_yielded_before_the_rest_of_the_backlog_is_read():
+    shards = build_shards(2)
+    read = []
+
+    def read_backlog():
+        for index in range(100):
+            read.append(index)
+            yield build_payment(f'payment-{index}')
+
+    shard_parts = iter_shard_parts(read_backlog(), shards, 3)
+    shard, payments = next(shard_parts)
+
+    assert len(payments) == 3 and all(shard.contains(payment) for payment in payments)
+    assert len(read) < 100
+    assert all(len(payments) <= 3 for _, payments in shard_parts)
+
+
+def test_a_shard_without_payments_gets_an_empty_part():
+    shards = build_shards(2)
+    payments = [
+        payment for payment in (build_payment(f'payment-{index}') for index in range(20)) if shards[0].contains(payment)
+    ]
+
+    shard_parts = list(iter_shard_parts(payments, shards, 4))
+
+    assert shard_parts[-1] == ShardPart(shards[1], [])
+    assert sum(len(payments) for shard, payments in shard_parts if shard == shards[0]) == len(payments)
+
+
+def test_the_payments_of_an_event_share_a_shard():
+    payments = [build_payment(f'payment-{index}', f'event-{index % 3}') for index in range(30)]
+
+    shard_payments = partition_payments(payments, build_shards(4, PaymentShardKey.EVENT_ID))
+
+    for payments_of_shard in shard_payments:
+        event_ids = {payment.eventId for payment in payments_of_shard}
+        assert all(
+            payment in payments_of_shard for payment in payments if payment.eventId in event_ids
+        ), 'an event was split across shards'
+
+
+def test_the_coordinator_downloads_the_pending_payments_once(monkeypatch, storage_server):
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    for index in range(20):
+        storage_server.create_payment(None, build_payment(f'payment-{index:02}').dict())
+
+    dispatcher = RecordingDispatcher()
+    coordinator = PaymentTrackingCoordinator(dispatcher, 3)
+    storage_requests = storage_server.request_count
+
+    sharded_tracking_summary = coordinator.track_pending_payments()
+
+    assert storage_server.request_count - storage_requests == 1
+    assert sharded_tracking_summary.total.checked == 20
+    assert sharded_tracking_summary.failed_shards == []
+    assert dispatcher.shard_parts == list(
+        iter_shard_parts([build_payment(f'payment-{index:02}') for index in range(20)], build_shards(3), 2000)
+    )
+
+
+def test_the_coordinator_adds_up_the_parts_of_each_shard(monkeypatch, storage_server):
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    monkeypatch.setattr(payment_tracking_coordinator, 'WORKER_MAX_PAYMENTS', 2)
+    for index in range(20):
+        storage_server.create_payment(None, build_payment(f'payment-{index:02}').dict())
+
+    dispatcher = RecordingDispatcher()
+    sharded_tracking_summary = PaymentTrackingCoordinator(dispatcher, 3).track_pending_payments()
+
+    assert len(dispatcher.shard_parts) > 3
+    assert sharded_tracking_summary.total.checked == 20
+
+
+def test_lambda_workers_get_the_payments_of_their_part(mocker):
+    payloads = []
+
+    def invoke(FunctionName, InvocationType, Payload):
+        payload = json.loads(Payload)
+        payloads.append(payload)
+        response = {'summary': build_summary(len(payload['payments']))._asdict()}
+        return {'Payload': io.BytesIO(json.dumps(response).encode())}
+
+    lambda_client = mocker.Mock(invoke=mocker.Mock(side_effect=invoke))
+    shards = build_shards(2)
+    payments = [build_payment(f'payment-{index}') for index in range(3)]
+    shard_parts = [ShardPart(shards[0], payments[:2]), ShardPart(shards[0], payments[2:]), ShardPart(shards[1], [])]
+
+    part_summaries = LambdaPaymentTrackingDispatcher('payment-tracker', lambda_client).dispatch(
+        iter(shard_parts), lambda: 60000
+    )
+
+    assert [(shard.index, summary.checked) for shard, summary in part_summaries] == [(0, 2), (0, 1), (1, 0)]
+    assert sorted((payload['shard'], len(payload['payments'])) for payload in payloads) == [(0, 1), (0, 2), (1, 0)]
+    assert all(
+        payload['timeBudgetMillis'] <= 60000 - payment_tracking_coordinator.COORDINATOR_MARGIN_MILLIS
+        for payload in payloads
+    )
+    assert PaymentTransactionOut(**payloads[0]['payments'][0]) in payments
+
+
+@pytest.fixture
+def clear_store_caches():
+    lru_caches = (get_payment_poll_schedule_store, get_payment_status_ledger, get_payment_tracking_coordinator)
+    for lru_cache in lru_caches:
+        lru_cache.cache_clear()
+
+    yield
+    for lru_cache in lru_caches:
+        lru_cache.cache_clear()
+
+
+def test_sharding_needs_the_shared_stores(monkeypatch, clear_store_caches):
+    monkeypatch.setenv('PAYMENT_TRACKER_SHARDS', '4')
+    monkeypatch.setenv('PAYMENT_POLL_SCHEDULE', 'NONE')
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER', 'MEMORY')
+
+    with pytest.raises(ValueError):
+        get_payment_tracking_coordinator('payment-tracker')
+
+    get_payment_status_ledger.cache_clear()
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER', 'DYNAMODB')
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER_TABLE_NAME', 'payment-status-ledger')
+    assert get_payment_tracking_coordinator('payment-tracker') is not None
+
+
+def test_a_local_run_without_a_function_name_tracks_the_shards_on_threads(monkeypatch, clear_store_caches):
+    monkeypatch.setenv('PAYMENT_TRACKER_SHARDS', '4')
+    monkeypatch.setenv('PAYMENT_POLL_SCHEDULE', 'NONE')
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER', 'NONE')
+
+    assert get_payment_tracking_coordinator(None) is not None
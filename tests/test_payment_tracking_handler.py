@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from functions import payment_tracking_handler
+from scripts.fake_servers import FakeLambdaContext
+
+
+@pytest.fixture
+def lambda_client(mocker, monkeypatch):
+    lambda_client = mocker.Mock()
+    monkeypatch.setattr(payment_tracking_handler, '_lambda_client', lambda_client)
+    monkeypatch.setenv('PAYMENT_TRACKER_MAX_REINVOCATIONS', '3')
+    return lambda_client
+
+
+def test_a_worker_resumes_its_part_without_its_payments(lambda_client):
+    event = {
+        'shard': 1,
+        'shardCount': 4,
+        'shardKey': 'ENTRY_ID',
+        'payments': [{'entryId': f'payment-{index:04}'} for index in range(2000)],
+        'timeBudgetMillis': 60000,
+    }
+
+    payment_tracking_handler._resume(event, FakeLambdaContext(), 'payment-0999')
+
+    payload = json.loads(lambda_client.invoke.call_args.kwargs['Payload'])
+    assert payload == {
+        'shard': 1,
+        'shardCount': 4,
+        'shardKey': 'ENTRY_ID',
+        'lastEntryId': 'payment-1999',
+        'resumeCursor': 'payment-0999',
+        'reinvocations': 1,
+    }
+    assert lambda_client.invoke.call_args.kwargs['InvocationType'] == 'Event'
+
+
+def test_a_resumed_worker_keeps_the_end_of_its_part(lambda_client):
+    event = {'shard': 1, 'shardCount': 4, 'lastEntryId': 'payment-1999', 'reinvocations': 1}
+
+    payment_tracking_handler._resume(event, FakeLambdaContext(), 'payment-1500')
+
+    payload = json.loads(lambda_client.invoke.call_args.kwargs['Payload'])
+    assert payload['lastEntryId'] == 'payment-1999'
+    assert payload['resumeCursor'] == 'payment-1500' and payload['reinvocations'] == 2
+
+
+def test_a_local_run_does_not_resume(lambda_client):
+    payment_tracking_handler._resume({}, None, 'payment-0999')
+
+    lambda_client.invoke.assert_not_called()
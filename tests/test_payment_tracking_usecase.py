@@ -0,0 +1,62 @@
+from external.payment_poll_schedule_store import InMemoryPaymentPollScheduleStore
+from external.payment_status_ledger import InMemoryPaymentStatusLedger
+from scripts.fake_servers import InMemorySqsClient
+from usecase.payment_poll_scheduler import PaymentPollScheduler
+from usecase.payment_tracking_usecase import PaymentTrackingUsecase
+
+ENTRY_IDS = ['payment-a', 'payment-b', 'payment-c', 'payment-d', 'payment-e']
+
+
+def test_a_run_with_a_poll_scheduler_resumes_after_the_cursor(
+    mocker, monkeypatch, storage_server, xendit_server, build_payment_usecase
+):
+    payment_usecase = build_payment_usecase()
+    resolve_payment_requests = mocker.spy(payment_usecase, 'resolve_payment_requests')
+    monkeypatch.setenv('SQS_QUEUE_URL', 'https://sqs.ap-southeast-1.amazonaws.com/000000000000/payment-status.fifo')
+    for entry_id in ENTRY_IDS:
+        xendit_server.add_payment_request(f'pr-{entry_id}')
+        storage_server.create_payment(
+            None,
+            {'entryId': entry_id, 'price': 500, 'transactionStatus': 'PENDING', 'paymentRequestId': f'pr-{entry_id}'},
+        )
+
+    payment_tracking_usecase = PaymentTrackingUsecase(
+        sqs_client=InMemorySqsClient(),
+        concurrency=1,
+        lookup_batch_size=2,
+        payment_poll_scheduler=PaymentPollScheduler(InMemoryPaymentPollScheduleStore()),
+        payment_status_ledger=InMemoryPaymentStatusLedger(),
+    )
+    tracking_summary = payment_tracking_usecase.track_pending_payments(resume_cursor='payment-c')
+
+    assert tracking_summary.checked == 2
+    assert tracking_summary.still_pending == 2
+    assert [call.args[0] for call in resolve_payment_requests.call_args_list] == [['pr-payment-d', 'pr-payment-e']]
+    assert tracking_summary.resume_cursor is None
+
+
+def test_a_resumed_worker_stops_at_the_last_payment_of_its_part(
+    mocker, monkeypatch, storage_server, xendit_server, build_payment_usecase
+):
+    payment_usecase = build_payment_usecase()
+    resolve_payment_requests = mocker.spy(payment_usecase, 'resolve_payment_requests')
+    monkeypatch.setenv('SQS_QUEUE_URL', 'https://sqs.ap-southeast-1.amazonaws.com/000000000000/payment-status.fifo')
+    for entry_id in ENTRY_IDS:
+        xendit_server.add_payment_request(f'pr-{entry_id}')
+        storage_server.create_payment(
+            None,
+            {'entryId': entry_id, 'price': 500, 'transactionStatus': 'PENDING', 'paymentRequestId': f'pr-{entry_id}'},
+        )
+
+    payment_tracking_usecase = PaymentTrackingUsecase(
+        sqs_client=InMemorySqsClient(),
+        concurrency=1,
+        payment_poll_scheduler=PaymentPollScheduler(InMemoryPaymentPollScheduleStore()),
+        payment_status_ledger=InMemoryPaymentStatusLedger(),
+    )
+    tracking_summary = payment_tracking_usecase.track_pending_payments(
+        resume_cursor='payment-a', last_entry_id='payment-c'
+    )
+
+    assert tracking_summary.checked == 2
+    assert [call.args[0] for call in resolve_payment_requests.call_args_list] == [['pr-payment-b', 'pr-payment-c']]
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from external.payment_storage_gateway import PaymentStorageGateway
+from external.payment_update_outbox import SqlitePaymentUpdateOutbox, SqsPaymentUpdateOutbox
+from model.payment.payment import PaymentTransactionIn
+from usecase.payment_update_outbox_drainer import PaymentUpdateOutboxDrainer
+
+
+@pytest.fixture
+def payment_storage_gateway(monkeypatch, storage_server) -> PaymentStorageGateway:
+    monkeypatch.setenv('CALLBACK_BASE_URL', storage_server.base_url)
+    return PaymentStorageGateway()
+
+
+def store_payment(storage_server, entry_id: str, transaction_status: str) -> None:
+    storage_server.payments[entry_id] = {'entryId': entry_id, 'price': 500, 'transactionStatus': transaction_status}
+
+
+def pending_payment(payment_request_id: str) -> PaymentTransactionIn:
+    return PaymentTransactionIn(price=500, transactionStatus='PENDING', paymentRequestId=payment_request_id)
+
+
+def test_queued_update_is_written_with_a_put_once(tmp_path, storage_server, payment_storage_gateway):
+    outbox = SqlitePaymentUpdateOutbox(str(tmp_path / 'outbox.sqlite3'))
+    drainer = PaymentUpdateOutboxDrainer(outbox, payment_storage_gateway)
+    store_payment(storage_server, 'payment-1', 'PENDING')
+    outbox.put('payment-1', pending_payment('pr-1'))
+
+    drain_stats = drainer.drain()
+
+    assert drain_stats.applied == 1
+    assert storage_server.payments['payment-1']['paymentRequestId'] == 'pr-1'
+    assert outbox.depth() == 0
+    # an update that was applied is not queued again
+    assert outbox.put('payment-1', pending_payment('pr-1')) is False
+
+
+def test_failed_put_is_retried_by_the_gateway_before_the_outbox(tmp_path, storage_server, payment_storage_gateway):
+    outbox = SqlitePaymentUpdateOutbox(str(tmp_path / 'outbox.sqlite3'))
+    drainer = PaymentUpdateOutboxDrainer(outbox, payment_storage_gateway)
+    store_payment(storage_server, 'payment-1', 'PENDING')
+    outbox.put('payment-1', pending_payment('pr-1'))
+
+    storage_server.fail_next(1)
+    drain_stats = drainer.drain()
+
+    assert drain_stats.applied == 1
+    assert drain_stats.failed == 0
+    assert storage_server.payments['payment-1']['paymentRequestId'] == 'pr-1'
+
+
+def test_sqs_message_is_applied_with_its_payment(mocker, storage_server, payment_storage_gateway):
+    sqs_client = mocker.Mock()
+    outbox = SqsPaymentUpdateOutbox('https://sqs.example.com/outbox.fifo', sqs_client=sqs_client)
+    drainer = PaymentUpdateOutboxDrainer(outbox, payment_storage_gateway)
+    store_payment(storage_server, 'payment-1', 'PENDING')
+    outbox.put('payment-1', pending_payment('pr-1'))
+    body = sqs_client.send_message.call_args.kwargs['MessageBody']
+
+    entry = SqsPaymentUpdateOutbox.from_message(body, 'receipt', {'ApproximateReceiveCount': '3'})
+
+    assert entry.outbox_id == 'payment-1:pr-1'
+    assert entry.attempts == 2
+    assert json.loads(body)['payment']['paymentRequestId'] == 'pr-1'
+    assert drainer.apply_entries([entry]) == []
+    assert storage_server.payments['payment-1']['paymentRequestId'] == 'pr-1'
+    sqs_client.delete_message.assert_called_once_with(
+        QueueUrl='https://sqs.example.com/outbox.fifo', ReceiptHandle='receipt'
+    )
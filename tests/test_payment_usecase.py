@@ -0,0 +1,235 @@
+from http import HTTPStatus
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from controller.app_controller import api_controller
+from scripts.fake_servers import SAMPLE_REGISTRATION
+from utils.secret_provider import SecretProvider
+
+
+def build_e_wallet_payment_in(reference_id: str = 'ref-1') -> dict:
+    return {
+        'successReturnUrl': 'https://example.com/success',
+        'failureReturnUrl': 'https://example.com/failure',
+        'referenceId': reference_id,
+        'amount': 500,
+        'channelCode': 'GCASH',
+        'eventId': 'event-1',
+        'registrationData': SAMPLE_REGISTRATION,
+    }
+
+
+def build_direct_debit_payment_in() -> dict:
+    return {
+        'amount': 500,
+        'givenNames': 'Juan',
+        'surname': 'Dela Cruz',
+        'email': 'juan@example.com',
+        'channelCode': 'BPI',
+        'successReturnUrl': 'https://example.com/success',
+        'failureReturnUrl': 'https://example.com/failure',
+        'eventId': 'event-1',
+        'registrationData': SAMPLE_REGISTRATION,
+    }
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    api_controller(app)
+    return TestClient(app)
+
+
+def test_warm_request_makes_no_ssm_calls(client, build_payment_usecase, ssm_client):
+    build_payment_usecase(IDEMPOTENCY_STORE='NONE')
+    cold_response = client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in('ref-cold'))
+    assert cold_response.status_code == 200
+    assert ssm_client.get_parameters.call_count == 1
+    ssm_client.get_parameters.reset_mock()
+
+    warm_response = client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in('ref-warm'))
+
+    assert warm_response.status_code == 200
+    assert ssm_client.get_parameters.call_count == 0
+
+
+def test_rotated_xendit_api_key_is_used_without_a_cold_start(client, build_payment_usecase, ssm_client):
+    payment_usecase = build_payment_usecase(IDEMPOTENCY_STORE='NONE')
+    assert client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in('ref-1')).status_code == 200
+
+    ssm_client.get_parameters.side_effect = lambda Names, WithDecryption=False: {
+        'Parameters': [{'Name': name, 'Value': 'xnd_development_rotated'} for name in Names]
+    }
+    SecretProvider.get_default().refresh()
+    assert client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in('ref-2')).status_code == 200
+
+    assert payment_usecase.xendit_api_instance.api_client.configuration.api_key == 'xnd_development_rotated'
+
+
+def test_service_ids_store_the_payment_request_id_on_the_created_record(client, build_payment_usecase, storage_server):
+    build_payment_usecase(IDEMPOTENCY_STORE='NONE', TRANSACTION_ID_MODE='SERVICE')
+
+    response = client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in())
+
+    assert response.status_code == 200
+    [payment] = storage_server.payments.values()
+    assert payment['paymentRequestId'] == response.json()['paymentRequestId']
+
+
+def test_service_ids_fail_the_request_when_the_create_fails(client, build_payment_usecase, storage_server):
+    build_payment_usecase(IDEMPOTENCY_STORE='NONE', TRANSACTION_ID_MODE='SERVICE')
+    storage_server.fail_next(1, status=400)
+
+    response = client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in())
+
+    assert response.status_code == 400
+    # no update is sent for the record that was never created
+    assert storage_server.request_count == 1
+    assert storage_server.payments == {}
+
+
+def test_requests_without_an_idempotency_key_are_not_deduplicated(client, build_payment_usecase, xendit_server):
+    build_payment_usecase(IDEMPOTENCY_STORE='MEMORY')
+    payment_in = build_e_wallet_payment_in()
+
+    first_response = client.post('/e_wallet/payment_method', json=payment_in)
+    second_response = client.post('/e_wallet/payment_method', json=payment_in)
+
+    assert first_response.json()['paymentRequestId'] != second_response.json()['paymentRequestId']
+    assert len(xendit_server.payment_requests) == 2
+
+
+def test_idempotency_key_is_deduplicated_and_forwarded_to_xendit(
+    mocker, client, build_payment_usecase, storage_server, xendit_server
+):
+    from external.async_xendit_payment_request_api import AsyncPaymentRequestApi
+
+    create_payment_request = mocker.spy(AsyncPaymentRequestApi, 'create_payment_request')
+    build_payment_usecase(IDEMPOTENCY_STORE='MEMORY')
+    payment_in = build_e_wallet_payment_in()
+
+    first_response = client.post('/e_wallet/payment_method', json=payment_in, headers={'Idempotency-Key': 'key-1'})
+    second_response = client.post('/e_wallet/payment_method', json=payment_in, headers={'Idempotency-Key': 'key-1'})
+
+    assert first_response.json() == second_response.json()
+    assert len(xendit_server.payment_requests) == 1
+    assert create_payment_request.call_count == 1
+    [payment_transaction_id] = storage_server.payments
+    assert create_payment_request.call_args.kwargs['idempotency_key'] == f'E_WALLET:key-1:{payment_transaction_id}'
+
+
+@pytest.mark.parametrize(
+    'path, payment_in',
+    [
+        ('/e_wallet/payment_method', build_e_wallet_payment_in()),
+        ('/direct_debit/payment_request', build_direct_debit_payment_in()),
+    ],
+)
+@pytest.mark.parametrize('transaction_id_mode', ['STORAGE', 'SERVICE'])
+def test_retry_after_a_failed_attach_sends_xendit_the_same_request(
+    mocker, client, build_payment_usecase, storage_server, path, payment_in, transaction_id_mode
+):
+    from external.async_payment_storage_gateway import AsyncPaymentStorageGateway
+    from external.async_xendit_payment_request_api import AsyncPaymentRequestApi
+
+    update_payment_transaction = AsyncPaymentStorageGateway.update_payment_transaction
+    attach_calls = []
+
+    async def fail_first_attach(self, payment_transaction_id, payment):
+        attach_calls.append(payment_transaction_id)
+        if len(attach_calls) == 1:
+            return HTTPStatus.BAD_REQUEST, None, 'Injected failure'
+
+        return await update_payment_transaction(self, payment_transaction_id, payment)
+
+    mocker.patch.object(AsyncPaymentStorageGateway, 'update_payment_transaction', fail_first_attach)
+    create_payment_request = mocker.spy(AsyncPaymentRequestApi, 'create_payment_request')
+    build_payment_usecase(IDEMPOTENCY_STORE='MEMORY', TRANSACTION_ID_MODE=transaction_id_mode)
+
+    failed_response = client.post(path, json=payment_in, headers={'Idempotency-Key': 'key-1'})
+    retried_response = client.post(path, json=payment_in, headers={'Idempotency-Key': 'key-1'})
+
+    assert failed_response.status_code == 400
+    assert retried_response.status_code == 200
+    # the retry reuses the payment transaction, so Xendit gets the same body under the same key
+    [payment_transaction_id] = storage_server.payments
+    assert attach_calls == [payment_transaction_id, payment_transaction_id]
+    first_call, retried_call = create_payment_request.call_args_list
+    assert first_call.kwargs == retried_call.kwargs
+    assert first_call.kwargs['idempotency_key'].endswith(f':key-1:{payment_transaction_id}')
+    assert storage_server.payments[payment_transaction_id]['paymentRequestId'] == (
+        retried_response.json()['paymentRequestId']
+    )
+
+
+def test_retry_with_another_body_after_a_failed_attach_is_rejected(mocker, client, build_payment_usecase):
+    from external.async_payment_storage_gateway import AsyncPaymentStorageGateway
+
+    mocker.patch.object(
+        AsyncPaymentStorageGateway,
+        'update_payment_transaction',
+        mocker.AsyncMock(return_value=(HTTPStatus.BAD_REQUEST, None, 'Injected failure')),
+    )
+    build_payment_usecase(IDEMPOTENCY_STORE='MEMORY')
+
+    client.post('/e_wallet/payment_method', json=build_e_wallet_payment_in(), headers={'Idempotency-Key': 'key-1'})
+    response = client.post(
+        '/e_wallet/payment_method', json=build_e_wallet_payment_in('ref-2'), headers={'Idempotency-Key': 'key-1'}
+    )
+
+    assert response.status_code == 422
+
+
+def test_payment_requests_missing_from_the_list_are_got_by_id(build_payment_usecase, xendit_server):
+    payment_usecase = build_payment_usecase()
+    for payment_request_id in ('pr-1', 'pr-2', 'pr-3'):
+        xendit_server.add_payment_request(payment_request_id)
+    xendit_server.unlisted_ids.add('pr-2')
+
+    resolved = payment_usecase.resolve_payment_requests(['pr-1', 'pr-2', 'pr-3', 'pr-1'])
+
+    assert {
+        payment_request_id: payment_request.id
+        for payment_request_id, payment_request in resolved.payment_requests.items()
+    } == {'pr-1': 'pr-1', 'pr-2': 'pr-2', 'pr-3': 'pr-3'}
+    assert (resolved.list_calls, resolved.get_calls, len(resolved.xendit_calls)) == (1, 1, 2)
+
+
+def test_a_single_payment_request_is_got_without_listing(build_payment_usecase, xendit_server):
+    payment_usecase = build_payment_usecase()
+    xendit_server.add_payment_request('pr-1')
+
+    resolved = payment_usecase.resolve_payment_requests(['pr-1'])
+
+    assert resolved.payment_requests['pr-1'].id == 'pr-1'
+    assert (resolved.list_calls, resolved.get_calls, xendit_server.list_request_count) == (0, 1, 0)
+
+
+def test_a_rejected_list_turns_listing_off_and_gets_by_id(build_payment_usecase, xendit_server):
+    payment_usecase = build_payment_usecase()
+    xendit_server.lists = False
+    for payment_request_id in ('pr-1', 'pr-2'):
+        xendit_server.add_payment_request(payment_request_id)
+
+    first = payment_usecase.resolve_payment_requests(['pr-1', 'pr-2'])
+    second = payment_usecase.resolve_payment_requests(['pr-1', 'pr-2'])
+
+    assert sorted(payment_request.id for payment_request in first.payment_requests.values()) == ['pr-1', 'pr-2']
+    assert (first.list_calls, first.get_calls) == (1, 2)
+    # listing stays off for the container, so the next lookups do not try it again
+    assert (second.list_calls, second.get_calls) == (0, 2)
+
+
+def test_a_failed_list_answers_its_ids_with_the_error_instead_of_getting_them(build_payment_usecase, xendit_server):
+    payment_usecase = build_payment_usecase()
+    for payment_request_id in ('pr-1', 'pr-2'):
+        xendit_server.add_payment_request(payment_request_id)
+    xendit_server.fail_next(1)
+
+    resolved = payment_usecase.resolve_payment_requests(['pr-1', 'pr-2'])
+
+    assert [response.status_code for response in resolved.payment_requests.values()] == [HTTPStatus.BAD_GATEWAY] * 2
+    assert (resolved.list_calls, resolved.get_calls) == (1, 0)
+    assert xendit_server.request_count == 1
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from utils.rate_limiter import RateLimitedError, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def build_rate_limiter(clock: FakeClock) -> RateLimiter:
+    # the tracking budget gets 5 of the 10 calls per second
+    return RateLimiter('xendit', 10, budget_shares={'tracking': 0.5}, clock=clock, sleep=clock.sleep)
+
+
+def test_a_rejected_call_gives_its_budget_token_back():
+    clock = FakeClock()
+    rate_limiter = build_rate_limiter(clock)
+    for _ in range(10):
+        rate_limiter.acquire('checkout')
+
+    # the shared bucket is empty, so every tracking call is rejected after taking a budget token
+    for _ in range(5):
+        with pytest.raises(RateLimitedError):
+            rate_limiter.acquire('tracking', max_wait_seconds=0)
+
+    clock.now += 0.1
+    assert rate_limiter.acquire('tracking', max_wait_seconds=0) == 0.0
+
+
+def test_a_rejected_async_call_gives_its_budget_token_back():
+    clock = FakeClock()
+    rate_limiter = build_rate_limiter(clock)
+    for _ in range(10):
+        rate_limiter.acquire('checkout')
+
+    async def acquire_tracking():
+        return await rate_limiter.acquire_async('tracking', max_wait_seconds=0)
+
+    for _ in range(5):
+        with pytest.raises(RateLimitedError):
+            asyncio.run(acquire_tracking())
+
+    clock.now += 0.1
+    assert asyncio.run(acquire_tracking()) == 0.0
+
+
+def test_a_call_waits_for_the_budget_and_the_shared_bucket():
+    clock = FakeClock()
+    rate_limiter = build_rate_limiter(clock)
+    for _ in range(5):
+        rate_limiter.acquire('tracking')
+
+    # the budget refills at 5 calls per second
+    assert rate_limiter.acquire('tracking') == pytest.approx(0.2)
+    assert [metrics.throttled for metrics in rate_limiter.metrics()] == [1]
@@ -0,0 +1,23 @@
+from utils.decorators import per_invocation_retry_budget
+from utils.retry_budget import RetryBudget, get_retry_budget
+
+
+def test_retries_are_denied_once_the_budget_is_spent():
+    retry_budget = RetryBudget(2)
+
+    assert [retry_budget.try_spend() for _ in range(3)] == [True, True, False]
+    assert (retry_budget.spent, retry_budget.denied) == (2, 1)
+
+
+def test_every_invocation_gets_the_whole_budget():
+    retry_budget = get_retry_budget()
+    while retry_budget.try_spend():
+        pass
+
+    @per_invocation_retry_budget
+    def handler(event, context):
+        return retry_budget.spent, retry_budget.try_spend()
+
+    assert handler({}, None) == (0, True)
+    assert handler({}, None) == (0, True)
+    retry_budget.reset()
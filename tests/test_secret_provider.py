@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+from scripts.fake_servers import InMemorySsmClient
+from utils.secret_provider import SecretNotFoundError, SecretProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_parameters_are_loaded_in_batches_and_served_from_memory(mocker, clock):
+    names = [f'parameter-{index}' for index in range(12)]
+    ssm_client = mocker.Mock(wraps=InMemorySsmClient({name: name.upper() for name in names}))
+    secret_provider = SecretProvider(parameter_names=names, ssm_client=ssm_client, clock=clock)
+
+    assert secret_provider.get('parameter-0') == 'PARAMETER-0'
+    assert secret_provider.get('parameter-11') == 'PARAMETER-11'
+    # 12 names take two GetParameters calls of at most 10 names, then every get is served from memory
+    assert ssm_client.get_parameters.call_count == 2
+
+
+def test_expired_parameters_are_refreshed(mocker, clock):
+    values = {'xendit-api-key': 'old-key'}
+    ssm_client = mocker.Mock(wraps=InMemorySsmClient(values))
+    secret_provider = SecretProvider(
+        parameter_names=['xendit-api-key'],
+        ttl_seconds=900,
+        refresh_margin_seconds=0,
+        ssm_client=ssm_client,
+        clock=clock,
+    )
+    assert secret_provider.get('xendit-api-key') == 'old-key'
+
+    values['xendit-api-key'] = 'new-key'
+    clock.now = 899
+    assert secret_provider.get('xendit-api-key') == 'old-key'
+
+    clock.now = 900
+    assert secret_provider.get('xendit-api-key') == 'new-key'
+    assert ssm_client.get_parameters.call_count == 2
+
+
+def test_parameters_close_to_expiry_are_refreshed_in_background(mocker, clock):
+    values = {'xendit-api-key': 'old-key'}
+    ssm_client = mocker.Mock(wraps=InMemorySsmClient(values))
+    secret_provider = SecretProvider(
+        parameter_names=['xendit-api-key'],
+        ttl_seconds=900,
+        refresh_margin_seconds=60,
+        ssm_client=ssm_client,
+        clock=clock,
+    )
+    secret_provider.get('xendit-api-key')
+
+    values['xendit-api-key'] = 'new-key'
+    clock.now = 850
+    # the cached value is served while the refresh runs
+    assert secret_provider.get('xendit-api-key') in ('old-key', 'new-key')
+
+    deadline = time.monotonic() + 5
+    while secret_provider.get('xendit-api-key') != 'new-key' and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert secret_provider.get('xendit-api-key') == 'new-key'
+    assert ssm_client.get_parameters.call_count == 2
+
+
+def test_failed_refresh_keeps_the_last_known_values(mocker, clock):
+    ssm_client = mocker.Mock(wraps=InMemorySsmClient({'xendit-api-key': 'old-key'}))
+    secret_provider = SecretProvider(
+        parameter_names=['xendit-api-key'],
+        ttl_seconds=900,
+        retry_interval_seconds=30,
+        ssm_client=ssm_client,
+        clock=clock,
+    )
+    secret_provider.get('xendit-api-key')
+
+    ssm_client.get_parameters.side_effect = RuntimeError('SSM is down')
+    clock.now = 900
+    assert secret_provider.refresh() is False
+    assert secret_provider.get('xendit-api-key') == 'old-key'
+
+    # the next attempt waits for the retry interval
+    clock.now = 920
+    secret_provider.get('xendit-api-key')
+    assert ssm_client.get_parameters.call_count == 2
+
+
+def test_missing_parameter_raises(mocker, clock):
+    secret_provider = SecretProvider(ssm_client=InMemorySsmClient({}), clock=clock)
+
+    with pytest.raises(SecretNotFoundError):
+        secret_provider.get('missing')
+
+
+def test_cached_reads_do_not_wait_on_an_expired_parameter(mocker, clock):
+    values = {'xendit-api-key': 'old-key'}
+    ssm_client = mocker.Mock(wraps=InMemorySsmClient(values))
+    secret_provider = SecretProvider(
+        parameter_names=['xendit-api-key'],
+        ttl_seconds=900,
+        refresh_margin_seconds=0,
+        ssm_client=ssm_client,
+        clock=clock,
+    )
+    secret_provider.get('xendit-api-key')
+
+    refresh = mocker.patch.object(secret_provider, 'refresh')
+    values['xendit-api-key'] = 'new-key'
+    clock.now = 900
+    assert secret_provider.get_cached('xendit-api-key') == 'old-key'
+
+    deadline = time.monotonic() + 5
+    while not refresh.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # the refresh ran on the background thread, not on the caller's
+    refresh.assert_called_once_with()
+    assert ssm_client.get_parameters.call_count == 1
@@ -0,0 +1,97 @@
+import pytest
+
+from external.payment_poll_schedule_store import (
+    DynamoDbPaymentPollScheduleStore,
+    SqlitePaymentPollScheduleStore,
+    get_payment_poll_schedule_store,
+)
+from external.payment_status_ledger import (
+    DynamoDbPaymentStatusLedger,
+    SqlitePaymentStatusLedger,
+    get_payment_status_ledger,
+)
+from external.store_tables import SQLITE_MAX_PARAMETERS, DynamoDbTable
+from usecase.payment_poll_scheduler import PaymentPollScheduler
+
+TABLE_NAME = 'payment-poll-schedule'
+
+
+def test_unprocessed_keys_are_retried_and_the_ones_left_counted(mocker):
+    mocker.patch('external.store_tables.time.sleep')
+    keys = [{'entryId': {'S': f'payment-{index}'}} for index in range(150)]
+    dynamodb_client = mocker.Mock()
+    dynamodb_client.batch_get_item.side_effect = [
+        {'Responses': {TABLE_NAME: keys[:90]}, 'UnprocessedKeys': {TABLE_NAME: {'Keys': keys[90:100]}}},
+        {'Responses': {TABLE_NAME: keys[90:100]}},
+        *[{'Responses': {}, 'UnprocessedKeys': {TABLE_NAME: {'Keys': keys[100:]}}}] * 5,
+    ]
+
+    items, unread = DynamoDbTable(TABLE_NAME, dynamodb_client).batch_get(
+        'entryId', [key['entryId']['S'] for key in keys]
+    )
+
+    assert items == keys[:100]
+    assert unread == 50
+    requests = [call.kwargs['RequestItems'][TABLE_NAME] for call in dynamodb_client.batch_get_item.mock_calls]
+    assert [len(request['Keys']) for request in requests] == [100, 10, 50, 50, 50, 50, 50]
+
+
+def test_items_are_put_in_batches_of_twenty_five(mocker):
+    dynamodb_client = mocker.Mock()
+    dynamodb_client.batch_write_item.return_value = {}
+
+    unwritten = DynamoDbTable(TABLE_NAME, dynamodb_client).batch_put(
+        {'entryId': {'S': f'payment-{index}'}} for index in range(60)
+    )
+
+    assert unwritten == 0
+    assert [len(call.kwargs['RequestItems'][TABLE_NAME]) for call in dynamodb_client.batch_write_item.mock_calls] == [
+        25,
+        25,
+        10,
+    ]
+
+
+def test_sqlite_reads_more_keys_than_one_statement_takes(tmp_path):
+    store = SqlitePaymentPollScheduleStore(str(tmp_path / 'poll_schedule.sqlite3'), clock=lambda: 1_700_000_000.0)
+    scheduler = PaymentPollScheduler(store, clock=lambda: 1_700_000_000.0)
+    entry_ids = [f'payment-{index}' for index in range(2 * SQLITE_MAX_PARAMETERS + 1)]
+    store.put_many([scheduler.resolved_schedule(entry_id, 1_700_000_000.0, 1_700_000_000.0) for entry_id in entry_ids])
+
+    assert sorted(store.get_many(entry_ids)) == sorted(entry_ids)
+
+
+def test_the_poll_schedule_defaults_to_dynamodb_only_with_a_table_name(monkeypatch, tmp_path):
+    monkeypatch.delenv('PAYMENT_POLL_SCHEDULE', raising=False)
+    monkeypatch.delenv('PAYMENT_POLL_SCHEDULE_TABLE_NAME', raising=False)
+    monkeypatch.setenv('PAYMENT_POLL_SCHEDULE_PATH', str(tmp_path / 'payment_poll_schedule.sqlite3'))
+    get_payment_poll_schedule_store.cache_clear()
+    assert isinstance(get_payment_poll_schedule_store(), SqlitePaymentPollScheduleStore)
+
+    get_payment_poll_schedule_store.cache_clear()
+    monkeypatch.setenv('PAYMENT_POLL_SCHEDULE', 'DYNAMODB')
+    with pytest.raises(ValueError, match='PAYMENT_POLL_SCHEDULE_TABLE_NAME'):
+        get_payment_poll_schedule_store()
+
+    monkeypatch.delenv('PAYMENT_POLL_SCHEDULE')
+    monkeypatch.setenv('PAYMENT_POLL_SCHEDULE_TABLE_NAME', TABLE_NAME)
+    assert isinstance(get_payment_poll_schedule_store(), DynamoDbPaymentPollScheduleStore)
+    get_payment_poll_schedule_store.cache_clear()
+
+
+def test_the_status_ledger_defaults_to_dynamodb_only_with_a_table_name(monkeypatch, tmp_path):
+    monkeypatch.delenv('PAYMENT_STATUS_LEDGER', raising=False)
+    monkeypatch.delenv('PAYMENT_STATUS_LEDGER_TABLE_NAME', raising=False)
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER_PATH', str(tmp_path / 'payment_status_ledger.sqlite3'))
+    get_payment_status_ledger.cache_clear()
+    assert isinstance(get_payment_status_ledger(), SqlitePaymentStatusLedger)
+
+    get_payment_status_ledger.cache_clear()
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER', 'DYNAMODB')
+    with pytest.raises(ValueError, match='PAYMENT_STATUS_LEDGER_TABLE_NAME'):
+        get_payment_status_ledger()
+
+    monkeypatch.delenv('PAYMENT_STATUS_LEDGER')
+    monkeypatch.setenv('PAYMENT_STATUS_LEDGER_TABLE_NAME', 'payment-status-ledger')
+    assert isinstance(get_payment_status_ledger(), DynamoDbPaymentStatusLedger)
+    get_payment_status_ledger.cache_clear()
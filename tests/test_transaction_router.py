@@ -0,0 +1,51 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from controller.app_controller import api_controller
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    api_controller(app)
+    return TestClient(app)
+
+
+def test_batch_items_reference_the_transaction_details_schema(client):
+    schema = client.get('/openapi.json').json()
+
+    items_schema = schema['components']['schemas']['GetTransactionDetailsBatchIn']['properties']['items']['items']
+    assert {'$ref': '#/components/schemas/GetTransactionDetailsIn'} in items_schema['anyOf']
+
+
+def test_batch_reports_invalid_items_at_their_index(client):
+    response = client.post(
+        '/transaction/fees/batch',
+        json={
+            'items': [
+                {'ticket_price': '100', 'payment_method': 'E_WALLET', 'payment_channel': 'GCASH'},
+                {'ticket_price': 'free', 'payment_method': 'E_WALLET', 'payment_channel': 'GCASH'},
+                {'ticket_price': '100', 'payment_method': 'E_WALLET', 'payment_channel': 'BPI'},
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert results[0]['result']['total_price'] == 102.64
+    assert results[1]['index'] == 1 and results[1]['message'].startswith('ticket_price')
+    assert results[2]['message'] == 'Invalid payment channel was passed for E_WALLET.'
+
+
+def test_direct_debit_with_an_e_wallet_channel_is_priced_like_a_bank(client):
+    bank_response = client.post(
+        '/transaction/fees', json={'ticket_price': '100', 'payment_method': 'DIRECT_DEBIT', 'payment_channel': 'BPI'}
+    )
+    response = client.post(
+        '/transaction/fees', json={'ticket_price': '100', 'payment_method': 'DIRECT_DEBIT', 'payment_channel': 'GCASH'}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == bank_response.json()
+    assert response.json()['total_price'] == 116.8
@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from utils.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_values_are_served_until_they_expire(clock):
+    cache = TTLCache(max_entries=10, ttl_seconds=60, clock=clock)
+
+    assert cache.get_or_compute('quote', lambda: 'first') == 'first'
+    clock.now = 59
+    assert cache.get_or_compute('quote', lambda: 'second') == 'first'
+    clock.now = 60
+    assert cache.get_or_compute('quote', lambda: 'third') == 'third'
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.expirations) == (1, 2, 1)
+
+
+def test_the_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_entries=2, ttl_seconds=60, clock=clock)
+    cache.get_or_compute('a', lambda: 'a')
+    cache.get_or_compute('b', lambda: 'b')
+    cache.get_or_compute('a', lambda: 'not computed')
+
+    cache.get_or_compute('c', lambda: 'c')
+
+    assert cache.get_or_compute('a', lambda: 'not computed') == 'a'
+    assert cache.get_or_compute('b', lambda: 'recomputed') == 'recomputed'
+    assert cache.stats().evictions == 2
+
+
+def test_entries_are_evicted_to_stay_under_the_byte_cap(clock):
+    cache = TTLCache(max_entries=100, ttl_seconds=60, max_bytes=10, size_of=len, clock=clock)
+    cache.get_or_compute('a', lambda: 'aaaa')
+    cache.get_or_compute('b', lambda: 'bbbb')
+
+    cache.get_or_compute('c', lambda: 'cccc')
+
+    stats = cache.stats()
+    assert (stats.entries, stats.size_bytes, stats.evictions) == (2, 8, 1)
+    assert cache.get_or_compute('a', lambda: 'recomputed') == 'recomputed'
+
+
+def test_a_value_larger_than_the_byte_cap_is_not_cached(clock):
+    cache = TTLCache(max_entries=100, ttl_seconds=60, max_bytes=10, size_of=len, clock=clock)
+
+    assert cache.get_or_compute('a', lambda: 'a' * 11) == 'a' * 11
+    assert cache.stats().entries == 0
+
+
+def test_concurrent_misses_compute_the_value_once(clock):
+    cache = TTLCache(max_entries=10, ttl_seconds=60, clock=clock)
+    started, release = Event(), Event()
+    computations = []
+
+    def compute():
+        computations.append(1)
+        started.set()
+        release.wait(5)
+        return 'quote'
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(cache.get_or_compute, 'quote', compute)
+        started.wait(5)
+        followers = [executor.submit(cache.get_or_compute, 'quote', compute) for _ in range(3)]
+        deadline = time.monotonic() + 5
+        while cache.stats().coalesced < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        release.set()
+        results = [future.result(5) for future in [leader, *followers]]
+
+    assert results == ['quote'] * 4
+    assert len(computations) == 1
+    assert cache.stats().coalesced == 3
+
+
+def test_concurrent_misses_share_the_error_and_do_not_cache_it(clock):
+    cache = TTLCache(max_entries=10, ttl_seconds=60, clock=clock)
+    started, release = Event(), Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('storage is down')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(cache.get_or_compute, 'quote', fail)
+        started.wait(5)
+        follower = executor.submit(cache.get_or_compute, 'quote', fail)
+        deadline = time.monotonic() + 5
+        while cache.stats().coalesced < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError, match='storage is down'):
+                future.result(5)
+
+    assert cache.get_or_compute('quote', lambda: 'quote') == 'quote'
@@ -0,0 +1,78 @@
+import pytest
+import xendit
+from urllib3.util.retry import Retry
+from xendit.apis import PaymentRequestApi
+
+from external import xendit_payment_request_client
+from external.xendit_payment_request_client import (
+    XenditPaymentRequestClient,
+    last_response_retries,
+    record_response_headers,
+    response_headers,
+)
+
+
+@pytest.fixture
+def xendit_client(xendit_server) -> XenditPaymentRequestClient:
+    configuration = xendit.Configuration(api_key='xnd_development_test')
+    configuration.host = xendit_server.base_url
+    # as the payment usecase builds it, leaving the Retry-After of a 429 to the caller
+    configuration.retries = Retry(3, respect_retry_after_header=False)
+    api_client = xendit.ApiClient(configuration)
+    record_response_headers(api_client)
+    return XenditPaymentRequestClient(PaymentRequestApi(api_client))
+
+
+def test_a_payment_request_is_got_by_id(xendit_server, xendit_client):
+    xendit_server.add_payment_request('pr-1', status='SUCCEEDED')
+
+    payment_request = xendit_client.get_payment_request('pr-1')
+
+    assert (payment_request.id, str(payment_request.status)) == ('pr-1', 'SUCCEEDED')
+    assert last_response_retries() == 0
+
+
+def test_only_the_given_ids_are_listed(xendit_server, xendit_client):
+    for payment_request_id in ('pr-1', 'pr-2', 'pr-3'):
+        xendit_server.add_payment_request(payment_request_id)
+
+    page = xendit_client.list_payment_requests(['pr-1', 'pr-3', 'pr-unknown'])
+
+    assert [payment_request.id for payment_request in page.payment_requests] == ['pr-1', 'pr-3']
+    assert not page.has_more
+
+
+def test_a_list_is_paged_after_the_last_id(monkeypatch, xendit_server, xendit_client):
+    monkeypatch.setattr(xendit_payment_request_client, 'XENDIT_LIST_MAX_LIMIT', 2)
+    payment_request_ids = ['pr-1', 'pr-2', 'pr-3']
+    for payment_request_id in payment_request_ids:
+        xendit_server.add_payment_request(payment_request_id)
+
+    first_page = xendit_client.list_payment_requests(payment_request_ids)
+    second_page = xendit_client.list_payment_requests(payment_request_ids, after_id='pr-2')
+
+    assert [payment_request.id for payment_request in first_page.payment_requests] == ['pr-1', 'pr-2']
+    assert first_page.has_more
+    assert [payment_request.id for payment_request in second_page.payment_requests] == ['pr-3']
+    assert not second_page.has_more
+
+
+def test_errors_carry_the_headers_of_their_response(xendit_server, xendit_client):
+    xendit_server.add_payment_request('pr-1')
+    xendit_server.rate_limit_per_second = 1
+    xendit_client.get_payment_request('pr-1')
+
+    with pytest.raises(xendit.XenditSdkException) as e:
+        xendit_client.get_payment_request('pr-1')
+
+    assert str(e.value.status) == '429'
+    assert response_headers(e.value)['Retry-After'] == '1'
+
+
+def test_a_rejected_list_is_raised(xendit_server, xendit_client):
+    xendit_server.lists = False
+
+    with pytest.raises(xendit.XenditSdkException) as e:
+        xendit_client.list_payment_requests(['pr-1', 'pr-2'])
+
+    assert str(e.value.status) == '403'
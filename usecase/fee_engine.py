@@ -0,0 +1,192 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Dict, List, Optional, Tuple, Union
+
+from model.payment.payment_constants import (
+    DirectDebitChannels,
+    EWalletChannels,
+    PaymentMethod,
+)
+from model.transaction.transaction import (
+    GetTransactionDetailsIn,
+    GetTransactionDetailsOut,
+)
+from usecase.fee_schedule_registry import (
+    ChannelFees,
+    CompiledFeeSchedule,
+    FeeScheduleRegistry,
+)
+
+CENTAVO = Decimal('0.01')
+
+
+class FeeEngineError(ValueError):
+    pass
+
+
+def round_centavo(amount: Decimal) -> Decimal:
+    return amount.quantize(CENTAVO, rounding=ROUND_HALF_EVEN)
+
+
+def get_payment_method(payment_channel: Union[DirectDebitChannels, EWalletChannels, str]) -> PaymentMethod:
+    if payment_channel in EWalletChannels.__members__:
+        return PaymentMethod.E_WALLET
+
+    if payment_channel in DirectDebitChannels.__members__:
+        return PaymentMethod.DIRECT_DEBIT
+
+    raise FeeEngineError('Invalid payment channel was passed.')
+
+
+def get_channel_fees(
+    payment_method: Union[PaymentMethod, str],
+    payment_channel: Union[DirectDebitChannels, EWalletChannels, str],
+    fee_schedule: Optional[CompiledFeeSchedule] = None,
+) -> ChannelFees:
+    """
+    Get the fee coefficients of a payment method and channel
+
+    A channel without its own rule takes the default channel rule of its payment method, if any.
+
+    Arguments:
+        payment_method -- Payment method
+        payment_channel -- Payment channel of the payment method
+        fee_schedule -- Compiled fee schedule, defaults to the registry's schedule
+
+    Returns:
+        ChannelFees -- Fee coefficients of the channel
+    """
+    fee_schedule = fee_schedule or FeeScheduleRegistry.get_fee_schedule()
+    payment_method = getattr(payment_method, 'value', payment_method)
+    payment_channel = getattr(payment_channel, 'value', payment_channel)
+
+    channel_fees = fee_schedule.channel_fees.get((payment_method, payment_channel))
+    if channel_fees is None:
+        channel_fees = fee_schedule.default_channel_fees.get(payment_method)
+
+    if channel_fees is not None:
+        return channel_fees
+
+    if payment_method in fee_schedule.payment_methods:
+        raise FeeEngineError(f'Invalid payment channel was passed for {payment_method}.')
+
+    raise FeeEngineError('Invalid payment method was passed.')
+
+
+def solve_total_price(ticket_price: Decimal, channel_fees: ChannelFees) -> Decimal:
+    """
+    Solve P - fee(P) - fee(P) * vat = ticket_price for the total price P
+
+    The fee is either a percentage of P or, at or below the threshold, a flat default fee,
+    so the equation is linear and the compiled channel fees invert it directly.
+
+    Arguments:
+        ticket_price -- Ticket price including the platform fee
+        channel_fees -- Compiled fee coefficients of the payment channel
+
+    Returns:
+        Decimal -- Unrounded total price
+    """
+    if channel_fees.default_total_fee is not None and ticket_price <= channel_fees.min_ticket_price_for_default:
+        return ticket_price + channel_fees.default_total_fee
+
+    return ticket_price / channel_fees.fee_divisor
+
+
+def get_channel_total_price(
+    ticket_price: Decimal,
+    payment_method: Union[PaymentMethod, str],
+    payment_channel: Union[DirectDebitChannels, EWalletChannels, str],
+) -> Decimal:
+    """
+    Compute the unrounded total price for a payment method and channel
+
+    Arguments:
+        ticket_price -- Ticket price including the platform fee
+        payment_method -- Payment method
+        payment_channel -- Payment channel of the payment method
+
+    Returns:
+        Decimal -- Unrounded total price
+    """
+    return solve_total_price(ticket_price, get_channel_fees(payment_method, payment_channel))
+
+
+def _build_transaction_details(
+    get_transaction_details_in: GetTransactionDetailsIn, channel_fees: ChannelFees, fee_schedule_version: str
+) -> GetTransactionDetailsOut:
+    platform_percent = get_transaction_details_in.platform_fee or Decimal(0)  # resolve None to 0
+
+    initial_ticket_price = get_transaction_details_in.ticket_price
+    platform_fee = platform_percent * initial_ticket_price  # platform fee is a percent of ticket price
+    ticket_price = initial_ticket_price + platform_fee
+
+    total_price = solve_total_price(ticket_price, channel_fees)
+    transaction_fee = total_price - ticket_price
+
+    # remove key if 0
+    platform_fee = None if platform_fee <= 0 else round_centavo(platform_fee)
+
+    return GetTransactionDetailsOut(
+        ticket_price=round_centavo(initial_ticket_price),
+        total_price=round_centavo(total_price),
+        platform_fee=platform_fee,
+        transaction_fee=round_centavo(transaction_fee),
+        fee_schedule_version=fee_schedule_version,
+    )
+
+
+def compute_transaction_details(get_transaction_details_in: GetTransactionDetailsIn) -> GetTransactionDetailsOut:
+    """
+    Compute the total price and fees of a ticket purchase
+
+    Arguments:
+        get_transaction_details_in -- Ticket price, platform fee, payment method and channel
+
+    Returns:
+        GetTransactionDetailsOut -- Rounded ticket price, fees and total price
+    """
+    fee_schedule = FeeScheduleRegistry.get_fee_schedule()
+    channel_fees = get_channel_fees(
+        get_transaction_details_in.payment_method,
+        get_transaction_details_in.payment_channel,
+        fee_schedule,
+    )
+    return _build_transaction_details(get_transaction_details_in, channel_fees, fee_schedule.version)
+
+
+def compute_transaction_details_batch(
+    get_transaction_details_in_list: List[GetTransactionDetailsIn],
+) -> List[Union[GetTransactionDetailsOut, FeeEngineError]]:
+    """
+    Compute the total price and fees of many ticket purchases
+
+    The fee schedule is resolved once for the whole batch and the channel fees once per
+    distinct method and channel pair, so each item only solves its total price. An invalid
+    pair does not fail the batch; its error is returned in its place.
+
+    Arguments:
+        get_transaction_details_in_list -- Ticket prices, platform fees, payment methods and channels
+
+    Returns:
+        List[Union[GetTransactionDetailsOut, FeeEngineError]] -- Results in the order of the input
+    """
+    fee_schedule = FeeScheduleRegistry.get_fee_schedule()
+    channel_fees_by_pair: Dict[Tuple[str, str], Union[ChannelFees, FeeEngineError]] = {}
+    results = []
+    for get_transaction_details_in in get_transaction_details_in_list:
+        pair = (get_transaction_details_in.payment_method, get_transaction_details_in.payment_channel)
+        channel_fees = channel_fees_by_pair.get(pair)
+        if channel_fees is None:
+            try:
+                channel_fees = get_channel_fees(*pair, fee_schedule)
+            except FeeEngineError as e:
+                channel_fees = e
+
+            channel_fees_by_pair[pair] = channel_fees
+
+        if isinstance(channel_fees, FeeEngineError):
+            results.append(channel_fees)
+        else:
+            results.append(_build_transaction_details(get_transaction_details_in, channel_fees, fee_schedule.version))
+
+    return results
@@ -0,0 +1,128 @@
+import json
+import os
+from decimal import Decimal
+from threading import Lock
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from model.transaction.fee_schedule import ChannelFeeRule, FeeSchedule
+from utils.logger import logger
+
+DEFAULT_FEE_SCHEDULE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'constants', 'fee_schedule.json'
+)
+
+
+class FeeScheduleError(Exception):
+    pass
+
+
+class ChannelFees(NamedTuple):
+    # total price = ticket price / fee_divisor when the percentage fee applies
+    fee_divisor: Decimal
+
+    # total price = ticket price + default_total_fee at or below min_ticket_price_for_default
+    default_total_fee: Optional[Decimal] = None
+    min_ticket_price_for_default: Optional[Decimal] = None
+
+
+class CompiledFeeSchedule(NamedTuple):
+    version: str
+    payment_methods: FrozenSet[str]
+    channel_fees: Dict[Tuple[str, str], ChannelFees]
+
+    # coefficients of the channels of a payment method without their own rule
+    default_channel_fees: Dict[str, ChannelFees]
+
+
+def compile_fee_schedule(fee_schedule: FeeSchedule) -> CompiledFeeSchedule:
+    """
+    Compile a fee schedule into per payment method and channel coefficients
+
+    Arguments:
+        fee_schedule -- Fee schedule to compile
+
+    Returns:
+        CompiledFeeSchedule -- Coefficients keyed by (payment method, payment channel)
+    """
+    vat_multiplier = 1 + fee_schedule.vat
+
+    def compile_rule(rule: ChannelFeeRule, name: str) -> ChannelFees:
+        fee_divisor = 1 - rule.fee_percentage * vat_multiplier
+        if fee_divisor <= 0:
+            raise FeeScheduleError(f'Fee of {name} is not less than the price')
+
+        return ChannelFees(
+            fee_divisor=fee_divisor,
+            default_total_fee=None if rule.default_fee is None else rule.default_fee * vat_multiplier,
+            min_ticket_price_for_default=rule.min_ticket_price_for_default,
+        )
+
+    channel_fees = {}
+    for payment_method, channel_rules in fee_schedule.channels.items():
+        for payment_channel, rule in channel_rules.items():
+            channel_fees[(payment_method.value, payment_channel)] = compile_rule(
+                rule, f'{payment_method.value} {payment_channel}'
+            )
+
+    default_channel_fees = {
+        payment_method.value: compile_rule(rule, f'{payment_method.value} default channel')
+        for payment_method, rule in fee_schedule.default_channels.items()
+    }
+
+    return CompiledFeeSchedule(
+        version=fee_schedule.version,
+        payment_methods=frozenset(
+            payment_method.value for payment_method in {*fee_schedule.channels, *fee_schedule.default_channels}
+        ),
+        channel_fees=channel_fees,
+        default_channel_fees=default_channel_fees,
+    )
+
+
+def load_fee_schedule() -> FeeSchedule:
+    """
+    Load the fee schedule from the FEE_SCHEDULE environment variable (JSON), the file
+    at FEE_SCHEDULE_PATH, or the bundled constants/fee_schedule.json, in that order
+
+    Returns:
+        FeeSchedule -- Parsed fee schedule
+    """
+    fee_schedule_json = os.environ.get('FEE_SCHEDULE')
+    if fee_schedule_json:
+        source = 'FEE_SCHEDULE'
+    else:
+        source = os.environ.get('FEE_SCHEDULE_PATH') or DEFAULT_FEE_SCHEDULE_PATH
+        with open(source) as fee_schedule_file:
+            fee_schedule_json = fee_schedule_file.read()
+
+    try:
+        fee_schedule = FeeSchedule(**json.loads(fee_schedule_json, parse_float=Decimal))
+    except ValueError as e:
+        raise FeeScheduleError(f'Invalid fee schedule from {source}: {e}') from e
+
+    logger.info(f'Loaded fee schedule version {fee_schedule.version} from {source}')
+    return fee_schedule
+
+
+class FeeScheduleRegistry:
+    __compiled_fee_schedule: Optional[CompiledFeeSchedule] = None
+    __lock = Lock()
+
+    @classmethod
+    def get_fee_schedule(cls) -> CompiledFeeSchedule:
+        """Get the compiled fee schedule, loading it once per container"""
+        compiled_fee_schedule = cls.__compiled_fee_schedule
+        if compiled_fee_schedule is not None:
+            return compiled_fee_schedule
+
+        with cls.__lock:
+            if cls.__compiled_fee_schedule is None:
+                cls.__compiled_fee_schedule = compile_fee_schedule(load_fee_schedule())
+
+            return cls.__compiled_fee_schedule
+
+    @classmethod
+    def set_fee_schedule(cls, fee_schedule: Optional[FeeSchedule]) -> None:
+        """Replace the compiled fee schedule, or clear it so the next call reloads it"""
+        with cls.__lock:
+            cls.__compiled_fee_schedule = None if fee_schedule is None else compile_fee_schedule(fee_schedule)
@@ -0,0 +1,282 @@
+import os
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from external.payment_poll_schedule_store import PaymentPollScheduleStore, PollSchedule, get_payment_poll_schedule_store
+from model.payment.payment import PaymentTransactionOut
+from utils.logger import logger
+
+YOUNG_PAYMENT_INTERVAL_SECONDS = 60
+
+# pending payments whose schedules are read in one call, a DynamoDB BatchGetItem
+SCHEDULE_PAGE_SIZE = 100
+
+
+def _parse_created_at(created: Optional[str]) -> Optional[float]:
+    # Xendit timestamps are ISO 8601 in UTC, e.g. 2024-01-01T00:00:00.000Z
+    try:
+        return datetime.fromisoformat(str(created).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+class PaymentPollRun:
+    """
+    Schedule of the pending payments for one tracker run
+
+    due_payments yields the payments to check this run as the pending payments stream in:
+    they are read a page of page_size at a time, with the schedules of a page read in one
+    call, and the due payments of each page are yielded most urgent first, payments never
+    checked before the others by how long they have been due. Checks are recorded as the
+    results come in and written to the store a page at a time, the rest by save().
+
+    As the due payments are not yielded in entryId order, a run stopping part way resumes
+    after the last payment of the last page whose due payments were all handled; the
+    payments of the next pages that it checked are no longer due when it is read again.
+    """
+
+    def __init__(
+        self,
+        scheduler: 'PaymentPollScheduler',
+        started_at: float,
+        pending_payments: Iterable[PaymentTransactionOut],
+        page_size: int = SCHEDULE_PAGE_SIZE,
+    ):
+        self.__scheduler = scheduler
+        self.__started_at = started_at
+        self.__page_size = page_size
+        # schedules of the due payments whose check is not recorded yet
+        self.__schedules: Dict[str, Optional[PollSchedule]] = {}
+        self.__updated: Dict[str, PollSchedule] = {}
+        # last due payment of each page to the last pending payment of the page
+        self.__page_ends: Dict[str, str] = {}
+        self.due = 0
+        self.not_due = 0
+        self.due_payments: Iterator[PaymentTransactionOut] = self.__iter_due_payments(pending_payments)
+
+    def record_pending(self, payment: PaymentTransactionOut, created: Optional[str]) -> None:
+        """
+        Schedule the next check of a payment that is still pending
+
+        Arguments:
+            payment -- Payment transaction
+            created -- When its payment request was created on Xendit, as Xendit reports it
+        """
+        schedule = self.__schedules.pop(payment.entryId, None)
+        created_at = _parse_created_at(created)
+        if created_at is None:
+            # first seen by this run if Xendit does not say when it was created
+            created_at = schedule.created_at if schedule is not None else self.__started_at
+
+        checks = schedule.checks if schedule is not None else 0
+        self.__record(self.__scheduler.next_schedule(payment.entryId, created_at, checks, self.__started_at))
+
+    def record_resolved(self, payment: PaymentTransactionOut) -> None:
+        """
+        Hold off checking a payment whose status update was sent
+
+        It stays pending in the storage service until the update is applied, and is only
+        checked again, sending its update again, if it still is after backoff_base_seconds.
+
+        Arguments:
+            payment -- Payment transaction
+        """
+        schedule = self.__schedules.pop(payment.entryId, None)
+        self.__record(
+            self.__scheduler.resolved_schedule(
+                payment.entryId, schedule.created_at if schedule is not None else self.__started_at, self.__started_at
+            )
+        )
+
+    def resume_cursor_after(self, payments: List[PaymentTransactionOut], resume_cursor: Optional[str]) -> Optional[str]:
+        """
+        Get the resume cursor once payments are handled, in the order due_payments yielded them
+
+        Arguments:
+            payments -- Payments handled, following the ones handled before
+            resume_cursor -- Resume cursor before they were handled
+
+        Returns:
+            Optional[str] -- entryId up to which every due payment was handled
+        """
+        for payment in payments:
+            resume_cursor = self.__page_ends.pop(payment.entryId, resume_cursor)
+
+        return resume_cursor
+
+    def save(self) -> None:
+        """Write the schedules of the payments checked this run that are not written yet"""
+        updated, self.__updated = self.__updated, {}
+        try:
+            if updated:
+                self.__scheduler.store.put_many(list(updated.values()))
+
+        except Exception as e:
+            # the payments keep their old schedules and are checked again when those are due
+            logger.error(f'Failed to save the poll schedules of {len(updated)} payments: {str(e)}')
+
+    def __record(self, schedule: PollSchedule) -> None:
+        self.__updated[schedule.entry_id] = schedule
+        if len(self.__updated) >= self.__page_size:
+            self.save()
+
+    def __iter_due_payments(self, pending_payments: Iterable[PaymentTransactionOut]) -> Iterator[PaymentTransactionOut]:
+        page = []
+        for payment in pending_payments:
+            page.append(payment)
+            if len(page) >= self.__page_size:
+                yield from self.__due_payments_of(page)
+                page = []
+
+        if page:
+            yield from self.__due_payments_of(page)
+
+        logger.info(f'{self.due} of {self.due + self.not_due} pending payments were due')
+
+    def __due_payments_of(self, page: List[PaymentTransactionOut]) -> List[PaymentTransactionOut]:
+        try:
+            schedules = self.__scheduler.store.get_many([payment.entryId for payment in page])
+        except Exception as e:
+            logger.error(f'Failed to read the poll schedules, checking {len(page)} pending payments: {str(e)}')
+            schedules = {}
+
+        # next checks are scheduled from the start of the run, so the run after next is not skipped
+        due = [
+            payment
+            for payment in page
+            if payment.entryId not in schedules or schedules[payment.entryId].next_check_at <= self.__started_at
+        ]
+
+        def urgency(payment: PaymentTransactionOut) -> tuple:
+            schedule = schedules.get(payment.entryId)
+            return (0, 0.0) if schedule is None else (1, schedule.next_check_at)
+
+        due.sort(key=urgency)
+        self.__schedules.update((payment.entryId, schedules.get(payment.entryId)) for payment in due)
+        if due:
+            self.__page_ends[due[-1].entryId] = page[-1].entryId
+
+        self.due += len(due)
+        self.not_due += len(page) - len(due)
+        return due
+
+
+class PaymentPollScheduler:
+    """
+    Decides which pending payments the tracker checks on Xendit, and when
+
+    A payment younger than young_seconds, whose user may still be waiting on the return
+    URL, is checked on every run. After that the interval between checks starts at
+    backoff_base_seconds and doubles with every check, and is at least a quarter of the
+    payment's age, up to max_interval_seconds, so an abandoned payment is checked a few
+    times a day instead of on every run. Schedules
+    expire retention_seconds after they were due, once their payment is no longer pending.
+    """
+
+    def __init__(
+        self,
+        store: PaymentPollScheduleStore,
+        young_seconds: float = 3600,
+        backoff_base_seconds: float = 600,
+        max_interval_seconds: float = 6 * 3600,
+        retention_seconds: float = 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.__young_seconds = young_seconds
+        self.__backoff_base_seconds = backoff_base_seconds
+        self.__max_interval_seconds = max_interval_seconds
+        self.__retention_seconds = retention_seconds
+        self.__clock = clock
+
+    def start_run(self, pending_payments: Iterable[PaymentTransactionOut]) -> PaymentPollRun:
+        """
+        Start a run over the pending payments, yielding the ones that are due as they stream in
+
+        If the schedules of a page cannot be read every payment of the page is due, as
+        without a scheduler.
+
+        Arguments:
+            pending_payments -- Every pending payment, e.g. as it is downloaded
+
+        Returns:
+            PaymentPollRun -- Payments due this run and the schedule to record their checks in
+        """
+        return PaymentPollRun(self, self.__clock(), pending_payments)
+
+    def next_schedule(self, entry_id: str, created_at: float, checks: int, now: float) -> PollSchedule:
+        """
+        Schedule the next check of a pending payment
+
+        Arguments:
+            entry_id -- Payment transaction ID
+            created_at -- When its payment request was created
+            checks -- Checks made since the payment stopped being young
+            now -- Time of this check
+
+        Returns:
+            PollSchedule -- Schedule of the next check
+        """
+        if now - created_at < self.__young_seconds:
+            # due on the next scheduled run, not on a run resuming this one right away
+            next_check_at = now + YOUNG_PAYMENT_INTERVAL_SECONDS
+        else:
+            # a payment first seen when already old starts at a quarter of its age, not at the base interval
+            interval = max(self.__backoff_base_seconds * 2**checks, (now - created_at) / 4)
+            interval = min(self.__max_interval_seconds, interval)
+            next_check_at = now + interval
+            checks += 1
+
+        return PollSchedule(
+            entry_id=entry_id,
+            created_at=created_at,
+            next_check_at=next_check_at,
+            checks=checks,
+            expires_at=next_check_at + self.__retention_seconds,
+        )
+
+    def resolved_schedule(self, entry_id: str, created_at: float, now: float) -> PollSchedule:
+        """
+        Schedule a check of a resolved payment in case its status update is lost
+
+        Arguments:
+            entry_id -- Payment transaction ID
+            created_at -- When its payment request was created
+            now -- Time of this check
+
+        Returns:
+            PollSchedule -- Schedule of the check
+        """
+        next_check_at = now + self.__backoff_base_seconds
+        return PollSchedule(
+            entry_id=entry_id,
+            created_at=created_at,
+            next_check_at=next_check_at,
+            checks=0,
+            expires_at=next_check_at + self.__retention_seconds,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_payment_poll_scheduler() -> Optional[PaymentPollScheduler]:
+    """
+    Get the poll scheduler of this container, configured from the environment
+
+    Configured by PAYMENT_POLL_YOUNG_SECONDS, PAYMENT_POLL_BACKOFF_BASE_SECONDS and
+    PAYMENT_POLL_MAX_INTERVAL_SECONDS, with its store selected by PAYMENT_POLL_SCHEDULE.
+
+    Returns:
+        Optional[PaymentPollScheduler] -- Scheduler, or None if every pending payment is checked on every run
+    """
+    store = get_payment_poll_schedule_store()
+    if store is None:
+        return None
+
+    return PaymentPollScheduler(
+        store,
+        young_seconds=float(os.environ.get('PAYMENT_POLL_YOUNG_SECONDS', 3600)),
+        backoff_base_seconds=float(os.environ.get('PAYMENT_POLL_BACKOFF_BASE_SECONDS', 600)),
+        max_interval_seconds=float(os.environ.get('PAYMENT_POLL_MAX_INTERVAL_SECONDS', 6 * 3600)),
+    )
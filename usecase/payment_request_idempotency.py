@@ -0,0 +1,228 @@
+import asyncio
+import os
+from functools import lru_cache
+from hashlib import sha256
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from external.idempotency_store import COMPLETED, RELEASED, IdempotencyStore, get_idempotency_store
+from model.payment.payment import PaymentRequestOut
+from model.payment.payment_constants import PaymentMethod
+from utils.logger import logger
+
+
+class IdempotencyConflictError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def build_idempotency_key(
+    payment_method: PaymentMethod, in_data: BaseModel, client_idempotency_key: str
+) -> Tuple[str, str]:
+    """
+    Build the idempotency key and request fingerprint of a payment request
+
+    The client supplied key is scoped to the payment method, so the same key sent to the
+    direct debit and e-wallet endpoints names two requests.
+
+    Arguments:
+        payment_method -- Payment method of the endpoint
+        in_data -- Payment request body
+        client_idempotency_key -- Idempotency-Key header sent by the client
+
+    Returns:
+        Tuple[str, str] -- Idempotency key, request fingerprint
+    """
+    fingerprint = sha256(in_data.json(sort_keys=True).encode()).hexdigest()
+    return f'{payment_method.value}:{client_idempotency_key}', fingerprint
+
+
+class PaymentRequestAttempt:
+    """
+    One run of a payment request under an idempotency key
+
+    payment_transaction_id is the payment transaction created for the key, by an earlier
+    run that failed or, once it is set, by this run. The Xendit idempotency key includes
+    it, so the key is only sent again with the same payment transaction, i.e. the same body.
+    """
+
+    def __init__(self, key: str, payment_transaction_id: Optional[str] = None):
+        self.key = key
+        self.payment_transaction_id = payment_transaction_id
+
+    @property
+    def xendit_idempotency_key(self) -> str:
+        return f'{self.key}:{self.payment_transaction_id}'
+
+
+class IdempotencyGuard:
+    """
+    Runs each payment request once per idempotency key
+
+    The first request with a key claims it in the store and runs; its PaymentRequestOut is
+    stored for ttl_seconds and returned to every duplicate without calling storage or
+    Xendit again. Duplicates that arrive while it runs wait for it: in the same container
+    they share its result directly, across containers they poll the store for up to
+    wait_seconds. Errors are not stored, so a retry after a failure runs again; if the
+    failed run created a payment transaction, the retry reuses it.
+    """
+
+    def __init__(
+        self,
+        idempotency_store: IdempotencyStore,
+        ttl_seconds: float = 900,
+        in_progress_ttl_seconds: float = 60,
+        wait_seconds: float = 10,
+        poll_interval_seconds: float = 0.1,
+    ):
+        self.__idempotency_store = idempotency_store
+        self.__ttl_seconds = ttl_seconds
+        self.__in_progress_ttl_seconds = in_progress_ttl_seconds
+        self.__wait_seconds = wait_seconds
+        self.__poll_interval_seconds = poll_interval_seconds
+        self.__in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        create_payment_request: Callable[[Optional[PaymentRequestAttempt]], Awaitable[PaymentRequestOut]],
+    ) -> Union[PaymentRequestOut, object]:
+        """
+        Create a payment request, or return the result of the request that used the key before
+
+        Arguments:
+            key -- Idempotency key
+            fingerprint -- Fingerprint of the request body
+            create_payment_request -- Creates the payment request when the key is new, given its attempt, or
+                None if the store is unavailable and the request is not deduplicated
+
+        Returns:
+            Union[PaymentRequestOut, object] -- Payment request details, or the error response of the request
+
+        Raises:
+            IdempotencyConflictError -- If the key was used with another request, or is still in progress
+        """
+        in_flight = self.__in_flight.get(key)
+        if in_flight is not None:
+            in_flight_fingerprint, future = in_flight
+            self.__check_fingerprint(key, in_flight_fingerprint, fingerprint)
+            logger.info(f'Waiting on the payment request in flight for idempotency key {key}')
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__in_flight[key] = (fingerprint, future)
+        try:
+            result = await self.__run(key, fingerprint, create_payment_request)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self.__in_flight.pop(key, None)
+
+    async def __run(
+        self,
+        key: str,
+        fingerprint: str,
+        create_payment_request: Callable[[Optional[PaymentRequestAttempt]], Awaitable[PaymentRequestOut]],
+    ):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.__wait_seconds
+        attempt = PaymentRequestAttempt(key)
+        while True:
+            try:
+                record = await loop.run_in_executor(
+                    None, self.__idempotency_store.begin, key, fingerprint, self.__in_progress_ttl_seconds
+                )
+            except Exception as e:
+                logger.error(f'Idempotency store is unavailable, creating the payment request without it: {str(e)}')
+                return await create_payment_request(None)
+
+            if record is None:
+                break
+
+            self.__check_fingerprint(key, record.fingerprint, fingerprint)
+            if record.status == COMPLETED:
+                logger.info(f'Replaying the payment request of idempotency key {key}')
+                return PaymentRequestOut.parse_raw(record.response)
+
+            if record.status == RELEASED:
+                resumed = await loop.run_in_executor(
+                    None, self.__idempotency_store.resume, key, fingerprint, self.__in_progress_ttl_seconds
+                )
+                if resumed:
+                    logger.info(
+                        f'Retrying idempotency key {key} with payment transaction {record.payment_transaction_id}'
+                    )
+                    attempt.payment_transaction_id = record.payment_transaction_id
+                    break
+
+                # resumed by another request meanwhile, wait for it
+                continue
+
+            if loop.time() >= deadline:
+                raise IdempotencyConflictError(
+                    HTTPStatus.CONFLICT, 'A payment request with this idempotency key is still in progress'
+                )
+
+            await asyncio.sleep(self.__poll_interval_seconds)
+
+        try:
+            result = await create_payment_request(attempt)
+        except BaseException:
+            await self.__release(attempt)
+            raise
+
+        try:
+            if isinstance(result, PaymentRequestOut):
+                await loop.run_in_executor(
+                    None, self.__idempotency_store.complete, key, result.json(), self.__ttl_seconds
+                )
+            else:
+                await self.__release(attempt)
+
+        except Exception as e:
+            logger.error(f'Failed to record the result of idempotency key {key}: {str(e)}')
+
+        return result
+
+    async def __release(self, attempt: PaymentRequestAttempt) -> None:
+        # the payment transaction is kept so a retry sends Xendit the same request under the same key
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.__idempotency_store.release, attempt.key, attempt.payment_transaction_id, self.__ttl_seconds
+        )
+
+    @staticmethod
+    def __check_fingerprint(key: str, stored_fingerprint: str, fingerprint: str) -> None:
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflictError(
+                HTTPStatus.UNPROCESSABLE_ENTITY,
+                f'Idempotency key {key.split(":", 1)[-1]} was already used with a different request',
+            )
+
+
+@lru_cache(maxsize=None)
+def get_idempotency_guard() -> Optional[IdempotencyGuard]:
+    """
+    Get the idempotency guard of this container, configured from the environment
+
+    Returns:
+        Optional[IdempotencyGuard] -- Guard, or None if payment requests are not deduplicated
+    """
+    idempotency_store = get_idempotency_store()
+    if idempotency_store is None:
+        return None
+
+    return IdempotencyGuard(
+        idempotency_store,
+        ttl_seconds=float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 900)),
+        wait_seconds=float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10)),
+    )
@@ -0,0 +1,355 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http import HTTPStatus
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from external.payment_poll_schedule_store import DynamoDbPaymentPollScheduleStore, get_payment_poll_schedule_store
+from external.payment_status_ledger import DynamoDbPaymentStatusLedger, get_payment_status_ledger
+from external.payment_storage_gateway import PaymentStorageGateway
+from model.payment.payment import PaymentTransactionOut
+from model.payment.payment_constants import PaymentShardKey, PaymentTrackingDispatchMode
+from usecase.payment_tracking_usecase import PaymentShard, PaymentTrackingUsecase, TrackingSummary
+from utils.logger import logger
+
+# Time a coordinator keeps for itself to collect and aggregate the summaries of its workers
+COORDINATOR_MARGIN_MILLIS = 2000
+
+# Payments sent to a worker per invocation, keeping the payload under the 6 MB Lambda allows
+WORKER_MAX_PAYMENTS = 2000
+
+# Workers tracking at a time, each on a thread of the coordinator
+WORKER_MAX_CONCURRENCY = 64
+
+
+class ShardPart(NamedTuple):
+    shard: PaymentShard
+    payments: List[PaymentTransactionOut]
+
+
+class ShardedTrackingSummary(NamedTuple):
+    shard_count: int
+    failed_shards: List[int]
+    total: TrackingSummary
+
+
+def aggregate_tracking_summaries(summaries: List[TrackingSummary], wall_seconds: float) -> TrackingSummary:
+    """
+    Add up the summaries of the shards of a run
+
+    Arguments:
+        summaries -- Summaries of the shards that completed
+        wall_seconds -- Wall time of the whole run
+
+    Returns:
+        TrackingSummary -- Outcome counts of the run; shards stop early and resume on their own, so it has no cursor
+    """
+    counts = {
+        field: sum(getattr(summary, field) for summary in summaries)
+        for field in TrackingSummary._fields
+        if field not in ('stopped_early', 'resume_cursor', 'wall_seconds')
+    }
+    return TrackingSummary(
+        **counts,
+        stopped_early=any(summary.stopped_early for summary in summaries),
+        resume_cursor=None,
+        wall_seconds=wall_seconds,
+    )
+
+
+def iter_shard_parts(
+    pending_payments: Iterable[PaymentTransactionOut], shards: List[PaymentShard], max_payments: int
+) -> Iterator[ShardPart]:
+    """
+    Assign the pending payments to their shards as they are read, in parts of up to max_payments
+
+    A part is yielded as soon as its shard has max_payments, so it can be tracked while the
+    rest of the backlog is still being downloaded and at most max_payments per shard are
+    held at a time. Once the backlog is read, the remaining payments of every shard are
+    yielded, an empty part for a shard that has none so every shard is tracked.
+
+    Arguments:
+        pending_payments -- Pending payments, in the order they are tracked in
+        shards -- Every shard of a run
+        max_payments -- Payments per part
+
+    Returns:
+        Iterator[ShardPart] -- Parts of the shards, each in the order its payments were read
+    """
+    shard_payments: List[List[PaymentTransactionOut]] = [[] for _ in shards]
+    parts_yielded = [0 for _ in shards]
+    for payment in pending_payments:
+        index = shards[0].index_of(payment)
+        shard_payments[index].append(payment)
+        if len(shard_payments[index]) >= max_payments:
+            yield ShardPart(shards[index], shard_payments[index])
+            shard_payments[index] = []
+            parts_yielded[index] += 1
+
+    for shard, payments, parts in zip(shards, shard_payments, parts_yielded):
+        if payments or not parts:
+            yield ShardPart(shard, payments)
+
+
+def aggregate_shard_summaries(
+    shards: List[PaymentShard], part_summaries: List[Tuple[PaymentShard, Optional[TrackingSummary]]]
+) -> List[Optional[TrackingSummary]]:
+    """
+    Add up the summaries of the parts of each shard
+
+    Arguments:
+        shards -- Every shard of a run
+        part_summaries -- Shard and summary of each part tracked, None for a part whose worker failed
+
+    Returns:
+        List[Optional[TrackingSummary]] -- Summary of each shard in the order of the shards, None if any of its parts failed
+    """
+    summaries = []
+    for shard in shards:
+        summaries_of_shard = [summary for part_shard, summary in part_summaries if part_shard == shard]
+        if not summaries_of_shard or None in summaries_of_shard:
+            summaries.append(None)
+        else:
+            summaries.append(
+                aggregate_tracking_summaries(
+                    summaries_of_shard, max(summary.wall_seconds for summary in summaries_of_shard)
+                )
+            )
+
+    return summaries
+
+
+class PaymentTrackingDispatcher(ABC):
+    """
+    Runs the parts of the shards of a tracker run in parallel and collects their summaries
+
+    dispatch() gets the parts as the coordinator reads the backlog, and should start
+    tracking each one as it arrives. It returns the shard and summary of each part, or None
+    for a part whose worker failed.
+    """
+
+    @abstractmethod
+    def dispatch(
+        self,
+        shard_parts: Iterable[ShardPart],
+        remaining_time_millis: Optional[Callable[[], int]],
+    ) -> List[Tuple[PaymentShard, Optional[TrackingSummary]]]:
+        pass
+
+
+class LocalPaymentTrackingDispatcher(PaymentTrackingDispatcher):
+    """Tracks every part on a thread of this process, e.g. to test the coordinator without AWS"""
+
+    def __init__(self, usecase_factory: Callable[[], PaymentTrackingUsecase] = PaymentTrackingUsecase):
+        self.__usecase_factory = usecase_factory
+
+    def dispatch(
+        self,
+        shard_parts: Iterable[ShardPart],
+        remaining_time_millis: Optional[Callable[[], int]],
+    ) -> List[Tuple[PaymentShard, Optional[TrackingSummary]]]:
+        def track(shard_part: ShardPart) -> Optional[TrackingSummary]:
+            shard, payments = shard_part
+            try:
+                return self.__usecase_factory().track_pending_payments(
+                    remaining_time_millis, shard=shard, pending_payments=payments
+                )
+            except Exception as e:
+                logger.error(f'Failed to track shard {shard.index} of {shard.count}: {str(e)}')
+                return None
+
+        with ThreadPoolExecutor(
+            max_workers=WORKER_MAX_CONCURRENCY, thread_name_prefix='payment-tracker-shard'
+        ) as executor:
+            futures = [(shard_part.shard, executor.submit(track, shard_part)) for shard_part in shard_parts]
+            return [(shard, future.result()) for shard, future in futures]
+
+
+class LambdaPaymentTrackingDispatcher(PaymentTrackingDispatcher):
+    """
+    Tracks every part of a shard in its own invocation of the tracker Lambda function
+
+    Workers are invoked synchronously, up to WORKER_MAX_CONCURRENCY at a time, and return
+    their summary in their response. A worker gets the payments of its part in its event,
+    and the time this invocation has left when it is invoked, less COORDINATOR_MARGIN_MILLIS,
+    so it stops before the coordinator times out.
+    """
+
+    def __init__(self, function_name: str, lambda_client=None):
+        self.__function_name = function_name
+        self.__lambda_client = lambda_client
+
+    def dispatch(
+        self,
+        shard_parts: Iterable[ShardPart],
+        remaining_time_millis: Optional[Callable[[], int]],
+    ) -> List[Tuple[PaymentShard, Optional[TrackingSummary]]]:
+        lambda_client = self.__get_lambda_client()
+
+        def invoke(shard_part: ShardPart) -> Optional[TrackingSummary]:
+            shard, payments = shard_part
+            payload = {
+                'shard': shard.index,
+                'shardCount': shard.count,
+                'shardKey': shard.key.value,
+                'payments': [json.loads(payment.json(exclude_none=True)) for payment in payments],
+            }
+            if remaining_time_millis is not None:
+                payload['timeBudgetMillis'] = max(0, remaining_time_millis() - COORDINATOR_MARGIN_MILLIS)
+
+            try:
+                response = lambda_client.invoke(
+                    FunctionName=self.__function_name,
+                    InvocationType='RequestResponse',
+                    Payload=json.dumps(payload),
+                )
+                result = json.loads(response['Payload'].read())
+                if response.get('FunctionError') or not result.get('summary'):
+                    logger.error(f'Shard {shard.index} of {shard.count} failed: {result}')
+                    return None
+
+                return TrackingSummary(**result['summary'])
+
+            except Exception as e:
+                logger.error(f'Failed to invoke the worker of shard {shard.index} of {shard.count}: {str(e)}')
+                return None
+
+        with ThreadPoolExecutor(
+            max_workers=WORKER_MAX_CONCURRENCY, thread_name_prefix='payment-tracker-shard'
+        ) as executor:
+            futures = [(shard_part.shard, executor.submit(invoke, shard_part)) for shard_part in shard_parts]
+            return [(shard, future.result()) for shard, future in futures]
+
+    def __get_lambda_client(self):
+        if self.__lambda_client is None:
+            import boto3
+            from botocore.config import Config
+
+            # a worker may take the whole timeout of the function to respond
+            self.__lambda_client = boto3.client(
+                'lambda',
+                config=Config(
+                    read_timeout=900, retries={'max_attempts': 0}, max_pool_connections=WORKER_MAX_CONCURRENCY
+                ),
+            )
+
+        return self.__lambda_client
+
+
+class PaymentTrackingCoordinator:
+    """
+    Splits a tracker run into shards of the pending payments, tracked by parallel workers
+
+    Payments are assigned to shard_count shards by a stable hash of their entryId, or of
+    their eventId to keep the payments of an event together. The coordinator downloads
+    the pending payments once, assigning each to its shard as it is read, sends each
+    worker a part of up to WORKER_MAX_PAYMENTS payments of its shard as soon as the part
+    is full, and adds up their summaries.
+    """
+
+    def __init__(
+        self,
+        dispatcher: PaymentTrackingDispatcher,
+        shard_count: int,
+        shard_key: PaymentShardKey = PaymentShardKey.ENTRY_ID,
+        payment_storage_gateway: Optional[PaymentStorageGateway] = None,
+    ):
+        self.__dispatcher = dispatcher
+        self.__shard_count = shard_count
+        self.__shard_key = shard_key
+        self.__payment_storage_gateway = payment_storage_gateway or PaymentStorageGateway()
+
+    def track_pending_payments(
+        self, remaining_time_millis: Optional[Callable[[], int]] = None
+    ) -> ShardedTrackingSummary:
+        """
+        Track the pending payments shard by shard in parallel
+
+        Arguments:
+            remaining_time_millis -- Time left before the invocation times out, e.g. context.get_remaining_time_in_millis
+
+        Returns:
+            ShardedTrackingSummary -- Shards that failed, and the outcome counts of the ones that completed
+        """
+        started_at = time.perf_counter()
+        shards = [PaymentShard(index, self.__shard_count, self.__shard_key) for index in range(self.__shard_count)]
+        status, pending_payments, error_message = self.__payment_storage_gateway.iter_pending_payment_transactions()
+        if status != HTTPStatus.OK:
+            logger.error(f'Failed to get pending payments: {error_message}')
+            return ShardedTrackingSummary(
+                shard_count=self.__shard_count,
+                failed_shards=[shard.index for shard in shards],
+                total=aggregate_tracking_summaries([], time.perf_counter() - started_at),
+            )
+
+        part_summaries = self.__dispatcher.dispatch(
+            iter_shard_parts(pending_payments, shards, WORKER_MAX_PAYMENTS), remaining_time_millis
+        )
+        summaries = aggregate_shard_summaries(shards, part_summaries)
+        for shard, summary in zip(shards, summaries):
+            logger.info(f'Shard {shard.index} of {shard.count}: {summary._asdict() if summary else "failed"}')
+
+        sharded_tracking_summary = ShardedTrackingSummary(
+            shard_count=self.__shard_count,
+            failed_shards=[shard.index for shard, summary in zip(shards, summaries) if summary is None],
+            total=aggregate_tracking_summaries(
+                [summary for summary in summaries if summary is not None], time.perf_counter() - started_at
+            ),
+        )
+        logger.info(f'Sharded payment tracking summary: {sharded_tracking_summary._asdict()}')
+        return sharded_tracking_summary
+
+
+@lru_cache(maxsize=None)
+def get_payment_tracking_coordinator(function_name: Optional[str]) -> Optional[PaymentTrackingCoordinator]:
+    """
+    Get the tracker coordinator of this container, configured from the environment
+
+    PAYMENT_TRACKER_SHARDS sets the number of shards, PAYMENT_TRACKER_SHARD_KEY hashes
+    ENTRY_ID or EVENT_ID, and PAYMENT_TRACKER_DISPATCH runs the shards in LAMBDA
+    invocations of function_name or on LOCAL threads; without a function name, e.g. in a
+    local run, the shards run on LOCAL threads.
+
+    Workers run in separate containers, so the poll schedule and the status ledger must be
+    the DYNAMODB ones every worker shares, or NONE.
+
+    Arguments:
+        function_name -- Name of the tracker Lambda function, which runs the workers, if running in Lambda
+
+    Returns:
+        Optional[PaymentTrackingCoordinator] -- Coordinator, or None if runs are not sharded
+
+    Raises:
+        ValueError -- Runs are sharded with a poll schedule or status ledger local to a container
+    """
+    shard_count = int(os.environ.get('PAYMENT_TRACKER_SHARDS', 1))
+    if shard_count <= 1:
+        return None
+
+    payment_poll_schedule_store = get_payment_poll_schedule_store()
+    if payment_poll_schedule_store is not None and not isinstance(
+        payment_poll_schedule_store, DynamoDbPaymentPollScheduleStore
+    ):
+        raise ValueError('Sharded payment tracking needs PAYMENT_POLL_SCHEDULE=DYNAMODB or NONE')
+
+    payment_status_ledger = get_payment_status_ledger()
+    if payment_status_ledger is not None and not isinstance(payment_status_ledger, DynamoDbPaymentStatusLedger):
+        raise ValueError('Sharded payment tracking needs PAYMENT_STATUS_LEDGER=DYNAMODB or NONE')
+
+    shard_key = PaymentShardKey(os.environ.get('PAYMENT_TRACKER_SHARD_KEY', PaymentShardKey.ENTRY_ID.value).upper())
+    mode = PaymentTrackingDispatchMode(
+        os.environ.get('PAYMENT_TRACKER_DISPATCH', PaymentTrackingDispatchMode.LAMBDA.value).upper()
+    )
+    if mode == PaymentTrackingDispatchMode.LAMBDA and function_name is None:
+        logger.warning('No Lambda function to invoke the shard workers of, tracking them on local threads')
+        mode = PaymentTrackingDispatchMode.LOCAL
+
+    if mode == PaymentTrackingDispatchMode.LOCAL:
+        dispatcher = LocalPaymentTrackingDispatcher()
+    else:
+        dispatcher = LambdaPaymentTrackingDispatcher(function_name)
+
+    return PaymentTrackingCoordinator(dispatcher, shard_count, shard_key)
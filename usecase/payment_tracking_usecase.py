@@ -1,89 +1,479 @@
-import json
+import hashlib
 import os
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from http import HTTPStatus
-from uuid import uuid4
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 import boto3
+from xendit.payment_request.model import PaymentRequest
 
+from external.metrics_emitter import (
+    UNIT_MILLISECONDS,
+    UNIT_SECONDS,
+    Metric,
+    MetricsEmitter,
+    get_metrics_emitter,
+    percentile,
+)
+from external.payment_status_ledger import (
+    DEFAULT_STATUS_LEDGER_RETENTION_SECONDS,
+    PaymentStatusLedger,
+    get_payment_status_ledger,
+)
+from external.payment_status_publisher import PaymentStatusPublisher
 from external.payment_storage_gateway import PaymentStorageGateway
 from model.payment.payment import PaymentTransactionOut, TransactionStatus
-from model.payment.payment_constants import PaymentRequestConstants
-from usecase.payment_usecase import PaymentUsecase
+from model.payment.payment_constants import PaymentRequestConstants, PaymentShardKey
+from usecase.payment_poll_scheduler import PaymentPollScheduler, get_payment_poll_scheduler
+from usecase.payment_usecase import XenditCall, get_payment_usecase
+from utils.http_session import get_http_session_stats
 from utils.logger import logger
 
+# outcomes whose status update is sent to SQS
+RESOLVED_OUTCOMES = {'succeeded': TransactionStatus.SUCCESS, 'failed': TransactionStatus.FAILED}
 
-class PaymentTrackingUsecase:
-    def __init__(self):
-        self.payment_storage_gateway = PaymentStorageGateway()
-        self.payment_usecase = PaymentUsecase()
-        self.queue_url = os.environ.get('SQS_QUEUE_URL')
-        self.sqs_client = boto3.client('sqs')
+TRACKING_METRICS_SERVICE = 'PaymentTracker'
+LATENCY_PERCENTILES = (50, 95, 99)
 
-    def _send_payment_status_update_to_queue(self, payment: PaymentTransactionOut, status: TransactionStatus):
-        """Send payment status update message to SQS queue"""
-        try:
-            logger.info(f'Sending payment status update to SQS: Transaction Status {status} for Payment {payment}')
-
-            message_body = {
-                'registration_details': payment.dict(),
-                'status': status.value,
-            }
-
-            response = self.sqs_client.send_message(
-                QueueUrl=self.queue_url,
-                MessageBody=json.dumps(message_body),
-                MessageGroupId=f'payment-{payment.entryId}',
-                MessageDeduplicationId=f'payment-{payment.entryId}-{uuid4()}',
+
+class TrackingSummary(NamedTuple):
+    checked: int
+    not_due: int
+    still_pending: int
+    succeeded: int
+    failed: int
+    unknown_status: int
+    lookup_errors: int
+    missing_payment_request_id: int
+    xendit_calls: int
+    throttle_wait_seconds: float
+    status_updates_sent: int
+    status_updates_skipped: int
+    queue_errors: int
+    sqs_calls: int
+    retries: int
+    stopped_early: bool
+    resume_cursor: Optional[str]
+    wall_seconds: float
+
+
+def shard_index(key: str, shard_count: int) -> int:
+    """
+    Get the shard of a key, the same in every process unlike hash()
+
+    Arguments:
+        key -- Shard key, e.g. an entryId
+        shard_count -- Number of shards
+
+    Returns:
+        int -- Shard index, from 0 to shard_count - 1
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def tracking_metrics(
+    tracking_summary: TrackingSummary,
+    xendit_call_seconds: List[float],
+    sqs_call_seconds: List[float],
+    retries: Dict[str, int],
+) -> List[Metric]:
+    """
+    Get the metrics of a tracker run
+
+    PaymentsScanned counts every pending payment read, StillPending the backlog left after
+    the run, and the latencies are percentiles of the calls that reached Xendit and SQS.
+
+    Arguments:
+        tracking_summary -- Summary of the run
+        xendit_call_seconds -- Latency of every call that reached Xendit
+        sqs_call_seconds -- Latency of every SQS call
+        retries -- Retries made by dependency, e.g. {'Xendit': 2}
+
+    Returns:
+        List[Metric] -- Metrics of the run
+    """
+    metrics = [
+        Metric(
+            'PaymentsScanned',
+            tracking_summary.checked + tracking_summary.not_due + tracking_summary.missing_payment_request_id,
+        ),
+        Metric('PaymentsChecked', tracking_summary.checked),
+        Metric('PaymentsNotDue', tracking_summary.not_due),
+        Metric('StillPending', tracking_summary.still_pending),
+        Metric('Succeeded', tracking_summary.succeeded),
+        Metric('Failed', tracking_summary.failed),
+        Metric('UnknownStatus', tracking_summary.unknown_status),
+        Metric('LookupErrors', tracking_summary.lookup_errors),
+        Metric('MissingPaymentRequestId', tracking_summary.missing_payment_request_id),
+        Metric('XenditCalls', tracking_summary.xendit_calls),
+        Metric('XenditThrottleWait', tracking_summary.throttle_wait_seconds, UNIT_SECONDS),
+        Metric('StatusUpdatesSent', tracking_summary.status_updates_sent),
+        Metric('StatusUpdatesSkipped', tracking_summary.status_updates_skipped),
+        Metric('QueueErrors', tracking_summary.queue_errors),
+        Metric('SqsCalls', tracking_summary.sqs_calls),
+        Metric('Retries', tracking_summary.retries),
+        Metric('StoppedEarly', int(tracking_summary.stopped_early)),
+        Metric('WallTime', tracking_summary.wall_seconds, UNIT_SECONDS),
+    ]
+    metrics.extend(Metric(f'{dependency}Retries', count) for dependency, count in retries.items())
+    for name, call_seconds in (('XenditLatency', xendit_call_seconds), ('SqsLatency', sqs_call_seconds)):
+        # a run without calls has no latency rather than one of 0
+        if call_seconds:
+            metrics.extend(
+                Metric(f'{name}P{percent}', percentile(call_seconds, percent) * 1000, UNIT_MILLISECONDS)
+                for percent in LATENCY_PERCENTILES
             )
 
-            logger.info(f'Successfully sent message to SQS: {response["MessageId"]}')
-            return True
+    return metrics
 
-        except Exception as e:
-            logger.error(f'Failed to send message to SQS: {str(e)}')
-            return False
 
-    def track_pending_payments(self):
+def take_through_entry_id(
+    pending_payments: Iterable[PaymentTransactionOut], last_entry_id: str
+) -> Iterator[PaymentTransactionOut]:
+    """Yield the pending payments up to and including the one with last_entry_id, or all of them if it is not there"""
+    for payment in pending_payments:
+        yield payment
+        if payment.entryId == last_entry_id:
+            return
+
+
+class PaymentShard(NamedTuple):
+    index: int
+    count: int
+    key: PaymentShardKey = PaymentShardKey.ENTRY_ID
+
+    def contains(self, payment: PaymentTransactionOut) -> bool:
+        return self.index_of(payment) == self.index
+
+    def index_of(self, payment: PaymentTransactionOut) -> int:
+        """Get the index of the shard of a payment, among the count shards of a run"""
+        key = payment.entryId if self.key == PaymentShardKey.ENTRY_ID else payment.eventId or ''
+        return shard_index(key, self.count)
+
+
+class PaymentTrackingUsecase:
+    def __init__(
+        self,
+        sqs_client=None,
+        concurrency: Optional[int] = None,
+        lookup_batch_size: Optional[int] = None,
+        payment_poll_scheduler: Optional[PaymentPollScheduler] = None,
+        payment_status_ledger: Optional[PaymentStatusLedger] = None,
+        metrics_emitter: Optional[MetricsEmitter] = None,
+    ):
+        self.payment_storage_gateway = PaymentStorageGateway()
+        self.payment_usecase = get_payment_usecase()
+        self.queue_url = os.environ.get('SQS_QUEUE_URL')
+        self.sqs_client = sqs_client or boto3.client('sqs')
+        self.concurrency = concurrency or int(os.environ.get('PAYMENT_TRACKER_CONCURRENCY', 16))
+        self.lookup_batch_size = lookup_batch_size or int(os.environ.get('PAYMENT_TRACKER_LOOKUP_BATCH_SIZE', 50))
+        self.payment_poll_scheduler = payment_poll_scheduler or get_payment_poll_scheduler()
+        self.safety_margin_ms = int(os.environ.get('PAYMENT_TRACKER_SAFETY_MARGIN_MS', 5000))
+        self.payment_status_ledger = payment_status_ledger or get_payment_status_ledger()
+        self.status_ledger_retention_seconds = float(
+            os.environ.get('PAYMENT_STATUS_LEDGER_RETENTION_SECONDS', DEFAULT_STATUS_LEDGER_RETENTION_SECONDS)
+        )
+        self.metrics_emitter = metrics_emitter or get_metrics_emitter()
+
+    def track_pending_payments(
+        self,
+        remaining_time_millis: Optional[Callable[[], int]] = None,
+        resume_cursor: Optional[str] = None,
+        shard: Optional[PaymentShard] = None,
+        pending_payments: Optional[List[PaymentTransactionOut]] = None,
+        last_entry_id: Optional[str] = None,
+    ) -> Optional[TrackingSummary]:
         """
         Track pending payments and send status updates to SQS queue
 
+        Payment requests are looked up on Xendit in batches of `lookup_batch_size`, each
+        listed in one call with only the IDs missing from the list got one by one. Batches
+        are looked up by up to `concurrency` threads while the pending payments are still
+        being downloaded, and each result is handled on this thread as soon as it completes.
+        Every payment is looked up and handled exactly once, so the summary and the status
+        updates sent do not depend on the order the lookups complete in; with a concurrency
+        and a batch size of 1 the run is the sequential one with a call per payment.
+
+        With a poll scheduler only the payments that are due are checked, most urgent first
+        within each page of pending payments as it is downloaded; see PaymentPollScheduler.
+
+        Once the remaining time falls to `safety_margin_ms` no more lookups are started, and
+        the lookups in flight get half of the margin to complete. The run then stops early:
+        the payments not handled are left to the next run. The summary holds the resume
+        cursor to pass to it, the entryId up to which every payment was handled; with a poll
+        scheduler, up to which every due payment was, see PaymentPollRun.resume_cursor_after.
+
+        Status updates are sent to SQS in batches of up to 10, and the last batch is sent
+        before returning, even if the run stopped early. With a status ledger a payment's
+        status is not sent again while the ledger holds it, e.g. on every run until the
+        storage service stops listing the payment as pending.
+
+        With a shard only the pending payments of that shard are tracked, so that workers
+        tracking the other shards can run in parallel. A worker is usually given a part of the
+        pending payments of its shard instead of downloading them; when it resumes, it
+        downloads them again after the cursor, up to the last payment of its part, so it does
+        not track the payments of the parts after it. See PaymentTrackingCoordinator.
+
+        With a metrics emitter the run's counts, the latency percentiles of its Xendit and
+        SQS calls, its retries and its wall time are emitted as one Embedded Metric Format
+        record; a sharded run gets a record per shard.
+
         Arguments:
-            payment -- Payment transaction details
+            remaining_time_millis -- Time left before the invocation times out, e.g. context.get_remaining_time_in_millis
+            resume_cursor -- Resume cursor of a run that stopped early
+            shard -- Shard of the pending payments to track, all of them if not given
+            pending_payments -- Pending payments to track, downloaded from the storage service if not given
+            last_entry_id -- Stop downloading the pending payments after the one with this entryId
+
+        Returns:
+            Optional[TrackingSummary] -- Outcome counts of the run, or None if the pending payments could not be read
         """
-        status, pending_payments, error_message = self.payment_storage_gateway.get_pending_payment_transactions()
-        if status != HTTPStatus.OK:
-            logger.error(f'Failed to get pending payments: {error_message}')
+        started_at = time.perf_counter()
+        storage_retries_before = get_http_session_stats().retries
+        if pending_payments is None:
+            status, pending_payments, error_message = self.payment_storage_gateway.iter_pending_payment_transactions(
+                after_entry_id=resume_cursor
+            )
+            if status != HTTPStatus.OK:
+                logger.error(f'Failed to get pending payments: {error_message}')
+                return None
+
+            if last_entry_id is not None:
+                pending_payments = take_through_entry_id(pending_payments, last_entry_id)
+
+        elif resume_cursor is not None:
+            entry_ids = [payment.entryId for payment in pending_payments]
+            if resume_cursor in entry_ids:
+                pending_payments = pending_payments[entry_ids.index(resume_cursor) + 1 :]
+
+        if shard is not None:
+            pending_payments = (payment for payment in pending_payments if shard.contains(payment))
+
+        payment_poll_run = None
+        if self.payment_poll_scheduler is not None:
+            payment_poll_run = self.payment_poll_scheduler.start_run(pending_payments)
+            pending_payments = payment_poll_run.due_payments
+
+        def out_of_time() -> bool:
+            return remaining_time_millis is not None and remaining_time_millis() <= self.safety_margin_ms
+
+        def wait_seconds() -> Optional[float]:
+            # lookups in flight may use half of the safety margin, the rest is left to flush and save
+            if remaining_time_millis is None:
+                return None
+
+            return max(0, remaining_time_millis() - self.safety_margin_ms / 2) / 1000
+
+        outcomes = Counter()
+        xendit_calls = 0
+        reached_xendit: List[XenditCall] = []
+        throttle_wait_seconds = 0.0
+        stopped_early = False
+        payment_status_publisher = PaymentStatusPublisher(
+            self.queue_url,
+            self.sqs_client,
+            status_ledger=self.payment_status_ledger,
+            status_ledger_retention_seconds=self.status_ledger_retention_seconds,
+        )
+        in_flight: Dict[Future, List[PaymentTransactionOut]] = {}
+        # batches in the order they were submitted, to move the resume cursor past the ones handled
+        submitted: Deque[Tuple[Future, List[PaymentTransactionOut]]] = deque()
+        handled: Set[Future] = set()
+        batch: List[PaymentTransactionOut] = []
+
+        def submit(executor: ThreadPoolExecutor, payments: List[PaymentTransactionOut]) -> None:
+            future = executor.submit(
+                self.payment_usecase.resolve_payment_requests, [payment.paymentRequestId for payment in payments]
+            )
+            in_flight[future] = payments
+            submitted.append((future, payments))
+
+        def handle(future: Future) -> None:
+            nonlocal xendit_calls, throttle_wait_seconds, resume_cursor
+            payments = in_flight.pop(future)
+            handled.add(future)
+            while submitted and submitted[0][0] in handled:
+                handled.discard(submitted[0][0])
+                handled_payments = submitted.popleft()[1]
+                if payment_poll_run is None:
+                    resume_cursor = handled_payments[-1].entryId
+                else:
+                    resume_cursor = payment_poll_run.resume_cursor_after(handled_payments, resume_cursor)
+
+            try:
+                resolved_payment_requests = future.result()
+            except Exception as e:
+                logger.error(f'Failed to get the payment requests of {len(payments)} payments: {str(e)}')
+                outcomes['lookup_errors'] += len(payments)
+                return
+
+            xendit_calls += resolved_payment_requests.list_calls + resolved_payment_requests.get_calls
+            reached_xendit.extend(resolved_payment_requests.xendit_calls)
+            throttle_wait_seconds += resolved_payment_requests.throttle_wait_seconds
+            status_updates = []
+            for payment in payments:
+                payment_request_details = resolved_payment_requests.payment_requests.get(payment.paymentRequestId)
+                outcome = self.__handle_payment_request(payment, payment_request_details)
+                outcomes[outcome] += 1
+                if outcome in RESOLVED_OUTCOMES:
+                    status_updates.append((payment, RESOLVED_OUTCOMES[outcome]))
+
+                if payment_poll_run is None:
+                    continue
+
+                # payments whose lookup failed keep their schedule and are checked again next run
+                if outcome in RESOLVED_OUTCOMES:
+                    payment_poll_run.record_resolved(payment)
+                elif outcome == 'still_pending':
+                    payment_poll_run.record_pending(payment, payment_request_details.created)
+
+            # the status ledger is read once per batch
+            payment_status_publisher.publish_many(status_updates)
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='payment-tracker')
+        try:
+            # payments are tracked as they are downloaded instead of after the whole backlog is
+            for payment in pending_payments:
+                if not payment.paymentRequestId:
+                    logger.error(f'Payment {payment.entryId} has no payment request ID')
+                    outcomes['missing_payment_request_id'] += 1
+                    continue
+
+                batch.append(payment)
+                if len(batch) < self.lookup_batch_size:
+                    continue
+
+                if out_of_time():
+                    stopped_early = True
+                    break
+
+                submit(executor, batch)
+                batch = []
+                # keep the lookups bounded, a few queued behind the running ones so no thread idles
+                if len(in_flight) >= 2 * self.concurrency:
+                    done, _ = wait(in_flight, timeout=wait_seconds(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(future)
+
+                    if not done:
+                        stopped_early = True
+                        break
+
+            if batch and not stopped_early:
+                submit(executor, batch)
+
+            try:
+                for future in as_completed(list(in_flight), timeout=wait_seconds()):
+                    handle(future)
+
+            except FuturesTimeoutError:
+                logger.warning(f'Abandoning {len(in_flight)} lookups still in flight to stop before the timeout')
+                stopped_early = True
+
+        finally:
+            # lookups not started are cancelled, the ones running finish in the background unhandled
+            executor.shutdown(wait=not stopped_early, cancel_futures=True)
+            # buffered status updates are sent and checks recorded even if the run fails part way
+            payment_status_publisher.flush()
+            if payment_poll_run is not None:
+                payment_poll_run.save()
+
+        if stopped_early:
+            logger.warning(
+                f'Payment tracking stopped early to stay within the time limit, resume cursor {resume_cursor}'
+            )
+
+        publish_stats = payment_status_publisher.stats()
+        # a status update sent alone is the retry of one that failed in its batch
+        retries = {
+            'Storage': get_http_session_stats().retries - storage_retries_before,
+            'Xendit': sum(call.retries for call in reached_xendit),
+            'Sqs': publish_stats.single_calls,
+        }
+        tracking_summary = TrackingSummary(
+            checked=sum(outcomes.values()) - outcomes['missing_payment_request_id'],
+            not_due=payment_poll_run.not_due if payment_poll_run is not None else 0,
+            still_pending=outcomes['still_pending'],
+            succeeded=outcomes['succeeded'],
+            failed=outcomes['failed'],
+            unknown_status=outcomes['unknown_status'],
+            lookup_errors=outcomes['lookup_errors'],
+            missing_payment_request_id=outcomes['missing_payment_request_id'],
+            xendit_calls=xendit_calls,
+            throttle_wait_seconds=throttle_wait_seconds,
+            status_updates_sent=publish_stats.published,
+            status_updates_skipped=publish_stats.skipped,
+            queue_errors=publish_stats.failed,
+            sqs_calls=publish_stats.batch_calls + publish_stats.single_calls,
+            retries=sum(retries.values()),
+            stopped_early=stopped_early,
+            resume_cursor=resume_cursor if stopped_early else None,
+            wall_seconds=time.perf_counter() - started_at,
+        )
+        logger.info(f'Payment tracking summary: {tracking_summary._asdict()}')
+        self.__emit_metrics(
+            tracking_summary,
+            [call.seconds for call in reached_xendit],
+            payment_status_publisher.call_seconds(),
+            retries,
+            shard,
+        )
+        return tracking_summary
+
+    def __emit_metrics(
+        self,
+        tracking_summary: TrackingSummary,
+        xendit_call_seconds: List[float],
+        sqs_call_seconds: List[float],
+        retries: Dict[str, int],
+        shard: Optional[PaymentShard],
+    ) -> None:
+        if self.metrics_emitter is None:
             return
 
-        for payment in pending_payments:
-            if not payment.paymentRequestId:
-                logger.error(f'Payment {payment.entryId} has no payment request ID')
-                continue
+        dimensions = {'Service': TRACKING_METRICS_SERVICE}
+        if os.environ.get('STAGE'):
+            dimensions['Stage'] = os.environ['STAGE']
+
+        properties = {}
+        if shard is not None:
+            properties.update(shard=shard.index, shardCount=shard.count, shardKey=shard.key.value)
+        if tracking_summary.resume_cursor is not None:
+            properties['resumeCursor'] = tracking_summary.resume_cursor
 
-            payment_request_details = self.payment_usecase.get_payment_request_details(
-                payment_request_id=payment.paymentRequestId,
+        try:
+            self.metrics_emitter.emit(
+                tracking_metrics(tracking_summary, xendit_call_seconds, sqs_call_seconds, retries),
+                dimensions=dimensions,
+                properties=properties,
             )
-            payment_request_status = str(payment_request_details.status)
+        except Exception as e:
+            # metrics never fail a run whose status updates are already sent
+            logger.error(f'Failed to emit payment tracking metrics: {str(e)}')
 
-            if payment_request_status in PaymentRequestConstants.PENDING_STATUSES or not payment_request_status:
-                logger.info(f'Payment {payment.entryId} is still pending')
-                continue
+    def __handle_payment_request(self, payment: PaymentTransactionOut, payment_request_details) -> str:
+        if not isinstance(payment_request_details, PaymentRequest):
+            # an error response, e.g. while the circuit of Xendit is open
+            logger.error(f'Failed to get the payment request of payment {payment.entryId}')
+            return 'lookup_errors'
 
-            transaction_status = TransactionStatus.PENDING
+        payment_request_status = str(payment_request_details.status)
 
-            if payment_request_status in PaymentRequestConstants.SUCCESS_STATUSES:
-                logger.info(f'Payment {payment.entryId} succeeded')
-                transaction_status = TransactionStatus.SUCCESS
+        if payment_request_status in PaymentRequestConstants.PENDING_STATUSES or not payment_request_status:
+            logger.info(f'Payment {payment.entryId} is still pending')
+            return 'still_pending'
 
-            elif payment_request_status in PaymentRequestConstants.ERROR_STATUSES:
-                logger.info(f'Payment {payment.entryId} failed')
-                transaction_status = TransactionStatus.FAILED
+        if payment_request_status in PaymentRequestConstants.SUCCESS_STATUSES:
+            logger.info(f'Payment {payment.entryId} succeeded')
+            return 'succeeded'
 
-            else:
-                logger.error(f'Payment {payment.entryId} has an unknown status: {payment_request_status}')
-                continue
+        if payment_request_status in PaymentRequestConstants.ERROR_STATUSES:
+            logger.info(f'Payment {payment.entryId} failed')
+            return 'failed'
 
-            result = self._send_payment_status_update_to_queue(payment, transaction_status)
-            if not result:
-                logger.error(f'Failed to send payment status update to SQS: {payment.entryId}')
-                continue
+        logger.error(f'Payment {payment.entryId} has an unknown status: {payment_request_status}')
+        return 'unknown_status'
@@ -0,0 +1,225 @@
+import os
+import time
+from functools import lru_cache
+from http import HTTPStatus
+from threading import Lock, Thread
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from external.payment_storage_gateway import PaymentStorageGateway
+from external.payment_update_outbox import (
+    OutboxEntry,
+    PaymentUpdateOutbox,
+    get_payment_update_outbox,
+)
+from utils.logger import logger
+
+
+class OutboxDrainStats(NamedTuple):
+    applied: int
+    skipped: int
+    failed: int
+    dead_lettered: int
+
+
+class OutboxMetrics(NamedTuple):
+    depth: int
+    oldest_entry_age_seconds: Optional[float]
+    applied: int
+    skipped: int
+    failed: int
+    dead_lettered: int
+    last_apply_lag_seconds: Optional[float]
+    max_apply_lag_seconds: Optional[float]
+
+
+class PaymentUpdateOutboxDrainer:
+    """
+    Writes queued payment transaction updates to the storage service
+
+    Entries are taken in batches and each is written with update_payment_transaction, whose
+    PUT is retried within the invocation's retry budget. A failed update is released with an exponential backoff and
+    dead lettered after max_attempts. An entry whose outbox ID was already applied is
+    acknowledged without writing it again.
+    Apply lag is the time from queueing an update to writing it.
+    """
+
+    def __init__(
+        self,
+        outbox: PaymentUpdateOutbox,
+        payment_storage_gateway: Optional[PaymentStorageGateway] = None,
+        max_attempts: int = 8,
+        base_retry_delay_seconds: float = 2,
+        max_retry_delay_seconds: float = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.__outbox = outbox
+        self.__payment_storage_gateway = payment_storage_gateway or PaymentStorageGateway()
+        self.__max_attempts = max_attempts
+        self.__base_retry_delay_seconds = base_retry_delay_seconds
+        self.__max_retry_delay_seconds = max_retry_delay_seconds
+        self.__clock = clock
+
+        self.__lock = Lock()
+        self.__drain_thread: Optional[Thread] = None
+        self.__applied = 0
+        self.__skipped = 0
+        self.__failed = 0
+        self.__dead_lettered = 0
+        self.__last_apply_lag_seconds: Optional[float] = None
+        self.__max_apply_lag_seconds: Optional[float] = None
+
+    def drain(self, max_entries: Optional[int] = None, batch_size: int = 10) -> OutboxDrainStats:
+        """
+        Apply queued updates until the outbox has none ready or max_entries were taken
+
+        Arguments:
+            max_entries -- Maximum number of entries to take, or None for no limit
+            batch_size -- Entries taken from the outbox at a time
+
+        Returns:
+            OutboxDrainStats -- Counts of this drain
+        """
+        outcomes = {outcome: 0 for outcome in OutboxDrainStats._fields}
+        taken = 0
+        while max_entries is None or taken < max_entries:
+            limit = batch_size if max_entries is None else min(batch_size, max_entries - taken)
+            entries = self.__outbox.take(limit)
+            if not entries:
+                break
+
+            taken += len(entries)
+            for outcome in self.__apply(entries):
+                outcomes[outcome] += 1
+
+        drain_stats = OutboxDrainStats(**outcomes)
+        if taken:
+            logger.info(f'Payment update outbox drained: {drain_stats._asdict()}, metrics: {self.metrics()._asdict()}')
+
+        return drain_stats
+
+    def apply_entries(self, entries: List[OutboxEntry]) -> List[OutboxEntry]:
+        """
+        Apply updates that were already taken from the outbox, e.g. delivered in an SQS event
+
+        Arguments:
+            entries -- Payment updates
+
+        Returns:
+            List[OutboxEntry] -- Entries that were not applied
+        """
+        outcomes = self.__apply(entries)
+        return [entry for entry, outcome in zip(entries, outcomes) if outcome in ('failed', 'dead_lettered')]
+
+    def drain_in_background(self) -> None:
+        """Start draining on a background thread until the outbox is empty, unless one is already running"""
+        with self.__lock:
+            if self.__drain_thread is not None and self.__drain_thread.is_alive():
+                return
+
+            self.__drain_thread = Thread(
+                target=self.__drain_until_empty, name='payment-update-outbox-drain', daemon=True
+            )
+            self.__drain_thread.start()
+
+    def metrics(self) -> OutboxMetrics:
+        """
+        Get the queue depth and apply lag of the outbox
+
+        Returns:
+            OutboxMetrics -- Current depth, age of the oldest queued update and counts since start
+        """
+        oldest_enqueued_at = self.__outbox.oldest_enqueued_at()
+        with self.__lock:
+            return OutboxMetrics(
+                depth=self.__outbox.depth(),
+                oldest_entry_age_seconds=(
+                    None if oldest_enqueued_at is None else max(0.0, self.__clock() - oldest_enqueued_at)
+                ),
+                applied=self.__applied,
+                skipped=self.__skipped,
+                failed=self.__failed,
+                dead_lettered=self.__dead_lettered,
+                last_apply_lag_seconds=self.__last_apply_lag_seconds,
+                max_apply_lag_seconds=self.__max_apply_lag_seconds,
+            )
+
+    def __drain_until_empty(self) -> None:
+        while True:
+            try:
+                self.drain()
+                if self.__outbox.depth() == 0:
+                    return
+
+            except Exception as e:
+                logger.error(f'Failed to drain the payment update outbox: {str(e)}')
+
+            # entries left are backing off before their next attempt
+            time.sleep(self.__base_retry_delay_seconds)
+
+    def __apply(self, entries: List[OutboxEntry]) -> List[str]:
+        outcomes: Dict[int, str] = {}
+        updates = []
+        for index, entry in enumerate(entries):
+            if self.__outbox.is_applied(entry.outbox_id):
+                self.__outbox.ack(entry)
+                with self.__lock:
+                    self.__skipped += 1
+
+                outcomes[index] = 'skipped'
+            else:
+                updates.append((index, entry))
+
+        # failed entries are retried by the outbox with a backoff
+        for index, entry in updates:
+            status, _, message = self.__payment_storage_gateway.update_payment_transaction(
+                entry.payment_transaction_id, entry.payment
+            )
+            outcomes[index] = self.__record_result(entry, status, message)
+
+        return [outcomes[index] for index in range(len(entries))]
+
+    def __record_result(self, entry: OutboxEntry, status: HTTPStatus, message: Optional[str]) -> str:
+        if status == HTTPStatus.OK:
+            self.__outbox.ack(entry)
+            apply_lag_seconds = max(0.0, self.__clock() - entry.enqueued_at)
+            with self.__lock:
+                self.__applied += 1
+                self.__last_apply_lag_seconds = apply_lag_seconds
+                self.__max_apply_lag_seconds = max(self.__max_apply_lag_seconds or 0.0, apply_lag_seconds)
+
+            return 'applied'
+
+        attempts = entry.attempts + 1
+        if attempts >= self.__max_attempts:
+            logger.error(f'Dead lettering payment update {entry.outbox_id} after {attempts} attempts: {message}')
+            self.__outbox.dead_letter(entry, message)
+            with self.__lock:
+                self.__dead_lettered += 1
+
+            return 'dead_lettered'
+
+        delay_seconds = min(self.__max_retry_delay_seconds, self.__base_retry_delay_seconds * 2**entry.attempts)
+        logger.error(
+            f'Failed to apply payment update {entry.outbox_id} (attempt {attempts}), retrying in {delay_seconds}s: '
+            f'{message}'
+        )
+        self.__outbox.release(entry, delay_seconds)
+        with self.__lock:
+            self.__failed += 1
+
+        return 'failed'
+
+
+@lru_cache(maxsize=None)
+def get_payment_update_outbox_drainer() -> Optional[PaymentUpdateOutboxDrainer]:
+    """
+    Get the drainer of this container's payment update outbox
+
+    Returns:
+        Optional[PaymentUpdateOutboxDrainer] -- Drainer, or None if updates are written synchronously
+    """
+    outbox = get_payment_update_outbox()
+    if outbox is None:
+        return None
+
+    return PaymentUpdateOutboxDrainer(outbox, max_attempts=int(os.environ.get('PAYMENT_UPDATE_OUTBOX_MAX_ATTEMPTS', 8)))
@@ -1,13 +1,23 @@
+import asyncio
 import os
+import time
+from functools import lru_cache
 from http import HTTPStatus
-from uuid import uuid4
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar, Union
+from uuid import NAMESPACE_URL, uuid4, uuid5
 
 import xendit
-from starlette.responses import JSONResponse
 from xendit.apis import PaymentRequestApi
 from xendit.payment_request.model import PaymentRequest
 
-from external.payment_storage_gateway import PaymentStorageGateway
+from external.payment_update_outbox import get_payment_update_outbox
+from external.xendit_payment_request_client import (
+    XENDIT_LIST_MAX_LIMIT,
+    XenditPaymentRequestClient,
+    last_response_retries,
+    record_response_headers,
+    response_headers,
+)
 from model.payment.payment import (
     DirectDebitPaymentIn,
     EWalletPaymentIn,
@@ -15,29 +25,141 @@ from model.payment.payment import (
     PaymentTransactionIn,
     TransactionStatus,
 )
+from model.payment.payment_constants import PaymentDependency, PaymentMethod, RateLimitBudget, TransactionIdMode
+from usecase.payment_request_idempotency import (
+    IdempotencyConflictError,
+    PaymentRequestAttempt,
+    build_idempotency_key,
+    get_idempotency_guard,
+)
+from usecase.payment_update_outbox_drainer import get_payment_update_outbox_drainer
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
 from utils.logger import logger
+from utils.rate_limiter import RateLimitedError, get_rate_limiter, parse_retry_after
 from utils.utils import Utils
 
+T = TypeVar('T')
+
+# Xendit calls per second of a container, shared by checkout and, up to half of it, tracking
+XENDIT_DEFAULT_RATE_LIMIT_PER_SECOND = 20
+XENDIT_DEFAULT_TRACKING_SHARE = 0.5
+
+
+def _error_response(status_code: int, message: str, headers: Optional[dict] = None):
+    # Imported here so the payment tracker, which only needs it on errors, does not load Starlette
+    from starlette.responses import JSONResponse
+
+    return JSONResponse(status_code=status_code, content={'message': message}, headers=headers)
+
+
+def _circuit_open_response(error: CircuitOpenError):
+    return _error_response(
+        HTTPStatus.SERVICE_UNAVAILABLE, str(error), headers={'Retry-After': str(error.retry_after_seconds)}
+    )
+
+
+def _rate_limited_response(error: RateLimitedError):
+    return _error_response(
+        HTTPStatus.TOO_MANY_REQUESTS, str(error), headers={'Retry-After': str(error.retry_after_seconds)}
+    )
+
+
+def _is_storage_failure(result: tuple) -> bool:
+    status = result[0]
+    return status == HTTPStatus.TOO_MANY_REQUESTS or status >= HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def _is_xendit_failure(error: BaseException) -> bool:
+    # Xendit rejecting a request is not a failure of Xendit
+    if isinstance(error, xendit.XenditSdkException):
+        try:
+            status = int(error.status)
+        except (TypeError, ValueError):
+            return True
+
+        return status == HTTPStatus.TOO_MANY_REQUESTS or status >= HTTPStatus.INTERNAL_SERVER_ERROR
+
+    return not isinstance(error, asyncio.CancelledError)
+
+
+def _is_xendit_rejection(error: BaseException) -> bool:
+    return isinstance(error, xendit.XenditSdkException) and not _is_xendit_failure(error)
+
+
+def _is_xendit_rate_limited(error: BaseException) -> bool:
+    return isinstance(error, xendit.XenditSdkException) and str(error.status) == str(HTTPStatus.TOO_MANY_REQUESTS.value)
+
+
+class XenditCall(NamedTuple):
+    seconds: float
+    retries: int
+
+
+def _record_xendit_call(xendit_calls: Optional[List[XenditCall]], started_at: float) -> None:
+    if xendit_calls is not None:
+        xendit_calls.append(XenditCall(seconds=time.perf_counter() - started_at, retries=last_response_retries()))
+
+
+class ResolvedPaymentRequests(NamedTuple):
+    # payment request, or the error response of its lookup, by payment request ID
+    payment_requests: Dict[str, Any]
+    list_calls: int
+    get_calls: int
+    throttle_wait_seconds: float
+    # latency and retries of every call that reached Xendit
+    xendit_calls: List[XenditCall]
+
 
 class PaymentUsecase:
     def __init__(self) -> None:
-        xendit_api_key_name = os.environ.get('XENDIT_API_KEY_SECRET_NAME')
-        self.__xendit_api_key = Utils.get_secret(xendit_api_key_name)
+        self.__xendit_api_key_name = os.environ.get('XENDIT_API_KEY_SECRET_NAME')
+        self.__xendit_api_key = Utils.get_secret(self.__xendit_api_key_name)
         self.__callback_base_url = os.environ.get('CALLBACK_BASE_URL')
         self.__xendit_callback_url = f'{self.__callback_base_url}/payments/callback'
-        self.__payment_storage_gateway = PaymentStorageGateway()
+        self.__payment_storage_gateway = None
+        self.__transaction_id_mode = TransactionIdMode(
+            os.environ.get('TRANSACTION_ID_MODE', TransactionIdMode.STORAGE.value).upper()
+        )
+
+        # Checkout may use the whole rate, tracking only its share, so a tracker burst leaves checkout the rest
+        self.__xendit_rate_limiter = get_rate_limiter(
+            PaymentDependency.XENDIT.value,
+            default_rate_per_second=XENDIT_DEFAULT_RATE_LIMIT_PER_SECOND,
+            default_budget_shares=((RateLimitBudget.TRACKING.value, XENDIT_DEFAULT_TRACKING_SHARE),),
+        )
+        self.__checkout_max_wait_seconds = float(os.environ.get('XENDIT_RATE_LIMIT_CHECKOUT_MAX_WAIT_SECONDS', 2))
 
         # Initialize Xendit API Client
         xendit.set_api_key(self.__xendit_api_key)
-        api_client = xendit.ApiClient()
+        configuration = xendit.Configuration.get_default_copy()
+        # Xendit is called from the async path's and the payment tracker's thread pools, keep a connection per thread
+        configuration.connection_pool_maxsize = int(os.environ.get('XENDIT_CONNECTION_POOL_MAXSIZE', 32))
+        if self.__xendit_rate_limiter is not None:
+            # urllib3 would sleep through the Retry-After of a 429 on the calling thread, unseen by the rate limiter
+            from urllib3.util.retry import Retry
+
+            configuration.retries = Retry(3, respect_retry_after_header=False)
+
+        api_client = xendit.ApiClient(configuration)
+        record_response_headers(api_client)
         self.xendit_api_instance = PaymentRequestApi(api_client)
+        self.xendit_client = XenditPaymentRequestClient(self.xendit_api_instance)
+        self.__async_xendit_api_instance = None
+        self.__xendit_list_supported = True
+
+        # Shared by every usecase of the container, so one request's failures fail the next ones fast
+        self.__storage_circuit_breaker = get_circuit_breaker(PaymentDependency.STORAGE.value)
+        self.__xendit_circuit_breaker = get_circuit_breaker(PaymentDependency.XENDIT.value)
 
-    def direct_debit_payment_request(self, in_data: DirectDebitPaymentIn) -> PaymentRequestOut:
+    async def direct_debit_payment_request(
+        self, in_data: DirectDebitPaymentIn, idempotency_key: Optional[str] = None
+    ) -> PaymentRequestOut:
         """
         Create a direct debit payment request
 
         Arguments:
             in_data -- Direct debit payment request data
+            idempotency_key -- Idempotency-Key header, requests without one are not deduplicated
 
         Returns:
             PaymentRequestOut -- Payment request details
@@ -49,82 +171,63 @@ class PaymentUsecase:
             transactionStatus=TransactionStatus.PENDING,
             eventId=in_data.eventId,
         )
-        status, payment, message = self.__payment_storage_gateway.create_payment(payment_transaction_in)
-        if status != HTTPStatus.OK:
-            return JSONResponse(status_code=status, content={'message': message})
-
-        idempotency_key = str(uuid4())
-        reference_id = str(uuid4())
-        payment_transaction_id = payment.entryId
-
-        payment_method_parameters = {
-            'type': 'DIRECT_DEBIT',
-            'direct_debit': {
-                'channel_code': in_data.channelCode,
-                'channel_properties': {
-                    'success_return_url': f'{self.__xendit_callback_url}?eventId={in_data.eventId}&paymentTransactionId={payment_transaction_id}',
-                    'failure_return_url': in_data.failureReturnUrl,
-                    'email': in_data.email,
+
+        def build_payment_request_parameters(
+            payment_transaction_id: str, xendit_idempotency_key: Optional[str]
+        ) -> dict:
+            # a retry under the same Xendit key must send the same body, so its reference ID is derived from the key
+            reference_id = str(uuid5(NAMESPACE_URL, xendit_idempotency_key)) if xendit_idempotency_key else str(uuid4())
+            payment_method_parameters = {
+                'type': 'DIRECT_DEBIT',
+                'direct_debit': {
+                    'channel_code': in_data.channelCode,
+                    'channel_properties': {
+                        'success_return_url': f'{self.__xendit_callback_url}?eventId={in_data.eventId}&paymentTransactionId={payment_transaction_id}',
+                        'failure_return_url': in_data.failureReturnUrl,
+                        'email': in_data.email,
+                    },
                 },
-            },
-            'reusability': 'ONE_TIME_USE',
-        }
-
-        payment_request_parameters = {
-            'reference_id': reference_id,
-            'amount': in_data.amount,
-            'currency': 'PHP',
-            'payment_method': payment_method_parameters,
-            'enable_otp': False,
-            'customer': {
+                'reusability': 'ONE_TIME_USE',
+            }
+
+            return {
                 'reference_id': reference_id,
-                'type': 'INDIVIDUAL',
-                'individual_detail': {
-                    'given_names': in_data.givenNames,
-                    'surname': in_data.surname,
+                'amount': in_data.amount,
+                'currency': 'PHP',
+                'payment_method': payment_method_parameters,
+                'enable_otp': False,
+                'customer': {
+                    'reference_id': reference_id,
+                    'type': 'INDIVIDUAL',
+                    'individual_detail': {
+                        'given_names': in_data.givenNames,
+                        'surname': in_data.surname,
+                    },
                 },
-            },
-        }
-
-        try:
-            # Create Payment Request
-            api_response = self.xendit_api_instance.create_payment_request(
-                idempotency_key=idempotency_key, payment_request_parameters=payment_request_parameters
-            )
-            payment_request_id = api_response.id
-            payment_request_out = PaymentRequestOut(
-                createDate=api_response.created,
-                paymentUrl=api_response.actions[0].url,
-                paymentRequestId=payment_request_id,
-                referenceId=api_response.reference_id,
-            )
-
-        except xendit.XenditSdkException as e:
-            message = f'Exception when calling PaymentRequestApi->create_payment_request: {e.errorMessage}'
-            logger.info(message)
-
-            return JSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'message': message})
-
-        payment_transaction_in.paymentRequestId = api_response.id
-        status, _, message = self.__payment_storage_gateway.update_payment_transaction(
-            payment_transaction_id, payment_transaction_in
+            }
+
+        return await self.__create_idempotent_payment_request(
+            PaymentMethod.DIRECT_DEBIT,
+            in_data,
+            idempotency_key,
+            lambda attempt: self.__create_payment_request(
+                payment_transaction_in, build_payment_request_parameters, attempt
+            ),
         )
-        if status != HTTPStatus.OK:
-            return JSONResponse(status_code=status, content={'message': message})
-
-        return payment_request_out
 
-    def e_wallet_payment_request(self, in_data: EWalletPaymentIn) -> PaymentRequestOut:
+    async def e_wallet_payment_request(
+        self, in_data: EWalletPaymentIn, idempotency_key: Optional[str] = None
+    ) -> PaymentRequestOut:
         """
         Create an e-wallet payment request
 
         Arguments:
             in_data -- E-wallet payment request data
+            idempotency_key -- Idempotency-Key header, requests without one are not deduplicated
 
         Returns:
             PaymentRequestOut -- Payment request details
         """
-        idempotency_key = str(uuid4())
         reference_id = in_data.referenceId
         registration = in_data.registrationData
 
@@ -134,57 +237,315 @@ class PaymentUsecase:
             eventId=in_data.eventId,
             registrationData=registration,
         )
-        status, payment, message = self.__payment_storage_gateway.create_payment(payment_transaction_in)
-        if status != HTTPStatus.OK:
-            return JSONResponse(status_code=status, content={'message': message})
-
-        payment_transaction_id = payment.entryId
-
-        payment_request_parameters = {
-            'country': 'PH',
-            'amount': in_data.amount,
-            'currency': 'PHP',
-            'reference_id': reference_id,
-            'payment_method': {
-                'type': 'EWALLET',
-                'ewallet': {
-                    'channel_properties': {
-                        'success_return_url': f'{self.__xendit_callback_url}?eventId={in_data.eventId}&paymentTransactionId={payment_transaction_id}',
-                        'failure_return_url': in_data.failureReturnUrl,
-                        'cancel_return_url': in_data.cancelReturnUrl,
+
+        def build_payment_request_parameters(
+            payment_transaction_id: str, xendit_idempotency_key: Optional[str]
+        ) -> dict:
+            return {
+                'country': 'PH',
+                'amount': in_data.amount,
+                'currency': 'PHP',
+                'reference_id': reference_id,
+                'payment_method': {
+                    'type': 'EWALLET',
+                    'ewallet': {
+                        'channel_properties': {
+                            'success_return_url': f'{self.__xendit_callback_url}?eventId={in_data.eventId}&paymentTransactionId={payment_transaction_id}',
+                            'failure_return_url': in_data.failureReturnUrl,
+                            'cancel_return_url': in_data.cancelReturnUrl,
+                        },
+                        'channel_code': in_data.channelCode,
                     },
-                    'channel_code': in_data.channelCode,
+                    'reusability': 'ONE_TIME_USE',
                 },
-                'reusability': 'ONE_TIME_USE',
-            },
-        }
+            }
+
+        return await self.__create_idempotent_payment_request(
+            PaymentMethod.E_WALLET,
+            in_data,
+            idempotency_key,
+            lambda attempt: self.__create_payment_request(
+                payment_transaction_in, build_payment_request_parameters, attempt
+            ),
+        )
+
+    async def __create_idempotent_payment_request(
+        self,
+        payment_method: PaymentMethod,
+        in_data: Union[DirectDebitPaymentIn, EWalletPaymentIn],
+        idempotency_key: Optional[str],
+        create_payment_request: Callable[[Optional[PaymentRequestAttempt]], Awaitable[PaymentRequestOut]],
+    ) -> PaymentRequestOut:
+        """
+        Create a payment request once per Idempotency-Key
+
+        Only requests with a client supplied key are deduplicated. The key is forwarded to
+        Xendit with the ID of the payment transaction, which a retry after a failure reuses,
+        so the retry does not create a second payment request there either.
+        """
 
+        async def create_or_fail_fast(attempt: Optional[PaymentRequestAttempt] = None) -> PaymentRequestOut:
+            try:
+                return await create_payment_request(attempt)
+
+            except CircuitOpenError as e:
+                logger.error(f'Failing payment request fast: {str(e)}')
+                return _circuit_open_response(e)
+
+            except RateLimitedError as e:
+                logger.error(f'Failing payment request fast: {str(e)}')
+                return _rate_limited_response(e)
+
+        idempotency_guard = get_idempotency_guard()
+        if idempotency_guard is None or not idempotency_key:
+            return await create_or_fail_fast()
+
+        key, fingerprint = build_idempotency_key(payment_method, in_data, idempotency_key)
+        try:
+            return await idempotency_guard.run(key, fingerprint, create_or_fail_fast)
+
+        except IdempotencyConflictError as e:
+            logger.info(e.message)
+            return _error_response(e.status_code, e.message)
+
+    async def __create_payment_request(
+        self,
+        payment_transaction_in: PaymentTransactionIn,
+        build_payment_request_parameters: Callable[[str, Optional[str]], dict],
+        attempt: Optional[PaymentRequestAttempt] = None,
+    ) -> PaymentRequestOut:
+        """
+        Store a pending payment transaction and create its Xendit payment request
+
+        With TRANSACTION_ID_MODE=STORAGE the storage service assigns the payment transaction ID,
+        so the record is created before Xendit is called. With TRANSACTION_ID_MODE=SERVICE the
+        ID is generated here and the record is created while Xendit is called.
+
+        If the circuit of storage or Xendit is open, or Xendit is rate limited for longer than
+        XENDIT_RATE_LIMIT_CHECKOUT_MAX_WAIT_SECONDS, nothing is created. An attempt that resumes
+        an idempotency key reuses the payment transaction its failed run created.
+
+        Arguments:
+            payment_transaction_in -- Pending payment transaction
+            build_payment_request_parameters -- Builds the Xendit parameters for a payment transaction ID and
+                Xendit idempotency key
+            attempt -- Attempt of an idempotency key, or None to call Xendit with a new idempotency key
+
+        Returns:
+            PaymentRequestOut -- Payment request details
+
+        Raises:
+            CircuitOpenError -- If storage or Xendit is failing
+            RateLimitedError -- If Xendit cannot be called soon enough
+        """
+        self.__storage_circuit_breaker.raise_if_open()
+        self.__xendit_circuit_breaker.raise_if_open()
+        if self.__xendit_rate_limiter is not None:
+            # the Xendit call's token is taken before the pending record is stored
+            await self.__xendit_rate_limiter.acquire_async(
+                RateLimitBudget.CHECKOUT.value, self.__checkout_max_wait_seconds
+            )
+
+        if self.__transaction_id_mode == TransactionIdMode.SERVICE:
+            return await self.__create_payment_request_with_service_id(
+                payment_transaction_in, build_payment_request_parameters, attempt
+            )
+
+        if attempt is not None and attempt.payment_transaction_id is not None:
+            payment_transaction_id = attempt.payment_transaction_id
+        else:
+            payment_storage_gateway = self.__get_payment_storage_gateway()
+            status, payment, message = await self.__call_storage(
+                lambda: payment_storage_gateway.create_payment(payment_transaction_in)
+            )
+            if status != HTTPStatus.OK:
+                return _error_response(status, message)
+
+            payment_transaction_id = payment.entryId
+            if attempt is not None:
+                attempt.payment_transaction_id = payment_transaction_id
+
+        xendit_idempotency_key = attempt.xendit_idempotency_key if attempt is not None else None
+        status, payment_request_out, message = await self.__send_payment_request(
+            build_payment_request_parameters(payment_transaction_id, xendit_idempotency_key), xendit_idempotency_key
+        )
+        if status != HTTPStatus.OK:
+            return _error_response(status, message)
+
+        payment_transaction_in.paymentRequestId = payment_request_out.paymentRequestId
+        status, message = await self.__attach_payment_request_id(payment_transaction_id, payment_transaction_in)
+        if status != HTTPStatus.OK:
+            return _error_response(status, message)
+
+        return payment_request_out
+
+    async def __create_payment_request_with_service_id(
+        self,
+        payment_transaction_in: PaymentTransactionIn,
+        build_payment_request_parameters: Callable[[str, Optional[str]], dict],
+        attempt: Optional[PaymentRequestAttempt] = None,
+    ) -> PaymentRequestOut:
+        """
+        Create the payment transaction and the Xendit payment request concurrently
+
+        The pending record and the payment request are created at the same time, then the
+        payment request ID is attached to the record. If Xendit fails, the record that was
+        created is marked FAILED so it is not left pending. If the create failed the request
+        fails with its error, since there is no record to attach the payment request to. An
+        attempt that resumes an idempotency key creates the record again under the same ID.
+
+        Arguments:
+            payment_transaction_in -- Pending payment transaction
+            build_payment_request_parameters -- Builds the Xendit parameters for a payment transaction ID and
+                Xendit idempotency key
+            attempt -- Attempt of an idempotency key, or None to call Xendit with a new idempotency key
+
+        Returns:
+            PaymentRequestOut -- Payment request details
+        """
+        payment_storage_gateway = self.__get_payment_storage_gateway()
+        if attempt is not None and attempt.payment_transaction_id is not None:
+            payment_transaction_id = attempt.payment_transaction_id
+        else:
+            payment_transaction_id = str(uuid4())
+            if attempt is not None:
+                attempt.payment_transaction_id = payment_transaction_id
+
+        xendit_idempotency_key = attempt.xendit_idempotency_key if attempt is not None else None
+
+        create_result, payment_request_result = await asyncio.gather(
+            self.__call_storage(
+                lambda: payment_storage_gateway.create_payment(payment_transaction_in, entry_id=payment_transaction_id)
+            ),
+            self.__send_payment_request(
+                build_payment_request_parameters(payment_transaction_id, xendit_idempotency_key),
+                xendit_idempotency_key,
+            ),
+            return_exceptions=True,
+        )
+        create_status, _, create_message = (
+            (HTTPStatus.INTERNAL_SERVER_ERROR, None, str(create_result))
+            if isinstance(create_result, Exception)
+            else create_result
+        )
+
+        if isinstance(payment_request_result, Exception) or payment_request_result[0] != HTTPStatus.OK:
+            if create_status == HTTPStatus.OK:
+                await self.__mark_orphaned_payment_transaction(payment_transaction_id, payment_transaction_in)
+
+            if isinstance(payment_request_result, Exception):
+                raise payment_request_result
+
+            status, _, message = payment_request_result
+            return _error_response(status, message)
+
+        _, payment_request_out, _ = payment_request_result
+        if create_status != HTTPStatus.OK:
+            logger.error(
+                f'Failed to create payment transaction {payment_transaction_id} for payment request '
+                f'{payment_request_out.paymentRequestId}: {create_message}'
+            )
+            return _error_response(create_status, create_message)
+
+        payment_transaction_in.paymentRequestId = payment_request_out.paymentRequestId
+        status, message = await self.__attach_payment_request_id(payment_transaction_id, payment_transaction_in)
+        if status != HTTPStatus.OK:
+            logger.error(
+                f'Failed to attach payment request {payment_request_out.paymentRequestId} to payment transaction '
+                f'{payment_transaction_id}: {message}'
+            )
+            return _error_response(status, message)
+
+        return payment_request_out
+
+    async def __attach_payment_request_id(
+        self, payment_transaction_id: str, payment_transaction_in: PaymentTransactionIn
+    ) -> Tuple[HTTPStatus, str]:
+        """
+        Write the payment request ID to a stored payment transaction
+
+        With a payment update outbox configured the update is queued and applied by its
+        drainer, so the payment request is returned without waiting on the storage service.
+        If it cannot be queued it is written directly.
+
+        Arguments:
+            payment_transaction_id -- Stored payment transaction ID
+            payment_transaction_in -- Payment transaction with its payment request ID
+
+        Returns:
+            Tuple[HTTPStatus, str] -- Status code, error message
+        """
+        payment_update_outbox = get_payment_update_outbox()
+        if payment_update_outbox is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    None, payment_update_outbox.put, payment_transaction_id, payment_transaction_in
+                )
+                if payment_update_outbox.DRAINS_IN_PROCESS:
+                    get_payment_update_outbox_drainer().drain_in_background()
+
+                return HTTPStatus.OK, None
+
+            except Exception as e:
+                logger.error(f'Failed to queue update of payment transaction {payment_transaction_id}: {str(e)}')
+
+        status, _, message = await self.__call_storage(
+            lambda: self.__get_payment_storage_gateway().update_payment_transaction(
+                payment_transaction_id=payment_transaction_id, payment=payment_transaction_in
+            )
+        )
+        return status, message
+
+    async def __mark_orphaned_payment_transaction(
+        self, payment_transaction_id: str, payment_transaction_in: PaymentTransactionIn
+    ) -> None:
+        failed_payment_transaction = payment_transaction_in.copy(update={'transactionStatus': TransactionStatus.FAILED})
+        try:
+            status, _, message = await self.__call_storage(
+                lambda: self.__get_payment_storage_gateway().update_payment_transaction(
+                    payment_transaction_id=payment_transaction_id, payment=failed_payment_transaction
+                )
+            )
+        except CircuitOpenError as e:
+            status, message = HTTPStatus.SERVICE_UNAVAILABLE, str(e)
+
+        if status != HTTPStatus.OK:
+            logger.error(f'Failed to mark orphaned payment transaction {payment_transaction_id} as failed: {message}')
+            return
+
+        logger.info(f'Marked orphaned payment transaction {payment_transaction_id} as failed')
+
+    async def __send_payment_request(
+        self, payment_request_parameters: dict, idempotency_key: Optional[str] = None
+    ) -> Tuple[HTTPStatus, Union[PaymentRequestOut, None], str]:
         try:
             # Create Payment Request
-            api_response = self.xendit_api_instance.create_payment_request(
-                idempotency_key=idempotency_key, payment_request_parameters=payment_request_parameters
+            self.__apply_xendit_api_key()
+            api_response = await self.__xendit_circuit_breaker.call_async(
+                lambda: self.__get_async_xendit_api_instance().create_payment_request(
+                    idempotency_key=idempotency_key or str(uuid4()),
+                    payment_request_parameters=payment_request_parameters,
+                ),
+                is_failure_error=_is_xendit_failure,
             )
+            self.__record_xendit_success()
             payment_request_out = PaymentRequestOut(
                 createDate=api_response.created,
                 paymentUrl=api_response.actions[0].url,
                 paymentRequestId=api_response.id,
                 referenceId=api_response.reference_id,
             )
+            return HTTPStatus.OK, payment_request_out, None
 
         except xendit.XenditSdkException as e:
             message = f'Exception when calling PaymentRequestApi->create_payment_request: {e.errorMessage}'
             logger.info(message)
+            if _is_xendit_rate_limited(e):
+                self.__record_xendit_rate_limited(e, RateLimitBudget.CHECKOUT)
+                return HTTPStatus.TOO_MANY_REQUESTS, None, message
 
-            return JSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'message': message})
-
-        payment_transaction_in.paymentRequestId = api_response.id
-        status, _, message = self.__payment_storage_gateway.update_payment_transaction(
-            payment_transaction_id=payment_transaction_id, payment=payment_transaction_in
-        )
-        if status != HTTPStatus.OK:
-            return JSONResponse(status_code=status, content={'message': message})
-
-        return payment_request_out
+            return HTTPStatus.BAD_REQUEST, None, message
 
     def get_payment_request_details(self, payment_request_id: str) -> PaymentRequest:
         """
@@ -196,14 +557,228 @@ class PaymentUsecase:
         Returns:
             PaymentRequest -- Payment request details
         """
+        payment_request, _ = self.__get_payment_request(payment_request_id)
+        return payment_request
+
+    def __get_payment_request(
+        self, payment_request_id: str, xendit_calls: Optional[List[XenditCall]] = None
+    ) -> Tuple[Any, float]:
+        """Get a payment request for the tracker, returning it or its error response and the seconds throttled"""
+        throttle_wait_seconds = self.__acquire_xendit_token(RateLimitBudget.TRACKING)
         try:
-            payment_request_response = self.xendit_api_instance.get_payment_request_by_id(
-                payment_request_id=payment_request_id
+            payment_request_response = self.__call_xendit(
+                lambda: self.xendit_client.get_payment_request(payment_request_id),
+                RateLimitBudget.TRACKING,
+                xendit_calls,
             )
-            return payment_request_response
+            return payment_request_response, throttle_wait_seconds
+
+        except CircuitOpenError as e:
+            logger.error(f'Not getting payment request {payment_request_id}: {str(e)}')
+            return _circuit_open_response(e), throttle_wait_seconds
 
         except xendit.XenditSdkException as e:
             message = f'Exception when calling PaymentRequestApi->get_payment_request_by_id: {e.errorMessage}'
             logger.info(message)
+            if _is_xendit_rate_limited(e):
+                return _error_response(HTTPStatus.TOO_MANY_REQUESTS, message), throttle_wait_seconds
+
+            return _error_response(HTTPStatus.BAD_REQUEST, message), throttle_wait_seconds
+
+    def resolve_payment_requests(self, payment_request_ids: List[str]) -> ResolvedPaymentRequests:
+        """
+        Get many payment requests from Xendit, listing them by ID instead of getting them one by one
+
+        The IDs are listed up to XENDIT_LIST_MAX_LIMIT per call, following the pages of each
+        call, and only the IDs missing from the list are looked up one by one. If the list
+        call fails the IDs it covered get its error response rather than a lookup each, so
+        a failing Xendit is not sent more calls. If Xendit rejects the list call, e.g. an API
+        key without access to it, listing is turned off for this container.
+
+        Arguments:
+            payment_request_ids -- Payment request IDs
+
+        Returns:
+            ResolvedPaymentRequests -- Payment request or error response by ID, and the calls made
+        """
+        payment_request_ids = list(dict.fromkeys(payment_request_ids))
+        payment_requests: Dict[str, Any] = {}
+        xendit_calls: List[XenditCall] = []
+        list_calls = 0
+        throttle_wait_seconds = 0.0
+        if len(payment_request_ids) > 1:
+            for start in range(0, len(payment_request_ids), XENDIT_LIST_MAX_LIMIT):
+                if not self.__xendit_list_supported:
+                    break
+
+                chunk = payment_request_ids[start : start + XENDIT_LIST_MAX_LIMIT]
+                chunk_list_calls, chunk_throttle_wait_seconds, error_response = self.__list_payment_requests(
+                    chunk, payment_requests, xendit_calls
+                )
+                list_calls += chunk_list_calls
+                throttle_wait_seconds += chunk_throttle_wait_seconds
+                if error_response is not None:
+                    payment_requests.update(
+                        {
+                            payment_request_id: error_response
+                            for payment_request_id in chunk
+                            if payment_request_id not in payment_requests
+                        }
+                    )
+
+        missing_ids = [
+            payment_request_id
+            for payment_request_id in payment_request_ids
+            if payment_request_id not in payment_requests
+        ]
+        if missing_ids and len(payment_request_ids) > 1 and self.__xendit_list_supported:
+            logger.info(f'{len(missing_ids)} payment requests missing from the Xendit list, getting them by ID')
+
+        for payment_request_id in missing_ids:
+            payment_requests[payment_request_id], get_throttle_wait_seconds = self.__get_payment_request(
+                payment_request_id, xendit_calls
+            )
+            throttle_wait_seconds += get_throttle_wait_seconds
+
+        return ResolvedPaymentRequests(
+            payment_requests=payment_requests,
+            list_calls=list_calls,
+            get_calls=len(missing_ids),
+            throttle_wait_seconds=throttle_wait_seconds,
+            xendit_calls=xendit_calls,
+        )
+
+    def __list_payment_requests(
+        self, payment_request_ids: List[str], payment_requests: Dict[str, Any], xendit_calls: List[XenditCall]
+    ) -> tuple:
+        """
+        List payment requests into payment_requests, recording the calls that reached Xendit in xendit_calls
+
+        Returns the calls made, the seconds throttled and the error response if a call failed.
+        """
+        wanted_ids = set(payment_request_ids)
+        after_id = None
+        calls = 0
+        throttle_wait_seconds = 0.0
+        while True:
+            calls += 1
+            throttle_wait_seconds += self.__acquire_xendit_token(RateLimitBudget.TRACKING)
+            try:
+                page = self.__call_xendit(
+                    lambda: self.xendit_client.list_payment_requests(payment_request_ids, after_id=after_id),
+                    RateLimitBudget.TRACKING,
+                    xendit_calls,
+                )
+
+            except CircuitOpenError as e:
+                logger.error(f'Not listing {len(payment_request_ids)} payment requests: {str(e)}')
+                return calls, throttle_wait_seconds, _circuit_open_response(e)
+
+            except Exception as e:
+                if _is_xendit_rejection(e):
+                    logger.warning(f'Xendit rejected listing payment requests, getting them by ID: {e.errorMessage}')
+                    self.__xendit_list_supported = False
+                    return calls, throttle_wait_seconds, None
+
+                message = f'Exception when calling PaymentRequestApi->get_all_payment_requests: {str(e)}'
+                logger.error(message)
+                status = HTTPStatus.TOO_MANY_REQUESTS if _is_xendit_rate_limited(e) else HTTPStatus.BAD_GATEWAY
+                return calls, throttle_wait_seconds, _error_response(status, message)
+
+            for payment_request in page.payment_requests:
+                if payment_request.id in wanted_ids:
+                    payment_requests[payment_request.id] = payment_request
+
+            if not page.has_more or not page.payment_requests:
+                return calls, throttle_wait_seconds, None
+
+            after_id = page.payment_requests[-1].id
+
+    def __acquire_xendit_token(self, budget: RateLimitBudget) -> float:
+        if self.__xendit_rate_limiter is None:
+            return 0.0
+
+        return self.__xendit_rate_limiter.acquire(budget.value)
+
+    def __call_xendit(
+        self, call: Callable[[], T], budget: RateLimitBudget, xendit_calls: Optional[List[XenditCall]] = None
+    ) -> T:
+        """
+        Call Xendit through its circuit breaker, adapting the rate limiter to the outcome
+
+        The latency and the retries of a call that reaches Xendit are appended to xendit_calls if given.
+        """
+        self.__apply_xendit_api_key()
+        started_at = time.perf_counter()
+        try:
+            result = self.__xendit_circuit_breaker.call(call, is_failure_error=_is_xendit_failure)
+        except CircuitOpenError:
+            # refused without calling Xendit
+            raise
+
+        except Exception as e:
+            _record_xendit_call(xendit_calls, started_at)
+            if _is_xendit_rate_limited(e):
+                self.__record_xendit_rate_limited(e, budget)
+            raise
+
+        _record_xendit_call(xendit_calls, started_at)
+        self.__record_xendit_success()
+        return result
+
+    def __apply_xendit_api_key(self) -> None:
+        """
+        Switch the Xendit ApiClient to the key last loaded from SSM, so a rotated key is used while warm
+
+        Only the cached key is read, as this runs on the event loop before a checkout call; the
+        secret provider refreshes it on a background thread.
+        """
+        xendit_api_key = Utils.get_cached_secret(self.__xendit_api_key_name)
+        if xendit_api_key is not None and xendit_api_key != self.__xendit_api_key:
+            logger.info('Xendit API key changed in SSM, using the new key')
+            self.xendit_api_instance.api_client.configuration.api_key = xendit_api_key
+            self.__xendit_api_key = xendit_api_key
+
+    def __record_xendit_success(self) -> None:
+        if self.__xendit_rate_limiter is not None:
+            self.__xendit_rate_limiter.record_success()
+
+    def __record_xendit_rate_limited(self, error: xendit.XenditSdkException, budget: RateLimitBudget) -> None:
+        if self.__xendit_rate_limiter is not None:
+            self.__xendit_rate_limiter.record_rate_limited(budget.value, parse_retry_after(response_headers(error)))
+
+    async def __call_storage(self, call: Callable[[], Awaitable[tuple]]) -> tuple:
+        return await self.__storage_circuit_breaker.call_async(call, is_failure=_is_storage_failure)
+
+    def __get_payment_storage_gateway(self):
+        # The async request path is imported on first use so the payment tracker, which
+        # only needs get_payment_request_details, does not load httpx on its cold start
+        if self.__payment_storage_gateway is None:
+            from external.async_payment_storage_gateway import AsyncPaymentStorageGateway
+
+            self.__payment_storage_gateway = AsyncPaymentStorageGateway()
+
+        return self.__payment_storage_gateway
+
+    def __get_async_xendit_api_instance(self):
+        if self.__async_xendit_api_instance is None:
+            from external.async_xendit_payment_request_api import AsyncPaymentRequestApi
+
+            self.__async_xendit_api_instance = AsyncPaymentRequestApi(self.xendit_api_instance)
+
+        return self.__async_xendit_api_instance
+
+
+@lru_cache(maxsize=None)
+def get_payment_usecase() -> PaymentUsecase:
+    """
+    Get the PaymentUsecase shared by every invocation served by this container
+
+    The Xendit ApiClient and its connection pool and the storage gateway are built on first
+    use and reused while the container is warm. The Xendit API key is read from the cached
+    secret provider before each Xendit call, so a key rotated in SSM is picked up on its refresh.
 
-            return JSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'message': message})
+    Returns:
+        PaymentUsecase -- Shared payment usecase
+    """
+    return PaymentUsecase()
@@ -1,58 +1,142 @@
+import os
+import sys
 from decimal import Decimal
+from hashlib import sha256
+from typing import Any, Dict, List
 
 from fastapi.responses import JSONResponse
-from sympy import Eq, solve, symbols
+from pydantic import ValidationError
 
-from model.payment.payment_constants import EWalletChannels, PaymentMethod
 from model.transaction.transaction import (
+    GetTransactionDetailsBatchIn,
+    GetTransactionDetailsBatchItemOut,
+    GetTransactionDetailsBatchOut,
     GetTransactionDetailsIn,
     GetTransactionDetailsOut,
 )
+from usecase.fee_engine import (
+    FeeEngineError,
+    compute_transaction_details,
+    compute_transaction_details_batch,
+    get_payment_method,
+)
+from usecase.fee_schedule_registry import FeeScheduleRegistry
+from utils.logger import logger
+from utils.ttl_cache import TTLCache
 
 
-class TransactionUsecase:
-    def get_transaction_details(self, get_transaction_details_in: GetTransactionDetailsIn):
-        e_wallet_fee_map = {EWalletChannels.GCASH.value: 0.023, EWalletChannels.PAYMAYA.value: 0.018}
-        platform_percent = get_transaction_details_in.platform_fee or Decimal(0.00)  # resolve None to 0
-
-        initial_ticket_price = get_transaction_details_in.ticket_price
-        platform_fee = platform_percent * initial_ticket_price  # platform fee is a percent of ticket price
-        ticket_price = initial_ticket_price + platform_fee
-
-        vat = 0.12
-
-        # Define the symbol P (the price we want to find)
-        P = symbols('P')
-
-        if get_transaction_details_in.payment_method == PaymentMethod.E_WALLET.value:
-            transaction_fee_percentage = e_wallet_fee_map.get(get_transaction_details_in.payment_channel)
-            transaction_fee = P * transaction_fee_percentage
-
-        elif get_transaction_details_in.payment_method == PaymentMethod.DIRECT_DEBIT.value:
-            transaction_fee_percentage = 0.01
-            default_fee = 15
-
-            # 1500 (1% == default_fee) - 15 (default_fee) - (1.8) default_fee * vat
-            min_ticket_price_for_default = 1483.2
-
-            is_fee_greater_than_default = ticket_price > min_ticket_price_for_default
-            transaction_fee = (P * transaction_fee_percentage) if is_fee_greater_than_default else default_fee
-
-        else:
-            return JSONResponse(status_code=422, content={'message': 'Invalid payment method was passed.'})
+def _quote_size(quote: GetTransactionDetailsOut) -> int:
+    return sys.getsizeof(quote) + sum(sys.getsizeof(value) for value in quote.__dict__.values())
 
-        equation = Eq(P - transaction_fee - (transaction_fee * vat), ticket_price)
 
-        # Solve the equation for P
-        total_price = solve(equation, P)[0]
-        transaction_fee = total_price - ticket_price
+# Shared by every request served by this container
+fee_quote_cache = TTLCache(
+    max_entries=int(os.environ.get('FEE_QUOTE_CACHE_MAX_ENTRIES', 10000)),
+    ttl_seconds=float(os.environ.get('FEE_QUOTE_CACHE_TTL_SECONDS', 300)),
+    max_bytes=int(os.environ.get('FEE_QUOTE_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+    size_of=_quote_size,
+)
 
-        # remove key if 0
-        platform_fee = None if platform_fee <= 0 else round(platform_fee, 2)
 
-        return GetTransactionDetailsOut(
-            ticket_price=round(initial_ticket_price, 2),
-            total_price=round(total_price, 2),
-            platform_fee=platform_fee,
-            transaction_fee=round(transaction_fee, 2),
+class TransactionUsecase:
+    def get_transaction_details(self, get_transaction_details_in: GetTransactionDetailsIn) -> GetTransactionDetailsOut:
+        cache_key = (
+            FeeScheduleRegistry.get_fee_schedule().version,
+            get_transaction_details_in.ticket_price,
+            get_transaction_details_in.platform_fee,
+            get_transaction_details_in.payment_method.value,
+            get_transaction_details_in.payment_channel.value,
+        )
+        try:
+            return fee_quote_cache.get_or_compute(
+                cache_key, lambda: compute_transaction_details(get_transaction_details_in)
+            )
+
+        except FeeEngineError as e:
+            return JSONResponse(status_code=422, content={'message': str(e)})
+
+        finally:
+            logger.info(f'Fee quote cache stats: {fee_quote_cache.stats()._asdict()}')
+
+    def get_transaction_details_etag(
+        self, get_transaction_details_in: GetTransactionDetailsIn, transaction_details_out: GetTransactionDetailsOut
+    ) -> str:
+        """
+        Build a deterministic ETag for a fee quote
+
+        Quotes are a pure function of the normalized request and the fee schedule version,
+        so equal requests priced by the same schedule get the same ETag.
+
+        Arguments:
+            get_transaction_details_in -- Fee quote request
+            transaction_details_out -- Fee quote computed for the request
+
+        Returns:
+            str -- Quoted strong ETag
+        """
+        normalized_request = '|'.join(
+            (
+                transaction_details_out.fee_schedule_version or '',
+                self._normalize_decimal(get_transaction_details_in.ticket_price),
+                self._normalize_decimal(get_transaction_details_in.platform_fee or Decimal(0)),
+                get_transaction_details_in.payment_method.value,
+                get_transaction_details_in.payment_channel.value,
+            )
         )
+        return f'"{sha256(normalized_request.encode()).hexdigest()[:32]}"'
+
+    def get_transaction_details_batch(self, batch_in: GetTransactionDetailsBatchIn) -> GetTransactionDetailsBatchOut:
+        """
+        Get the transaction totals of many ticket prices and payment channels
+
+        Items are validated one by one so an invalid item is reported at its index
+        instead of failing the whole batch.
+
+        Arguments:
+            batch_in -- List of transaction details requests, or ticket prices x payment channels
+
+        Returns:
+            GetTransactionDetailsBatchOut -- Result or error message of each item, in order
+        """
+        items = batch_in.items if batch_in.items is not None else self._expand_cross_product(batch_in)
+
+        results = [None] * len(items)
+        valid_indices = []
+        valid_items = []
+        for index, item in enumerate(items):
+            try:
+                valid_items.append(
+                    item if isinstance(item, GetTransactionDetailsIn) else GetTransactionDetailsIn(**item)
+                )
+                valid_indices.append(index)
+            except ValidationError as e:
+                message = '; '.join(
+                    f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()
+                )
+                results[index] = GetTransactionDetailsBatchItemOut(index=index, message=message)
+
+        quotes = compute_transaction_details_batch(valid_items)
+        for index, quote in zip(valid_indices, quotes):
+            if isinstance(quote, FeeEngineError):
+                results[index] = GetTransactionDetailsBatchItemOut(index=index, message=str(quote))
+            else:
+                results[index] = GetTransactionDetailsBatchItemOut(index=index, result=quote)
+
+        return GetTransactionDetailsBatchOut(results=results)
+
+    @staticmethod
+    def _normalize_decimal(value: Decimal) -> str:
+        return format(value.normalize(), 'f')
+
+    @staticmethod
+    def _expand_cross_product(batch_in: GetTransactionDetailsBatchIn) -> List[Dict[str, Any]]:
+        return [
+            {
+                'ticket_price': ticket_price,
+                'platform_fee': batch_in.platform_fee,
+                'payment_method': get_payment_method(payment_channel),
+                'payment_channel': payment_channel,
+            }
+            for ticket_price in batch_in.ticket_prices
+            for payment_channel in batch_in.payment_channels
+        ]
@@ -0,0 +1,117 @@
+import asyncio
+from threading import Lock
+from typing import Optional
+
+import httpx
+
+from utils.http_session import (
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_MAX_RETRIES,
+    HTTP_READ_TIMEOUT_SECONDS,
+    RETRYABLE_METHODS,
+    RETRYABLE_STATUS_CODES,
+    retry_delay_seconds,
+)
+from utils.logger import logger
+from utils.retry_budget import RetryBudget, get_retry_budget
+
+ASYNC_HTTP_TIMEOUT = httpx.Timeout(HTTP_READ_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+ASYNC_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_client_lock = Lock()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Get the httpx.AsyncClient shared by every request served by this container
+
+    Connections are bound to the event loop that opened them. Mangum reuses one loop
+    for every invocation of a warm container, so the client and its connection pool
+    are reused; if the running loop changes a new client is created for it.
+
+    Returns:
+        httpx.AsyncClient -- Shared async HTTP client
+    """
+    global _client, _client_loop
+
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        if _client is None or _client.is_closed or _client_loop is not loop:
+            _client = httpx.AsyncClient(timeout=ASYNC_HTTP_TIMEOUT, limits=ASYNC_HTTP_LIMITS)
+            _client_loop = loop
+
+        return _client
+
+
+async def close_async_http_client() -> None:
+    """Close the shared client and its connections, if it was created"""
+    global _client, _client_loop
+
+    with _client_lock:
+        client, _client, _client_loop = _client, None, None
+
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+async def send_async_request(
+    method: str, url: str, retry_budget: Optional[RetryBudget] = None, **kwargs
+) -> httpx.Response:
+    """
+    Send a request on the shared async client, retrying like utils.http_session.send_request
+
+    GET and PUT are retried on connection errors, timeouts and 429/502/503/504 responses,
+    up to HTTP_MAX_RETRIES times with the same full jitter backoff, each retry spending one
+    unit of the invocation's retry budget. Other methods are sent once. The backoff awaits,
+    so it does not hold the event loop.
+
+    Arguments:
+        method -- HTTP method
+        url -- Request URL
+        retry_budget -- Retry budget to spend, defaults to the invocation's
+        kwargs -- Passed to httpx.AsyncClient.request
+
+    Returns:
+        httpx.Response -- Response of the last attempt
+
+    Raises:
+        httpx.TransportError -- If the last attempt failed without a response
+    """
+    method = method.upper()
+    max_retries = HTTP_MAX_RETRIES if method in RETRYABLE_METHODS else 0
+    retry_budget = retry_budget or get_retry_budget()
+
+    attempt = 0
+    while True:
+        response, error = None, None
+        try:
+            response = await get_async_http_client().request(method, url, **kwargs)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+
+        except (httpx.NetworkError, httpx.TimeoutException) as e:
+            error = e
+
+        if attempt >= max_retries:
+            break
+
+        if not retry_budget.try_spend():
+            logger.warning(f'Retry budget spent, not retrying {method} {url}')
+            break
+
+        delay_seconds = retry_delay_seconds(attempt, response)
+        attempt += 1
+        if response is not None:
+            # give the connection back to the pool before the retry takes another
+            await response.aclose()
+
+        reason = f'HTTP {response.status_code}' if response is not None else type(error).__name__
+        logger.warning(f'{method} {url} failed with {reason}, retry {attempt} in {delay_seconds:.2f}s')
+        await asyncio.sleep(delay_seconds)
+
+    if response is None:
+        raise error
+
+    return response
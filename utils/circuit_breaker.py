@@ -0,0 +1,298 @@
+import math
+import os
+import time
+from collections import deque
+from functools import lru_cache
+from threading import Lock
+from typing import Awaitable, Callable, Deque, List, NamedTuple, Tuple, TypeVar
+
+from utils.logger import logger
+
+T = TypeVar('T')
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+_breakers_lock = Lock()
+_breakers: List['CircuitBreaker'] = []
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, dependency: str, retry_after_seconds: int):
+        super().__init__(f'{dependency} is unavailable, retry after {retry_after_seconds}s')
+        self.dependency = dependency
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreakerMetrics(NamedTuple):
+    dependency: str
+    state: str
+    window_calls: int
+    window_failures: int
+    failure_rate: float
+    times_opened: int
+    rejected_calls: int
+    retry_after_seconds: int
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast while it is failing
+
+    Outcomes of the calls of the last window_seconds are kept. Once at least minimum_calls
+    were made in the window and the share that failed reaches failure_rate_threshold, the
+    circuit opens and every call is rejected with CircuitOpenError for open_seconds. Then
+    the circuit is half-open: one probe call is let through, and the circuit closes if it
+    succeeds or opens again if it fails, while other calls keep being rejected.
+    """
+
+    def __init__(
+        self,
+        dependency: str,
+        window_seconds: float = 30,
+        minimum_calls: int = 10,
+        failure_rate_threshold: float = 0.5,
+        open_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__dependency = dependency
+        self.__window_seconds = window_seconds
+        self.__minimum_calls = minimum_calls
+        self.__failure_rate_threshold = failure_rate_threshold
+        self.__open_seconds = open_seconds
+        self.__clock = clock
+
+        self.__lock = Lock()
+        self.__state = CLOSED
+        self.__outcomes: Deque[Tuple[float, bool]] = deque()
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__probe_in_flight = False
+        self.__times_opened = 0
+        self.__rejected_calls = 0
+
+    @property
+    def dependency(self) -> str:
+        return self.__dependency
+
+    def before_call(self) -> None:
+        """
+        Admit a call, claiming the probe if the circuit is half-open
+
+        Raises:
+            CircuitOpenError -- If the circuit is open, or half-open with its probe in flight
+        """
+        with self.__lock:
+            self.__check(claim_probe=True)
+
+    def raise_if_open(self) -> None:
+        """
+        Fail fast if a call would be rejected now, without claiming the probe
+
+        Raises:
+            CircuitOpenError -- If the circuit is open, or half-open with its probe in flight
+        """
+        with self.__lock:
+            self.__check(claim_probe=False)
+
+    def record_success(self) -> None:
+        self.__record(failed=False)
+
+    def record_failure(self) -> None:
+        self.__record(failed=True)
+
+    def call(
+        self,
+        func: Callable[[], T],
+        is_failure: Callable[[T], bool] = lambda _: False,
+        is_failure_error: Callable[[BaseException], bool] = lambda _: True,
+    ) -> T:
+        """
+        Make a call through the circuit breaker
+
+        Arguments:
+            func -- Call to the dependency
+            is_failure -- Tells whether a result counts as a failure of the dependency
+            is_failure_error -- Tells whether an exception counts as one, e.g. not a rejected request
+
+        Returns:
+            T -- Result of the call
+
+        Raises:
+            CircuitOpenError -- If the call was rejected
+        """
+        self.before_call()
+        try:
+            result = func()
+        except BaseException as e:
+            self.__record(failed=is_failure_error(e))
+            raise
+
+        self.__record(failed=is_failure(result))
+        return result
+
+    async def call_async(
+        self,
+        func: Callable[[], Awaitable[T]],
+        is_failure: Callable[[T], bool] = lambda _: False,
+        is_failure_error: Callable[[BaseException], bool] = lambda _: True,
+    ) -> T:
+        """
+        Await a call through the circuit breaker
+
+        Arguments:
+            func -- Call to the dependency
+            is_failure -- Tells whether a result counts as a failure of the dependency
+            is_failure_error -- Tells whether an exception counts as one, e.g. not a rejected request
+
+        Returns:
+            T -- Result of the call
+
+        Raises:
+            CircuitOpenError -- If the call was rejected
+        """
+        self.before_call()
+        try:
+            result = await func()
+        except BaseException as e:
+            self.__record(failed=is_failure_error(e))
+            raise
+
+        self.__record(failed=is_failure(result))
+        return result
+
+    def metrics(self) -> CircuitBreakerMetrics:
+        """
+        Get the state and failure rate of the circuit
+
+        Returns:
+            CircuitBreakerMetrics -- State, calls and failures in the window, and counts since start
+        """
+        with self.__lock:
+            now = self.__clock()
+            self.__expire(now)
+            calls = len(self.__outcomes)
+            return CircuitBreakerMetrics(
+                dependency=self.__dependency,
+                state=self.__current_state(now),
+                window_calls=calls,
+                window_failures=self.__failures,
+                failure_rate=self.__failures / calls if calls else 0.0,
+                times_opened=self.__times_opened,
+                rejected_calls=self.__rejected_calls,
+                retry_after_seconds=self.__retry_after_seconds(now),
+            )
+
+    def __check(self, claim_probe: bool) -> None:
+        now = self.__clock()
+        state = self.__current_state(now)
+        if state == CLOSED:
+            return
+
+        if state == HALF_OPEN and not self.__probe_in_flight:
+            if claim_probe:
+                self.__state = HALF_OPEN
+                self.__probe_in_flight = True
+                logger.info(f'Circuit of {self.__dependency} is half-open, sending a probe call')
+
+            return
+
+        self.__rejected_calls += 1
+        raise CircuitOpenError(self.__dependency, self.__retry_after_seconds(now))
+
+    def __record(self, failed: bool) -> None:
+        with self.__lock:
+            now = self.__clock()
+            if self.__state == HALF_OPEN:
+                self.__probe_in_flight = False
+                if failed:
+                    self.__open(now)
+                else:
+                    self.__state = CLOSED
+                    self.__outcomes.clear()
+                    self.__failures = 0
+                    logger.info(f'Circuit of {self.__dependency} closed, probe call succeeded')
+
+                return
+
+            if self.__state == OPEN:
+                # a call admitted before the circuit opened finished after it
+                return
+
+            self.__outcomes.append((now, failed))
+            self.__failures += failed
+            self.__expire(now)
+            calls = len(self.__outcomes)
+            if failed and calls >= self.__minimum_calls and self.__failures / calls >= self.__failure_rate_threshold:
+                self.__open(now)
+
+    def __open(self, now: float) -> None:
+        calls = len(self.__outcomes)
+        self.__state = OPEN
+        self.__opened_at = now
+        self.__times_opened += 1
+        self.__outcomes.clear()
+        self.__failures = 0
+        logger.error(
+            f'Circuit of {self.__dependency} opened for {self.__open_seconds}s'
+            + (f' after {calls} calls in {self.__window_seconds}s' if calls else ', probe call failed')
+        )
+
+    def __expire(self, now: float) -> None:
+        while self.__outcomes and self.__outcomes[0][0] <= now - self.__window_seconds:
+            _, failed = self.__outcomes.popleft()
+            self.__failures -= failed
+
+    def __current_state(self, now: float) -> str:
+        if self.__state == OPEN and now - self.__opened_at >= self.__open_seconds:
+            return HALF_OPEN
+
+        return self.__state
+
+    def __retry_after_seconds(self, now: float) -> int:
+        state = self.__current_state(now)
+        if state == OPEN:
+            return max(1, math.ceil(self.__opened_at + self.__open_seconds - now))
+
+        return 1 if state == HALF_OPEN else 0
+
+
+@lru_cache(maxsize=None)
+def get_circuit_breaker(dependency: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a dependency, shared by every invocation served by this container
+
+    Configured by CIRCUIT_BREAKER_WINDOW_SECONDS, CIRCUIT_BREAKER_MINIMUM_CALLS,
+    CIRCUIT_BREAKER_FAILURE_RATE and CIRCUIT_BREAKER_OPEN_SECONDS.
+
+    Arguments:
+        dependency -- Name of the dependency
+
+    Returns:
+        CircuitBreaker -- Circuit breaker of the dependency
+    """
+    circuit_breaker = CircuitBreaker(
+        dependency,
+        window_seconds=float(os.environ.get('CIRCUIT_BREAKER_WINDOW_SECONDS', 30)),
+        minimum_calls=int(os.environ.get('CIRCUIT_BREAKER_MINIMUM_CALLS', 10)),
+        failure_rate_threshold=float(os.environ.get('CIRCUIT_BREAKER_FAILURE_RATE', 0.5)),
+        open_seconds=float(os.environ.get('CIRCUIT_BREAKER_OPEN_SECONDS', 30)),
+    )
+    with _breakers_lock:
+        _breakers.append(circuit_breaker)
+
+    return circuit_breaker
+
+
+def get_circuit_breaker_metrics() -> List[CircuitBreakerMetrics]:
+    """
+    Get the metrics of every circuit breaker of this container
+
+    Returns:
+        List[CircuitBreakerMetrics] -- Metrics per dependency
+    """
+    with _breakers_lock:
+        circuit_breakers = list(_breakers)
+
+    return [circuit_breaker.metrics() for circuit_breaker in circuit_breakers]
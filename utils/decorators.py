@@ -0,0 +1,54 @@
+from functools import wraps
+
+from utils.retry_budget import get_retry_budget
+
+
+def cors_headers(handler):
+    """
+    Add an Access-Control-Allow-Origin: * header to the handler's response
+
+    Same behavior as lambda_decorators.cors_headers, without importing boto3 on cold start.
+    """
+
+    @wraps(handler)
+    def wrapper(event, context):
+        response = handler(event, context)
+        if response is None:
+            response = {}
+
+        headers = response.setdefault('headers', {})
+        headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    return wrapper
+
+
+def lazy_warmer(handler):
+    """
+    Apply lambdawarmer.warmer only to warmer invocations
+
+    lambdawarmer imports boto3, so it is loaded only when a warmer event arrives instead
+    of on every cold start.
+    """
+
+    @wraps(handler)
+    def wrapper(event, context):
+        if isinstance(event, dict) and event.get('warmer'):
+            import lambdawarmer
+
+            return lambdawarmer.warmer(handler)(event, context)
+
+        return handler(event, context)
+
+    return wrapper
+
+
+def per_invocation_retry_budget(handler):
+    """Refill the retry budget of outbound calls at the start of every invocation"""
+
+    @wraps(handler)
+    def wrapper(event, context):
+        get_retry_budget().reset()
+        return handler(event, context)
+
+    return wrapper
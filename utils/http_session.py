@@ -0,0 +1,179 @@
+import os
+import random
+import time
+from functools import lru_cache
+from threading import Lock
+from typing import NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.logger import logger
+from utils.retry_budget import RetryBudget, get_retry_budget
+
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', 3.05))
+HTTP_READ_TIMEOUT_SECONDS = float(os.environ.get('HTTP_READ_TIMEOUT_SECONDS', 10))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+
+RETRYABLE_METHODS = frozenset(('GET', 'PUT'))
+RETRYABLE_STATUS_CODES = frozenset((429, 502, 503, 504))
+RETRY_BASE_DELAY_SECONDS = 0.1
+RETRY_MAX_DELAY_SECONDS = 2.0
+
+_stats_lock = Lock()
+_retries = 0
+_retries_denied = 0
+
+
+class HttpSessionStats(NamedTuple):
+    requests: int
+    connections: int
+    reused_connections: int
+    connection_reuse_ratio: float
+    retries: int
+    retries_denied: int
+
+
+@lru_cache(maxsize=None)
+def get_http_session() -> requests.Session:
+    """
+    Get the requests.Session shared by every blocking HTTP call of this container
+
+    Connections are kept alive in its pool between calls and between invocations of a
+    warm container, so only the first call to a host pays the TCP and TLS handshake.
+
+    Returns:
+        requests.Session -- Shared pooled session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def send_request(method: str, url: str, retry_budget: Optional[RetryBudget] = None, **kwargs) -> requests.Response:
+    """
+    Send a request on the shared session with connect and read timeouts
+
+    GET and PUT are idempotent, so they are retried on connection errors, timeouts and
+    429/502/503/504 responses, up to HTTP_MAX_RETRIES times with full jitter exponential
+    backoff, waiting at least the Retry-After of the response up to the backoff cap. Every
+    retry spends one unit of the invocation's retry budget; once it is spent, the error
+    is returned as is. Other methods are sent once.
+
+    Arguments:
+        method -- HTTP method
+        url -- Request URL
+        retry_budget -- Retry budget to spend, defaults to the invocation's
+        kwargs -- Passed to requests.Session.request
+
+    Returns:
+        requests.Response -- Response of the last attempt
+
+    Raises:
+        requests.RequestException -- If the last attempt failed without a response
+    """
+    global _retries, _retries_denied
+
+    method = method.upper()
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS))
+    max_retries = HTTP_MAX_RETRIES if method in RETRYABLE_METHODS else 0
+    retry_budget = retry_budget or get_retry_budget()
+
+    attempt = 0
+    while True:
+        response, error = None, None
+        try:
+            response = get_http_session().request(method, url, **kwargs)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        if attempt >= max_retries:
+            break
+
+        if not retry_budget.try_spend():
+            with _stats_lock:
+                _retries_denied += 1
+
+            logger.warning(f'Retry budget spent, not retrying {method} {url}')
+            break
+
+        delay_seconds = retry_delay_seconds(attempt, response)
+        attempt += 1
+        with _stats_lock:
+            _retries += 1
+
+        if response is not None:
+            _release(response)
+
+        reason = f'HTTP {response.status_code}' if response is not None else type(error).__name__
+        logger.warning(f'{method} {url} failed with {reason}, retry {attempt} in {delay_seconds:.2f}s')
+        time.sleep(delay_seconds)
+
+    if response is None:
+        raise error
+
+    return response
+
+
+def _release(response: requests.Response) -> None:
+    """Read the rest of a response that will not be returned, so its connection goes back to the pool"""
+    try:
+        response.content
+    except requests.RequestException:
+        # the connection broke, close() discards it instead
+        pass
+
+    response.close()
+
+
+def retry_delay_seconds(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """
+    Get the full jitter exponential backoff before a retry
+
+    Arguments:
+        attempt -- Retries made so far
+        response -- Failed response, whose Retry-After is honoured up to the backoff cap
+
+    Returns:
+        float -- Seconds to wait
+    """
+    delay_seconds = random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2**attempt))
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay_seconds = max(delay_seconds, min(RETRY_MAX_DELAY_SECONDS, float(retry_after)))
+
+    return delay_seconds
+
+
+def get_http_session_stats() -> HttpSessionStats:
+    """
+    Get the connection reuse and retry counts of the shared session since the container started
+
+    Returns:
+        HttpSessionStats -- Requests sent, connections opened, and retries made and denied
+    """
+    total_requests, total_connections = 0, 0
+    for adapter in set(get_http_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+
+    reused_connections = max(0, total_requests - total_connections)
+    with _stats_lock:
+        return HttpSessionStats(
+            requests=total_requests,
+            connections=total_connections,
+            reused_connections=reused_connections,
+            connection_reuse_ratio=reused_connections / total_requests if total_requests else 0.0,
+            retries=_retries,
+            retries_denied=_retries_denied,
+        )
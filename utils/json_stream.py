@@ -0,0 +1,71 @@
+import json
+from typing import Any, Iterable, Iterator
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """
+    Parse a JSON array incrementally, yielding each element once it has fully arrived
+
+    Only the element being parsed is buffered, so a large array is never held in memory
+    as a whole and its first elements can be used before the rest has been downloaded.
+
+    Arguments:
+        chunks -- Text of the JSON array, in pieces of any size
+
+    Returns:
+        Iterator[Any] -- Elements of the array
+
+    Raises:
+        ValueError -- If the text is not a JSON array or ends before the array is closed
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    expecting_element = True
+    for chunk in chunks:
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError(f'Expected a JSON array, got {buffer[position:position + 20]!r}')
+
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                return
+
+            if not expecting_element:
+                if buffer[position] != ',':
+                    raise ValueError(f'Expected , or ] in JSON array, got {buffer[position:position + 20]!r}')
+
+                expecting_element = True
+                position += 1
+                continue
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the element continues in the next chunk
+                break
+
+            if end == len(buffer) and not isinstance(element, (dict, list)):
+                # a number or literal at the end of the buffer may continue in the next chunk
+                break
+
+            yield element
+            position = end
+            expecting_element = False
+
+    raise ValueError('JSON array ended before it was closed')
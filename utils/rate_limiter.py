@@ -0,0 +1,367 @@
+import asyncio
+import math
+import os
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional
+
+from utils.logger import logger
+
+_limiters_lock = Lock()
+_limiters: List['RateLimiter'] = []
+
+
+class RateLimitedError(Exception):
+    def __init__(self, dependency: str, retry_after_seconds: int):
+        super().__init__(f'{dependency} is rate limited, retry after {retry_after_seconds}s')
+        self.dependency = dependency
+        self.retry_after_seconds = retry_after_seconds
+
+
+class RateLimiterMetrics(NamedTuple):
+    dependency: str
+    budget: str
+    rate_per_second: float
+    acquired: int
+    throttled: int
+    throttle_wait_seconds: float
+    rejected: int
+    rate_limited_responses: int
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float, now: float):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def wait_seconds(self) -> float:
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate_per_second
+
+
+class _BudgetCounters:
+    def __init__(self):
+        self.acquired = 0
+        self.throttled = 0
+        self.throttle_wait_seconds = 0.0
+        self.rejected = 0
+        self.rate_limited_responses = 0
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]], now: Optional[float] = None) -> Optional[float]:
+    """
+    Read how long to hold off from the headers of a rate limited response
+
+    Retry-After is read as seconds or as an HTTP date. Without it, a RateLimit-Reset or
+    X-RateLimit-Reset header is used when the remaining calls are 0, as seconds to wait or,
+    if larger than a day, as the Unix time the limit resets at.
+
+    Arguments:
+        headers -- Response headers, matched case-insensitively
+        now -- Current Unix time, the clock if not given
+
+    Returns:
+        Optional[float] -- Seconds to wait, or None if the headers do not say
+    """
+    if not headers:
+        return None
+
+    now = time.time() if now is None else now
+    headers = {name.lower(): value for name, value in headers.items()}
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - now)
+        except (TypeError, ValueError):
+            pass
+
+    for prefix in ('ratelimit-', 'x-ratelimit-'):
+        remaining, reset = headers.get(f'{prefix}remaining'), headers.get(f'{prefix}reset')
+        try:
+            if remaining is not None and reset is not None and float(remaining) <= 0:
+                reset = float(reset)
+                return max(0.0, reset - now if reset > 86400 else reset)
+        except ValueError:
+            pass
+
+    return None
+
+
+class RateLimiter:
+    """
+    Paces the calls to a dependency with token buckets, and backs off when it rate limits them
+
+    Every call takes a token of a bucket filled at rate_per_second, holding up to burst
+    tokens. Calls are made for a budget, and a budget with a share below 1 also takes a
+    token of its own bucket, filled at that share of the rate, so it cannot use up the
+    tokens of the budgets with a larger share. It takes the token of the shared bucket only
+    once it has the one of its own, so its calls waiting on their budget do not hold tokens
+    the other budgets could use. A call that finds no token waits for it, unless it would
+    wait longer than its max_wait_seconds.
+
+    When the dependency answers a call with a rate limit, every call is held off for the
+    time its headers ask, or for a second, and the rate is halved, down to min_rate_ratio of
+    the configured rate. Every call that succeeds then adds back recovery_ratio of it.
+    """
+
+    def __init__(
+        self,
+        dependency: str,
+        rate_per_second: float,
+        burst: Optional[float] = None,
+        budget_shares: Optional[Dict[str, float]] = None,
+        min_rate_ratio: float = 0.1,
+        recovery_ratio: float = 0.01,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.__dependency = dependency
+        self.__max_rate_per_second = rate_per_second
+        self.__rate_per_second = rate_per_second
+        self.__burst = burst or rate_per_second
+        self.__budget_shares = budget_shares or {}
+        self.__min_rate_per_second = rate_per_second * min_rate_ratio
+        self.__recovery_step = rate_per_second * recovery_ratio
+        self.__clock = clock
+        self.__sleep = sleep
+
+        self.__lock = Lock()
+        now = clock()
+        self.__bucket = _TokenBucket(rate_per_second, self.__burst, now)
+        self.__budget_buckets = {
+            budget: _TokenBucket(rate_per_second * share, max(1.0, self.__burst * share), now)
+            for budget, share in self.__budget_shares.items()
+            if share < 1
+        }
+        self.__counters: Dict[str, _BudgetCounters] = {}
+        self.__blocked_until = 0.0
+        self.__slowed_down_at = -math.inf
+
+    @property
+    def dependency(self) -> str:
+        return self.__dependency
+
+    def acquire(self, budget: str, max_wait_seconds: Optional[float] = None) -> float:
+        """
+        Take a token for a call, waiting until one is available
+
+        Arguments:
+            budget -- Budget the call is made for
+            max_wait_seconds -- Longest the call may wait, no limit if not given
+
+        Returns:
+            float -- Seconds waited
+
+        Raises:
+            RateLimitedError -- If the call would wait longer than max_wait_seconds
+        """
+        waited_seconds = self.__reserve(budget, False, max_wait_seconds, 0.0)
+        if waited_seconds:
+            self.__sleep(waited_seconds)
+
+        wait_seconds = self.__reserve_shared(budget, max_wait_seconds, waited_seconds)
+        if wait_seconds:
+            self.__sleep(wait_seconds)
+
+        return waited_seconds + wait_seconds
+
+    async def acquire_async(self, budget: str, max_wait_seconds: Optional[float] = None) -> float:
+        """
+        Take a token for a call, waiting on the event loop until one is available
+
+        Arguments:
+            budget -- Budget the call is made for
+            max_wait_seconds -- Longest the call may wait, no limit if not given
+
+        Returns:
+            float -- Seconds waited
+
+        Raises:
+            RateLimitedError -- If the call would wait longer than max_wait_seconds
+        """
+        waited_seconds = self.__reserve(budget, False, max_wait_seconds, 0.0)
+        if waited_seconds:
+            await asyncio.sleep(waited_seconds)
+
+        wait_seconds = self.__reserve_shared(budget, max_wait_seconds, waited_seconds)
+        if wait_seconds:
+            await asyncio.sleep(wait_seconds)
+
+        return waited_seconds + wait_seconds
+
+    def record_success(self) -> None:
+        with self.__lock:
+            if self.__rate_per_second < self.__max_rate_per_second:
+                self.__set_rate(min(self.__max_rate_per_second, self.__rate_per_second + self.__recovery_step))
+
+    def record_rate_limited(self, budget: str, retry_after_seconds: Optional[float] = None) -> None:
+        """
+        Hold every call off and slow down after the dependency rate limited a call
+
+        Arguments:
+            budget -- Budget the call was made for
+            retry_after_seconds -- Time the dependency asked to wait, a second if not given
+        """
+        with self.__lock:
+            now = self.__clock()
+            self.__counters_of(budget).rate_limited_responses += 1
+            retry_after_seconds = 1.0 if retry_after_seconds is None else retry_after_seconds
+            self.__blocked_until = max(self.__blocked_until, now + retry_after_seconds)
+            # the calls in flight when the limit was hit are rate limited together, slow down once for them
+            if now - self.__slowed_down_at >= 1.0:
+                self.__slowed_down_at = now
+                self.__set_rate(max(self.__min_rate_per_second, self.__rate_per_second / 2))
+                logger.warning(
+                    f'{self.__dependency} rate limited a call, holding calls off for {retry_after_seconds:.1f}s '
+                    f'and slowing down to {self.__rate_per_second:.1f} calls/s'
+                )
+
+            for bucket in (self.__bucket, *self.__budget_buckets.values()):
+                bucket.refill(now)
+                bucket.tokens = min(bucket.tokens, 0.0)
+
+    def metrics(self) -> List[RateLimiterMetrics]:
+        """
+        Get the rate and the waits of every budget used
+
+        Returns:
+            List[RateLimiterMetrics] -- Counts since start per budget
+        """
+        with self.__lock:
+            return [
+                RateLimiterMetrics(
+                    dependency=self.__dependency,
+                    budget=budget,
+                    rate_per_second=self.__rate_per_second * min(1.0, self.__budget_shares.get(budget, 1.0)),
+                    acquired=counters.acquired,
+                    throttled=counters.throttled,
+                    throttle_wait_seconds=counters.throttle_wait_seconds,
+                    rejected=counters.rejected,
+                    rate_limited_responses=counters.rate_limited_responses,
+                )
+                for budget, counters in self.__counters.items()
+            ]
+
+    def __reserve(self, budget: str, shared: bool, max_wait_seconds: Optional[float], waited_seconds: float) -> float:
+        """Take a token of the budget's or the shared bucket now, returning how long the call must wait for it"""
+        with self.__lock:
+            now = self.__clock()
+            counters = self.__counters_of(budget)
+            if shared:
+                bucket = self.__bucket
+                wait_seconds = max(0.0, self.__blocked_until - now)
+            else:
+                bucket = self.__budget_buckets.get(budget)
+                wait_seconds = 0.0
+                if bucket is None:
+                    return 0.0
+
+            # tokens are taken ahead of their refill, so the calls waiting are served in turn
+            bucket.refill(now)
+            wait_seconds = max(wait_seconds, bucket.wait_seconds())
+            if max_wait_seconds is not None and waited_seconds + wait_seconds > max_wait_seconds:
+                counters.rejected += 1
+                raise RateLimitedError(self.__dependency, max(1, math.ceil(waited_seconds + wait_seconds)))
+
+            bucket.tokens -= 1
+            if shared:
+                counters.acquired += 1
+                if waited_seconds + wait_seconds > 0:
+                    counters.throttled += 1
+
+            counters.throttle_wait_seconds += wait_seconds
+            return wait_seconds
+
+    def __reserve_shared(self, budget: str, max_wait_seconds: Optional[float], waited_seconds: float) -> float:
+        """Take a token of the shared bucket after the budget's, giving the budget's back if the call is rejected"""
+        try:
+            return self.__reserve(budget, True, max_wait_seconds, waited_seconds)
+        except RateLimitedError:
+            with self.__lock:
+                bucket = self.__budget_buckets.get(budget)
+                if bucket is not None:
+                    bucket.refill(self.__clock())
+                    bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+
+            raise
+
+    def __counters_of(self, budget: str) -> _BudgetCounters:
+        if budget not in self.__counters:
+            self.__counters[budget] = _BudgetCounters()
+
+        return self.__counters[budget]
+
+    def __set_rate(self, rate_per_second: float) -> None:
+        now = self.__clock()
+        self.__rate_per_second = rate_per_second
+        self.__bucket.refill(now)
+        self.__bucket.rate_per_second = rate_per_second
+        for budget, bucket in self.__budget_buckets.items():
+            bucket.refill(now)
+            bucket.rate_per_second = rate_per_second * self.__budget_shares[budget]
+
+
+@lru_cache(maxsize=None)
+def get_rate_limiter(
+    dependency: str, default_rate_per_second: float = 0, default_budget_shares: tuple = ()
+) -> Optional[RateLimiter]:
+    """
+    Get the rate limiter of a dependency, shared by every invocation served by this container
+
+    Configured by <DEPENDENCY>_RATE_LIMIT_PER_SECOND, <DEPENDENCY>_RATE_LIMIT_BURST and
+    <DEPENDENCY>_RATE_LIMIT_<BUDGET>_SHARE, e.g. XENDIT_RATE_LIMIT_TRACKING_SHARE. Each
+    container paces its own calls, so the rate should be the dependency's limit divided by
+    the containers expected to call it at once; rate limited responses slow every container
+    down on their own.
+
+    Arguments:
+        dependency -- Name of the dependency
+        default_rate_per_second -- Rate if not configured
+        default_budget_shares -- (budget, share of the rate) pairs of the budgets limited to a share
+
+    Returns:
+        Optional[RateLimiter] -- Rate limiter, or None if the rate is 0 and calls are not paced
+    """
+    prefix = dependency.upper()
+    rate_per_second = float(os.environ.get(f'{prefix}_RATE_LIMIT_PER_SECOND', default_rate_per_second))
+    if rate_per_second <= 0:
+        return None
+
+    rate_limiter = RateLimiter(
+        dependency,
+        rate_per_second,
+        burst=float(os.environ.get(f'{prefix}_RATE_LIMIT_BURST', 0)) or None,
+        budget_shares={
+            budget: float(os.environ.get(f'{prefix}_RATE_LIMIT_{budget.upper()}_SHARE', share))
+            for budget, share in default_budget_shares
+        },
+    )
+    with _limiters_lock:
+        _limiters.append(rate_limiter)
+
+    return rate_limiter
+
+
+def get_rate_limiter_metrics() -> List[RateLimiterMetrics]:
+    """
+    Get the metrics of every rate limiter of this container
+
+    Returns:
+        List[RateLimiterMetrics] -- Metrics per dependency and budget
+    """
+    with _limiters_lock:
+        rate_limiters = list(_limiters)
+
+    return [metrics for rate_limiter in rate_limiters for metrics in rate_limiter.metrics()]
@@ -0,0 +1,59 @@
+import os
+from functools import lru_cache
+from threading import Lock
+
+
+class RetryBudget:
+    """
+    Caps the retries of one Lambda invocation
+
+    Every retry of an outbound call spends one unit. Once the budget is spent, calls fail
+    on their first error instead of retrying, so a dependency that is down cannot make an
+    invocation spend its whole timeout on backoff. reset() refills it at the start of
+    each invocation.
+    """
+
+    def __init__(self, max_retries: int):
+        self.__max_retries = max_retries
+        self.__spent = 0
+        self.__denied = 0
+        self.__lock = Lock()
+
+    def try_spend(self) -> bool:
+        """
+        Spend one retry if any are left
+
+        Returns:
+            bool -- True if the caller may retry
+        """
+        with self.__lock:
+            if self.__spent >= self.__max_retries:
+                self.__denied += 1
+                return False
+
+            self.__spent += 1
+            return True
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__spent = 0
+            self.__denied = 0
+
+    @property
+    def spent(self) -> int:
+        return self.__spent
+
+    @property
+    def denied(self) -> int:
+        return self.__denied
+
+
+@lru_cache(maxsize=None)
+def get_retry_budget() -> RetryBudget:
+    """
+    Get the retry budget of the current invocation, sized by HTTP_RETRY_BUDGET
+
+    Returns:
+        RetryBudget -- Retry budget shared by every outbound call of this container
+    """
+    return RetryBudget(int(os.environ.get('HTTP_RETRY_BUDGET', 10)))
@@ -0,0 +1,193 @@
+import os
+import time
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterable, Optional
+
+from utils.logger import logger
+
+# SSM GetParameters accepts at most 10 names per call
+GET_PARAMETERS_MAX_NAMES = 10
+
+
+class SecretNotFoundError(Exception):
+    pass
+
+
+class SecretProvider:
+    """
+    Cache of SSM parameters, loaded in batches and refreshed before they expire
+
+    All known parameter names (and every parameter under parameter_path) are loaded
+    together with GetParameters/GetParametersByPath. Values are served from memory
+    for ttl_seconds; within refresh_margin_seconds of expiry a background refresh is
+    started. If a refresh fails the last known good values keep being served.
+    """
+
+    __default: Optional['SecretProvider'] = None
+    __default_lock = Lock()
+
+    def __init__(
+        self,
+        parameter_names: Iterable[str] = (),
+        parameter_path: Optional[str] = None,
+        ttl_seconds: float = 900,
+        refresh_margin_seconds: float = 60,
+        retry_interval_seconds: float = 30,
+        ssm_client=None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__parameter_names = {name for name in parameter_names if name}
+        self.__parameter_path = parameter_path
+        self.__ttl_seconds = ttl_seconds
+        self.__refresh_margin_seconds = refresh_margin_seconds
+        self.__retry_interval_seconds = retry_interval_seconds
+        self.__ssm_client = ssm_client
+        self.__clock = clock
+
+        self.__values: Dict[str, str] = {}
+        self.__expires_at: Optional[float] = None
+        self.__lock = Lock()
+        self.__refresh_thread: Optional[Thread] = None
+
+    @classmethod
+    def get_default(cls) -> 'SecretProvider':
+        """
+        Get the provider shared by the container, configured from the environment
+
+        XENDIT_API_KEY_SECRET_NAME and the comma separated SSM_PARAMETER_NAMES are loaded
+        together, along with every parameter under SSM_PARAMETER_PATH if it is set.
+        """
+        if cls.__default is None:
+            with cls.__default_lock:
+                if cls.__default is None:
+                    parameter_names = [os.environ.get('XENDIT_API_KEY_SECRET_NAME')]
+                    parameter_names += os.environ.get('SSM_PARAMETER_NAMES', '').split(',')
+                    cls.__default = cls(
+                        parameter_names=[name.strip() for name in parameter_names if name],
+                        parameter_path=os.environ.get('SSM_PARAMETER_PATH'),
+                        ttl_seconds=float(os.environ.get('SECRET_CACHE_TTL_SECONDS', 900)),
+                    )
+
+        return cls.__default
+
+    @classmethod
+    def set_default(cls, secret_provider: Optional['SecretProvider']) -> None:
+        """Replace the shared provider, or clear it so the next call rebuilds it from the environment"""
+        with cls.__default_lock:
+            cls.__default = secret_provider
+
+    def get(self, name: str) -> str:
+        """
+        Get a parameter value, loading or refreshing the cache when needed
+
+        Arguments:
+            name -- SSM parameter name
+
+        Returns:
+            str -- Decrypted parameter value
+        """
+        if not name:
+            raise SecretNotFoundError('No secret name was given')
+
+        if name not in self.__parameter_names and name not in self.__values:
+            with self.__lock:
+                self.__parameter_names.add(name)
+
+            self.refresh()
+
+        elif self.__expires_at is None or self.__clock() >= self.__expires_at:
+            self.refresh()
+
+        elif self.__clock() >= self.__expires_at - self.__refresh_margin_seconds:
+            self.__refresh_in_background()
+
+        value = self.__values.get(name)
+        if value is None:
+            raise SecretNotFoundError(f'Failed to get secret, {name}, from AWS SSM')
+
+        return value
+
+    def get_cached(self, name: str) -> Optional[str]:
+        """
+        Get the last loaded value of a parameter without waiting on SSM
+
+        Once the value is expired or close to expiry a refresh is started in the background,
+        so a caller that cannot block, e.g. on the event loop, keeps the value it has until
+        the refresh completes.
+
+        Arguments:
+            name -- SSM parameter name
+
+        Returns:
+            Optional[str] -- Decrypted parameter value, or None if it was never loaded
+        """
+        expires_at = self.__expires_at
+        if expires_at is None or self.__clock() >= expires_at - self.__refresh_margin_seconds:
+            self.__refresh_in_background()
+
+        return self.__values.get(name)
+
+    def refresh(self) -> bool:
+        """
+        Reload every parameter from SSM
+
+        Returns:
+            bool -- True if the parameters were reloaded, False if the last known values are kept
+        """
+        with self.__lock:
+            try:
+                values = self.__fetch_parameters()
+
+            except Exception as e:
+                logger.error(f'Failed to refresh secrets from AWS SSM, keeping last known values: {str(e)}')
+
+                # retry on the next call until a first load succeeds, then back off, background refreshes included
+                self.__expires_at = (
+                    self.__clock() + self.__retry_interval_seconds + self.__refresh_margin_seconds
+                    if self.__values
+                    else None
+                )
+                return False
+
+            self.__values.update(values)
+            self.__expires_at = self.__clock() + self.__ttl_seconds
+            return True
+
+    def __refresh_in_background(self) -> None:
+        with self.__lock:
+            if self.__refresh_thread is not None and self.__refresh_thread.is_alive():
+                return
+
+            self.__refresh_thread = Thread(target=self.refresh, name='secret-provider-refresh', daemon=True)
+            self.__refresh_thread.start()
+
+    def __get_ssm_client(self):
+        if self.__ssm_client is None:
+            from boto3.session import Session
+
+            self.__ssm_client = Session().client(service_name='ssm', region_name=os.getenv('REGION'))
+
+        return self.__ssm_client
+
+    def __fetch_parameters(self) -> Dict[str, str]:
+        ssm_client = self.__get_ssm_client()
+        values = {}
+
+        parameter_names = sorted(self.__parameter_names)
+        for start in range(0, len(parameter_names), GET_PARAMETERS_MAX_NAMES):
+            response = ssm_client.get_parameters(
+                Names=parameter_names[start : start + GET_PARAMETERS_MAX_NAMES], WithDecryption=True
+            )
+            for parameter in response['Parameters']:
+                values[parameter['Name']] = parameter['Value']
+
+            for invalid_parameter in response.get('InvalidParameters', []):
+                logger.error(f'SSM parameter {invalid_parameter} does not exist')
+
+        if self.__parameter_path:
+            paginator = ssm_client.get_paginator('get_parameters_by_path')
+            for page in paginator.paginate(Path=self.__parameter_path, Recursive=True, WithDecryption=True):
+                for parameter in page['Parameters']:
+                    values[parameter['Name']] = parameter['Value']
+
+        return values
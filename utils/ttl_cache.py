@@ -0,0 +1,155 @@
+import sys
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+    expirations: int
+    entries: int
+    size_bytes: int
+
+
+class _CacheEntry(NamedTuple):
+    value: Any
+    expires_at: float
+    size_bytes: int
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a TTL, bounded by entry count and approximate memory
+
+    Concurrent misses for the same key are coalesced: the first caller computes the
+    value while the others wait for it and share the result (or the raised error).
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        max_bytes: Optional[int] = None,
+        size_of: Callable[[Any], int] = sys.getsizeof,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__max_entries = max_entries
+        self.__ttl_seconds = ttl_seconds
+        self.__max_bytes = max_bytes
+        self.__size_of = size_of
+        self.__clock = clock
+
+        self.__entries: 'OrderedDict[Hashable, _CacheEntry]' = OrderedDict()
+        self.__in_flight: Dict[Hashable, _InFlight] = {}
+        self.__lock = Lock()
+        self.__size_bytes = 0
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__coalesced = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get a cached value, computing it once if it is missing or expired
+
+        Arguments:
+            key -- Cache key
+            compute -- Called without arguments to compute the value on a miss
+
+        Returns:
+            Any -- Cached or computed value
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry.expires_at > self.__clock():
+                    self.__entries.move_to_end(key)
+                    self.__hits += 1
+                    return entry.value
+
+                self.__remove(key)
+                self.__expirations += 1
+
+            in_flight = self.__in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _InFlight()
+                self.__in_flight[key] = in_flight
+                self.__misses += 1
+            else:
+                self.__coalesced += 1
+
+        if not is_leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+
+            return in_flight.value
+
+        try:
+            value = compute()
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        else:
+            in_flight.value = value
+            self.__store(key, value)
+            return value
+        finally:
+            with self.__lock:
+                self.__in_flight.pop(key, None)
+
+            in_flight.done.set()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__size_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self.__lock:
+            return CacheStats(
+                hits=self.__hits,
+                misses=self.__misses,
+                coalesced=self.__coalesced,
+                evictions=self.__evictions,
+                expirations=self.__expirations,
+                entries=len(self.__entries),
+                size_bytes=self.__size_bytes,
+            )
+
+    def __store(self, key: Hashable, value: Any) -> None:
+        size_bytes = self.__size_of(value)
+        if self.__max_bytes is not None and size_bytes > self.__max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+
+            self.__entries[key] = _CacheEntry(value, self.__clock() + self.__ttl_seconds, size_bytes)
+            self.__size_bytes += size_bytes
+
+            while len(self.__entries) > self.__max_entries or (
+                self.__max_bytes is not None and self.__size_bytes > self.__max_bytes
+            ):
+                oldest_key = next(iter(self.__entries))
+                self.__remove(oldest_key)
+                self.__evictions += 1
+
+    def __remove(self, key: Hashable) -> None:
+        entry = self.__entries.pop(key)
+        self.__size_bytes -= entry.size_bytes
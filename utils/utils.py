@@ -1,20 +1,34 @@
-import logging
-import os
+from typing import Optional
 
-from boto3.session import Session
+from utils.secret_provider import SecretProvider
 
 
 class Utils:
     @staticmethod
     def get_secret(secret_name: str) -> str:
-        secret = ''
-        try:
-            session = Session()
-            client = session.client(service_name='ssm', region_name=os.getenv('REGION'))
-            resp = client.get_parameter(Name=secret_name, WithDecryption=True)
-            secret = resp['Parameter']['Value']
-        except Exception as e:
-            message = f'Failed to get secret, {secret_name}, from AWS SSM: {str(e)}'
-            logging.error(message)
-
-        return secret
+        """
+        Get a decrypted SSM parameter from the container's cached secret provider
+
+        Arguments:
+            secret_name -- SSM parameter name
+
+        Returns:
+            str -- Parameter value
+
+        Raises:
+            SecretNotFoundError -- If the parameter could not be loaded from AWS SSM
+        """
+        return SecretProvider.get_default().get(secret_name)
+
+    @staticmethod
+    def get_cached_secret(secret_name: str) -> Optional[str]:
+        """
+        Get the last loaded value of an SSM parameter without blocking, refreshing it in the background
+
+        Arguments:
+            secret_name -- SSM parameter name
+
+        Returns:
+            Optional[str] -- Parameter value, or None if it was never loaded
+        """
+        return SecretProvider.get_default().get_cached(secret_name)